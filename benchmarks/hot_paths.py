@@ -0,0 +1,351 @@
+"""
+クライアント側の処理（スキーマの説明の生成、JSONの解析と型変換、画像のエンコード）の所要時間を計測するマイクロベンチマークです。
+
+プロバイダーへのリクエストは行わないため、APIキーやネットワーク接続は不要です。
+スキーマの大きさ（small/large）と画像の大きさ（100KB〜20MB）ごとに計測し、結果をJSONで出力できます。
+画像のケースでは、1回の呼び出しで確保されたメモリの最大量（tracemallocで計測）も画像の大きさに対する比で報告します。
+*.generate_with_imageのケースは、SDKによるリクエストのJSONへの変換を含みます（応答はトランスポートで用意したものを返します）。
+*.stream_imagesのケースは、stream_imagesを有効にして画像を送信中にエンコードする場合です。
+保存した結果を--compareに指定すると、リリース間で比較して遅くなったケースを報告します。
+
+使用例:
+    $ python benchmarks/hot_paths.py
+    $ python benchmarks/hot_paths.py --output results.json
+    $ python benchmarks/hot_paths.py --compare results.json --threshold 0.2  # 20%以上遅くなった場合は終了コード1
+    $ python benchmarks/hot_paths.py --filter image --quick
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from typing import Any, Callable, Dict, List, Tuple
+from types import SimpleNamespace
+from unittest.mock import MagicMock
+
+import httpx
+from pydantic import BaseModel, create_model
+
+import mosaicai
+from mosaicai.images import ImageInput
+from mosaicai.models.chatgpt import ChatGPT
+from mosaicai.models.claude import Claude
+from mosaicai.utils import client_registry
+from mosaicai.utils.api_key_manager import APIKeyManager
+
+# 画像の大きさ（バイト）
+IMAGE_SIZES = {"100KB": 100 * 1024, "1MB": 1024 * 1024, "5MB": 5 * 1024 * 1024,
+               "20MB": 20 * 1024 * 1024}
+QUICK_IMAGE_SIZES = ("100KB", "1MB")
+TYPES = ("str", "int", "float", "bool")
+SAMPLE_VALUES = {"str": "value", "int": "42", "float": "3.14", "bool": "true"}
+CLAUDE_RESPONSE = {"id": "msg_benchmark", "type": "message", "role": "assistant",
+                   "model": "benchmark", "content": [{"type": "text", "text": "ok"}],
+                   "stop_reason": "end_turn",
+                   "usage": {"input_tokens": 1, "output_tokens": 1}}
+OPENAI_RESPONSE = {"id": "chatcmpl-benchmark", "object": "chat.completion", "created": 0,
+                   "model": "benchmark",
+                   "choices": [{"index": 0, "message": {"role": "assistant", "content": "ok"},
+                                "finish_reason": "stop"}],
+                   "usage": {"prompt_tokens": 1, "completion_tokens": 1, "total_tokens": 2}}
+
+
+class OfflineTransport:
+    """リクエストを送信せずに用意した応答を返すトランスポートを作成する（client_registry.install_transportに渡す）"""
+
+    def transport(self, inner):
+        return _OfflineTransport()
+
+    def async_transport(self, inner):
+        raise NotImplementedError("hot_paths.pyは同期版のみを計測します。")
+
+
+class _OfflineTransport(httpx.BaseTransport):
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        # 実際のトランスポートと同様に、本文を保持せずに最後まで読み込む
+        for _ in request.stream:
+            pass
+        body = CLAUDE_RESPONSE if request.url.path.endswith("/messages") else OPENAI_RESPONSE
+        return httpx.Response(200, json=body)
+
+
+def dict_schema(keys: int, nested: int, nested_keys: int) -> Dict[str, Any]:
+    """
+    辞書形式のスキーマを作成します。
+
+    :param keys: 最上位のキーの数
+    :param nested: ネストしたオブジェクトの数
+    :param nested_keys: ネストしたオブジェクトのキーの数
+    :return: スキーマ
+    """
+    schema: Dict[str, Any] = {f"field_{i}": TYPES[i % len(TYPES)] for i in range(keys)}
+    for i in range(nested):
+        schema[f"object_{i}"] = {f"field_{j}": TYPES[j % len(TYPES)] for j in range(nested_keys)}
+    return schema
+
+
+def pydantic_schema(keys: int, nested: int, nested_keys: int) -> type:
+    """
+    dict_schemaと同じ構造のPydanticモデルを作成します。
+
+    :param keys: 最上位のフィールドの数
+    :param nested: ネストしたモデルの数
+    :param nested_keys: ネストしたモデルのフィールドの数
+    :return: Pydanticモデル
+    """
+    python_types = {"str": str, "int": int, "float": float, "bool": bool}
+    fields: Dict[str, Any] = {f"field_{i}": (python_types[TYPES[i % len(TYPES)]], ...)
+                              for i in range(keys)}
+    for i in range(nested):
+        nested_model = create_model(f"Nested{i}", **{
+            f"field_{j}": (python_types[TYPES[j % len(TYPES)]], ...) for j in range(nested_keys)})
+        fields[f"object_{i}"] = (nested_model, ...)
+    return create_model("Schema", __base__=BaseModel, **fields)
+
+
+def sample_data(schema: Dict[str, Any]) -> Dict[str, Any]:
+    """スキーマに適合する（型変換が必要な文字列の値を含む）応答のデータを作成する"""
+    return {key: sample_data(value) if isinstance(value, dict) else SAMPLE_VALUES[value]
+            for key, value in schema.items()}
+
+
+def measure(func: Callable[[], Any], repeat: int, min_time: float) -> Dict[str, float]:
+    """
+    1回の呼び出しの所要時間を計測します。
+    1回の計測がmin_time秒以上になるよう呼び出し回数を決め、repeat回計測します。
+
+    :param func: 計測する関数
+    :param repeat: 計測の回数
+    :param min_time: 1回の計測の最小時間（秒）
+    :return: 呼び出し1回あたりの所要時間（マイクロ秒）の中央値、最小値、標準偏差と呼び出し回数
+    """
+    func()  # ウォームアップ
+    loops = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(loops):
+            func()
+        if time.perf_counter() - start >= min_time or loops >= 1_000_000:
+            break
+        loops *= 10
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(loops):
+            func()
+        timings.append((time.perf_counter() - start) / loops * 1e6)
+    return {
+        "median_us": round(statistics.median(timings), 3),
+        "min_us": round(min(timings), 3),
+        "stdev_us": round(statistics.stdev(timings), 3) if len(timings) > 1 else 0.0,
+        "loops": loops,
+    }
+
+
+def measure_peak(func: Callable[[], Any]) -> int:
+    """
+    1回の呼び出しで確保されたメモリの最大量を計測します。
+
+    :param func: 計測する関数
+    :return: 呼び出し前からの増加量の最大値（バイト）
+    """
+    tracemalloc.start()
+    try:
+        func()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def build_cases(image_dir: str, quick: bool) -> List[Tuple[str, Dict[str, Any], Callable[[], Any]]]:
+    """
+    計測するケースの一覧を作成します。
+
+    :param image_dir: 画像ファイルを作成するディレクトリ
+    :param quick: Trueの場合は大きな画像のケースを省略する
+    :return: (ケース名, パラメーター, 計測する関数) のリスト
+    """
+    manager = MagicMock(spec=APIKeyManager)
+    manager.get_api_key.return_value = "benchmark-api-key"
+    # 以降に作成するモデルのSDKクライアントは、リクエストを送信せずに用意した応答を返す
+    client_registry.install_transport(OfflineTransport())
+    claude = Claude(manager)
+    chatgpt = ChatGPT(manager)
+    streaming_claude = Claude(manager)
+    streaming_claude.stream_images = True
+    streaming_chatgpt = ChatGPT(manager)
+    streaming_chatgpt.stream_images = True
+
+    schemas = {
+        "small": (3, 1, 3),
+        "large": (200, 20, 10),
+    }
+    cases = []
+    for size, shape in schemas.items():
+        schema = dict_schema(*shape)
+        model = pydantic_schema(*shape)
+        data = sample_data(schema)
+        text = json.dumps(data)
+        json_schema = model.model_json_schema()
+        # _convert_typesはネストしたPydanticモデル（$ref）に対応していないため、フラットなモデルで計測する
+        flat_model = pydantic_schema(shape[0], 0, 0)
+        flat_data = {key: value for key, value in data.items() if key.startswith("field_")}
+        params = {"schema": size, "keys": shape[0] + shape[1] * shape[2]}
+        cases += [
+            ("schema_description.dict", params,
+             lambda s=schema: claude._generate_schema_description(s)),
+            ("schema_description.pydantic", params,
+             lambda m=model: claude._generate_schema_description(m)),
+            ("format_json_schema", params, lambda s=json_schema: claude._format_json_schema(s)),
+            ("parse_json_response", params, lambda t=text: claude._parse_json_response(t)),
+            ("convert_types.dict", params, lambda d=data, s=schema: claude._convert_types(d, s)),
+            ("convert_types.pydantic", {"schema": size, "keys": shape[0]},
+             lambda d=flat_data, m=flat_model: claude._convert_types(d, m)),
+        ]
+        # generate_json全体のクライアント側の処理（プロバイダーへのリクエストは用意した応答を返す関数に置き換える）
+        offline = Claude(manager)
+        response = SimpleNamespace(content=[SimpleNamespace(text=text)], usage=None)
+        offline._send = lambda *args, r=response, **kwargs: r
+        cases.append(("claude.generate_json", params,
+                      lambda s=schema, m=offline: m.generate_json("benchmark", s)))
+
+    for label, size in IMAGE_SIZES.items():
+        if quick and label not in QUICK_IMAGE_SIZES:
+            continue
+        path = os.path.join(image_dir, f"image_{label}.png")
+        with open(path, "wb") as image_file:
+            image_file.write(b"\x89PNG\r\n\x1a\n" + os.urandom(size - 8))
+        params = {"image": label, "bytes": size}
+        cases += [
+            ("claude.encode_image", params, lambda p=path: claude._encode_image(ImageInput(p))),
+            ("claude.image_request", params,
+             lambda p=path: claude._request("benchmark", image_path=p)),
+            ("chatgpt.image_content", params,
+             lambda p=path: chatgpt._image_content("benchmark", p)),
+            ("claude.generate_with_image", params,
+             lambda p=path: claude.generate_with_image("benchmark", p)),
+            ("chatgpt.generate_with_image", params,
+             lambda p=path: chatgpt.generate_with_image("benchmark", p)),
+            ("claude.generate_with_image.stream_images", params,
+             lambda p=path: streaming_claude.generate_with_image("benchmark", p)),
+            ("chatgpt.generate_with_image.stream_images", params,
+             lambda p=path: streaming_chatgpt.generate_with_image("benchmark", p)),
+        ]
+    return cases
+
+
+def run(args: argparse.Namespace) -> Dict[str, Any]:
+    """
+    すべてのケースを計測し、結果を返します。
+
+    :param args: コマンドライン引数
+    :return: 実行環境と計測結果
+    """
+    results = []
+    with tempfile.TemporaryDirectory() as image_dir:
+        try:
+            for name, params, func in build_cases(image_dir, args.quick):
+                if args.filter and args.filter not in name:
+                    continue
+                result = {"name": name, "params": params,
+                          **measure(func, args.repeat, args.min_time)}
+                if "bytes" in params:
+                    seconds = result["median_us"] / 1e6
+                    result["mb_per_s"] = round(params["bytes"] / 1024 / 1024 / seconds, 1)
+                    result["peak_bytes"] = measure_peak(func)
+                    result["peak_ratio"] = round(result["peak_bytes"] / params["bytes"], 2)
+                results.append(result)
+                if not args.json:
+                    print_result(result)
+        finally:
+            client_registry.install_transport(None)
+    return {
+        "mosaicai_version": mosaicai.__version__,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "results": results,
+    }
+
+
+def case_id(result: Dict[str, Any]) -> str:
+    """ケース名とパラメーターから、結果を比較するための識別子を作成する"""
+    params = ",".join(f"{key}={value}" for key, value in sorted(result["params"].items()))
+    return f"{result['name']}[{params}]"
+
+
+def compare(report: Dict[str, Any], baseline: Dict[str, Any],
+            threshold: float) -> List[Dict[str, Any]]:
+    """
+    基準の結果と比較し、ケースごとの所要時間の比を返します。
+
+    :param report: 今回の結果
+    :param baseline: 基準の結果
+    :param threshold: 遅くなったと判定する比の増加分（0.2の場合は1.2倍以上）
+    :return: case、baseline_us、current_us、ratio、regressedを持つ辞書のリスト
+    """
+    baseline_results = {case_id(result): result for result in baseline["results"]}
+    comparisons = []
+    for result in report["results"]:
+        base = baseline_results.get(case_id(result))
+        if base is None:
+            continue
+        ratio = result["median_us"] / base["median_us"] if base["median_us"] else float("inf")
+        comparisons.append({
+            "case": case_id(result),
+            "baseline_us": base["median_us"],
+            "current_us": result["median_us"],
+            "ratio": round(ratio, 3),
+            "regressed": ratio > 1 + threshold,
+        })
+    return comparisons
+
+
+def print_result(result: Dict[str, Any]):
+    throughput = ""
+    if "mb_per_s" in result:
+        throughput = f"  {result['mb_per_s']:>8.1f} MB/s  peak {result['peak_ratio']:>5.2f}x"
+    print(f"{case_id(result):<70} {result['median_us']:>14.2f}us "
+          f"±{result['stdev_us']:>10.2f}{throughput}")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Microbenchmarks for mosaicai's client-side hot paths.")
+    parser.add_argument("--repeat", type=int, default=5, help="ケースごとの計測回数")
+    parser.add_argument("--min-time", type=float, default=0.2, help="1回の計測の最小時間（秒）")
+    parser.add_argument("--filter", default=None, help="名前にこの文字列を含むケースのみを計測する")
+    parser.add_argument("--quick", action="store_true", help="5MB以上の画像のケースを省略する")
+    parser.add_argument("--json", action="store_true", help="結果をJSONで標準出力に出力する")
+    parser.add_argument("--output", default=None, help="結果をJSONで保存するファイル")
+    parser.add_argument("--compare", default=None, help="比較する基準の結果（--outputで保存したファイル）")
+    parser.add_argument("--threshold", type=float, default=0.2, help="遅くなったと判定する所要時間の増加率")
+    args = parser.parse_args()
+
+    report = run(args)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+    failed = False
+    if args.compare:
+        with open(args.compare) as f:
+            report["comparison"] = compare(report, json.load(f), args.threshold)
+        failed = any(item["regressed"] for item in report["comparison"])
+        if not args.json:
+            print(f"\ncompared with {args.compare}:")
+            for item in report["comparison"]:
+                mark = "  REGRESSED" if item["regressed"] else ""
+                print(f"  {item['case']:<62} {item['ratio']:>6.2f}x{mark}")
+    if args.json:
+        print(json.dumps(report, indent=2))
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+"""
+`import mosaicai`の所要時間を計測するベンチマークです。
+
+`python -X importtime -c "import mosaicai"`を新しいプロセスで複数回実行し、
+mosaicaiの累積インポート時間、時間のかかっているモジュール、プロバイダーのSDKが読み込まれたかどうかを報告します。
+
+使用例:
+    $ python benchmarks/import_time.py
+    $ python benchmarks/import_time.py --runs 10 --json
+    $ python benchmarks/import_time.py --max-ms 300  # 中央値が300msを超えた場合は終了コード1
+"""
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+from typing import Dict, List
+
+# `import mosaicai`の時点では読み込まれるべきではないプロバイダーのSDK
+PROVIDER_MODULES = ("openai", "anthropic", "google.generativeai", "PIL")
+
+
+def measure_once(target: str = "mosaicai") -> Dict[str, int]:
+    """
+    新しいプロセスで1回インポートし、モジュールごとの累積インポート時間（マイクロ秒）を返します。
+
+    :param target: インポートするモジュール名
+    :return: モジュール名をキー、累積インポート時間を値とする辞書
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {target}"],
+        capture_output=True, text=True, check=True,
+    )
+    timings = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        timings[name.strip()] = int(cumulative)
+    return timings
+
+
+def run(runs: int, top: int) -> Dict[str, object]:
+    """
+    インポート時間を複数回計測し、結果を集計します。
+
+    :param runs: 計測回数
+    :param top: 報告する時間のかかっているモジュールの数
+    :return: 集計結果
+    """
+    samples: List[Dict[str, int]] = [measure_once() for _ in range(runs)]
+    totals_ms = [sample["mosaicai"] / 1000 for sample in samples]
+    last = samples[-1]
+    slowest = sorted(
+        ((name, us) for name, us in last.items() if name != "mosaicai"),
+        key=lambda item: item[1], reverse=True,
+    )[:top]
+    return {
+        "runs": runs,
+        "median_ms": round(statistics.median(totals_ms), 2),
+        "min_ms": round(min(totals_ms), 2),
+        "max_ms": round(max(totals_ms), 2),
+        "provider_modules_loaded": [name for name in PROVIDER_MODULES if name in last],
+        "slowest_modules": [{"module": name, "cumulative_ms": round(us / 1000, 2)}
+                            for name, us in slowest],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure the import time of mosaicai.")
+    parser.add_argument("--runs", type=int, default=5, help="計測回数")
+    parser.add_argument("--top", type=int, default=10, help="報告する時間のかかっているモジュールの数")
+    parser.add_argument("--json", action="store_true", help="結果をJSONで出力する")
+    parser.add_argument("--max-ms", type=float, default=None, help="中央値がこの値を超えた場合は終了コード1で終了する")
+    args = parser.parse_args()
+
+    report = run(args.runs, args.top)
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print(f"import mosaicai: median {report['median_ms']}ms "
+              f"(min {report['min_ms']}ms, max {report['max_ms']}ms, {report['runs']} runs)")
+        print(f"provider SDKs loaded at import: {report['provider_modules_loaded'] or 'none'}")
+        print("slowest modules:")
+        for entry in report["slowest_modules"]:
+            print(f"  {entry['cumulative_ms']:>9.2f}ms  {entry['module']}")
+
+    failed = bool(report["provider_modules_loaded"])
+    if args.max_ms is not None and report["median_ms"] > args.max_ms:
+        failed = True
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,270 @@
+"""
+ローカルのモックサーバー（mosaicai.testing.MockProviderServer）に対してMosaicAIで負荷をかけるベンチマークです。
+
+モデル（アダプター）ごとに指定した数のリクエストを指定した並行数で送信し、
+スループット、レイテンシのp50/p95/p99、エラー率、再試行の回数を報告します。
+実際のAPIにはリクエストを送らないため、APIキーは不要です（--recordを指定した場合を除く）。
+
+使用例:
+    $ python benchmarks/load_test.py
+    $ python benchmarks/load_test.py --requests 1000 --concurrency 64 --latency 0.3 \
+          --latency-sigma 0.5
+    $ python benchmarks/load_test.py --mode async --stream --rate-limit-rate 0.05 --max-retries 3 \
+          --json
+    $ python benchmarks/load_test.py --server http://127.0.0.1:8080  # 起動済みのモックサーバーを使用する
+    $ python benchmarks/load_test.py --record cassettes/load.json --requests 5  # 実際のAPIの応答を記録する
+    $ python benchmarks/load_test.py --cassette cassettes/load.json --speed 2  # 記録した応答を再生する
+"""
+import argparse
+import asyncio
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from mosaicai import AsyncMosaicAI, MosaicAI, RetryPolicy, metrics
+from mosaicai.cassette import Cassette
+from mosaicai.testing import MockBehavior, MockProviderServer, mock_base_urls
+from mosaicai.utils import client_registry
+
+DEFAULT_MODELS = ("gpt-4o", "claude-3-5-sonnet-20240620", "llama-3.1-sonar-large-128k-online")
+PROMPT = "負荷試験のリクエストです。"
+SCHEMA = {"answer": "str"}
+API_KEY_VARIABLES = ("OPENAI_API_KEY", "ANTHROPIC_API_KEY", "PERPLEXITY_API_KEY")
+
+
+def percentile(sorted_values: Sequence[float], p: float) -> Optional[float]:
+    """
+    ソート済みの値の百分位数を最近傍法で返します。
+
+    :param sorted_values: ソート済みの値
+    :param p: 百分位（0〜100）
+    :return: 百分位数（値がない場合はNone）
+    """
+    if not sorted_values:
+        return None
+    index = max(0, min(len(sorted_values) - 1, int(round(p / 100 * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[index]
+
+
+def summarize(model: str, samples: List[Tuple[float, Optional[float], Optional[BaseException]]],
+              elapsed: float) -> Dict[str, Any]:
+    """
+    1つのモデルの計測結果を集計します。
+
+    :param model: モデル名
+    :param samples: (レイテンシ, 最初の差分までの時間, 例外) のリスト
+    :param elapsed: 全リクエストの所要時間（秒）
+    :return: 集計結果
+    """
+    latencies = sorted(latency for latency, _, error in samples if error is None)
+    ttfts = sorted(ttft for _, ttft, error in samples if error is None and ttft is not None)
+    errors: Dict[str, int] = {}
+    for _, _, error in samples:
+        if error is not None:
+            errors[type(error).__name__] = errors.get(type(error).__name__, 0) + 1
+    failed = sum(errors.values())
+    retries = sum(sample["value"] for sample in metrics.RETRIES.samples()
+                  if sample["labels"]["model"] == model)
+
+    def ms(value: Optional[float]) -> Optional[float]:
+        return None if value is None else round(value * 1000, 2)
+
+    return {
+        "model": model,
+        "requests": len(samples),
+        "errors": failed,
+        "error_rate": round(failed / len(samples), 4) if samples else 0.0,
+        "error_types": errors,
+        "retries": int(retries),
+        "throughput_rps": round(len(samples) / elapsed, 2) if elapsed > 0 else None,
+        "p50_ms": ms(percentile(latencies, 50)),
+        "p95_ms": ms(percentile(latencies, 95)),
+        "p99_ms": ms(percentile(latencies, 99)),
+        "ttft_p50_ms": ms(percentile(ttfts, 50)),
+        "ttft_p95_ms": ms(percentile(ttfts, 95)),
+    }
+
+
+def consume_stream(stream) -> Optional[float]:
+    """ストリームを最後まで受信し、最初の差分を受信するまでの時間（秒）を返す"""
+    start = time.perf_counter()
+    first = None
+    for _ in stream:
+        if first is None:
+            first = time.perf_counter() - start
+    return first
+
+
+async def consume_stream_async(stream) -> Optional[float]:
+    """consume_streamの非同期版"""
+    start = time.perf_counter()
+    first = None
+    async for _ in stream:
+        if first is None:
+            first = time.perf_counter() - start
+    return first
+
+
+def run_sync(model: str, args: argparse.Namespace, retry_policy: RetryPolicy) -> Dict[str, Any]:
+    """スレッドプールからMosaicAIを呼び出して計測する"""
+    client = MosaicAI(model, retry_policy=retry_policy)
+
+    def call() -> Optional[float]:
+        if args.stream:
+            return consume_stream(client.generate_text_stream(PROMPT))
+        if args.method == "json":
+            client.generate_json(PROMPT, SCHEMA)
+        else:
+            client.generate_text(PROMPT)
+        return None
+
+    def timed(_):
+        start = time.perf_counter()
+        try:
+            ttft = call()
+            return time.perf_counter() - start, ttft, None
+        except Exception as e:
+            return time.perf_counter() - start, None, e
+
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        start = time.perf_counter()
+        samples = list(executor.map(timed, range(args.requests)))
+        elapsed = time.perf_counter() - start
+    return summarize(model, samples, elapsed)
+
+
+async def run_async(model: str, args: argparse.Namespace,
+                    retry_policy: RetryPolicy) -> Dict[str, Any]:
+    """AsyncMosaicAIを並行数を制限して呼び出して計測する"""
+    client = AsyncMosaicAI(model, retry_policy=retry_policy)
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def call() -> Optional[float]:
+        if args.stream:
+            return await consume_stream_async(client.generate_text_stream(PROMPT))
+        if args.method == "json":
+            await client.generate_json(PROMPT, SCHEMA)
+        else:
+            await client.generate_text(PROMPT)
+        return None
+
+    async def timed():
+        async with semaphore:
+            start = time.perf_counter()
+            try:
+                ttft = await call()
+                return time.perf_counter() - start, ttft, None
+            except Exception as e:
+                return time.perf_counter() - start, None, e
+
+    start = time.perf_counter()
+    samples = await asyncio.gather(*(timed() for _ in range(args.requests)))
+    elapsed = time.perf_counter() - start
+    return summarize(model, list(samples), elapsed)
+
+
+def run(args: argparse.Namespace, base_urls: Dict[str, str]) -> List[Dict[str, Any]]:
+    """
+    モデルごとに順に負荷をかけ、結果を返します。
+
+    :param args: コマンドライン引数
+    :param base_urls: プロバイダーごとのモックサーバーのベースURL
+    :return: モデルごとの集計結果
+    """
+    for variable in API_KEY_VARIABLES:
+        os.environ.setdefault(variable, "mock-api-key")
+    for provider, base_url in base_urls.items():
+        client_registry.configure_base_url(provider, base_url)
+    client_registry.configure_http_pool(max_connections=max(args.concurrency, 100))
+    metrics.clear_metrics()
+    retry_policy = RetryPolicy(max_retries=args.max_retries, timeout=args.timeout, base_delay=0.05,
+                               max_delay=1.0)
+
+    reports = []
+    for model in args.models:
+        if args.mode == "async":
+            reports.append(asyncio.run(run_async(model, args, retry_policy)))
+        else:
+            reports.append(run_sync(model, args, retry_policy))
+    return reports
+
+
+def print_report(reports: List[Dict[str, Any]], server_stats: Optional[Dict[str, Dict[str, int]]]):
+    header = (f"{'model':<36} {'reqs':>6} {'rps':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} "
+              f"{'errors':>7} {'retries':>8}")
+    print(header)
+    print("-" * len(header))
+    for report in reports:
+        print(f"{report['model']:<36} {report['requests']:>6} {report['throughput_rps'] or 0:>9} "
+              f"{report['p50_ms'] or 0:>9} {report['p95_ms'] or 0:>9} {report['p99_ms'] or 0:>9} "
+              f"{report['error_rate']:>7.2%} {report['retries']:>8}")
+        if report["ttft_p50_ms"] is not None:
+            print(f"    time to first token: p50 {report['ttft_p50_ms']}ms, "
+                  f"p95 {report['ttft_p95_ms']}ms")
+        for name, count in report["error_types"].items():
+            print(f"    {name}: {count}")
+    if server_stats:
+        print("\nmock server:")
+        for provider, counts in server_stats.items():
+            values = ", ".join(f"{name}={value}" for name, value in counts.items())
+            print(f"  {provider}: {values}")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Load-test MosaicAI against a local mock provider server.")
+    parser.add_argument("--models", nargs="+", default=list(DEFAULT_MODELS), help="負荷をかけるモデル")
+    parser.add_argument("--requests", type=int, default=200, help="モデルごとのリクエスト数")
+    parser.add_argument("--concurrency", type=int, default=16, help="同時に実行するリクエストの数")
+    parser.add_argument("--mode", choices=("sync", "async"), default="sync",
+                        help="MosaicAIとAsyncMosaicAIのどちらを使用するか")
+    parser.add_argument("--method", choices=("text", "json"), default="text",
+                        help="generate_textとgenerate_jsonのどちらを呼び出すか")
+    parser.add_argument("--stream", action="store_true", help="generate_text_streamを使用する")
+    parser.add_argument("--max-retries", type=int, default=0, help="再試行の最大回数")
+    parser.add_argument("--timeout", type=float, default=30.0, help="1回の呼び出しのタイムアウト（秒）")
+    parser.add_argument("--server", default=None, help="使用するモックサーバーのURL（省略した場合はこのプロセスで起動する）")
+    parser.add_argument("--cassette", default=None, help="モックサーバーの代わりに再生するカセット（--recordで記録したもの）")
+    parser.add_argument("--record", default=None, help="実際のAPIにリクエストを送り、カセットに記録する（APIキーが必要）")
+    parser.add_argument("--speed", type=float, default=1.0, help="カセットの再生速度（0の場合は待機しない）")
+    parser.add_argument("--latency", type=float, default=0.05, help="モックサーバーの遅延の中央値（秒）")
+    parser.add_argument("--latency-sigma", type=float, default=0.3, help="モックサーバーの遅延の対数正規分布のσ")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="モックサーバーが500エラーを返す確率")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="モックサーバーが429エラーを返す確率")
+    parser.add_argument("--chunk-delay", type=float, default=0.0, help="ストリーミングのチャンクの間隔（秒）")
+    parser.add_argument("--seed", type=int, default=None, help="モックサーバーの乱数のシード")
+    parser.add_argument("--json", action="store_true", help="結果をJSONで出力する")
+    args = parser.parse_args()
+
+    server = None
+    server_stats = None
+    if args.cassette or args.record:
+        # 実際のAPIへのリクエストを記録する、または記録した応答を再生する
+        cassette = Cassette(args.record, mode="record") if args.record else \
+            Cassette(args.cassette, mode="replay", speed=args.speed)
+        with cassette:
+            reports = run(args, {})
+    else:
+        if args.server is None:
+            behavior = MockBehavior(latency=args.latency, latency_sigma=args.latency_sigma,
+                                    error_rate=args.error_rate,
+                                    rate_limit_rate=args.rate_limit_rate,
+                                    chunk_delay=args.chunk_delay)
+            server = MockProviderServer(behavior, seed=args.seed).start()
+        try:
+            reports = run(args, server.base_urls if server else mock_base_urls(args.server))
+            server_stats = server.stats() if server else None
+        finally:
+            if server:
+                server.stop()
+
+    if args.json:
+        print(json.dumps({"results": reports, "server": server_stats}, indent=2))
+    else:
+        print_report(reports, server_stats)
+
+
+if __name__ == "__main__":
+    main()
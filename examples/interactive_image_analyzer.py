@@ -2,9 +2,14 @@
 
 import streamlit as st
 from PIL import Image
-from mosaicai import MosaicAI
-import tempfile
-import os
+from mosaicai import ImageCache, MosaicAI
+
+
+@st.cache_resource
+def get_image_cache():
+    # バイト列の画像は内容で識別されるため、再実行しても同じ画像ならキャッシュを再利用できる
+    return ImageCache()
+
 
 # Streamlitアプリのタイトルを設定
 st.title("AI画像分析ツール")
@@ -18,26 +23,20 @@ if uploaded_file is not None:
     image = Image.open(uploaded_file)
     st.image(image, caption="アップロードされた画像", use_column_width=True)
 
-    # MosaicAIクライアントを初期化
-    client = MosaicAI(model="gpt-4o")
-
-    # アップロードされたファイルを一時ファイルとして保存
-    with tempfile.NamedTemporaryFile(delete=False, suffix=".png") as tmp_file:
-        tmp_file.write(uploaded_file.getvalue())
-        tmp_file_path = tmp_file.name
-
-    try:
-        # 初期分析を実行
-        initial_analysis = client.generate_with_image(
-            "この画像を詳しく分析してください", tmp_file_path)
-        st.write("初期分析:", initial_analysis)
-
-        # ユーザーからの質問を受け付ける
-        user_question = st.text_input("画像について質問してください")
-        if user_question:
-            # ユーザーの質問に基づいて画像分析を実行
-            answer = client.generate_with_image(user_question, tmp_file_path)
-            st.write("回答:", answer)
-    finally:
-        # 処理が終了したら一時ファイルを削除
-        os.unlink(tmp_file_path)
+    # MosaicAIクライアントを初期化（同じ画像への質問では、エンコードした画像を再利用する）
+    client = MosaicAI(model="gpt-4o", image_cache=get_image_cache())
+
+    # アップロードされた画像は一時ファイルに保存せず、バイト列のまま送信する
+    image_data = uploaded_file.getvalue()
+
+    # 初期分析を実行
+    initial_analysis = client.generate_with_image(
+        "この画像を詳しく分析してください", image_data)
+    st.write("初期分析:", initial_analysis)
+
+    # ユーザーからの質問を受け付ける
+    user_question = st.text_input("画像について質問してください")
+    if user_question:
+        # ユーザーの質問に基づいて画像分析を実行
+        answer = client.generate_with_image(user_question, image_data)
+        st.write("回答:", answer)
@@ -1,12 +1,38 @@
 from .client import MosaicAI
-from .exceptions import MosaicAIError, ModelNotSupportedError, APIKeyNotFoundError, InvalidJSONSchemaError
+from .async_client import AsyncMosaicAI
+from .cache import ImageCache, ResponseCache
+from .circuit_breaker import CircuitBreakerPolicy
+from .coalesce import RequestCoalescer
+from .hedging import HedgePolicy
+from .images import ImageInput, ImagePolicy
+from .rate_limit import configure_rate_limit
+from .routing import LatencyRouter
+from .retry import RetryPolicy
+from .utils.client_registry import configure_base_url, configure_http_pool
+from .exceptions import (MosaicAIError, ModelNotSupportedError, APIKeyNotFoundError,
+                         InvalidJSONSchemaError, CircuitOpenError, CassetteMismatchError)
 
 __all__ = [
     'MosaicAI',
+    'AsyncMosaicAI',
+    'ResponseCache',
+    'ImageCache',
+    'HedgePolicy',
+    'ImagePolicy',
+    'ImageInput',
+    'CircuitBreakerPolicy',
+    'RequestCoalescer',
+    'LatencyRouter',
+    'RetryPolicy',
+    'configure_http_pool',
+    'configure_base_url',
+    'configure_rate_limit',
     'MosaicAIError',
     'ModelNotSupportedError',
     'APIKeyNotFoundError',
-    'InvalidJSONSchemaError'
+    'InvalidJSONSchemaError',
+    'CircuitOpenError',
+    'CassetteMismatchError'
 ]
 
 __version__ = "0.1.4"
@@ -0,0 +1,315 @@
+from functools import partial
+from typing import (Dict, Any, Union, Type, Iterable, AsyncIterator, Optional, Sequence, Awaitable,
+                    Callable)
+from pydantic import BaseModel
+import time
+from .batch import BatchResult, build_batch_items, run_batch_async
+from .client import _MosaicAIBase
+from .fan_out import (DEFAULT_AGGREGATION_PROMPT, FanOutResult, build_aggregation_prompt,
+                      run_fan_out_async, timed_call_async)
+from .hedging import hedged_call_async, first_success_async
+from .images import ImageInput, ImageSource, LabeledImages, label_images
+from .streaming import AsyncTextStream
+
+
+class AsyncMosaicAI(_MosaicAIBase):
+    """
+    AsyncMosaicAIクラスは、MosaicAIの非同期版です。
+    各プロバイダーの非同期SDK（AsyncOpenAI、AsyncAnthropic、Geminiのgenerate_content_async）を使用するため、
+    スレッドを消費せずに1つのイベントループで多数のリクエストを同時に処理できます。
+    """
+
+    async def generate_text(self, prompt: str) -> str:
+        """
+        指定されたモデルを使用してテキストを生成します。
+
+        :param prompt: 生成のためのプロンプト
+        :return: 生成されたテキスト
+        :raises ModelNotSupportedError: 指定されたモデルがサポートされていない場合
+        """
+        self._validate_prompt(prompt)
+        self._get_model_instance()
+        return await self._cached(self._cache_key("generate", prompt),
+                                  lambda: self._call("generate_async", prompt, hedge=True))
+
+    def generate_text_stream(self, prompt: str) -> AsyncTextStream:
+        """
+        指定されたモデルを使用してテキストをストリーミングで生成します。
+
+        返されたAsyncTextStreamをasync forで反復処理すると、生成されたテキストの差分（StreamDelta）が順次返されます。
+        反復処理の終了後は、usageで最終的なトークン使用量を参照できます。
+
+        :param prompt: 生成のためのプロンプト
+        :return: StreamDeltaを返すAsyncTextStream
+        :raises ModelNotSupportedError: 指定されたモデルがサポートされていない場合
+        """
+        self._validate_prompt(prompt)
+        return self._get_model_instance().generate_text_stream_async(prompt)
+
+    async def generate_with_image(self, prompt: str, image_path: ImageSource) -> str:
+        """
+        指定されたモデルを使用して画像付きのテキストを生成します。
+
+        :param prompt: 生成のためのプロンプト
+        :param image_path: 画像（ファイルのパス、バイト列、memoryview、PILの画像、またはImageInput）
+        :return: 生成されたテキスト
+        :raises ModelNotSupportedError: 指定されたモデルがサポートされていない場合
+        """
+        self._validate_prompt(prompt)
+        self._get_model_instance('generate_with_image_async', "画像付きの生成")
+        image_path = ImageInput.of(image_path)
+        key = self._cache_key("generate_with_image", prompt, image_path=image_path)
+        call = partial(self._call, "generate_with_image_async", prompt, image_path)
+        return await self._cached(key, call)
+
+    async def generate_json(
+            self, prompt: str,
+            schema: Union[Dict[str, Union[str, Dict]], Type[BaseModel]]) -> Dict[str, Any]:
+        """
+        指定されたモデルを使用してJSONを生成します。
+
+        :param prompt: 生成のためのプロンプト
+        :param schema: 生成するJSONのスキーマ
+        :return: 生成されたJSON
+        :raises ModelNotSupportedError: 指定されたモデルがサポートされていない場合
+        """
+        self._validate_prompt(prompt)
+        self._get_model_instance()
+        call = partial(self._call, "generate_json_async", prompt, schema, hedge=True)
+        return await self._cached(self._cache_key("generate_json", prompt, schema), call)
+
+    async def generate_with_image_json(
+            self, prompt: str, image_path: ImageSource,
+            schema: Union[Dict[str, Union[str, Dict]], Type[BaseModel]]) -> Dict[str, Any]:
+        """
+        指定されたモデルを使用して画像付きのJSONを生成します。
+
+        :param prompt: 生成のためのプロンプト
+        :param image_path: 画像（ファイルのパス、バイト列、memoryview、PILの画像、またはImageInput）
+        :param schema: 生成するJSONのスキーマ
+        :return: 生成されたJSON
+        :raises ModelNotSupportedError: 指定されたモデルがサポートされていない場合
+        """
+        self._validate_prompt(prompt)
+        self._get_model_instance('generate_with_image_json_async', "画像付きのJSON生成")
+        image_path = ImageInput.of(image_path)
+        key = self._cache_key("generate_with_image_json", prompt, schema, image_path)
+        call = partial(self._call, "generate_with_image_json_async", prompt, image_path, schema)
+        return await self._cached(key, call)
+
+    async def generate_with_images(self, prompt: str, images: LabeledImages) -> str:
+        """
+        指定されたモデルを使用して、ラベルを付けた複数の画像について1回のリクエストでテキストを生成します。
+
+        画像の数や大きさがプロバイダーの1回のリクエストの上限を超える場合は、できるだけ少ない回数に分けて送信し、
+        それぞれの回答を同じモデルで1つにまとめます。
+
+        :param prompt: 生成のためのプロンプト
+        :param images: ラベルと画像の辞書、または画像か(ラベル, 画像)のリスト（ラベルを省略した画像は"画像1"、"画像2"...）
+        :return: 生成されたテキスト
+        :raises ModelNotSupportedError: 指定されたモデルがサポートされていない場合
+        """
+        self._validate_prompt(prompt)
+        self._get_model_instance('generate_with_images_async', "複数の画像付きの生成")
+        images = label_images(images)
+        return await self._cached(self._cache_key("generate_with_images", prompt, images=images),
+                                  lambda: self._call("generate_with_images_async", prompt, images))
+
+    async def generate_with_images_json(
+            self, prompt: str, images: LabeledImages,
+            schema: Union[Dict[str, Union[str, Dict]], Type[BaseModel]]) -> Dict[str, Any]:
+        """
+        指定されたモデルを使用して、ラベルを付けた複数の画像について1回のリクエストでJSONを生成します。
+
+        :param prompt: 生成のためのプロンプト
+        :param images: ラベルと画像の辞書、または画像か(ラベル, 画像)のリスト
+        :param schema: 生成するJSONのスキーマ
+        :return: 生成されたJSON
+        :raises ModelNotSupportedError: 指定されたモデルがサポートされていない場合
+        """
+        self._validate_prompt(prompt)
+        self._get_model_instance('generate_with_images_json_async', "複数の画像付きのJSON生成")
+        images = label_images(images)
+        key = self._cache_key("generate_with_images_json", prompt, schema, images=images)
+        call = partial(self._call, "generate_with_images_json_async", prompt, images, schema)
+        return await self._cached(key, call)
+
+    async def race_json(self, prompt: str,
+                        schema: Union[Dict[str, Union[str, Dict]], Type[BaseModel]],
+                        models: Sequence[str],
+                        image_path: Optional[ImageSource] = None) -> Dict[str, Any]:
+        """
+        同じプロンプトを複数のモデルに同時に送信し、最初にスキーマの検証に成功したJSONを返します。
+        残りのリクエストはキャンセルされます。
+
+        :param prompt: 生成のためのプロンプト
+        :param schema: 生成するJSONのスキーマ
+        :param models: 同時にリクエストを送信するモデルの名前
+        :param image_path: 画像（オプション。ファイルのパス、バイト列、PILの画像など）
+        :return: 最初に検証に成功したJSON
+        :raises Exception: すべてのモデルが失敗した場合、最初に発生した例外
+        """
+        calls = self._race_calls(models, prompt, schema, image_path, suffix="_async")
+        return await first_success_async([partial(self._invoke_checked, model_name, method, *args)
+                                          for model_name, method, args in calls])
+
+    async def fan_out(self, prompt: str, models: Sequence[str],
+                      image_path: Optional[ImageSource] = None,
+                      schema: Optional[Union[Dict[str, Union[str, Dict]], Type[BaseModel]]] = None,
+                      aggregator: Optional[str] = None,
+                      aggregation_prompt: str = DEFAULT_AGGREGATION_PROMPT) -> FanOutResult:
+        """
+        同じプロンプトを複数のモデルに同時に送信し、すべてのモデルの結果を返します。
+        aggregatorを指定した場合は、成功したモデルの回答をaggregatorのモデルで集約します。
+
+        :param prompt: 生成のためのプロンプト
+        :param models: リクエストを送信するモデルの名前
+        :param image_path: 画像（オプション。ファイルのパス、バイト列、PILの画像など）
+        :param schema: 生成するJSONのスキーマ（オプション。Noneの場合はテキストを生成）
+        :param aggregator: 回答を集約するモデルの名前（オプション）
+        :param aggregation_prompt: 集約に使用するプロンプトのテンプレート（{prompt}と{responses}が置き換えられます）
+        :return: モデルごとの結果と集約結果
+        :raises ModelNotSupportedError: 指定されたモデルがサポートされていない場合
+        """
+        method, args = self._parallel_request(models, prompt, schema, image_path, suffix="_async")
+        if aggregator is not None:
+            self._parallel_request([aggregator], prompt, None, None, suffix="_async")
+        calls = [(model_name, partial(self._invoke_checked, model_name, method, *args))
+                 for model_name in models]
+        result = FanOutResult(await run_fan_out_async(calls))
+        if aggregator is not None and result.successes:
+            aggregation = build_aggregation_prompt(prompt, result.results, aggregation_prompt)
+            call = partial(self._invoke_checked, aggregator, "generate_async", aggregation)
+            result.aggregate = await timed_call_async(aggregator, call)
+        return result
+
+    def generate_text_batch(self, prompts: Iterable[str],
+                            image_paths: Optional[Sequence[Optional[ImageSource]]] = None,
+                            max_concurrency: int = 8,
+                            ordered: bool = True) -> AsyncIterator[BatchResult]:
+        """
+        複数のプロンプトに対して、同時実行数を制限しながらテキストを生成します。
+
+        :param prompts: プロンプトのイテラブル
+        :param image_paths: 項目ごとの画像（オプション。Noneの項目はテキストのみで生成）
+        :param max_concurrency: 同時に実行するリクエストの最大数
+        :param ordered: Trueの場合は入力順、Falseの場合は完了順に結果を返します
+        :return: BatchResultの非同期イテレータ
+        """
+        items = build_batch_items(prompts, image_paths)
+        return run_batch_async(self._generate_text_item, items, max_concurrency, ordered)
+
+    def generate_json_batch(
+            self, prompts: Iterable[str],
+            schemas: Union[Dict[str, Union[str, Dict]], Type[BaseModel], Sequence[Any]],
+            image_paths: Optional[Sequence[Optional[ImageSource]]] = None, max_concurrency: int = 8,
+            ordered: bool = True) -> AsyncIterator[BatchResult]:
+        """
+        複数のプロンプトに対して、同時実行数を制限しながらJSONを生成します。
+
+        :param prompts: プロンプトのイテラブル
+        :param schemas: 全項目共通のスキーマ、または項目ごとのスキーマのリスト
+        :param image_paths: 項目ごとの画像（オプション。Noneの項目はテキストのみで生成）
+        :param max_concurrency: 同時に実行するリクエストの最大数
+        :param ordered: Trueの場合は入力順、Falseの場合は完了順に結果を返します
+        :return: BatchResultの非同期イテレータ
+        """
+        items = build_batch_items(prompts, self._batch_schemas(schemas), image_paths)
+        return run_batch_async(self._generate_json_item, items, max_concurrency, ordered)
+
+    async def _cached(self, key: Optional[str], call: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        キャッシュに値があればそれを返し、なければcallを実行して結果をキャッシュします。
+        coalescerが設定されている場合、同じキーの実行中の呼び出しがあればその結果を共有します。
+
+        :param key: キャッシュキー（Noneの場合はキャッシュを使用しない）
+        :param call: 生成処理のコルーチンを返す関数
+        :return: 生成結果
+        """
+        if key is None:
+            return await call()
+        if self.cache is not None:
+            value = self.cache.get(key)
+            if value is not None:
+                return self._from_cache(value)
+            call = partial(self._call_and_store, key, call)
+        if self.coalescer is not None:
+            return await self.coalescer.do_async(key, call)
+        return await call()
+
+    async def _call_and_store(self, key: str, call: Callable[[], Awaitable[Any]]) -> Any:
+        value = await call()
+        self.cache.set(key, self._to_cache(value))
+        return value
+
+    async def _invoke(self, model_name: str, method: str, *args: Any) -> Any:
+        """
+        モデルの非同期メソッドを呼び出し、結果を統計情報、サーキットブレーカー、メトリクスに記録します。
+
+        :param model_name: モデル名
+        :param method: 呼び出すメソッド名
+        :return: メソッドの戻り値
+        """
+        model = self.models[model_name]
+        token = self._start(model_name, method)
+        start = time.monotonic()
+        try:
+            if self.return_result:
+                result = await model.call_with_result_async(method, *args)
+            else:
+                result = await getattr(model, method)(*args)
+        except Exception as e:
+            self._record_error(model_name, e, time.monotonic() - start)
+            raise
+        except BaseException:
+            # キャンセルされた呼び出し（race_jsonやヘッジリクエストで負けたリクエスト）は成否を記録しない
+            self._release(model_name)
+            raise
+        else:
+            self._record_success(model_name, time.monotonic() - start)
+        finally:
+            self._finish(model_name, token)
+        return result
+
+    async def _invoke_checked(self, model_name: str, method: str, *args: Any) -> Any:
+        """サーキットブレーカーがリクエストを許可する場合に限り、_invokeを呼び出します（ハーフオープン状態では試行リクエストを記録します）。"""
+        self._check_circuit(model_name)
+        return await self._invoke(model_name, method, *args)
+
+    async def _call(self, method: str, *args: Any, hedge: bool = False) -> Any:
+        """
+        使用中のモデルの非同期メソッドを呼び出します。プロバイダーや通信のエラーで失敗した場合やサーキットブレーカーが
+        オープン状態の場合は、fallback_modelsのモデルを順に試します。入力の誤りなどのエラーはそのまま送出します。
+        ヘッジリクエストで負けたリクエストはキャンセルされます。
+
+        :param method: 呼び出すメソッド名
+        :param hedge: ヘッジリクエストが有効な場合に使用するかどうか
+        :return: メソッドの戻り値
+        :raises CircuitOpenError: リクエストを送信できるモデルがない場合
+        """
+        error = None
+        for model_name in self._candidates():
+            try:
+                if hedge and self.hedge is not None:
+                    hedge_model, delay = self._hedge_targets(model_name)
+                    return await hedged_call_async(
+                        lambda: self._invoke_checked(model_name, method, *args),
+                        lambda: self._invoke_checked(hedge_model, method, *args),
+                        delay, self.hedge)
+                return await self._invoke_checked(model_name, method, *args)
+            except Exception as e:
+                if not self._is_provider_failure(e):
+                    raise
+                error = e
+        raise self._no_candidate_error(error)
+
+    async def _generate_text_item(self, prompt: str, image_path: Optional[ImageSource]) -> str:
+        if image_path is None:
+            return await self.generate_text(prompt)
+        return await self.generate_with_image(prompt, image_path)
+
+    async def _generate_json_item(self, prompt: str, schema,
+                                  image_path: Optional[ImageSource]) -> Dict[str, Any]:
+        if image_path is None:
+            return await self.generate_json(prompt, schema)
+        return await self.generate_with_image_json(prompt, image_path, schema)
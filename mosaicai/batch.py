@@ -0,0 +1,138 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from dataclasses import dataclass
+from itertools import repeat
+from typing import Any, AsyncIterator, Awaitable, Callable, Iterable, Iterator, Optional, Tuple
+
+
+@dataclass
+class BatchResult:
+    """
+    バッチ処理における1件分の結果を表すクラスです。
+
+    :param index: 入力におけるインデックス
+    :param prompt: 入力されたプロンプト
+    :param result: 生成結果（エラーの場合はNone）
+    :param error: 発生した例外（成功した場合はNone）
+    """
+    index: int
+    prompt: str
+    result: Any = None
+    error: Optional[BaseException] = None
+
+    @property
+    def ok(self) -> bool:
+        """生成に成功した場合にTrueを返します。"""
+        return self.error is None
+
+
+def _check_max_concurrency(max_concurrency: int):
+    if max_concurrency < 1:
+        raise ValueError("max_concurrencyは1以上である必要があります。")
+
+
+def build_batch_items(prompts: Iterable[str],
+                      *per_item: Optional[Iterable[Any]]) -> Iterator[Tuple[str, tuple]]:
+    """
+    プロンプトと項目ごとの追加引数を組み合わせて、バッチの入力を作成します。
+
+    :param prompts: プロンプトのイテラブル
+    :param per_item: 項目ごとの追加引数のイテラブル（Noneの場合は全項目でNone）
+    :return: (プロンプト, 追加引数のタプル) のイテレータ
+    """
+    columns = [repeat(None) if values is None else values for values in per_item]
+    for prompt, *extras in zip(prompts, *columns):
+        yield prompt, tuple(extras)
+
+
+def run_batch(func: Callable[..., Any], items: Iterable[Tuple[str, tuple]],
+              max_concurrency: int = 8, ordered: bool = True) -> Iterator[BatchResult]:
+    """
+    スレッドプールを使用して、同時実行数を制限しながらバッチを実行します。
+
+    入力は遅延的に読み込まれ、実行中のリクエストは常にmax_concurrency件以下に保たれます。
+    各項目の例外はBatchResult.errorに格納され、バッチ全体は中断されません。
+
+    :param func: 各項目に対して呼び出す関数。func(prompt, *extras)の形式で呼び出されます
+    :param items: (プロンプト, 追加引数のタプル) のイテラブル
+    :param max_concurrency: 同時に実行するリクエストの最大数
+    :param ordered: Trueの場合は入力順、Falseの場合は完了順に結果を返します
+    :return: BatchResultのイテレータ
+    """
+    _check_max_concurrency(max_concurrency)
+    source = enumerate(items)
+    pending = {}
+    completed = {}
+    next_index = 0
+
+    with ThreadPoolExecutor(max_workers=max_concurrency) as executor:
+        def submit_next() -> bool:
+            for index, (prompt, extras) in source:
+                pending[executor.submit(func, prompt, *extras)] = (index, prompt)
+                return True
+            return False
+
+        while len(pending) < max_concurrency and submit_next():
+            pass
+
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                index, prompt = pending.pop(future)
+                error = future.exception()
+                result = BatchResult(index, prompt, None if error else future.result(), error)
+                submit_next()
+                if not ordered:
+                    yield result
+                    continue
+                completed[index] = result
+                while next_index in completed:
+                    yield completed.pop(next_index)
+                    next_index += 1
+
+
+async def run_batch_async(func: Callable[..., Awaitable[Any]], items: Iterable[Tuple[str, tuple]],
+                          max_concurrency: int = 8,
+                          ordered: bool = True) -> AsyncIterator[BatchResult]:
+    """
+    run_batchの非同期版です。スレッドの代わりにasyncioのタスクを使用します。
+
+    :param func: 各項目に対して呼び出すコルーチン関数。func(prompt, *extras)の形式で呼び出されます
+    :param items: (プロンプト, 追加引数のタプル) のイテラブル
+    :param max_concurrency: 同時に実行するリクエストの最大数
+    :param ordered: Trueの場合は入力順、Falseの場合は完了順に結果を返します
+    :return: BatchResultの非同期イテレータ
+    """
+    _check_max_concurrency(max_concurrency)
+    source = enumerate(items)
+    pending = {}
+    completed = {}
+    next_index = 0
+
+    def submit_next() -> bool:
+        for index, (prompt, extras) in source:
+            pending[asyncio.ensure_future(func(prompt, *extras))] = (index, prompt)
+            return True
+        return False
+
+    while len(pending) < max_concurrency and submit_next():
+        pass
+
+    try:
+        while pending:
+            done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                index, prompt = pending.pop(task)
+                error = task.exception()
+                result = BatchResult(index, prompt, None if error else task.result(), error)
+                submit_next()
+                if not ordered:
+                    yield result
+                    continue
+                completed[index] = result
+                while next_index in completed:
+                    yield completed.pop(next_index)
+                    next_index += 1
+    finally:
+        for task in pending:
+            task.cancel()
@@ -0,0 +1,367 @@
+import copy
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple, Type, TypeVar, Union
+from pydantic import BaseModel
+from .images import ImageInput, ImageSource, LabeledImages, label_images
+
+T = TypeVar("T")
+
+
+def schema_fingerprint(
+        schema: Union[Dict[str, Union[str, Dict]], Type[BaseModel], None]) -> Optional[str]:
+    """
+    スキーマを安定した文字列表現に変換します。
+
+    :param schema: 辞書またはPydanticモデルのスキーマ
+    :return: スキーマの文字列表現（スキーマがない場合はNone）
+    """
+    if schema is None:
+        return None
+    if isinstance(schema, type) and issubclass(schema, BaseModel):
+        schema = schema.model_json_schema()
+    return json.dumps(schema, sort_keys=True, ensure_ascii=False, default=str)
+
+
+def make_cache_key(model: str, method: str, prompt: str,
+                   schema: Union[Dict[str, Union[str, Dict]], Type[BaseModel], None] = None,
+                   image_path: Optional[ImageSource] = None,
+                   images: Optional[LabeledImages] = None) -> str:
+    """
+    リクエストを一意に識別するキーを生成します。
+
+    モデル名、メソッド名、正規化されたメッセージ、スキーマ、画像の内容のダイジェストから
+    SHA-256ハッシュを計算します。画像はパスではなく内容で識別されるため、
+    同じ内容のファイルとバイト列は同じキーになります。
+
+    :param model: モデル名
+    :param method: 呼び出すメソッド名
+    :param prompt: プロンプト
+    :param schema: JSON応答のスキーマ（オプション）
+    :param image_path: 画像（オプション。ファイルのパス、バイト列、PILの画像、またはImageInput）
+    :param images: ラベルを付けた複数の画像（オプション）
+    :return: キー文字列
+    """
+    payload = {
+        "model": model,
+        "method": method,
+        "messages": [{"role": "user", "content": prompt}],
+        "schema": schema_fingerprint(schema),
+        "image": ImageInput.of(image_path).digest() if image_path is not None else None,
+    }
+    if images is not None:
+        # 複数の画像は、ラベルと内容のダイジェストの組を順に並べて識別する（既存のキーは変えない）
+        payload["images"] = [[label, image.digest()] for label, image in label_images(images)]
+    encoded = json.dumps(payload, sort_keys=True, ensure_ascii=False).encode()
+    return hashlib.sha256(encoded).hexdigest()
+
+
+class MemoryCache:
+    """
+    プロセス内のLRUキャッシュです。エントリ数の上限とTTLを指定できます。
+    """
+
+    def __init__(self, max_entries: int = 1024, ttl: Optional[float] = None):
+        """
+        :param max_entries: 保持する最大エントリ数
+        :param ttl: エントリの有効期間（秒）。Noneの場合は期限なし
+        """
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[Any]:
+        """キーに対応する値を返します。存在しないか期限切れの場合はNoneを返します。"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at is not None and expires_at <= time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None):
+        """値を保存し、上限を超えた場合は最も古く使用されたエントリを削除します。"""
+        ttl = self.ttl if ttl is None else ttl
+        expires_at = time.time() + ttl if ttl is not None else None
+        with self._lock:
+            self._entries[key] = (expires_at, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        """すべてのエントリを削除します。"""
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class SQLiteCache:
+    """
+    SQLite（WALモード）を使用した永続キャッシュです。
+    合計サイズが上限を超えた場合、最後に使用された時刻が古いエントリから削除します。
+    """
+
+    def __init__(self, path: str, ttl: Optional[float] = None, max_bytes: int = 100 * 1024 * 1024):
+        """
+        :param path: データベースファイルのパス
+        :param ttl: エントリの有効期間（秒）。Noneの場合は期限なし
+        :param max_bytes: 保存する値の合計サイズの上限（バイト）
+        """
+        self.path = path
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL, "
+            "expires_at REAL, accessed_at REAL NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS responses_accessed_at ON responses (accessed_at)")
+
+    def get(self, key: str) -> Optional[Any]:
+        """キーに対応する値を返します。存在しないか期限切れの場合はNoneを返します。"""
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, expires_at FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            value, expires_at = row
+            if expires_at is not None and expires_at <= now:
+                self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                return None
+            self._conn.execute("UPDATE responses SET accessed_at = ? WHERE key = ?", (now, key))
+        return json.loads(value)
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None):
+        """値をJSONとして保存し、合計サイズが上限を超えた場合は古いエントリを削除します。"""
+        ttl = self.ttl if ttl is None else ttl
+        now = time.time()
+        encoded = json.dumps(value, ensure_ascii=False)
+        size = len(encoded.encode())
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, value, size, expires_at, accessed_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (key, encoded, size, now + ttl if ttl is not None else None, now))
+            self._evict(now)
+
+    def _evict(self, now: float):
+        """期限切れのエントリと、サイズの上限を超えた分のエントリを削除します。"""
+        self._conn.execute(
+            "DELETE FROM responses WHERE expires_at IS NOT NULL AND expires_at <= ?", (now,))
+        total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        rows = self._conn.execute("SELECT key, size FROM responses ORDER BY accessed_at").fetchall()
+        evicted = []
+        for key, size in rows:
+            if total <= self.max_bytes:
+                break
+            evicted.append((key,))
+            total -= size
+        self._conn.executemany("DELETE FROM responses WHERE key = ?", evicted)
+
+    def clear(self):
+        """すべてのエントリを削除します。"""
+        with self._lock:
+            self._conn.execute("DELETE FROM responses")
+
+    def close(self):
+        """データベース接続を閉じます。"""
+        with self._lock:
+            self._conn.close()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+
+
+class ResponseCache:
+    """
+    プロセス内のLRUキャッシュと、オプションのSQLiteキャッシュからなる2階層の応答キャッシュです。
+
+    取得時はメモリ、ディスクの順に参照し、ディスクでヒットした値はメモリに昇格されます。
+    ヒット数とミス数はstats()で参照できます。
+    """
+
+    def __init__(self, max_entries: int = 1024, ttl: Optional[float] = None,
+                 path: Optional[str] = None, max_bytes: int = 100 * 1024 * 1024):
+        """
+        :param max_entries: メモリキャッシュに保持する最大エントリ数
+        :param ttl: エントリの有効期間（秒）。Noneの場合は期限なし
+        :param path: SQLiteデータベースファイルのパス。Noneの場合はメモリキャッシュのみを使用
+        :param max_bytes: SQLiteキャッシュに保存する値の合計サイズの上限（バイト）
+        """
+        self.memory = MemoryCache(max_entries=max_entries, ttl=ttl)
+        self.disk = SQLiteCache(path, ttl=ttl, max_bytes=max_bytes) if path else None
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "memory_hits": 0, "disk_hits": 0, "misses": 0}
+
+    def get(self, key: str) -> Optional[Any]:
+        """キーに対応する値を返します。見つからない場合はNoneを返します。"""
+        value = self.memory.get(key)
+        if value is not None:
+            self._count("memory_hits")
+            # 呼び出し元での変更がキャッシュに影響しないよう複製して返す
+            return copy.deepcopy(value)
+        if self.disk is not None:
+            value = self.disk.get(key)
+            if value is not None:
+                self.memory.set(key, copy.deepcopy(value))
+                self._count("disk_hits")
+                return value
+        self._count("misses")
+        return None
+
+    def set(self, key: str, value: Any):
+        """値を両方の階層に保存します。Noneは保存しません。"""
+        if value is None:
+            return
+        self.memory.set(key, copy.deepcopy(value))
+        if self.disk is not None:
+            self.disk.set(key, value)
+
+    def stats(self) -> Dict[str, int]:
+        """ヒット数、ミス数などの統計情報を返します。"""
+        with self._lock:
+            return dict(self._stats)
+
+    def clear(self):
+        """両方の階層のエントリを削除します。統計情報は保持されます。"""
+        self.memory.clear()
+        if self.disk is not None:
+            self.disk.clear()
+
+    def _count(self, name: str):
+        with self._lock:
+            self._stats[name] += 1
+            if name != "misses":
+                self._stats["hits"] += 1
+
+
+def payload_size(value: Any) -> int:
+    """
+    キャッシュする画像のペイロードのおおよそのメモリ使用量を返します。
+
+    :param value: 文字列、バイト列、PILの画像、またはそれらを含む辞書やタプル
+    :return: バイト数
+    """
+    if isinstance(value, str):
+        return len(value)
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return len(value)
+    if isinstance(value, dict):
+        return sum(payload_size(item) for item in value.values())
+    if isinstance(value, (list, tuple)):
+        return sum(payload_size(item) for item in value)
+    if hasattr(value, "getbands") and hasattr(value, "size"):
+        # PILの画像は展開したピクセルのサイズ
+        width, height = value.size
+        return width * height * len(value.getbands())
+    return 0
+
+
+class ImageCache:
+    """
+    エンコードした画像のペイロード（base64文字列、データURL、MIMEタイプ、PILの画像など）のプロセス内のLRUキャッシュです。
+
+    同じ画像について複数回（または複数のモデルに）問い合わせる場合に、画像ファイルの読み込みとエンコードを省略します。
+    エントリは画像ファイルのパス、サイズ、更新時刻（by_digest=Trueの場合は内容のダイジェスト）と、
+    ペイロードの形式（プロバイダー、前処理の方針など）で識別されます。
+    ペイロードの合計サイズが上限を超えた場合、最も古く使用されたエントリから削除します。
+    """
+
+    def __init__(self, max_bytes: int = 256 * 1024 * 1024, by_digest: bool = False):
+        """
+        :param max_bytes: 保持するペイロードの合計サイズの上限（バイト）
+        :param by_digest: Trueの場合、パスではなく画像ファイルの内容のSHA-256ダイジェストで識別します
+                          （内容が同じ別のファイルでもヒットしますが、呼び出しごとにファイル全体を読み込みます）
+        """
+        self.max_bytes = max_bytes
+        self.by_digest = by_digest
+        self._entries: "OrderedDict[tuple, Tuple[int, Any]]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "evictions": 0}
+
+    def file_key(self, image_path: ImageSource) -> tuple:
+        """
+        画像を識別するキーを返します。メモリ上の画像（バイト列、PILの画像）は常に内容のダイジェストで識別します。
+
+        :param image_path: 画像ファイルのパス、またはImageInputなどの画像
+        :return: (パス, サイズ, 更新時刻) または (ダイジェスト,)
+        """
+        image = ImageInput.of(image_path)
+        if self.by_digest or not image.is_file:
+            return (image.digest(),)
+        stat = os.stat(image.path)
+        return (os.path.abspath(image.path), stat.st_size, stat.st_mtime_ns)
+
+    def get_or_create(self, image_path: ImageSource, form: Hashable, create: Callable[[], T]) -> T:
+        """
+        キャッシュしたペイロードを返します。見つからない場合はcreateで作成して保存します。
+
+        同時に同じペイロードを要求された場合は、それぞれがcreateを呼び出すことがあります。
+
+        :param image_path: 画像ファイルのパス、またはImageInputなどの画像
+        :param form: ペイロードの形式を識別する値（プロバイダー、エンコード方法、前処理の方針など）
+        :param create: ペイロードを作成する関数
+        :return: ペイロード
+        """
+        key = (form,) + self.file_key(image_path)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self._stats["hits"] += 1
+                return entry[1]
+            self._stats["misses"] += 1
+        value = create()
+        size = payload_size(value)
+        if size > self.max_bytes:
+            return value
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._bytes -= previous[0]
+            self._entries[key] = (size, value)
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                _, (evicted_size, _) = self._entries.popitem(last=False)
+                self._bytes -= evicted_size
+                self._stats["evictions"] += 1
+        return value
+
+    def stats(self) -> Dict[str, int]:
+        """ヒット数、ミス数、削除したエントリ数、エントリ数、ペイロードの合計サイズを返します。"""
+        with self._lock:
+            return {**self._stats, "entries": len(self._entries), "bytes": self._bytes}
+
+    def clear(self):
+        """すべてのエントリを削除します。統計情報は保持されます。"""
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
@@ -0,0 +1,369 @@
+import asyncio
+import base64
+import collections
+import json
+import os
+import threading
+import time
+from typing import Any, Deque, Dict, Iterator, AsyncIterator, List, Optional, Tuple
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+import httpx
+from .exceptions import CassetteMismatchError
+from .utils import client_registry
+
+CASSETTE_VERSION = 1
+REDACTED = "REDACTED"
+# 記録するリクエストのヘッダー（認証情報やSDKのバージョンなどは記録しない）
+RECORDED_REQUEST_HEADERS = frozenset({"content-type", "anthropic-version", "anthropic-beta"})
+# 値を伏せて記録する応答のヘッダー
+REDACTED_RESPONSE_HEADERS = frozenset({"openai-organization", "anthropic-organization-id"})
+# 記録しない応答のヘッダー（本文は復号した状態で記録し、再生時に長さが変わるため）
+DROPPED_RESPONSE_HEADERS = frozenset({"set-cookie", "content-encoding", "content-length",
+                                      "transfer-encoding", "connection", "keep-alive"})
+# 値を伏せて記録するクエリパラメーター
+REDACTED_QUERY_PARAMS = frozenset({"key", "api_key", "api-key"})
+
+
+class Cassette:
+    """
+    プロバイダーとのHTTPリクエストと応答を記録し、ネットワークに接続せずに再生するクラスです。
+
+    with文の中で作成されたモデルインスタンス（MosaicAI、AsyncMosaicAI）のHTTPリクエストが対象になります。
+    記録モードでは実際のAPIにリクエストを送り、認証情報を除いたリクエストと応答、応答までの時間、
+    ストリーミングのチャンクの到着時刻をファイルに保存します。再生モードでは記録した応答を記録した時間どおり
+    （またはspeed倍の速さで）返します。
+
+    OpenAI、Anthropic、Perplexityに対応しています（GeminiはSDKが独自の通信を行うため対象外です）。
+
+    ```python
+    with Cassette("cassettes/summary.json", mode="record"):
+        MosaicAI("gpt-4o").generate_text("要約してください")
+
+    with Cassette("cassettes/summary.json", mode="replay", speed=10.0):
+        MosaicAI("gpt-4o").generate_text("要約してください")
+    ```
+    """
+
+    def __init__(self, path: str, mode: str = "replay", speed: Optional[float] = 1.0,
+                 repeat: bool = True):
+        """
+        :param path: カセットファイルのパス
+        :param mode: "record"（記録）または"replay"（再生）
+        :param speed: 再生の速さ（2.0の場合は記録した時間の半分で応答する。Noneの場合は待機しない）
+        :param repeat: 同じリクエストを記録した回数より多く受け取った場合に、記録した応答を繰り返し返すかどうか
+        :raises ValueError: modeが不正な場合
+        """
+        if mode not in ("record", "replay"):
+            raise ValueError(f"modeには'record'または'replay'を指定してください: {mode}")
+        self.path = path
+        self.mode = mode
+        self.speed = speed
+        self.repeat = repeat
+        self.interactions: List[Dict[str, Any]] = []
+        self._lock = threading.Lock()
+        self._queues: Dict[str, Deque[Dict[str, Any]]] = {}
+        self._played: Dict[str, List[Dict[str, Any]]] = {}
+        if mode == "replay":
+            self.load()
+
+    def load(self):
+        """
+        カセットファイルを読み込みます。
+
+        :raises FileNotFoundError: ファイルが存在しない場合
+        """
+        with open(self.path, encoding="utf-8") as f:
+            data = json.load(f)
+        with self._lock:
+            self.interactions = data.get("interactions", [])
+            self._queues = {}
+            self._played = {}
+            for interaction in self.interactions:
+                key = _match_key(interaction["request"])
+                self._queues.setdefault(key, collections.deque()).append(interaction)
+
+    def save(self):
+        """記録したリクエストと応答をカセットファイルに書き込みます。"""
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._lock:
+            data = {"version": CASSETTE_VERSION, "interactions": list(self.interactions)}
+        temporary_path = f"{self.path}.tmp"
+        with open(temporary_path, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False, indent=2)
+        os.replace(temporary_path, self.path)
+
+    def __enter__(self) -> "Cassette":
+        client_registry.install_transport(self)
+        return self
+
+    def __exit__(self, *exc_info):
+        client_registry.install_transport(None)
+        if self.mode == "record":
+            self.save()
+
+    def transport(self, inner):
+        """
+        httpx.Clientに渡すトランスポートを返します（client_registryから呼び出されます）。
+
+        :param inner: 実際に通信を行うhttpx.HTTPTransport
+        :return: 記録または再生を行うトランスポート
+        """
+        return _Transport(self, inner)
+
+    def async_transport(self, inner):
+        """
+        transportの非同期版です。
+
+        :param inner: 実際に通信を行うhttpx.AsyncHTTPTransport
+        :return: 記録または再生を行うトランスポート
+        """
+        return _AsyncTransport(self, inner)
+
+    def _next(self, request: Dict[str, Any]) -> Dict[str, Any]:
+        """リクエストに一致する記録を返す"""
+        key = _match_key(request)
+        with self._lock:
+            queue = self._queues.get(key)
+            if queue:
+                interaction = queue.popleft()
+                self._played.setdefault(key, []).append(interaction)
+                return interaction
+            played = self._played.get(key)
+            if played and self.repeat:
+                # 記録した応答を順に繰り返す
+                self._queues[key] = collections.deque(played[1:])
+                self._played[key] = [played[0]]
+                return played[0]
+        raise CassetteMismatchError(
+            f"リクエストに一致する記録がカセットにありません: {request['method']} {request['url']}")
+
+    def _append(self, interaction: Dict[str, Any]):
+        with self._lock:
+            self.interactions.append(interaction)
+
+    def _delay(self, seconds: float) -> float:
+        return 0.0 if not self.speed else max(0.0, seconds) / self.speed
+
+
+def normalize_request(request: httpx.Request) -> Dict[str, Any]:
+    """
+    httpx.Requestを、認証情報を除いた記録用の辞書に変換します。
+
+    :param request: httpx.Request
+    :return: method、url、headers、bodyを持つ辞書
+    """
+    parts = urlsplit(str(request.url))
+    query = urlencode([(name, REDACTED if name.lower() in REDACTED_QUERY_PARAMS else value)
+                       for name, value in parse_qsl(parts.query, keep_blank_values=True)])
+    content = request.read()
+    try:
+        body: Any = json.loads(content) if content else None
+    except ValueError:
+        body = content.decode("utf-8", errors="replace")
+    return {
+        "method": request.method,
+        "url": urlunsplit((parts.scheme, parts.netloc, parts.path, query, "")),
+        "headers": {name: value for name, value in request.headers.items()
+                    if name.lower() in RECORDED_REQUEST_HEADERS},
+        "body": body,
+    }
+
+
+def _match_key(request: Dict[str, Any]) -> str:
+    """メソッド、URL、本文（キーの順序を正規化したもの）からリクエストを照合するキーを作成する"""
+    body = json.dumps(request.get("body"), sort_keys=True, ensure_ascii=False,
+                      separators=(",", ":"))
+    return f"{request['method']} {request['url']} {body}"
+
+
+def _response_headers(headers) -> Dict[str, str]:
+    return {name: REDACTED if name.lower() in REDACTED_RESPONSE_HEADERS else value
+            for name, value in headers.items() if name.lower() not in DROPPED_RESPONSE_HEADERS}
+
+
+def _encode_body(body: bytes) -> Dict[str, str]:
+    try:
+        return {"body": body.decode("utf-8")}
+    except UnicodeDecodeError:
+        return {"body_base64": base64.b64encode(body).decode()}
+
+
+def _decode_body(response: Dict[str, Any]) -> bytes:
+    if "body_base64" in response:
+        return base64.b64decode(response["body_base64"])
+    return response.get("body", "").encode("utf-8")
+
+
+def _replay_chunks(response: Dict[str, Any]) -> List[Tuple[float, bytes]]:
+    """記録した本文を、記録したチャンクの到着時刻と大きさで分割する"""
+    body = _decode_body(response)
+    chunks, position = [], 0
+    for offset, length in response.get("chunks") or [[0.0, len(body)]]:
+        chunks.append((offset, body[position:position + length]))
+        position += length
+    if position < len(body):
+        chunks.append((chunks[-1][0] if chunks else 0.0, body[position:]))
+    return chunks
+
+
+class _Recorder:
+    """応答の本文を読み進めながらチャンクの到着時刻を記録し、読み終えたらカセットに追加する"""
+
+    def __init__(self, cassette: Cassette, request: Dict[str, Any], response: httpx.Response,
+                 elapsed: float):
+        self.cassette = cassette
+        self.request = request
+        self.status = response.status_code
+        self.headers = _response_headers(response.headers)
+        self.elapsed = elapsed
+        self.start = time.perf_counter()
+        self.body = bytearray()
+        self.chunks: List[List[float]] = []
+        self.finished = False
+
+    def add(self, chunk: bytes):
+        if chunk:
+            self.chunks.append([round(time.perf_counter() - self.start, 6), len(chunk)])
+            self.body.extend(chunk)
+
+    def finish(self):
+        if self.finished:
+            return
+        self.finished = True
+        self.cassette._append({
+            "request": self.request,
+            "response": {"status": self.status, "headers": self.headers,
+                         "elapsed": round(self.elapsed, 6), "chunks": self.chunks,
+                         **_encode_body(bytes(self.body))},
+        })
+
+
+class _RecordingStream(httpx.SyncByteStream):
+    def __init__(self, stream, recorder: _Recorder):
+        self._stream = stream
+        self._recorder = recorder
+
+    def __iter__(self) -> Iterator[bytes]:
+        for chunk in self._stream:
+            self._recorder.add(chunk)
+            yield chunk
+        self._recorder.finish()
+
+    def close(self):
+        self._stream.close()
+        self._recorder.finish()
+
+
+class _AsyncRecordingStream(httpx.AsyncByteStream):
+    def __init__(self, stream, recorder: _Recorder):
+        self._stream = stream
+        self._recorder = recorder
+
+    async def __aiter__(self) -> AsyncIterator[bytes]:
+        async for chunk in self._stream:
+            self._recorder.add(chunk)
+            yield chunk
+        self._recorder.finish()
+
+    async def aclose(self):
+        await self._stream.aclose()
+        self._recorder.finish()
+
+
+class _ReplayStream(httpx.SyncByteStream):
+    def __init__(self, cassette: Cassette, chunks: List[Tuple[float, bytes]]):
+        self._cassette = cassette
+        self._chunks = chunks
+
+    def __iter__(self) -> Iterator[bytes]:
+        previous = 0.0
+        for offset, chunk in self._chunks:
+            delay = self._cassette._delay(offset - previous)
+            if delay:
+                time.sleep(delay)
+            previous = offset
+            yield chunk
+
+
+class _AsyncReplayStream(httpx.AsyncByteStream):
+    def __init__(self, cassette: Cassette, chunks: List[Tuple[float, bytes]]):
+        self._cassette = cassette
+        self._chunks = chunks
+
+    async def __aiter__(self) -> AsyncIterator[bytes]:
+        previous = 0.0
+        for offset, chunk in self._chunks:
+            delay = self._cassette._delay(offset - previous)
+            if delay:
+                await asyncio.sleep(delay)
+            previous = offset
+            yield chunk
+
+
+def _prepare_recording(request: httpx.Request) -> Dict[str, Any]:
+    """記録する本文が圧縮されないよう、圧縮しない応答を要求する"""
+    request.headers["Accept-Encoding"] = "identity"
+    return normalize_request(request)
+
+
+def _replay_response(cassette: Cassette, request: httpx.Request,
+                     stream_class) -> Tuple[Dict[str, Any], httpx.Response]:
+    interaction = cassette._next(normalize_request(request))
+    response = interaction["response"]
+    stream = stream_class(cassette, _replay_chunks(response))
+    return response, httpx.Response(response["status"], headers=response.get("headers", {}),
+                                    stream=stream, request=request)
+
+
+class _Transport(httpx.BaseTransport):
+    """記録または再生を行うhttpx.Clientのトランスポート"""
+
+    def __init__(self, cassette: Cassette, inner):
+        self._cassette = cassette
+        self._inner = inner
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        if self._cassette.mode == "replay":
+            recorded, response = _replay_response(self._cassette, request, _ReplayStream)
+            delay = self._cassette._delay(recorded.get("elapsed", 0.0))
+            if delay:
+                time.sleep(delay)
+            return response
+        normalized = _prepare_recording(request)
+        start = time.perf_counter()
+        response = self._inner.handle_request(request)
+        recorder = _Recorder(self._cassette, normalized, response, time.perf_counter() - start)
+        return httpx.Response(response.status_code, headers=response.headers,
+                              stream=_RecordingStream(response.stream, recorder),
+                              extensions=response.extensions, request=request)
+
+    def close(self):
+        self._inner.close()
+
+
+class _AsyncTransport(httpx.AsyncBaseTransport):
+    """_Transportの非同期版"""
+
+    def __init__(self, cassette: Cassette, inner):
+        self._cassette = cassette
+        self._inner = inner
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        if self._cassette.mode == "replay":
+            recorded, response = _replay_response(self._cassette, request, _AsyncReplayStream)
+            delay = self._cassette._delay(recorded.get("elapsed", 0.0))
+            if delay:
+                await asyncio.sleep(delay)
+            return response
+        normalized = _prepare_recording(request)
+        start = time.perf_counter()
+        response = await self._inner.handle_async_request(request)
+        recorder = _Recorder(self._cassette, normalized, response, time.perf_counter() - start)
+        return httpx.Response(response.status_code, headers=response.headers,
+                              stream=_AsyncRecordingStream(response.stream, recorder),
+                              extensions=response.extensions, request=request)
+
+    async def aclose(self):
+        await self._inner.aclose()
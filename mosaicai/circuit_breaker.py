@@ -0,0 +1,168 @@
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Dict, Optional
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitBreaker:
+    """
+    1つのモデルに対するサーキットブレーカーです。
+
+    直近の呼び出しのうち失敗（またはslow_call_thresholdより遅い呼び出し）の割合がしきい値を超えると
+    オープン状態になり、reset_timeoutの間はリクエストを送信せずに失敗させます。
+    reset_timeoutの経過後はハーフオープン状態になり、少数の試行リクエストの結果でクローズまたは再オープンします。
+    """
+
+    def __init__(self, failure_rate_threshold: float = 0.5,
+                 slow_call_threshold: Optional[float] = None, window_size: int = 20,
+                 minimum_calls: int = 10, reset_timeout: float = 30.0,
+                 half_open_max_calls: int = 1):
+        """
+        :param failure_rate_threshold: オープン状態にする失敗の割合（0から1）
+        :param slow_call_threshold: 失敗とみなすレイテンシ（秒）。Noneの場合はレイテンシを考慮しない
+        :param window_size: 失敗の割合を計算する直近の呼び出し数
+        :param minimum_calls: 失敗の割合を計算するために必要な最小の呼び出し数
+        :param reset_timeout: オープン状態からハーフオープン状態に移るまでの時間（秒）
+        :param half_open_max_calls: ハーフオープン状態で許可する試行リクエストの数
+        """
+        self.failure_rate_threshold = failure_rate_threshold
+        self.slow_call_threshold = slow_call_threshold
+        self.minimum_calls = minimum_calls
+        self.reset_timeout = reset_timeout
+        self.half_open_max_calls = half_open_max_calls
+        self._outcomes = deque(maxlen=window_size)
+        self._state = CLOSED
+        self._opened_at = 0.0
+        self._probes = 0
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        """現在の状態（"closed"、"open"、"half_open"）を返します。"""
+        with self._lock:
+            self._update_state()
+            return self._state
+
+    def _update_state(self):
+        if self._state == OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+            self._state = HALF_OPEN
+            self._probes = 0
+
+    def allow_request(self) -> bool:
+        """
+        リクエストを送信してよいかを返します。ハーフオープン状態では試行リクエストの数を記録します。
+
+        :return: 送信してよい場合はTrue
+        """
+        with self._lock:
+            self._update_state()
+            if not self._can_send():
+                return False
+            if self._state == HALF_OPEN:
+                self._probes += 1
+            return True
+
+    def available(self) -> bool:
+        """
+        試行リクエストの数を記録せずに、リクエストを送信できる状態かどうかを返します。
+
+        :return: 送信できる場合はTrue
+        """
+        with self._lock:
+            self._update_state()
+            return self._can_send()
+
+    def release(self):
+        """
+        成否を記録せずに終了した呼び出し（キャンセルされた呼び出しや、呼び出し元の誤りによるエラー）の
+        試行リクエストを返却し、ハーフオープン状態で次の試行リクエストを許可します。
+        """
+        with self._lock:
+            if self._state == HALF_OPEN and self._probes > 0:
+                self._probes -= 1
+
+    def _can_send(self) -> bool:
+        if self._state == CLOSED:
+            return True
+        return self._state == HALF_OPEN and self._probes < self.half_open_max_calls
+
+    def record_success(self, latency: float):
+        """
+        成功した呼び出しを記録します。slow_call_thresholdより遅い呼び出しは失敗として扱います。
+
+        :param latency: 呼び出しのレイテンシ（秒）
+        """
+        slow = self.slow_call_threshold is not None and latency > self.slow_call_threshold
+        self._record(failed=slow)
+
+    def record_failure(self):
+        """失敗した呼び出しを記録します。"""
+        self._record(failed=True)
+
+    def _record(self, failed: bool):
+        with self._lock:
+            self._update_state()
+            if self._state == HALF_OPEN:
+                if failed:
+                    self._open()
+                else:
+                    self._state = CLOSED
+                    self._outcomes.clear()
+                return
+            self._outcomes.append(failed)
+            if self._state == CLOSED and len(self._outcomes) >= self.minimum_calls:
+                if sum(self._outcomes) / len(self._outcomes) >= self.failure_rate_threshold:
+                    self._open()
+
+    def _open(self):
+        self._state = OPEN
+        self._opened_at = time.monotonic()
+        self._outcomes.clear()
+
+
+@dataclass
+class CircuitBreakerPolicy:
+    """
+    モデルごとのサーキットブレーカーの設定です。同じ方針を使用するMosaicAIインスタンスは、モデルごとの状態を共有します。
+
+    :param failure_rate_threshold: オープン状態にする失敗の割合（0から1）
+    :param slow_call_threshold: 失敗とみなすレイテンシ（秒）。Noneの場合はレイテンシを考慮しない
+    :param window_size: 失敗の割合を計算する直近の呼び出し数
+    :param minimum_calls: 失敗の割合を計算するために必要な最小の呼び出し数
+    :param reset_timeout: オープン状態からハーフオープン状態に移るまでの時間（秒）
+    :param half_open_max_calls: ハーフオープン状態で許可する試行リクエストの数
+    """
+    failure_rate_threshold: float = 0.5
+    slow_call_threshold: Optional[float] = None
+    window_size: int = 20
+    minimum_calls: int = 10
+    reset_timeout: float = 30.0
+    half_open_max_calls: int = 1
+    _breakers: Dict[str, CircuitBreaker] = field(default_factory=dict, init=False, repr=False,
+                                                 compare=False)
+    _lock: threading.Lock = field(default_factory=threading.Lock, init=False, repr=False,
+                                  compare=False)
+
+    def breaker(self, model: str) -> CircuitBreaker:
+        """
+        モデルのサーキットブレーカーを返します。
+
+        :param model: モデル名
+        :return: サーキットブレーカー
+        """
+        with self._lock:
+            breaker = self._breakers.get(model)
+            if breaker is None:
+                breaker = self._breakers[model] = CircuitBreaker(
+                    self.failure_rate_threshold, self.slow_call_threshold, self.window_size,
+                    self.minimum_calls, self.reset_timeout, self.half_open_max_calls)
+            return breaker
+
+
+# fallback_modelsだけを指定した場合に使用する、プロセス内で共有される既定の方針
+default_policy = CircuitBreakerPolicy()
@@ -1,40 +1,121 @@
-from typing import Dict, Any, Union, Type
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import (Dict, Any, Union, Type, Iterable, Iterator, Optional, Sequence, Callable, Tuple,
+                    List)
+from itertools import repeat
 from pydantic import BaseModel
+import contextvars
 import json
-from .models import ChatGPT, Claude, Gemini, Perplexity, AIModelBase
+import logging
+import threading
+import time
+from .batch import BatchResult, build_batch_items, run_batch
+from .cache import ImageCache, ResponseCache, make_cache_key
+from .circuit_breaker import CircuitBreakerPolicy
+from .coalesce import RequestCoalescer
+from . import circuit_breaker as circuit_breaker_module
+from .fan_out import (DEFAULT_AGGREGATION_PROMPT, FanOutResult, build_aggregation_prompt,
+                      run_fan_out, timed_call)
+from .images import ImageInput, ImagePolicy, ImageSource, LabeledImages, label_images
+from .hedging import HedgePolicy, hedged_call, first_success
+from .routing import LatencyRouter
+from . import metrics, stats
+from .rate_limit import configure_rate_limit
+from .utils.client_registry import configure_base_url
+from .retry import RetryPolicy, is_retryable
+from .streaming import TextStream
+from .types import GenerationResult
+from . import models
+from .models import AIModelBase
 from .utils.api_key_manager import APIKeyManager
-from .exceptions import ModelNotSupportedError
+from .exceptions import ModelNotSupportedError, CircuitOpenError
 
+# モデル名の接頭辞と、対応するモデルクラスの名前
+# モデルクラス（とプロバイダーのSDK）は、initialize_modelで最初に必要になったときに読み込まれる
+MODEL_PREFIXES = (
+    ("gpt-", "ChatGPT"),
+    ("claude-", "Claude"),
+    ("gemini-", "Gemini"),
+    ("llama-", "Perplexity"),
+)
 
-class MosaicAI:
+# ヘッジリクエストや複数モデルへの同時リクエストを実行するスレッドの最大数
+# （同期版では負けたリクエストも完了までスレッドを使用する）
+EXECUTOR_MAX_WORKERS = 64
+
+
+class _MosaicAIBase:
     """
-    MosaicAIクラスは、複数のAIモデルを統合して管理するためのクラスです。
-    異なるAIモデルを使用してテキスト生成、画像説明生成、JSON生成などの機能を提供します。
+    MosaicAIとAsyncMosaicAIに共通する、モデルの初期化とAPIキー管理を行う基底クラスです。
     """
 
-    def __init__(self, model: str, config: Dict[str, Any] = None):
+    def __init__(self, model: str, config: Dict[str, Any] = None,
+                 cache: Optional[ResponseCache] = None, retry_policy: Optional[RetryPolicy] = None,
+                 hedge: Optional[HedgePolicy] = None,
+                 fallback_models: Optional[Sequence[str]] = None,
+                 circuit_breaker: Optional[CircuitBreakerPolicy] = None,
+                 router: Optional[LatencyRouter] = None,
+                 coalescer: Optional[RequestCoalescer] = None, return_result: bool = False,
+                 image_policy: Optional[ImagePolicy] = None,
+                 image_cache: Optional[ImageCache] = None, stream_images: bool = False):
         """
-        MosaicAIクラスのコンストラクタ。
+        コンストラクタ。
 
         :param model: 使用するモデルの名前
         :param config: 設定情報を含む辞書（オプション）
+        :param cache: 応答キャッシュ（オプション）。指定した場合、同一のリクエストにはキャッシュした応答を返します
+        :param retry_policy: 再試行の方針（オプション）。省略した場合は環境変数MAX_RETRIES、REQUEST_TIMEOUTに従います
+        :param hedge: ヘッジリクエストの方針（オプション）。generate_textとgenerate_jsonに適用されます
+        :param fallback_models: modelの呼び出しに失敗した場合に順に試すモデルの名前（オプション）
+        :param circuit_breaker: モデルごとのサーキットブレーカーの方針（オプション）。
+                                fallback_modelsのみを指定した場合は、プロセス内で共有される既定の方針を使用します
+        :param router: モデルのプールから呼び出しごとにモデルを選択するルーター（オプション）
+        :param coalescer: 同時に実行される同一のリクエストを1回の呼び出しにまとめるRequestCoalescer（オプション）
+        :param return_result: Trueの場合、生成メソッドは生成結果の代わりにトークン使用量や終了理由を含むGenerationResultを返します
+        :param image_policy: 画像を送信する前に縮小、再圧縮し、メタデータを除去する方針（オプション）
+        :param image_cache: エンコードした画像のペイロードのキャッシュ（オプション）。同じ画像を繰り返し送信する場合にエンコードを省略します
+        :param stream_images: Trueの場合、ClaudeとChatGPTは画像をリクエストの送信中に少しずつエンコードし、エンコードした画像全体をメモリに保持しません
         """
         self.config = config or {}
+        self.cache = cache
+        self.retry_policy = retry_policy
+        self.hedge = hedge
+        self.fallback_models = [m for m in (fallback_models or []) if m != model]
+        if circuit_breaker is None and self.fallback_models:
+            circuit_breaker = circuit_breaker_module.default_policy
+        self.circuit_breaker = circuit_breaker
+        self.router = router
+        self.coalescer = coalescer
+        self.return_result = return_result
+        self.image_policy = image_policy
+        self.image_cache = image_cache
+        self.stream_images = stream_images
         self.api_key_manager = APIKeyManager()
         self.api_key_manager.load_from_env()
         self.models = {}
+        self._set_rate_limits_from_config()
+        self._set_base_urls_from_config()
         self.initialize_model(model)
+        if hedge is not None and hedge.model is not None:
+            self.initialize_model(hedge.model)
+        for fallback_model in self.fallback_models:
+            self.initialize_model(fallback_model)
+        if router is not None:
+            for pool_model in router.models:
+                self.initialize_model(pool_model)
 
     def initialize_model(self, model: str) -> AIModelBase:
         if model not in self.models:
-            if model.startswith("gpt-"):
-                self.models[model] = ChatGPT(self.api_key_manager, model)
-            elif model.startswith("claude-"):
-                self.models[model] = Claude(self.api_key_manager, model)
-            elif model.startswith("gemini-"):
-                self.models[model] = Gemini(self.api_key_manager, model)
-            elif model.startswith("llama-"):
-                self.models[model] = Perplexity(self.api_key_manager, model)
+            for prefix, class_name in MODEL_PREFIXES:
+                if model.startswith(prefix):
+                    model_class = getattr(models, class_name)
+                    self.models[model] = model_class(self.api_key_manager, model)
+                    self.models[model].retry_policy = self.retry_policy
+                    self.models[model].image_policy = self.image_policy
+                    self.models[model].image_cache = self.image_cache
+                    self.models[model].stream_images = self.stream_images
+                    self.models[model].model_name = model
+                    break
             else:
                 raise ValueError(f"サポートされていないモデル: {model}")
         return self.models[model]
@@ -46,6 +127,24 @@ class MosaicAI:
         for model, api_key in self.config.get('api_keys', {}).items():
             self.set_api_key(model, api_key)
 
+    def _set_rate_limits_from_config(self):
+        """
+        設定からプロバイダーごとのレート制限を設定します。
+
+        設定例: {"rate_limits": {"openai": {"rpm": 500, "tpm": 30000}}}
+        """
+        for provider, limits in self.config.get('rate_limits', {}).items():
+            configure_rate_limit(provider, rpm=limits.get('rpm'), tpm=limits.get('tpm'))
+
+    def _set_base_urls_from_config(self):
+        """
+        設定からプロバイダーごとのAPIのベースURLを設定します。
+
+        設定例: {"base_urls": {"openai": "http://127.0.0.1:8080/v1"}}
+        """
+        for provider, base_url in self.config.get('base_urls', {}).items():
+            configure_base_url(provider, base_url)
+
     def get_model(self) -> str:
         """
         使用中のモデル名を返します。
@@ -54,41 +153,282 @@ class MosaicAI:
         """
         return list(self.models.keys())[0]
 
-    def generate_text(self, prompt: str) -> str:
+    def set_api_key(self, model: str, api_key: str):
         """
-        指定されたモデルを使用してテキストを生成します。
+        指定されたモデルのAPIキーを設定します。
+
+        :param model: APIキーを設定するモデルの名前
+        :param api_key: 設定するAPIキー
+        """
+        self.api_key_manager.set_api_key(model, api_key)
+
+    @classmethod
+    def from_config_file(cls, config_path: str):
+        """
+        設定ファイルからインスタンスを作成します。
+
+        :param config_path: 設定ファイルのパス
+        :return: 作成されたインスタンス
+        """
+        with open(config_path, 'r') as f:
+            config = json.load(f)
+        return cls(config)
+
+    def _validate_prompt(self, prompt: str):
+        """
+        プロンプトが空でないことを検証します。
 
         :param prompt: 生成のためのプロンプト
-        :return: 生成されたテキスト
-        :raises ModelNotSupportedError: 指定されたモデルがサポートされていない場合
+        :raises ValueError: プロンプトが空の場合
         """
         if not prompt or not prompt.strip():
             raise ValueError("プロンプトが空です。有効なプロンプトを入力してください。")
 
+    def _get_model_instance(self, method: str = None, feature: str = None) -> AIModelBase:
+        """
+        使用中のモデルのインスタンスを取得します。
+
+        :param method: モデルに要求するメソッド名（オプション）
+        :param feature: methodが存在しない場合のエラーメッセージに使用する機能名（オプション）
+        :return: モデルのインスタンス
+        :raises ModelNotSupportedError: モデルがサポートされていない、またはmethodを持たない場合
+        """
         model = self.get_model()
         if model not in self.models:
-            raise ModelNotSupportedError(f"Model '{model}' is not supported.")
-        return self.models[model].generate(prompt)
+            raise ModelNotSupportedError(f"モデル '{model}' はサポートされていません。")
+        if method is not None and not hasattr(self.models[model], method):
+            raise ModelNotSupportedError(f"モデル '{model}' は{feature}をサポートしていません。")
+        return self.models[model]
 
-    def generate_with_image(self, prompt: str, image_path: str) -> str:
+    def _hedge_targets(self, model_name: str) -> Tuple[str, float]:
         """
-        指定されたモデルを使用して画像付きのテキストを生成します。
+        ヘッジリクエストの対象を返します。
+
+        :param model_name: 最初のリクエストを送信するモデル
+        :return: ヘッジリクエストを送信するモデル、ヘッジまでの待機時間
+        """
+        return self.hedge.model or model_name, self.hedge.hedge_delay(stats.model_stats(model_name))
+
+    def _candidates(self) -> Iterator[str]:
+        """
+        呼び出しを試みるモデルを、使用中のモデル、fallback_modelsの順に返します。
+        ルーターが設定されている場合は、ルーターが選択した順のプールのモデルを先に返します。
+        サーキットブレーカーがリクエストを許可しないモデルは除外します（試行リクエストは呼び出しの開始時に記録します）。
+
+        :return: モデル名のイテレータ
+        """
+        chain = [self.get_model()] + self.fallback_models
+        if self.router is not None:
+            ranked = self.router.rank()
+            chain = ranked + [model_name for model_name in chain if model_name not in ranked]
+        for model_name in chain:
+            if self._available(model_name):
+                yield model_name
+
+    def _start(self, model_name: str, method: str) -> contextvars.Token:
+        """呼び出しの開始を統計情報に記録し、メトリクスのmethodラベルを設定します。"""
+        stats.model_stats(model_name).start()
+        return metrics.set_method(method)
+
+    def _finish(self, model_name: str, token: contextvars.Token):
+        """呼び出しの終了を統計情報に記録し、メトリクスのmethodラベルを元に戻します。"""
+        stats.model_stats(model_name).finish()
+        metrics.reset_method(token)
+
+    def _record_success(self, model_name: str, latency: float):
+        """成功した呼び出しを統計情報、サーキットブレーカー、メトリクスに記録します。"""
+        stats.model_stats(model_name).record_success(latency)
+        if self.circuit_breaker is not None:
+            self.circuit_breaker.breaker(model_name).record_success(latency)
+        metrics.record_call(model_name, metrics.current_method(), latency)
+
+    def _record_failure(self, model_name: str, error: Exception, latency: float):
+        """失敗した呼び出しを統計情報、サーキットブレーカー、メトリクスに記録します。"""
+        stats.model_stats(model_name).record_failure(latency)
+        if self.circuit_breaker is not None:
+            self.circuit_breaker.breaker(model_name).record_failure()
+        metrics.record_call(model_name, metrics.current_method(), latency, error)
+        if self.fallback_models:
+            logging.warning(f"モデル '{model_name}' の呼び出しに失敗しました: {error}")
+
+    def _record_error(self, model_name: str, error: Exception, latency: float):
+        """
+        呼び出しのエラーを記録します。プロバイダーや通信のエラーのみを失敗として記録し、
+        入力の誤りなど呼び出し元のエラーはメトリクスにのみ記録して、試行リクエストを返却します。
+        """
+        if self._is_provider_failure(error):
+            self._record_failure(model_name, error, latency)
+        else:
+            metrics.record_call(model_name, metrics.current_method(), latency, error)
+            self._release(model_name)
+
+    def _release(self, model_name: str):
+        """成否を記録せずに終了した呼び出し（キャンセルされた呼び出しなど）の試行リクエストを返却します。"""
+        if self.circuit_breaker is not None:
+            self.circuit_breaker.breaker(model_name).release()
+
+    @staticmethod
+    def _is_provider_failure(error: BaseException) -> bool:
+        """サーキットブレーカーに失敗として記録し、次のモデルに切り替えるエラー（プロバイダーや通信の一時的なエラー）かどうかを返します。"""
+        return isinstance(error, CircuitOpenError) or is_retryable(error)
+
+    def _available(self, model_name: str) -> bool:
+        """試行リクエストを記録せずに、サーキットブレーカーがモデルへのリクエストを許可する状態かどうかを返します。"""
+        return self.circuit_breaker is None or self.circuit_breaker.breaker(model_name).available()
+
+    def _allows(self, model_name: str) -> bool:
+        """サーキットブレーカーがモデルへのリクエストを許可する場合にTrueを返します。"""
+        if self.circuit_breaker is None:
+            return True
+        return self.circuit_breaker.breaker(model_name).allow_request()
+
+    def _check_circuit(self, model_name: str):
+        """
+        サーキットブレーカーがモデルへのリクエストを許可しない場合、例外を送出します。
+
+        :raises CircuitOpenError: サーキットブレーカーがオープン状態の場合
+        """
+        if not self._allows(model_name):
+            raise CircuitOpenError(f"モデル '{model_name}' のサーキットブレーカーがオープン状態です。")
+
+    def _parallel_request(self, models: Sequence[str], prompt: str, schema,
+                          image_path: Optional[ImageSource], suffix: str = "") -> Tuple[str, tuple]:
+        """
+        複数のモデルに同じリクエストを送信するためのメソッド名と引数を返します。各モデルはここで初期化されます。
+
+        :param schema: 生成するJSONのスキーマ（Noneの場合はテキストを生成）
+        :param suffix: メソッド名の接尾辞（非同期版では"_async"）
+        :return: メソッド名、引数
+        :raises ModelNotSupportedError: モデルがサポートされていない、またはリクエストに対応していない場合
+        """
+        self._validate_prompt(prompt)
+        if schema is None and image_path is None:
+            method, args, feature = "generate", (prompt,), "テキスト生成"
+        elif schema is None:
+            method, args, feature = "generate_with_image", (prompt, image_path), "画像付きのテキスト生成"
+        elif image_path is None:
+            method, args, feature = "generate_json", (prompt, schema), "JSON生成"
+        else:
+            method, feature = "generate_with_image_json", "画像付きのJSON生成"
+            args = (prompt, image_path, schema)
+        for model_name in models:
+            if not hasattr(self.initialize_model(model_name), method + suffix):
+                raise ModelNotSupportedError(f"モデル '{model_name}' は{feature}をサポートしていません。")
+        return method + suffix, args
+
+    def _race_calls(self, models: Sequence[str], prompt: str, schema,
+                    image_path: Optional[ImageSource],
+                    suffix: str = "") -> List[Tuple[str, str, tuple]]:
+        """
+        race_jsonで各モデルに送信する呼び出しを作成します。サーキットブレーカーがオープン状態のモデルは除外します。
+        ハーフオープン状態の試行リクエストは、各モデルの呼び出しを開始するときに記録します。
+
+        :param suffix: メソッド名の接尾辞（非同期版では"_async"）
+        :return: (モデル名, メソッド名, 引数) のリスト
+        :raises CircuitOpenError: リクエストを送信できるモデルがない場合
+        """
+        method, args = self._parallel_request(models, prompt, schema, image_path, suffix)
+        calls = [(model_name, method, args) for model_name in models if self._available(model_name)]
+        if not calls:
+            raise self._no_candidate_error(None)
+        return calls
+
+    @staticmethod
+    def _no_candidate_error(error: Optional[Exception]) -> Exception:
+        """すべてのモデルの呼び出しに失敗した場合に送出する例外を返します。"""
+        if error is not None:
+            return error
+        return CircuitOpenError("サーキットブレーカーがオープン状態のため、リクエストを送信できるモデルがありません。")
+
+    def _cache_key(self, method: str, prompt: str, schema=None,
+                   image_path: Optional[ImageSource] = None,
+                   images: Optional[LabeledImages] = None) -> Optional[str]:
+        """
+        キャッシュまたはリクエストの集約が有効な場合、リクエストを識別するキーを返します。
+
+        :return: キー（どちらも無効な場合はNone）
+        """
+        if self.cache is None and self.coalescer is None:
+            return None
+        if self.return_result:
+            # GenerationResultを返すクライアントと生成結果を返すクライアントでキャッシュを共有しても混在しないようにする
+            method += ":result"
+        return make_cache_key(self.get_model(), method, prompt, schema, image_path, images)
+
+    def _to_cache(self, value: Any) -> Any:
+        """キャッシュに保存する値（JSONに変換できる値）を返します。"""
+        return value.to_dict() if self.return_result else value
+
+    def _from_cache(self, value: Any) -> Any:
+        """キャッシュから取り出した値を、生成メソッドの戻り値に変換します。"""
+        if not self.return_result:
+            return value
+        result = GenerationResult.from_dict(value)
+        result.cached = True
+        return result
+
+    @staticmethod
+    def _batch_schemas(schemas) -> Iterable:
+        """
+        バッチ処理用のスキーマを項目ごとのイテラブルに変換します。
+
+        :param schemas: 全項目共通のスキーマ、または項目ごとのスキーマのリスト
+        :return: 項目ごとのスキーマのイテラブル
+        """
+        if isinstance(schemas, (list, tuple)):
+            return schemas
+        return repeat(schemas)
+
+
+class MosaicAI(_MosaicAIBase):
+    """
+    MosaicAIクラスは、複数のAIモデルを統合して管理するためのクラスです。
+    異なるAIモデルを使用してテキスト生成、画像説明生成、JSON生成などの機能を提供します。
+    """
+    _executor: Optional[ThreadPoolExecutor] = None
+    _executor_lock = threading.Lock()
+
+    def generate_text(self, prompt: str) -> str:
+        """
+        指定されたモデルを使用してテキストを生成します。
 
         :param prompt: 生成のためのプロンプト
-        :param image_path: 画像ファイルのパス
         :return: 生成されたテキスト
         :raises ModelNotSupportedError: 指定されたモデルがサポートされていない場合
         """
-        if not prompt or not prompt.strip():
-            raise ValueError("プロンプトが空です。有効なプロンプトを入力してください。")
-        model = self.get_model()
-        if model not in self.models:
-            raise ModelNotSupportedError(f"モデル '{model}' はサポートされていません。")
+        self._validate_prompt(prompt)
+        self._get_model_instance()
+        return self._cached(self._cache_key("generate", prompt),
+                            lambda: self._call("generate", prompt, hedge=True))
+
+    def generate_text_stream(self, prompt: str) -> TextStream:
+        """
+        指定されたモデルを使用してテキストをストリーミングで生成します。
+
+        返されたTextStreamを反復処理すると、生成されたテキストの差分（StreamDelta）が順次返されます。
+        反復処理の終了後は、usageで最終的なトークン使用量を参照できます。
 
-        if not hasattr(self.models[model], 'generate_with_image'):
-            raise ModelNotSupportedError(f"モデル '{model}' は画像付きの生成をサポートしていません。")
+        :param prompt: 生成のためのプロンプト
+        :return: StreamDeltaを返すTextStream
+        :raises ModelNotSupportedError: 指定されたモデルがサポートされていない場合
+        """
+        self._validate_prompt(prompt)
+        return self._get_model_instance().generate_text_stream(prompt)
 
-        return self.models[model].generate_with_image(prompt, image_path)
+    def generate_with_image(self, prompt: str, image_path: ImageSource) -> str:
+        """
+        指定されたモデルを使用して画像付きのテキストを生成します。
+
+        :param prompt: 生成のためのプロンプト
+        :param image_path: 画像（ファイルのパス、バイト列、memoryview、PILの画像、またはImageInput）
+        :return: 生成されたテキスト
+        :raises ModelNotSupportedError: 指定されたモデルがサポートされていない場合
+        """
+        self._validate_prompt(prompt)
+        self._get_model_instance('generate_with_image', "画像付きの生成")
+        image_path = ImageInput.of(image_path)
+        return self._cached(self._cache_key("generate_with_image", prompt, image_path=image_path),
+                            lambda: self._call("generate_with_image", prompt, image_path))
 
     def generate_json(self, prompt: str, schema: Union[Dict[str, Union[str, Dict]], Type[BaseModel]]) -> Dict[str, Any]:
         """
@@ -99,52 +439,256 @@ class MosaicAI:
         :return: 生成されたJSON
         :raises ModelNotSupportedError: 指定されたモデルがサポートされていない場合
         """
-        if not prompt or not prompt.strip():
-            raise ValueError("プロンプトが空です。有効なプロンプトを入力してください。")
-        model = self.get_model()
-        if model not in self.models:
-            raise ModelNotSupportedError(f"Model '{model}' is not supported.")
-        return self.models[model].generate_json(prompt, schema)
+        self._validate_prompt(prompt)
+        self._get_model_instance()
+        return self._cached(self._cache_key("generate_json", prompt, schema),
+                            lambda: self._call("generate_json", prompt, schema, hedge=True))
 
-    def generate_with_image_json(self, prompt: str, image_path: str, schema: Union[Dict[str, Union[str, Dict]], Type[BaseModel]]) -> Dict[str, Any]:
+    def generate_with_image_json(
+            self, prompt: str, image_path: ImageSource,
+            schema: Union[Dict[str, Union[str, Dict]], Type[BaseModel]]) -> Dict[str, Any]:
         """
         指定されたモデルを使用して画像付きのJSONを生成します。
 
         :param prompt: 生成のためのプロンプト
-        :param image_path: 画像ファイルのパス
+        :param image_path: 画像（ファイルのパス、バイト列、memoryview、PILの画像、またはImageInput）
         :param schema: 生成するJSONのスキーマ
         :return: 生成されたJSON
         :raises ModelNotSupportedError: 指定されたモデルがサポートされていない場合
         """
-        if not prompt or not prompt.strip():
-            raise ValueError("プロンプトが空です。有効なプロンプトを入力してください。")
+        self._validate_prompt(prompt)
+        self._get_model_instance('generate_with_image_json', "画像付きのJSON生成")
+        image_path = ImageInput.of(image_path)
+        key = self._cache_key("generate_with_image_json", prompt, schema, image_path)
+        call = partial(self._call, "generate_with_image_json", prompt, image_path, schema)
+        return self._cached(key, call)
 
-        model = self.get_model()
-        if model not in self.models:
-            raise ModelNotSupportedError(f"モデル '{model}' はサポートされていません。")
+    def generate_with_images(self, prompt: str, images: LabeledImages) -> str:
+        """
+        指定されたモデルを使用して、ラベルを付けた複数の画像について1回のリクエストでテキストを生成します。
 
-        if not hasattr(self.models[model], 'generate_with_image_json'):
-            raise ModelNotSupportedError(f"モデル '{model}' は画像付きのJSON生成をサポートしていません。")
+        画像の数や大きさがプロバイダーの1回のリクエストの上限を超える場合は、できるだけ少ない回数に分けて送信し、
+        それぞれの回答を同じモデルで1つにまとめます。
 
-        return self.models[model].generate_with_image_json(prompt, image_path, schema)
+        :param prompt: 生成のためのプロンプト
+        :param images: ラベルと画像の辞書、または画像か(ラベル, 画像)のリスト（ラベルを省略した画像は"画像1"、"画像2"...）
+        :return: 生成されたテキスト
+        :raises ModelNotSupportedError: 指定されたモデルがサポートされていない場合
+        """
+        self._validate_prompt(prompt)
+        self._get_model_instance('generate_with_images', "複数の画像付きの生成")
+        images = label_images(images)
+        return self._cached(self._cache_key("generate_with_images", prompt, images=images),
+                            lambda: self._call("generate_with_images", prompt, images))
 
-    def set_api_key(self, model: str, api_key: str):
+    def generate_with_images_json(
+            self, prompt: str, images: LabeledImages,
+            schema: Union[Dict[str, Union[str, Dict]], Type[BaseModel]]) -> Dict[str, Any]:
         """
-        指定されたモデルのAPIキーを設定します。
+        指定されたモデルを使用して、ラベルを付けた複数の画像について1回のリクエストでJSONを生成します。
 
-        :param model: APIキーを設定するモデルの名前
-        :param api_key: 設定するAPIキー
+        :param prompt: 生成のためのプロンプト
+        :param images: ラベルと画像の辞書、または画像か(ラベル, 画像)のリスト
+        :param schema: 生成するJSONのスキーマ
+        :return: 生成されたJSON
+        :raises ModelNotSupportedError: 指定されたモデルがサポートされていない場合
         """
-        self.api_key_manager.set_api_key(model, api_key)
+        self._validate_prompt(prompt)
+        self._get_model_instance('generate_with_images_json', "複数の画像付きのJSON生成")
+        images = label_images(images)
+        key = self._cache_key("generate_with_images_json", prompt, schema, images=images)
+        call = partial(self._call, "generate_with_images_json", prompt, images, schema)
+        return self._cached(key, call)
 
-    @classmethod
-    def from_config_file(cls, config_path: str) -> 'MosaicAI':
+    def race_json(self, prompt: str, schema: Union[Dict[str, Union[str, Dict]], Type[BaseModel]],
+                  models: Sequence[str],
+                  image_path: Optional[ImageSource] = None) -> Dict[str, Any]:
         """
-        設定ファイルからMosaicAIインスタンスを作成します。
+        同じプロンプトを複数のモデルに同時に送信し、最初にスキーマの検証に成功したJSONを返します。
 
-        :param config_path: 設定ファイルのパス
-        :return: 作成されたMosaicAIインスタンス
+        応答がJSONとして解析できない場合やスキーマに適合しない場合は、そのモデルの結果は使用されず、
+        他のモデルの応答を待ちます。同期版では実行中のリクエストを中断できないため、残りの応答は破棄されます。
+
+        :param prompt: 生成のためのプロンプト
+        :param schema: 生成するJSONのスキーマ
+        :param models: 同時にリクエストを送信するモデルの名前
+        :param image_path: 画像（オプション。ファイルのパス、バイト列、PILの画像など）
+        :return: 最初に検証に成功したJSON
+        :raises Exception: すべてのモデルが失敗した場合、最初に発生した例外
         """
-        with open(config_path, 'r') as f:
-            config = json.load(f)
-        return cls(config)
+        calls = self._race_calls(models, prompt, schema, image_path)
+        return first_success([partial(self._invoke_checked, model_name, method, *args)
+                              for model_name, method, args in calls], self._get_executor())
+
+    def fan_out(self, prompt: str, models: Sequence[str], image_path: Optional[ImageSource] = None,
+                schema: Optional[Union[Dict[str, Union[str, Dict]], Type[BaseModel]]] = None,
+                aggregator: Optional[str] = None,
+                aggregation_prompt: str = DEFAULT_AGGREGATION_PROMPT) -> FanOutResult:
+        """
+        同じプロンプトを複数のモデルに同時に送信し、すべてのモデルの結果を返します。
+
+        各モデルの結果には所要時間と発生した例外が含まれ、一部のモデルが失敗しても処理は中断されません。
+        aggregatorを指定した場合は、成功したモデルの回答をまとめてaggregatorのモデルに送信し、その結果も返します。
+        SDKクライアントはすべてのモデルで共有されます。
+
+        :param prompt: 生成のためのプロンプト
+        :param models: リクエストを送信するモデルの名前
+        :param image_path: 画像（オプション。ファイルのパス、バイト列、PILの画像など）
+        :param schema: 生成するJSONのスキーマ（オプション。Noneの場合はテキストを生成）
+        :param aggregator: 回答を集約するモデルの名前（オプション）
+        :param aggregation_prompt: 集約に使用するプロンプトのテンプレート（{prompt}と{responses}が置き換えられます）
+        :return: モデルごとの結果と集約結果
+        :raises ModelNotSupportedError: 指定されたモデルがサポートされていない場合
+        """
+        method, args = self._parallel_request(models, prompt, schema, image_path)
+        if aggregator is not None:
+            self._parallel_request([aggregator], prompt, None, None)
+        calls = [(model_name, partial(self._invoke_checked, model_name, method, *args))
+                 for model_name in models]
+        result = FanOutResult(run_fan_out(calls, self._get_executor()))
+        if aggregator is not None and result.successes:
+            aggregation = build_aggregation_prompt(prompt, result.results, aggregation_prompt)
+            call = partial(self._invoke_checked, aggregator, "generate", aggregation)
+            result.aggregate = timed_call(aggregator, call)
+        return result
+
+    def generate_text_batch(self, prompts: Iterable[str],
+                            image_paths: Optional[Sequence[Optional[ImageSource]]] = None,
+                            max_concurrency: int = 8,
+                            ordered: bool = True) -> Iterator[BatchResult]:
+        """
+        複数のプロンプトに対して、同時実行数を制限しながらテキストを生成します。
+
+        結果は反復処理の進行に合わせて遅延的に生成されます。リストが必要な場合はlist()で囲んでください。
+        各項目で発生した例外はBatchResult.errorに格納され、バッチ全体は中断されません。
+
+        :param prompts: プロンプトのイテラブル
+        :param image_paths: 項目ごとの画像（オプション。Noneの項目はテキストのみで生成）
+        :param max_concurrency: 同時に実行するリクエストの最大数
+        :param ordered: Trueの場合は入力順、Falseの場合は完了順に結果を返します
+        :return: BatchResultのイテレータ
+        """
+        items = build_batch_items(prompts, image_paths)
+        return run_batch(self._generate_text_item, items, max_concurrency, ordered)
+
+    def generate_json_batch(
+            self, prompts: Iterable[str],
+            schemas: Union[Dict[str, Union[str, Dict]], Type[BaseModel], Sequence[Any]],
+            image_paths: Optional[Sequence[Optional[ImageSource]]] = None, max_concurrency: int = 8,
+            ordered: bool = True) -> Iterator[BatchResult]:
+        """
+        複数のプロンプトに対して、同時実行数を制限しながらJSONを生成します。
+
+        :param prompts: プロンプトのイテラブル
+        :param schemas: 全項目共通のスキーマ、または項目ごとのスキーマのリスト
+        :param image_paths: 項目ごとの画像（オプション。Noneの項目はテキストのみで生成）
+        :param max_concurrency: 同時に実行するリクエストの最大数
+        :param ordered: Trueの場合は入力順、Falseの場合は完了順に結果を返します
+        :return: BatchResultのイテレータ
+        """
+        items = build_batch_items(prompts, self._batch_schemas(schemas), image_paths)
+        return run_batch(self._generate_json_item, items, max_concurrency, ordered)
+
+    def _cached(self, key: Optional[str], call: Callable[[], Any]) -> Any:
+        """
+        キャッシュに値があればそれを返し、なければcallを実行して結果をキャッシュします。
+        coalescerが設定されている場合、同じキーの実行中の呼び出しがあればその結果を共有します。
+
+        :param key: キャッシュキー（Noneの場合はキャッシュを使用しない）
+        :param call: 生成処理を実行する関数
+        :return: 生成結果
+        """
+        if key is None:
+            return call()
+        if self.cache is not None:
+            value = self.cache.get(key)
+            if value is not None:
+                return self._from_cache(value)
+            call = partial(self._call_and_store, key, call)
+        if self.coalescer is not None:
+            return self.coalescer.do(key, call)
+        return call()
+
+    def _call_and_store(self, key: str, call: Callable[[], Any]) -> Any:
+        value = call()
+        self.cache.set(key, self._to_cache(value))
+        return value
+
+    def _invoke(self, model_name: str, method: str, *args: Any) -> Any:
+        """
+        モデルのメソッドを呼び出し、結果を統計情報、サーキットブレーカー、メトリクスに記録します。
+
+        :param model_name: モデル名
+        :param method: 呼び出すメソッド名
+        :return: メソッドの戻り値
+        """
+        model = self.models[model_name]
+        token = self._start(model_name, method)
+        start = time.monotonic()
+        try:
+            if self.return_result:
+                result = model.call_with_result(method, *args)
+            else:
+                result = getattr(model, method)(*args)
+        except Exception as e:
+            self._record_error(model_name, e, time.monotonic() - start)
+            raise
+        except BaseException:
+            # 中断された呼び出しは成否を記録しない
+            self._release(model_name)
+            raise
+        else:
+            self._record_success(model_name, time.monotonic() - start)
+        finally:
+            self._finish(model_name, token)
+        return result
+
+    def _invoke_checked(self, model_name: str, method: str, *args: Any) -> Any:
+        """サーキットブレーカーがリクエストを許可する場合に限り、_invokeを呼び出します（ハーフオープン状態では試行リクエストを記録します）。"""
+        self._check_circuit(model_name)
+        return self._invoke(model_name, method, *args)
+
+    def _call(self, method: str, *args: Any, hedge: bool = False) -> Any:
+        """
+        使用中のモデルのメソッドを呼び出します。プロバイダーや通信のエラーで失敗した場合やサーキットブレーカーが
+        オープン状態の場合は、fallback_modelsのモデルを順に試します。入力の誤りなどのエラーはそのまま送出します。
+
+        :param method: 呼び出すメソッド名
+        :param hedge: ヘッジリクエストが有効な場合に使用するかどうか
+        :return: メソッドの戻り値
+        :raises CircuitOpenError: リクエストを送信できるモデルがない場合
+        """
+        error = None
+        for model_name in self._candidates():
+            try:
+                if hedge and self.hedge is not None:
+                    hedge_model, delay = self._hedge_targets(model_name)
+                    return hedged_call(lambda: self._invoke_checked(model_name, method, *args),
+                                       lambda: self._invoke_checked(hedge_model, method, *args),
+                                       delay, self.hedge, self._get_executor())
+                return self._invoke_checked(model_name, method, *args)
+            except Exception as e:
+                if not self._is_provider_failure(e):
+                    raise
+                error = e
+        raise self._no_candidate_error(error)
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        """ヘッジリクエストや複数モデルへの同時リクエストを実行する、すべてのインスタンスで共有するスレッドプールを返します。"""
+        if MosaicAI._executor is None:
+            with MosaicAI._executor_lock:
+                if MosaicAI._executor is None:
+                    MosaicAI._executor = ThreadPoolExecutor(max_workers=EXECUTOR_MAX_WORKERS,
+                                                            thread_name_prefix="mosaicai")
+        return MosaicAI._executor
+
+    def _generate_text_item(self, prompt: str, image_path: Optional[ImageSource]) -> str:
+        if image_path is None:
+            return self.generate_text(prompt)
+        return self.generate_with_image(prompt, image_path)
+
+    def _generate_json_item(self, prompt: str, schema,
+                            image_path: Optional[ImageSource]) -> Dict[str, Any]:
+        if image_path is None:
+            return self.generate_json(prompt, schema)
+        return self.generate_with_image_json(prompt, image_path, schema)
@@ -0,0 +1,98 @@
+import asyncio
+import copy
+import threading
+from concurrent.futures import Future
+from typing import Any, Awaitable, Callable, Dict, List, Tuple
+
+
+class RequestCoalescer:
+    """
+    同時に実行される同一のリクエストを1回の呼び出しにまとめるクラスです（singleflight）。
+
+    あるキーの呼び出しが実行中に同じキーのリクエストが到着した場合、新たに呼び出すのではなく
+    実行中の呼び出しの完了を待ち、同じ結果（または例外）を受け取ります。完了した呼び出しの結果は保持しません。
+    複数のMosaicAIインスタンスで1つのインスタンスを共有できます。スレッドとasyncioのどちらからでも使用できますが、
+    asyncioの呼び出しは同じイベントループ内のリクエストだけがまとめられます。
+
+    待機していたリクエストには結果のコピーが返されるため、呼び出し元が結果を変更しても互いに影響しません。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls: Dict[str, Future] = {}
+        self._tasks: Dict[Tuple[int, str], List[Any]] = {}
+        self._stats = {"calls": 0, "coalesced": 0}
+
+    def do(self, key: str, call: Callable[[], Any]) -> Any:
+        """
+        同じキーの呼び出しが実行中であればその結果を待ち、なければcallを実行します。
+
+        :param key: リクエストを識別するキー
+        :param call: 実行する関数
+        :return: 呼び出しの結果
+        :raises Exception: 呼び出しで発生した例外
+        """
+        with self._lock:
+            future = self._calls.get(key)
+            if future is None:
+                future = self._calls[key] = Future()
+                self._stats["calls"] += 1
+                leader = True
+            else:
+                self._stats["coalesced"] += 1
+                leader = False
+        if not leader:
+            return copy.deepcopy(future.result())
+
+        try:
+            result = call()
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                del self._calls[key]
+
+    async def do_async(self, key: str, call: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        doの非同期版です。待機しているリクエストがすべてキャンセルされた場合は、実行中の呼び出しもキャンセルします。
+
+        :param key: リクエストを識別するキー
+        :param call: 実行するコルーチンを返す関数
+        :return: 呼び出しの結果
+        :raises Exception: 呼び出しで発生した例外
+        """
+        task_key = (id(asyncio.get_running_loop()), key)
+        with self._lock:
+            entry = self._tasks.get(task_key)
+            leader = entry is None
+            if leader:
+                # [タスク, 待機しているリクエストの数]
+                entry = self._tasks[task_key] = [asyncio.ensure_future(call()), 0]
+                entry[0].add_done_callback(lambda _: self._remove_task(task_key, entry))
+                self._stats["calls"] += 1
+            else:
+                self._stats["coalesced"] += 1
+            entry[1] += 1
+
+        task = entry[0]
+        try:
+            result = await asyncio.shield(task)
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0 and not task.done():
+                task.cancel()
+        return result if leader else copy.deepcopy(result)
+
+    def _remove_task(self, task_key: Tuple[int, str], entry: List[Any]):
+        with self._lock:
+            if self._tasks.get(task_key) is entry:
+                del self._tasks[task_key]
+
+    def stats(self) -> Dict[str, int]:
+        """実際に実行した呼び出しの数（calls）と、実行中の呼び出しにまとめたリクエストの数（coalesced）を返します。"""
+        with self._lock:
+            return dict(self._stats)
@@ -21,3 +21,13 @@ class InvalidJSONSchemaError(MosaicAIError):
 # 無効なスキーマが提供されたときに発生する例外
 class InvalidSchemaError(MosaicAIError):
     """Raised when an invalid schema is provided"""
+
+
+# サーキットブレーカーがオープン状態で、リクエストを送信できるモデルがないときに発生する例外
+class CircuitOpenError(MosaicAIError):
+    """Raised when every candidate model's circuit breaker is open"""
+
+
+# 再生中のカセットに、リクエストに一致する記録がないときに発生する例外
+class CassetteMismatchError(MosaicAIError):
+    """Raised when a replayed request has no matching recorded interaction"""
@@ -0,0 +1,138 @@
+import asyncio
+import time
+from concurrent.futures import Executor
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, List, Optional, Sequence, Tuple
+from .types import GenerationResult
+
+# 集約モデルに送信するプロンプトの既定のテンプレート（{prompt}と{responses}が置き換えられる）
+DEFAULT_AGGREGATION_PROMPT = (
+    "以下は、同じ質問に対する複数のAIモデルの回答です。"
+    "回答を分析し、共通点と相違点を挙げて総合的な結論を導き出してください。\n\n"
+    "質問:\n{prompt}\n\n{responses}"
+)
+
+
+@dataclass
+class ModelResult:
+    """
+    1つのモデルの呼び出し結果を表すクラスです。
+
+    :param model: モデル名
+    :param result: 生成結果（エラーの場合はNone）
+    :param error: 発生した例外（成功した場合はNone）
+    :param latency: 呼び出しにかかった時間（秒）
+    """
+    model: str
+    result: Any = None
+    error: Optional[BaseException] = None
+    latency: float = 0.0
+
+    @property
+    def ok(self) -> bool:
+        """生成に成功した場合にTrueを返します。"""
+        return self.error is None
+
+
+@dataclass
+class FanOutResult:
+    """
+    fan_outの結果を表すクラスです。
+
+    :param results: モデルごとの結果（modelsに指定した順）
+    :param aggregate: 集約モデルの結果（集約しなかった場合はNone）
+    """
+    results: List[ModelResult] = field(default_factory=list)
+    aggregate: Optional[ModelResult] = None
+
+    @property
+    def successes(self) -> List[ModelResult]:
+        """生成に成功したモデルの結果を返します。"""
+        return [result for result in self.results if result.ok]
+
+    def __getitem__(self, model: str) -> ModelResult:
+        """
+        モデル名で結果を取得します。
+
+        :param model: モデル名
+        :return: そのモデルの結果
+        :raises KeyError: モデルの結果がない場合
+        """
+        for result in self.results:
+            if result.model == model:
+                return result
+        raise KeyError(model)
+
+
+def build_aggregation_prompt(prompt: str, results: Sequence[ModelResult],
+                             template: str = DEFAULT_AGGREGATION_PROMPT) -> str:
+    """
+    成功したモデルの回答をまとめて、集約モデルに送信するプロンプトを作成します。
+
+    :param prompt: 元のプロンプト
+    :param results: モデルごとの結果
+    :param template: {prompt}と{responses}を含むテンプレート
+    :return: 集約モデルに送信するプロンプト
+    """
+    responses = "\n\n".join(f"### {result.model}\n{_content(result.result)}"
+                            for result in results if result.ok)
+    return template.format(prompt=prompt, responses=responses)
+
+
+def _content(value: Any) -> Any:
+    """return_result=Trueのクライアントの結果からは生成結果のみを取り出す"""
+    return value.content if isinstance(value, GenerationResult) else value
+
+
+def timed_call(model: str, call: Callable[[], Any]) -> ModelResult:
+    """
+    関数を呼び出し、結果と所要時間をModelResultに格納します。例外は送出せずにModelResult.errorに格納します。
+
+    :param model: モデル名
+    :param call: 呼び出す関数
+    :return: 呼び出し結果
+    """
+    start = time.monotonic()
+    try:
+        return ModelResult(model, call(), latency=time.monotonic() - start)
+    except Exception as e:
+        return ModelResult(model, error=e, latency=time.monotonic() - start)
+
+
+async def timed_call_async(model: str, call: Callable[[], Awaitable[Any]]) -> ModelResult:
+    """
+    timed_callの非同期版です。
+
+    :param model: モデル名
+    :param call: 呼び出すコルーチン関数
+    :return: 呼び出し結果
+    """
+    start = time.monotonic()
+    try:
+        return ModelResult(model, await call(), latency=time.monotonic() - start)
+    except Exception as e:
+        return ModelResult(model, error=e, latency=time.monotonic() - start)
+
+
+def run_fan_out(calls: Sequence[Tuple[str, Callable[[], Any]]],
+                executor: Executor) -> List[ModelResult]:
+    """
+    すべての関数を同時に実行し、すべての完了を待って結果を返します。
+
+    :param calls: (モデル名, 呼び出す関数) のリスト
+    :param executor: 関数を実行するExecutor
+    :return: callsと同じ順のModelResultのリスト
+    """
+    futures = [executor.submit(timed_call, model, call) for model, call in calls]
+    return [future.result() for future in futures]
+
+
+async def run_fan_out_async(
+        calls: Sequence[Tuple[str, Callable[[], Awaitable[Any]]]]) -> List[ModelResult]:
+    """
+    run_fan_outの非同期版です。
+
+    :param calls: (モデル名, 呼び出すコルーチン関数) のリスト
+    :return: callsと同じ順のModelResultのリスト
+    """
+    return list(await asyncio.gather(*(timed_call_async(model, call) for model, call in calls)))
@@ -0,0 +1,174 @@
+import asyncio
+import threading
+from concurrent.futures import Executor, FIRST_COMPLETED, Future, wait
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Optional, Sequence, Set, TypeVar
+from .stats import ModelStats
+
+T = TypeVar("T")
+
+
+@dataclass
+class HedgePolicy:
+    """
+    ヘッジリクエストの方針です。
+
+    最初のリクエストが一定時間内に完了しない場合、同じモデル（またはmodelで指定した別のモデル）に
+    同じリクエストをもう1つ送信し、先に成功した応答を返します。
+
+    :param delay: ヘッジリクエストを送信するまでの待機時間（秒）。Noneの場合はpercentileから計算します
+    :param percentile: 待機時間に使用する、観測したレイテンシのパーセンタイル
+    :param min_samples: パーセンタイルを使用するために必要なサンプル数
+    :param fallback_delay: サンプルが足りない場合の待機時間（秒）
+    :param max_hedge_rate: リクエスト数に対するヘッジリクエスト数の割合の上限（コストの上限）
+    :param model: ヘッジリクエストを送信するモデル（Noneの場合は同じモデル）
+    """
+    delay: Optional[float] = None
+    percentile: float = 95.0
+    min_samples: int = 20
+    fallback_delay: float = 2.0
+    max_hedge_rate: float = 0.05
+    model: Optional[str] = None
+    requests: int = field(default=0, init=False)
+    hedges: int = field(default=0, init=False)
+    _lock: threading.Lock = field(default_factory=threading.Lock, init=False, repr=False,
+                                  compare=False)
+
+    def hedge_delay(self, stats: ModelStats) -> float:
+        """
+        ヘッジリクエストを送信するまでの待機時間を返します。
+
+        :param stats: 最初のリクエストを送信するモデルの統計情報
+        :return: 待機時間（秒）
+        """
+        if self.delay is not None:
+            return self.delay
+        if len(stats.latency) < self.min_samples:
+            return self.fallback_delay
+        return stats.latency.percentile(self.percentile)
+
+    def record_request(self):
+        """リクエストの送信を記録します。"""
+        with self._lock:
+            self.requests += 1
+
+    def try_acquire_hedge(self) -> bool:
+        """
+        ヘッジリクエストの送信が上限の範囲内であれば、送信を記録してTrueを返します。
+
+        :return: ヘッジリクエストを送信できる場合はTrue
+        """
+        with self._lock:
+            if self.hedges + 1 > self.max_hedge_rate * self.requests:
+                return False
+            self.hedges += 1
+            return True
+
+
+def hedged_call(primary: Callable[[], T], hedge: Callable[[], T], delay: float,
+                policy: HedgePolicy, executor: Executor) -> T:
+    """
+    primaryを実行し、delay秒以内に完了しない場合はhedgeも実行して、先に成功した結果を返します。
+
+    同期版では実行中のリクエストを中断できないため、後に完了した結果は破棄されます。
+
+    :param primary: 最初のリクエストを実行する関数
+    :param hedge: ヘッジリクエストを実行する関数
+    :param delay: ヘッジリクエストを送信するまでの待機時間（秒）
+    :param policy: ヘッジリクエストの方針
+    :param executor: リクエストを実行するExecutor
+    :return: 先に成功したリクエストの結果
+    :raises Exception: すべてのリクエストが失敗した場合、最初に発生した例外
+    """
+    policy.record_request()
+    first = executor.submit(primary)
+    done, _ = wait([first], timeout=delay)
+    if done or not policy.try_acquire_hedge():
+        return first.result()
+    return _first_success({first, executor.submit(hedge)})
+
+
+async def hedged_call_async(primary: Callable[[], Awaitable[T]], hedge: Callable[[], Awaitable[T]],
+                            delay: float, policy: HedgePolicy) -> T:
+    """
+    hedged_callの非同期版です。先に成功した結果を返し、もう一方のリクエストはキャンセルします。
+
+    :param primary: 最初のリクエストを実行するコルーチン関数
+    :param hedge: ヘッジリクエストを実行するコルーチン関数
+    :param delay: ヘッジリクエストを送信するまでの待機時間（秒）
+    :param policy: ヘッジリクエストの方針
+    :return: 先に成功したリクエストの結果
+    :raises Exception: すべてのリクエストが失敗した場合、最初に発生した例外
+    """
+    policy.record_request()
+    first = asyncio.ensure_future(primary())
+    pending = {first}
+    try:
+        done, _ = await asyncio.wait(pending, timeout=delay)
+        if done or not policy.try_acquire_hedge():
+            return await first
+        pending.add(asyncio.ensure_future(hedge()))
+        return await _first_success_async(pending)
+    finally:
+        for task in pending:
+            task.cancel()
+
+
+def first_success(calls: Sequence[Callable[[], T]], executor: Executor) -> T:
+    """
+    すべての関数を同時に実行し、最初に成功した結果を返します。
+
+    同期版では実行中の関数を中断できないため、後に完了した結果は破棄されます。
+
+    :param calls: 実行する関数
+    :param executor: 関数を実行するExecutor
+    :return: 最初に成功した関数の結果
+    :raises Exception: すべての関数が失敗した場合、最初に発生した例外
+    """
+    return _first_success({executor.submit(call) for call in calls})
+
+
+async def first_success_async(calls: Sequence[Callable[[], Awaitable[T]]]) -> T:
+    """
+    first_successの非同期版です。最初に成功した結果を返し、残りのコルーチンはキャンセルします。
+
+    :param calls: 実行するコルーチン関数
+    :return: 最初に成功したコルーチンの結果
+    :raises Exception: すべてのコルーチンが失敗した場合、最初に発生した例外
+    """
+    pending = {asyncio.ensure_future(call()) for call in calls}
+    try:
+        return await _first_success_async(pending)
+    finally:
+        for task in pending:
+            task.cancel()
+
+
+def _first_success(pending: Set[Future]) -> Any:
+    """最初に成功したFutureの結果を返し、未開始のFutureをキャンセルする"""
+    error = None
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            if future.exception() is None:
+                for loser in pending:
+                    loser.cancel()
+                return future.result()
+            error = error or future.exception()
+    raise error
+
+
+async def _first_success_async(pending: Set["asyncio.Future"]) -> Any:
+    """
+    最初に成功したタスクの結果を返す。pendingは完了したタスクを取り除きながら更新され、
+    呼び出し元は戻った後に残りのタスクをキャンセルする
+    """
+    error = None
+    while pending:
+        done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+        pending -= done
+        for task in done:
+            if task.exception() is None:
+                return task.result()
+            error = error or task.exception()
+    raise error
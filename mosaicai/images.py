@@ -0,0 +1,658 @@
+import binascii
+import hashlib
+import io
+import json
+import mimetypes
+import mmap
+import os
+import uuid
+import weakref
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import (IO, TYPE_CHECKING, Any, Dict, Iterator, List, Mapping, Optional, Sequence,
+                    Tuple, Union)
+
+if TYPE_CHECKING:
+    # PILは画像を扱うときに読み込むため、型の注釈にのみ使用する
+    import PIL.Image
+
+# プロバイダーが画像を縮小する実効的な最大解像度（長辺、短辺のピクセル数。Noneは制限なし）
+# これより大きい画像はプロバイダー側で縮小されるため、送信前に縮小しても応答の品質は変わらない
+PROVIDER_MAX_DIMENSIONS: Dict[str, Tuple[Optional[int], Optional[int]]] = {
+    "claude": (1568, None),
+    "openai": (2048, 768),
+    "gemini": (3072, None),
+}
+
+# EXIFの向き（Orientation）のタグ
+ORIENTATION_TAG = 0x0112
+
+# base64エンコードする単位（バイト）。パディングが途中に入らないよう3の倍数にする
+ENCODE_CHUNK_SIZE = 3 * 256 * 1024
+
+# リクエストの本文を送信するときに画像に置き換える文字列の接頭辞
+PLACEHOLDER_PREFIX = "mosaicai-image-"
+
+# 再圧縮の形式と、対応するMIMEタイプ
+FORMAT_MIME_TYPES = {"JPEG": "image/jpeg", "PNG": "image/png", "WEBP": "image/webp"}
+
+# 画像の形式を判定するために読み込む先頭のバイト数
+SNIFF_SIZE = 16
+
+# 画像の形式ごとの先頭のバイト列（シグネチャ）と、対応するMIMEタイプ
+_SIGNATURES = (
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"GIF87a", "image/gif"),
+    (b"GIF89a", "image/gif"),
+    (b"BM", "image/bmp"),
+    (b"II*\x00", "image/tiff"),
+    (b"MM\x00*", "image/tiff"),
+)
+
+# HEIF系の形式のftypボックスのブランドと、対応するMIMEタイプ
+_HEIF_BRANDS = {
+    b"heic": "image/heic", b"heix": "image/heic", b"heim": "image/heic", b"heis": "image/heic",
+    b"mif1": "image/heif", b"msf1": "image/heif", b"avif": "image/avif",
+}
+
+
+@dataclass
+class ImagePolicy:
+    """
+    画像をプロバイダーに送信する前の前処理（縮小、再圧縮、メタデータの除去）の方針です。
+
+    :param max_dimension: 長辺の最大ピクセル数。Noneの場合はプロバイダーごとの実効的な最大解像度（PROVIDER_MAX_DIMENSIONS）
+    :param format: 再圧縮の形式（"JPEG"、"PNG"、"WEBP"）。Noneの場合は元の形式を維持します
+                   （JPEG、PNG、WEBP以外の形式は、透過がある場合はPNG、ない場合はJPEGに変換します）
+    :param quality: JPEGとWEBPで再圧縮する場合の品質（1〜95）
+    :param strip_metadata: Trueの場合は、EXIF（位置情報を含む）やICCプロファイルなどのメタデータを除去します
+    """
+    max_dimension: Optional[int] = None
+    format: Optional[str] = None
+    quality: int = 85
+    strip_metadata: bool = True
+
+    def __post_init__(self):
+        if self.format is not None:
+            self.format = self.format.upper()
+            if self.format not in FORMAT_MIME_TYPES:
+                raise ValueError(f"サポートされていない画像の形式: {self.format}"
+                                 f"（{', '.join(FORMAT_MIME_TYPES)}のいずれかを指定してください）")
+        if not 1 <= self.quality <= 95:
+            raise ValueError("qualityは1〜95の範囲で指定してください。")
+
+    def target_size(self, width: int, height: int, provider: Optional[str]) -> Tuple[int, int]:
+        """
+        縮小後の画像の大きさを返します。縦横比は維持し、拡大はしません。
+
+        :param width: 元の画像の幅
+        :param height: 元の画像の高さ
+        :param provider: 送信先のプロバイダー名
+        :return: 縮小後の(幅, 高さ)
+        """
+        if self.max_dimension is not None:
+            max_long, max_short = self.max_dimension, None
+        else:
+            max_long, max_short = PROVIDER_MAX_DIMENSIONS.get(provider, (None, None))
+        scale = 1.0
+        if max_long is not None:
+            scale = min(scale, max_long / max(width, height))
+        if max_short is not None:
+            scale = min(scale, max_short / min(width, height))
+        if scale >= 1.0:
+            return width, height
+        return max(1, round(width * scale)), max(1, round(height * scale))
+
+
+@dataclass
+class PreprocessedImage:
+    """
+    前処理した画像です。
+
+    :param data: 送信する画像のバイト列
+    :param mime_type: dataのMIMEタイプ
+    :param width: 送信する画像の幅
+    :param height: 送信する画像の高さ
+    :param original_bytes: 元の画像ファイルのサイズ（バイト）
+    :param original_width: 元の画像の幅
+    :param original_height: 元の画像の高さ
+    """
+    data: bytes
+    mime_type: str
+    width: int
+    height: int
+    original_bytes: int
+    original_width: int
+    original_height: int
+
+    @property
+    def bytes_saved(self) -> int:
+        """前処理によって削減したバイト数"""
+        return max(self.original_bytes - len(self.data), 0)
+
+    @property
+    def resized(self) -> bool:
+        """縮小したかどうか"""
+        return (self.width, self.height) != (self.original_width, self.original_height)
+
+
+def detect_mime_type(header: bytes, name: Optional[str] = None) -> str:
+    """
+    画像の先頭のバイト列からMIMEタイプを判定します。判定できない場合はファイル名の拡張子から推測します。
+
+    :param header: 画像の先頭のバイト列（SNIFF_SIZEバイト以上）
+    :param name: ファイル名（オプション）
+    :return: MIMEタイプ（判定できない場合は"application/octet-stream"）
+    """
+    header = bytes(header[:SNIFF_SIZE])
+    for signature, mime_type in _SIGNATURES:
+        if header.startswith(signature):
+            return mime_type
+    if header[:4] == b"RIFF" and header[8:12] == b"WEBP":
+        return "image/webp"
+    if header[4:8] == b"ftyp" and header[8:12] in _HEIF_BRANDS:
+        return _HEIF_BRANDS[header[8:12]]
+    if name:
+        if name.lower().endswith((".jpg", ".jpeg")):
+            return "image/jpeg"
+        guessed = mimetypes.guess_type(name)[0]
+        if guessed:
+            return guessed
+    return "application/octet-stream"
+
+
+class ImageInput:
+    """
+    generate_with_image*に渡す画像です。ファイルのパス、バイト列、memoryview、PILの画像、ファイルオブジェクトを同じように扱います。
+
+    ファイルはmmapで参照し、bytes、bytearray、memoryviewはコピーせずに参照するため、
+    メモリ上にある画像を一時ファイルに書き出す必要はありません。PILの画像は送信するときにPNGに変換します。
+    MIMEタイプは内容の先頭のバイト列から判定し、判定できない場合はファイル名の拡張子から推測します。
+    """
+
+    def __init__(self, source: "ImageSource", mime_type: Optional[str] = None,
+                 name: Optional[str] = None):
+        """
+        :param source: ファイルのパス（strまたはos.PathLike）、bytes、bytearray、memoryview、PILの画像、
+                       または読み込み可能なファイルオブジェクト（作成時に読み込みます）
+        :param mime_type: MIMEタイプ（省略した場合は内容から判定します）
+        :param name: ログやエラーメッセージに表示する名前（省略した場合はファイルのパス）
+        """
+        self.path: Optional[str] = None
+        self.image = None
+        self._buffer: Optional[memoryview] = None
+        if isinstance(source, (str, os.PathLike)):
+            self.path = os.fspath(source)
+        elif isinstance(source, (bytes, bytearray, memoryview)):
+            self._buffer = _byte_view(source)
+        elif hasattr(source, "getbands") and hasattr(source, "save"):
+            self.image = source
+        elif hasattr(source, "read"):
+            self._buffer = _byte_view(source.read())
+        else:
+            raise TypeError(f"画像として使用できない型です: {type(source).__name__}"
+                            "（ファイルのパス、バイト列、memoryview、PILの画像のいずれかを指定してください）")
+        self._mime_type = mime_type
+        self.name = name or self.path or ("<PIL image>" if self.image is not None else "<bytes>")
+        self._digest: Optional[str] = None
+
+    @classmethod
+    def of(cls, source: "ImageSource") -> "ImageInput":
+        """
+        画像をImageInputに変換します。ImageInputの場合はそのまま返します。
+
+        :param source: 画像
+        :return: ImageInput
+        """
+        return source if isinstance(source, ImageInput) else cls(source)
+
+    @property
+    def is_file(self) -> bool:
+        """ファイルのパスで指定された画像かどうか"""
+        return self.path is not None
+
+    @property
+    def mime_type(self) -> str:
+        """画像のMIMEタイプ（ファイルの場合は先頭のバイト列を読み込んで判定します）"""
+        if self._mime_type is None:
+            if self.path is not None:
+                with open(self.path, "rb") as image_file:
+                    header = image_file.read(SNIFF_SIZE)
+            else:
+                header = self.buffer[:SNIFF_SIZE]
+            self._mime_type = detect_mime_type(header, self.path)
+        return self._mime_type
+
+    @property
+    def size(self) -> int:
+        """画像のバイト数"""
+        if self.path is not None:
+            return os.path.getsize(self.path)
+        return self.buffer.nbytes
+
+    @property
+    def buffer(self) -> memoryview:
+        """メモリ上の画像のバイト列（PILの画像は最初に参照したときにPNGに変換します）"""
+        if self._buffer is None:
+            if self.path is not None:
+                raise ValueError(f"ファイルの画像はメモリ上にありません: {self.path}")
+            self._buffer = memoryview(_encode(self.image, "PNG", ImagePolicy(strip_metadata=False)))
+            self._mime_type = self._mime_type or "image/png"
+        return self._buffer
+
+    @property
+    def payload_source(self) -> Union[str, memoryview]:
+        """encode_base64とImagePlaceholderに渡す値（ファイルのパス、またはメモリ上のバイト列）"""
+        return self.path if self.path is not None else self.buffer
+
+    def read(self) -> bytes:
+        """
+        画像のバイト列を返します。bytesで指定された画像はコピーせずにそのまま返します。
+
+        :return: 画像のバイト列
+        """
+        if self.path is not None:
+            with open(self.path, "rb") as image_file:
+                data = image_file.read()
+            if self._mime_type is None:
+                self._mime_type = detect_mime_type(data, self.path)
+            return data
+        view = self.buffer
+        if isinstance(view.obj, bytes) and len(view.obj) == view.nbytes:
+            return view.obj
+        return view.tobytes()
+
+    @contextmanager
+    def view(self) -> Iterator[memoryview]:
+        """
+        画像のバイト列のビューを返すコンテキストマネージャーです。ファイルはmmapで参照し、MIMEタイプも判定します。
+        """
+        if self.path is None:
+            yield self.buffer
+            return
+        with _map_file(self.path) as view:
+            if self._mime_type is None:
+                self._mime_type = detect_mime_type(view[:SNIFF_SIZE], self.path)
+            yield view
+
+    def digest(self) -> str:
+        """
+        画像の内容のSHA-256ダイジェストを返します。PILの画像はモード、大きさ、ピクセルから計算します。
+
+        :return: 16進数のダイジェスト文字列
+        """
+        if self._digest is None:
+            if self.image is not None:
+                digest = hashlib.sha256(f"{self.image.mode}:{self.image.size}:".encode())
+                digest.update(self.image.tobytes())
+            else:
+                with self.view() as view:
+                    digest = hashlib.sha256(view)
+            self._digest = digest.hexdigest()
+        return self._digest
+
+    def __repr__(self) -> str:
+        return f"ImageInput({self.name!r})"
+
+
+# 画像として受け付ける値
+ImageSource = Union[str, "os.PathLike[str]", bytes, bytearray, memoryview, "PIL.Image.Image",
+                    IO[bytes], ImageInput]
+
+
+# 複数の画像を送信する場合に受け付ける値（ラベルと画像の辞書、画像または(ラベル, 画像)のシーケンス）
+LabeledImages = Union[Mapping[str, ImageSource],
+                      Sequence[Union[ImageSource, Tuple[str, ImageSource]]]]
+
+# 画像を複数のリクエストに分割して送信する場合に、各リクエストのメッセージに追加する説明
+IMAGES_BATCH_PROMPT = ("{prompt}\n\n（画像が多いため{count}回に分けて送信しています。"
+                       "この回の画像は{labels}です。これらの画像についてのみ回答してください）")
+
+# 分割して送信したリクエストの回答を1つにまとめるプロンプト
+IMAGES_AGGREGATION_PROMPT = (
+    "以下は、同じ質問について画像を{count}回に分けて送信し、それぞれの回で得た回答です。"
+    "すべての画像についての1つの回答にまとめてください。\n\n"
+    "質問:\n{prompt}\n\n{responses}"
+)
+
+
+def label_images(images: LabeledImages) -> List[Tuple[str, ImageInput]]:
+    """
+    複数の画像を(ラベル, ImageInput)のリストに変換します。ラベルのない画像には"画像1"、"画像2"...のラベルを付けます。
+
+    :param images: ラベルと画像の辞書、または画像か(ラベル, 画像)のシーケンス
+    :return: (ラベル, ImageInput)のリスト
+    """
+    items = images.items() if isinstance(images, Mapping) else images
+    labeled = []
+    for number, item in enumerate(items, start=1):
+        if isinstance(item, tuple):
+            label, image = item
+        else:
+            label, image = f"画像{number}", item
+        labeled.append((str(label), ImageInput.of(image)))
+    if not labeled:
+        raise ValueError("画像を1つ以上指定してください。")
+    return labeled
+
+
+def pack_images(sizes: Sequence[int], max_count: Optional[int] = None,
+                max_bytes: Optional[int] = None) -> List[List[int]]:
+    """
+    画像を、1回のリクエストの画像の数とサイズの上限を超えない、できるだけ少ない数のグループに分けます。
+
+    元の順序のまま区切った場合にグループの数が下限（画像の数とサイズから計算した最小値）になる場合はその分け方を、
+    そうでない場合は大きい順に入る最初のグループに入れる方法（first-fit decreasing）と比べて少ない方を使用します。
+
+    :param sizes: 画像ごとのサイズ（バイト）
+    :param max_count: 1回のリクエストに含められる画像の数（Noneは制限なし）
+    :param max_bytes: 1回のリクエストに含められる画像の合計サイズ（Noneは制限なし）
+    :return: 画像のインデックスのリストのリスト（各グループ内、グループ間とも元の順序）
+    :raises ValueError: 1つの画像がmax_bytesを超える場合
+    """
+    for index, size in enumerate(sizes):
+        if max_bytes is not None and size > max_bytes:
+            raise ValueError(f"画像{index + 1}が大きすぎるため、1回のリクエストで送信できません"
+                             f"（{size} bytes > {max_bytes} bytes）。")
+
+    def fits(group: List[int], total: int, size: int) -> bool:
+        return ((max_count is None or len(group) < max_count)
+                and (max_bytes is None or total + size <= max_bytes))
+
+    sequential: List[List[int]] = []
+    total = 0
+    for index, size in enumerate(sizes):
+        if not sequential or not fits(sequential[-1], total, size):
+            sequential.append([])
+            total = 0
+        sequential[-1].append(index)
+        total += size
+    lower_bound = max(-(-len(sizes) // max_count) if max_count else 1,
+                      -(-sum(sizes) // max_bytes) if max_bytes else 1)
+    if len(sequential) <= lower_bound:
+        return sequential
+
+    groups: List[List[int]] = []
+    totals: List[int] = []
+    for index in sorted(range(len(sizes)), key=lambda i: -sizes[i]):
+        for number, group in enumerate(groups):
+            if fits(group, totals[number], sizes[index]):
+                group.append(index)
+                totals[number] += sizes[index]
+                break
+        else:
+            groups.append([index])
+            totals.append(sizes[index])
+    if len(groups) >= len(sequential):
+        return sequential
+    return sorted(sorted(group) for group in groups)
+
+
+def build_batch_prompt(prompt: str, labels: Sequence[str], count: int) -> str:
+    """
+    分割して送信するリクエストのメッセージを作成します。
+
+    :param prompt: 元のメッセージ
+    :param labels: このリクエストに含める画像のラベル
+    :param count: リクエストの数
+    :return: メッセージ（分割しない場合は元のメッセージ）
+    """
+    if count == 1:
+        return prompt
+    return IMAGES_BATCH_PROMPT.format(prompt=prompt, count=count, labels="、".join(labels))
+
+
+def build_images_aggregation_prompt(prompt: str, batches: Sequence[Sequence[str]],
+                                    answers: Sequence[Any]) -> str:
+    """
+    分割して送信したリクエストの回答を1つにまとめるプロンプトを作成します。
+
+    :param prompt: 元のメッセージ
+    :param batches: リクエストごとの画像のラベル
+    :param answers: リクエストごとの回答（テキストまたはJSON）
+    :return: プロンプト
+    """
+    texts = [answer if isinstance(answer, str) else json.dumps(answer, ensure_ascii=False)
+             for answer in answers]
+    responses = "\n\n".join(f"### {'、'.join(labels)}\n{text}"
+                            for labels, text in zip(batches, texts))
+    return IMAGES_AGGREGATION_PROMPT.format(prompt=prompt, count=len(batches), responses=responses)
+
+
+def _byte_view(data: Union[bytes, bytearray, memoryview]) -> memoryview:
+    """バイト列を1次元のバイトのmemoryviewに変換する（連続していない場合はコピーする）"""
+    view = memoryview(data)
+    if not view.c_contiguous:
+        return memoryview(view.tobytes())
+    return view.cast("B") if view.format != "B" or view.ndim != 1 else view
+
+
+@contextmanager
+def _map_file(path: str) -> Iterator[memoryview]:
+    """ファイルをmmapで開き、内容のビューを返す（mmapを使用できない場合は読み込む）"""
+    with open(path, "rb") as image_file:
+        try:
+            mapped = mmap.mmap(image_file.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            # 空のファイルやmmapに対応していないファイル
+            mapped = None
+        if mapped is None:
+            yield memoryview(image_file.read())
+            return
+        with mapped, memoryview(mapped) as view:
+            yield view
+
+
+def preprocess_image(image: ImageSource, provider: Optional[str] = None,
+                     policy: Optional[ImagePolicy] = None) -> PreprocessedImage:
+    """
+    画像をプロバイダーの実効的な最大解像度に縮小し、再圧縮してメタデータを除去します。
+
+    縮小も形式の変換も不要で、再圧縮しても小さくならない場合は元のバイト列をそのまま使用します
+    （strip_metadataがTrueでメタデータを含む場合を除く）。アニメーション画像は処理しません。
+
+    :param image: 画像（ファイルのパス、バイト列、PILの画像、またはImageInput）
+    :param provider: 送信先のプロバイダー名（"claude"、"openai"、"gemini"）
+    :param policy: 前処理の方針（省略した場合は既定の方針）
+    :return: 前処理した画像
+    """
+    from PIL import Image, ImageOps
+
+    source = ImageInput.of(image)
+    policy = policy or ImagePolicy()
+    original = source.read()
+    with Image.open(io.BytesIO(original)) as image:
+        source_format = image.format
+        original_width, original_height = image.size
+        original_mime = Image.MIME.get(source_format) or source.mime_type
+        if getattr(image, "n_frames", 1) > 1:
+            return PreprocessedImage(original, original_mime, original_width, original_height,
+                                     len(original), original_width, original_height)
+
+        exif = image.getexif()
+        has_metadata = bool(exif or image.info.get("icc_profile") or image.info.get("xmp"))
+        rotated = exif.get(ORIENTATION_TAG, 1) != 1
+        # EXIFの向きの情報を除去する前に、画像を正しい向きに回転する
+        processed = ImageOps.exif_transpose(image) if rotated else image
+        width, height = policy.target_size(processed.width, processed.height, provider)
+        supported_format = source_format if source_format in FORMAT_MIME_TYPES else None
+        target_format = policy.format or supported_format
+        if target_format is None:
+            target_format = "PNG" if _has_alpha(processed) else "JPEG"
+        needs_reencode = ((width, height) != processed.size or target_format != source_format
+                          or rotated or (policy.strip_metadata and has_metadata))
+        if not needs_reencode:
+            return PreprocessedImage(original, original_mime, original_width, original_height,
+                                     len(original), original_width, original_height)
+
+        if (width, height) != processed.size:
+            processed = processed.resize((width, height), Image.LANCZOS)
+        data = _encode(processed, target_format, policy)
+
+    keep_original = ((width, height) == (original_width, original_height)
+                     and len(data) >= len(original)
+                     and target_format == source_format
+                     and not (policy.strip_metadata and has_metadata))
+    if keep_original:
+        return PreprocessedImage(original, original_mime, original_width, original_height,
+                                 len(original), original_width, original_height)
+    return PreprocessedImage(data, FORMAT_MIME_TYPES[target_format], width, height,
+                             len(original), original_width, original_height)
+
+
+def _has_alpha(image) -> bool:
+    """画像が透過の情報を持つかどうかを返す"""
+    if image.mode in ("RGBA", "LA", "PA"):
+        return True
+    return image.mode == "P" and "transparency" in image.info
+
+
+def _encode(image, image_format: str, policy: ImagePolicy) -> bytes:
+    """画像を指定した形式で圧縮する。strip_metadataがFalseの場合のみEXIFとICCプロファイルを引き継ぐ"""
+    from PIL import Image
+
+    if image_format == "JPEG" and image.mode not in ("RGB", "L"):
+        if _has_alpha(image):
+            # JPEGは透過に対応していないため、白い背景に合成する
+            rgba = image.convert("RGBA")
+            background = Image.new("RGB", rgba.size, (255, 255, 255))
+            background.paste(rgba, mask=rgba.getchannel("A"))
+            image = background
+        else:
+            image = image.convert("RGB")
+    elif image_format == "WEBP" and image.mode not in ("RGB", "RGBA"):
+        image = image.convert("RGBA" if _has_alpha(image) else "RGB")
+    elif image_format == "PNG" and image.mode in ("CMYK", "YCbCr", "LAB", "HSV"):
+        image = image.convert("RGB")
+    options = {}
+    if image_format in ("JPEG", "WEBP"):
+        options["quality"] = policy.quality
+    if image_format == "JPEG":
+        options["optimize"] = True
+    if not policy.strip_metadata:
+        for key in ("exif", "icc_profile"):
+            if image.info.get(key):
+                options[key] = image.info[key]
+    buffer = io.BytesIO()
+    image.save(buffer, format=image_format, **options)
+    return buffer.getvalue()
+
+
+def encode_image(image: ImageInput, data_url: bool = False) -> Tuple[str, str]:
+    """
+    画像をbase64エンコードし、MIMEタイプとともに返します。ファイルは1回だけ開き、MIMEタイプの判定とエンコードを行います。
+
+    :param image: 画像
+    :param data_url: Trueの場合は"data:<MIMEタイプ>;base64,"で始まるデータURLを返します
+    :return: (MIMEタイプ, base64エンコードした文字列またはデータURL)
+    """
+    with image.view() as view:
+        mime_type = image.mime_type
+        return mime_type, _encode_view(view, f"data:{mime_type};base64," if data_url else "")
+
+
+def encode_base64(source: Union[str, bytes, bytearray, memoryview], prefix: str = "") -> str:
+    """
+    画像ファイルまたはバイト列をbase64エンコードした文字列を返します。
+
+    ファイルはmmapで参照し、エンコードした結果をあらかじめ確保した領域にENCODE_CHUNK_SIZEごとに書き込むため、
+    元のバイト列全体、エンコードしたバイト列、文字列を同時に保持しません。
+    prefix（データURLの"data:image/png;base64,"など）も同じ領域に書き込むため、連結による複製も作成しません。
+
+    :param source: 画像ファイルのパス、またはバイト列
+    :param prefix: エンコードした文字列の前に付ける文字列（ASCII）
+    :return: prefixとbase64エンコードした文字列を連結した文字列
+    """
+    if not isinstance(source, str):
+        return _encode_view(_byte_view(source), prefix)
+    with _map_file(source) as view:
+        return _encode_view(view, prefix)
+
+
+def _encode_view(view: memoryview, prefix: str) -> str:
+    """バイト列のビューを、prefixの後ろにbase64エンコードした文字列を返す"""
+    head = prefix.encode("ascii")
+    buffer = bytearray(len(head) + (len(view) + 2) // 3 * 4)
+    buffer[:len(head)] = head
+    position = len(head)
+    for encoded in _iter_base64(view):
+        buffer[position:position + len(encoded)] = encoded
+        position += len(encoded)
+    return buffer.decode("ascii")
+
+
+# 送信前のリクエストに含まれるImagePlaceholder（リクエストの引数から参照されている間だけ保持する）
+_placeholders: "weakref.WeakValueDictionary[str, ImagePlaceholder]" = weakref.WeakValueDictionary()
+
+
+class ImagePlaceholder(str):
+    """
+    base64エンコードした画像の代わりにリクエストの引数に含める文字列です。
+
+    SDKがリクエストの本文をJSONに変換した後、送信するときに（mosaicai.utils.image_uploadによって）
+    画像ファイルを少しずつbase64エンコードしたものに置き換えられます。
+    エンコードした画像全体をメモリに保持しないため、大きな画像を並行して送信する場合のメモリ使用量を抑えられます。
+    """
+
+    def __new__(cls, source: Union[str, bytes, bytearray, memoryview], prefix: str = ""):
+        """
+        :param source: 画像ファイルのパス、またはバイト列
+        :param prefix: エンコードした文字列の前に付ける文字列（ASCII）
+        """
+        placeholder = super().__new__(cls, PLACEHOLDER_PREFIX + uuid.uuid4().hex)
+        placeholder.source = source
+        placeholder.prefix = prefix
+        if isinstance(source, str):
+            placeholder.size = os.path.getsize(source)
+        else:
+            placeholder.size = memoryview(source).nbytes
+        _placeholders[str(placeholder)] = placeholder
+        return placeholder
+
+    @property
+    def encoded_size(self) -> int:
+        """置き換えた後の文字列の長さ"""
+        return len(self.prefix) + (self.size + 2) // 3 * 4
+
+    def iter_encoded(self) -> Iterator[bytes]:
+        """
+        prefixとbase64エンコードした画像を、ENCODE_CHUNK_SIZEごとに返します。
+
+        :return: エンコードしたバイト列のイテレーター
+        :raises ValueError: 画像ファイルの大きさがImagePlaceholderを作成したときから変わった場合
+        """
+        if self.prefix:
+            yield self.prefix.encode("ascii")
+        if not isinstance(self.source, str):
+            yield from _iter_base64(_byte_view(self.source))
+            return
+        with open(self.source, "rb") as image_file:
+            if os.fstat(image_file.fileno()).st_size != self.size:
+                raise ValueError(f"画像ファイルが送信前に変更されました: {self.source}")
+            if self.size == 0:
+                return
+            with mmap.mmap(image_file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                with memoryview(mapped) as view:
+                    yield from _iter_base64(view)
+
+
+def find_placeholder(token: str) -> Optional[ImagePlaceholder]:
+    """
+    文字列に対応する送信前のImagePlaceholderを返します。
+
+    :param token: ImagePlaceholderの文字列
+    :return: ImagePlaceholder（見つからない場合はNone）
+    """
+    return _placeholders.get(token)
+
+
+def has_placeholders() -> bool:
+    """送信前のImagePlaceholderがあるかどうかを返します。"""
+    return len(_placeholders) > 0
+
+
+def _iter_base64(view: memoryview) -> Iterator[bytes]:
+    """バイト列のビューをENCODE_CHUNK_SIZEごとにbase64エンコードして返す"""
+    for start in range(0, len(view), ENCODE_CHUNK_SIZE):
+        yield binascii.b2a_base64(view[start:start + ENCODE_CHUNK_SIZE], newline=False)
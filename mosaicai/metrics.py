@@ -0,0 +1,341 @@
+import bisect
+import contextvars
+import threading
+from typing import Any, Dict, List, Optional, Sequence, Tuple, Union
+from .types import Usage
+
+# レイテンシのヒストグラムのバケット（秒）
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+# リクエストのペイロードサイズのヒストグラムのバケット（バイト）
+BYTES_BUCKETS = (1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+
+# 呼び出し中のMosaicAIのメソッド名（モデルクラスで記録するメトリクスのラベルに使用する）
+_method = contextvars.ContextVar("mosaicai_method", default="unknown")
+
+
+class _Metric:
+    """ラベルの値の組ごとに値を保持するメトリクスの基底クラス"""
+    type = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str]):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Tuple[str, ...], Any] = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def clear(self):
+        """すべての値を破棄します。"""
+        with self._lock:
+            self._values.clear()
+
+
+class Counter(_Metric):
+    """
+    単調に増加するカウンターです。
+    """
+    type = "counter"
+
+    def inc(self, amount: float = 1, **labels: str):
+        """
+        カウンターを増やします。
+
+        :param amount: 増加量
+        :param labels: ラベルの値
+        """
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels: str) -> float:
+        """
+        ラベルの値の組に対応する現在の値を返します。
+
+        :param labels: ラベルの値
+        :return: カウンターの値（記録がない場合は0）
+        """
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+    def samples(self) -> List[Dict[str, Any]]:
+        """ラベルの値の組ごとの値を返します。"""
+        with self._lock:
+            items = list(self._values.items())
+        return [{"labels": dict(zip(self.labelnames, key)), "value": value} for key, value in items]
+
+
+class Histogram(_Metric):
+    """
+    観測値の分布をバケットごとの件数として記録するヒストグラムです。
+    """
+    type = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str],
+                 buckets: Sequence[float]):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels: str):
+        """
+        値を記録します。
+
+        :param value: 観測値
+        :param labels: ラベルの値
+        """
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                # [バケットごとの件数（最後は+Inf）, 合計, 件数]
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    def samples(self) -> List[Dict[str, Any]]:
+        """ラベルの値の組ごとの累積バケット、合計、件数を返します。"""
+        with self._lock:
+            items = [(key, (list(state[0]), state[1], state[2]))
+                     for key, state in self._values.items()]
+        samples = []
+        for key, (counts, total, count) in items:
+            cumulative, buckets = 0, {}
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                buckets[bound] = cumulative
+            samples.append({"labels": dict(zip(self.labelnames, key)), "buckets": buckets,
+                            "sum": total, "count": count})
+        return samples
+
+
+class MetricsRegistry:
+    """
+    メトリクスを名前で管理するレジストリです。スナップショットとPrometheusのテキスト形式での出力に対応します。
+    """
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric: _Metric) -> _Metric:
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                if type(existing) is not type(metric) or existing.labelnames != metric.labelnames:
+                    raise ValueError(f"メトリクス '{metric.name}' は異なる種類またはラベルで登録されています。")
+                return existing
+            self._metrics[metric.name] = metric
+            return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        """
+        カウンターを登録して返します。同じ名前のカウンターが登録済みの場合はそれを返します。
+
+        :param name: メトリクス名
+        :param documentation: 説明
+        :param labelnames: ラベルの名前
+        :return: カウンター
+        """
+        return self._register(Counter(name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+        """
+        ヒストグラムを登録して返します。同じ名前のヒストグラムが登録済みの場合はそれを返します。
+
+        :param name: メトリクス名
+        :param documentation: 説明
+        :param labelnames: ラベルの名前
+        :param buckets: バケットの上限値
+        :return: ヒストグラム
+        """
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        """
+        すべてのメトリクスの現在の値を返します。
+
+        :return: メトリクス名をキーとし、type、help、samplesを持つ辞書
+        """
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return {metric.name: {"type": metric.type, "help": metric.documentation,
+                              "samples": metric.samples()}
+                for metric in metrics}
+
+    def to_prometheus(self) -> str:
+        """
+        すべてのメトリクスをPrometheusのテキスト形式（バージョン0.0.4）で返します。
+
+        :return: Prometheusのテキスト形式の文字列
+        """
+        lines = []
+        for name, metric in self.snapshot().items():
+            lines.append(f"# HELP {name} {_escape_help(metric['help'])}")
+            lines.append(f"# TYPE {name} {metric['type']}")
+            for sample in metric["samples"]:
+                labels = sample["labels"]
+                if metric["type"] == "counter":
+                    lines.append(f"{name}{_format_labels(labels)} {_format_value(sample['value'])}")
+                    continue
+                for bound, count in sample["buckets"].items():
+                    le = "+Inf" if bound == float("inf") else _format_value(float(bound))
+                    lines.append(f"{name}_bucket{_format_labels({**labels, 'le': le})} {count}")
+                lines.append(f"{name}_sum{_format_labels(labels)} {_format_value(sample['sum'])}")
+                lines.append(f"{name}_count{_format_labels(labels)} {sample['count']}")
+        return "\n".join(lines) + "\n" if lines else ""
+
+    def clear(self):
+        """登録されたメトリクスはそのままで、すべての値を破棄します。"""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        for metric in metrics:
+            metric.clear()
+
+
+def _escape_help(text: str) -> str:
+    return text.replace("\\", "\\\\").replace("\n", "\\n")
+
+
+def _escape_label(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ""
+    pairs = ",".join(f'{name}="{_escape_label(value)}"' for name, value in labels.items())
+    return "{" + pairs + "}"
+
+
+def _format_value(value: Union[int, float]) -> str:
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+registry = MetricsRegistry()
+
+REQUEST_DURATION = registry.histogram(
+    "mosaicai_request_duration_seconds", "End-to-end latency of MosaicAI calls, including retries.",
+    ("model", "method"))
+TIME_TO_FIRST_TOKEN = registry.histogram(
+    "mosaicai_time_to_first_token_seconds",
+    "Time from sending a streaming request to receiving the first text.",
+    ("model", "method"))
+REQUESTS = registry.counter(
+    "mosaicai_requests_total", "Number of MosaicAI calls.",
+    ("model", "method"))
+ERRORS = registry.counter(
+    "mosaicai_errors_total", "Number of failed MosaicAI calls.",
+    ("model", "method", "error"))
+RETRIES = registry.counter(
+    "mosaicai_retries_total", "Number of retried provider requests.",
+    ("model", "method"))
+PROMPT_TOKENS = registry.counter(
+    "mosaicai_prompt_tokens_total", "Prompt tokens reported by providers.",
+    ("model", "method"))
+COMPLETION_TOKENS = registry.counter(
+    "mosaicai_completion_tokens_total", "Completion tokens reported by providers.",
+    ("model", "method"))
+REQUEST_BYTES = registry.histogram(
+    "mosaicai_request_payload_bytes",
+    "Approximate size of the text and binary payload sent to providers.",
+    ("model", "method"), BYTES_BUCKETS)
+IMAGE_BYTES_SAVED = registry.counter(
+    "mosaicai_image_bytes_saved_total", "Bytes removed from images by preprocessing before upload.",
+    ("model", "method"))
+
+
+def set_method(method: str) -> contextvars.Token:
+    """
+    呼び出し中のメソッド名を設定します。モデルクラスで記録するメトリクスのmethodラベルに使用されます。
+
+    :param method: メソッド名（"_async"の接尾辞は取り除かれます）
+    :return: reset_methodに渡すトークン
+    """
+    return _method.set(method[:-len("_async")] if method.endswith("_async") else method)
+
+
+def reset_method(token: contextvars.Token):
+    """set_methodで設定したメソッド名を元に戻します。"""
+    _method.reset(token)
+
+
+def current_method() -> str:
+    """呼び出し中のメソッド名を返します（MosaicAIを経由しない場合は"unknown"）。"""
+    return _method.get()
+
+
+def record_call(model: str, method: str, seconds: float, error: Optional[BaseException] = None):
+    """
+    呼び出しのレイテンシと成否を記録します。
+
+    :param model: モデル名
+    :param method: メソッド名
+    :param seconds: レイテンシ（秒）
+    :param error: 発生した例外（成功した場合はNone）
+    """
+    REQUESTS.inc(model=model, method=method)
+    if error is None:
+        REQUEST_DURATION.observe(seconds, model=model, method=method)
+    else:
+        ERRORS.inc(model=model, method=method, error=type(error).__name__)
+
+
+def record_usage(model: str, method: str, usage: Optional[Usage]):
+    """プロバイダーが報告したトークン使用量を記録します。"""
+    if usage is None:
+        return
+    PROMPT_TOKENS.inc(usage.prompt_tokens, model=model, method=method)
+    COMPLETION_TOKENS.inc(usage.completion_tokens, model=model, method=method)
+
+
+def payload_bytes(*args: Any, **kwargs: Any) -> int:
+    """
+    リクエストの引数に含まれる文字列（UTF-8）とバイト列のおおよそのサイズを返します。
+
+    :return: バイト数
+    """
+    total = 0
+    stack = list(args) + list(kwargs.values())
+    while stack:
+        value = stack.pop()
+        if isinstance(value, str):
+            if hasattr(value, "encoded_size"):
+                # 送信するときに画像に置き換えられるImagePlaceholder
+                total += value.encoded_size
+            else:
+                total += len(value) if value.isascii() else len(value.encode("utf-8", "replace"))
+        elif isinstance(value, (bytes, bytearray, memoryview)):
+            total += len(value)
+        elif isinstance(value, dict):
+            stack.extend(value.values())
+        elif isinstance(value, (list, tuple)):
+            stack.extend(value)
+    return total
+
+
+def snapshot() -> Dict[str, Dict[str, Any]]:
+    """
+    プロセス内のすべてのメトリクスの現在の値を返します。
+
+    :return: メトリクス名をキーとし、type、help、samplesを持つ辞書
+    """
+    return registry.snapshot()
+
+
+def export_prometheus() -> str:
+    """
+    プロセス内のすべてのメトリクスをPrometheusのテキスト形式で返します。
+
+    :return: Prometheusのテキスト形式の文字列（Content-Type: text/plain; version=0.0.4）
+    """
+    return registry.to_prometheus()
+
+
+def clear_metrics():
+    """すべてのメトリクスの値を破棄します。"""
+    registry.clear()
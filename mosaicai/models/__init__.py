@@ -1,7 +1,20 @@
+import importlib
 from .base import AIModelBase
-from .chatgpt import ChatGPT
-from .claude import Claude
-from .gemini import Gemini
-from .perplexity import Perplexity
+
+# 各モデルクラスが定義されているモジュール
+# プロバイダーのSDKの読み込みには時間がかかるため、モデルクラスは最初に参照されたときに読み込む
+_MODEL_MODULES = {
+    "ChatGPT": ".chatgpt",
+    "Claude": ".claude",
+    "Gemini": ".gemini",
+    "Perplexity": ".perplexity",
+}
 
 __all__ = ["AIModelBase", "ChatGPT", "Claude", "Gemini", "Perplexity"]
+
+
+def __getattr__(name: str):
+    if name in _MODEL_MODULES:
+        module = importlib.import_module(_MODEL_MODULES[name], __name__)
+        return getattr(module, name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
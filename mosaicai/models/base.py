@@ -1,10 +1,512 @@
 from abc import ABC, abstractmethod
+import asyncio
+import contextvars
+import inspect
 import json
-from typing import Dict, Any, Union, Type
+import logging
+import time
+from typing import (Dict, Any, Union, Type, Callable, Iterator, AsyncIterator, Awaitable, Optional,
+                    Tuple, List, TypeVar)
 from pydantic import BaseModel
+from .. import metrics, profiling, rate_limit, retry
+from ..profiling import profiled
+from ..cache import ImageCache
+from ..images import (ImageInput, ImagePlaceholder, ImagePolicy, LabeledImages, PreprocessedImage,
+                      build_batch_prompt, build_images_aggregation_prompt, encode_image,
+                      label_images, pack_images, preprocess_image)
+from ..retry import RetryPolicy
+from ..streaming import TextStream, AsyncTextStream, StreamEvent
+from ..types import GenerationResult, StreamDelta, Usage
+from ..exceptions import MosaicAIError
+
+T = TypeVar("T")
+
+# call_with_resultの実行中に、_sendが受信したSDKの応答を格納するリスト
+_responses = contextvars.ContextVar("mosaicai_responses", default=None)
 
 
 class AIModelBase(ABC):
+    # APIKeyManagerのサービス名と同じプロバイダー名（レート制限の単位として使用）
+    provider: Optional[str] = None
+    _api_key: Optional[str] = None
+    # 再試行の方針（Noneの場合は環境変数MAX_RETRIES、REQUEST_TIMEOUTから作成される既定の方針）
+    retry_policy: Optional[RetryPolicy] = None
+    # MosaicAIで指定されたモデル名（メトリクスのmodelラベルとして使用。Noneの場合はプロバイダー名）
+    model_name: Optional[str] = None
+    # 送信前の画像の前処理の方針（Noneの場合は画像ファイルをそのまま送信する）
+    image_policy: Optional[ImagePolicy] = None
+    # エンコードした画像のペイロードのキャッシュ（Noneの場合は呼び出しごとに画像ファイルを読み込む）
+    image_cache: Optional[ImageCache] = None
+    # Trueの場合、画像はbase64エンコードした文字列の代わりにImagePlaceholderとしてリクエストに含め、送信するときにエンコードする
+    stream_images: bool = False
+    # 1回のリクエストに含められる画像の数と、画像とメッセージの合計サイズ（バイト）の上限（Noneは制限なし）
+    # generate_with_imagesは、これを超える場合にリクエストを分割する
+    max_images_per_request: Optional[int] = None
+    max_request_bytes: Optional[int] = None
+    # 明示的に設定された非同期クライアント（テストなどで差し替える場合に使用）
+    _async_client_override = None
+
+    @property
+    def async_client(self):
+        """
+        非同期SDKクライアント
+        httpxの非同期接続プールはイベントループをまたいで使用できないため、実行中のイベントループごとに共有されるクライアントを返す
+        """
+        if self._async_client_override is not None:
+            return self._async_client_override
+        return self._get_async_client()
+
+    @async_client.setter
+    def async_client(self, client):
+        self._async_client_override = client
+
+    def _get_async_client(self):
+        """共有レジストリから非同期SDKクライアントを取得する。非同期SDKクライアントを使用するモデルで実装する"""
+        raise AttributeError(f"{type(self).__name__}は非同期SDKクライアントを使用しません。")
+
+    def _extract_usage(self, response: Any) -> Optional[Usage]:
+        """
+        SDKの応答からトークン使用量を取り出す。取り出せない場合はNoneを返す
+
+        :param response: SDKの応答
+        :return: トークン使用量
+        """
+        return None
+
+    def _response_info(self, response: Any) -> Dict[str, Optional[str]]:
+        """
+        SDKの応答から終了理由、モデルID、リクエストIDを取り出す。取り出せない値はNoneにする
+
+        :param response: SDKの応答
+        :return: finish_reason、model、request_idを持つ辞書
+        """
+        return {}
+
+    def _capture_response(self, response: Any):
+        """call_with_resultの実行中であれば、SDKの応答を記録する"""
+        responses = _responses.get()
+        if responses is not None:
+            responses.append(response)
+
+    def _build_result(self, content: Any, responses: list, latency: float) -> GenerationResult:
+        """生成結果と、最後に受信したSDKの応答からGenerationResultを作成する"""
+        result = GenerationResult(content, model=self.model_name, latency=latency)
+        if responses:
+            response = responses[-1]
+            usages = [self._extract_usage(item) for item in responses]
+            if len(usages) > 1 and all(usage is not None for usage in usages):
+                # 画像を分割して複数回リクエストした場合は、すべてのリクエストのトークン使用量を合計する
+                result.usage = Usage(sum(usage.prompt_tokens for usage in usages),
+                                     sum(usage.completion_tokens for usage in usages))
+            else:
+                result.usage = usages[-1]
+            for name, value in self._response_info(response).items():
+                if value is not None:
+                    setattr(result, name, value)
+        return result
+
+    def call_with_result(self, method: str, *args: Any) -> GenerationResult:
+        """
+        生成メソッドを呼び出し、生成結果をトークン使用量、終了理由、モデルID、リクエストID、レイテンシとともに返す
+
+        :param method: 呼び出すメソッド名（generate、generate_jsonなど）
+        :return: GenerationResult
+        """
+        token = _responses.set([])
+        start = time.monotonic()
+        try:
+            content = getattr(self, method)(*args)
+            return self._build_result(content, _responses.get(), time.monotonic() - start)
+        finally:
+            _responses.reset(token)
+
+    async def call_with_result_async(self, method: str, *args: Any) -> GenerationResult:
+        """
+        call_with_resultの非同期版
+
+        :param method: 呼び出す非同期メソッド名（generate_async、generate_json_asyncなど）
+        :return: GenerationResult
+        """
+        token = _responses.set([])
+        start = time.monotonic()
+        try:
+            content = await getattr(self, method)(*args)
+            return self._build_result(content, _responses.get(), time.monotonic() - start)
+        finally:
+            _responses.reset(token)
+
+    def _reserve(self, args: tuple,
+                 kwargs: Dict[str, Any]) -> Optional["rate_limit.RateLimitReservation"]:
+        """レート制限が設定されている場合、リクエストの枠を予約する"""
+        limiter = rate_limit.get_rate_limiter(self.provider, self._api_key)
+        if limiter is None:
+            return None
+        return limiter.acquire(rate_limit.estimate_tokens(*args, **kwargs))
+
+    async def _reserve_async(self, args: tuple,
+                             kwargs: Dict[str, Any]) -> Optional["rate_limit.RateLimitReservation"]:
+        """_reserveの非同期版"""
+        limiter = rate_limit.get_rate_limiter(self.provider, self._api_key)
+        if limiter is None:
+            return None
+        return await limiter.acquire_async(rate_limit.estimate_tokens(*args, **kwargs))
+
+    def _timeout_kwargs(self, timeout: float) -> Dict[str, Any]:
+        """
+        1回のリクエストのタイムアウトを指定するSDKの引数を返す
+
+        :param timeout: タイムアウト（秒）
+        :return: SDKのリクエストメソッドに追加するキーワード引数
+        """
+        return {"timeout": timeout}
+
+    def _encode_image_payload(self, image: ImageInput, data_url: bool = False) -> Tuple[str, str]:
+        """
+        画像をbase64エンコードし、MIMEタイプとともに返す
+        stream_imagesがTrueの場合は、送信するときにエンコードされるImagePlaceholderを返す
+
+        :param image: 画像
+        :param data_url: Trueの場合は"data:<MIMEタイプ>;base64,"で始まるデータURLを返す
+        :return: (MIMEタイプ, base64エンコードした文字列、データURL、またはImagePlaceholder)
+        """
+        if self.stream_images:
+            mime_type = image.mime_type
+            prefix = f"data:{mime_type};base64," if data_url else ""
+            return mime_type, ImagePlaceholder(image.payload_source, prefix)
+        return encode_image(image, data_url)
+
+    def _cached_image(self, image: ImageInput, form: str, create: Callable[[], Any]) -> Any:
+        """
+        画像のペイロードのキャッシュが設定されている場合、キャッシュしたペイロードを返す
+        ペイロードはプロバイダー、形式、画像の前処理の方針ごとに区別する
+
+        :param image: 画像
+        :param form: ペイロードの形式（"base64"、"data_url"など）
+        :param create: ペイロードを作成する関数
+        :return: ペイロード
+        """
+        if self.image_cache is None:
+            return create()
+        form_key = (self.provider, form, repr(self.image_policy), self.stream_images)
+        return self.image_cache.get_or_create(image, form_key, create)
+
+    def _preprocess_image(self, image: ImageInput) -> Optional[ImageInput]:
+        """
+        画像の前処理の方針が設定されている場合、画像を縮小、再圧縮し、削減したバイト数をメトリクスに記録する
+
+        :param image: 画像
+        :return: 前処理した画像（方針が設定されていない場合はNone）
+        """
+        if self.image_policy is None:
+            return None
+        labels = self._metric_labels()
+        with profiling.stage("preprocess_image", **labels):
+            processed: PreprocessedImage = preprocess_image(image, self.provider, self.image_policy)
+        if processed.bytes_saved:
+            metrics.IMAGE_BYTES_SAVED.inc(processed.bytes_saved, **labels)
+            logging.info(f"画像を前処理しました: {processed.original_bytes} bytes -> "
+                         f"{len(processed.data)} bytes "
+                         f"（{processed.original_width}x{processed.original_height} -> "
+                         f"{processed.width}x{processed.height}）")
+        return ImageInput(processed.data, mime_type=processed.mime_type, name=image.name)
+
+    def _image_part(self, image: ImageInput) -> Any:
+        """
+        画像をリクエストに含めるパート（プロバイダーごとの形式）に変換する。複数の画像に対応するモデルで実装する
+
+        :param image: 画像
+        :return: パート
+        """
+        raise NotImplementedError(f"{type(self).__name__}は複数の画像の送信に対応していません。")
+
+    def _image_part_bytes(self, part: Any) -> int:
+        """リクエストに含めたパートのおおよそのサイズ（バイト）を返す"""
+        return metrics.payload_bytes(part)
+
+    def _image_batches(self, message: str, images: LabeledImages) -> List[List[Tuple[str, Any]]]:
+        """
+        画像をパートに変換し、max_images_per_requestとmax_request_bytesを超えない最小の数のリクエストに分ける
+
+        :param message: ユーザーからの入力メッセージ
+        :param images: ラベルと画像
+        :return: リクエストごとの(ラベル, パート)のリスト
+        """
+        parts = [(label, self._image_part(image)) for label, image in label_images(images)]
+        budget = None
+        if self.max_request_bytes is not None:
+            # ラベルや分割の説明の分も含め、メッセージの2倍をメッセージ以外の本文に見込む
+            budget = self.max_request_bytes - 2 * metrics.payload_bytes(message) - sum(
+                metrics.payload_bytes(label) for label, _ in parts)
+        sizes = [self._image_part_bytes(part) for _, part in parts]
+        groups = pack_images(sizes, self.max_images_per_request, budget)
+        if len(groups) > 1:
+            logging.info(f"{len(parts)}枚の画像を{len(groups)}回のリクエストに分けて送信します。")
+        return [[parts[index] for index in group] for group in groups]
+
+    def _run_image_batches(self, message: str, images: LabeledImages,
+                           send: Callable[[str, List[Tuple[str, Any]]], T],
+                           aggregate: Callable[[str], T]) -> T:
+        """
+        画像を分けたリクエストを順に送信し、複数に分けた場合は回答を1つにまとめる
+
+        :param message: ユーザーからの入力メッセージ
+        :param images: ラベルと画像
+        :param send: メッセージと(ラベル, パート)のリストから1回のリクエストを送信する関数
+        :param aggregate: 回答をまとめるプロンプトから、まとめた回答を生成する関数
+        :return: 回答
+        """
+        batches = self._image_batches(message, images)
+        labels = [[label for label, _ in batch] for batch in batches]
+        answers = [send(build_batch_prompt(message, batch_labels, len(batches)), batch)
+                   for batch_labels, batch in zip(labels, batches)]
+        if len(answers) == 1:
+            return answers[0]
+        return aggregate(build_images_aggregation_prompt(message, labels, answers))
+
+    async def _run_image_batches_async(self, message: str, images: LabeledImages,
+                                       send: Callable[[str, List[Tuple[str, Any]]], Awaitable[T]],
+                                       aggregate: Callable[[str], Awaitable[T]]) -> T:
+        """_run_image_batchesの非同期版。分けたリクエストは同時に送信する"""
+        batches = self._image_batches(message, images)
+        labels = [[label for label, _ in batch] for batch in batches]
+        answers = await asyncio.gather(*(
+            send(build_batch_prompt(message, batch_labels, len(batches)), batch)
+            for batch_labels, batch in zip(labels, batches)))
+        if len(answers) == 1:
+            return answers[0]
+        return await aggregate(build_images_aggregation_prompt(message, labels, answers))
+
+    def _metric_labels(self, method: Optional[str] = None) -> Dict[str, str]:
+        """メトリクスのラベル（model、method）を返す。methodを省略した場合は呼び出し中のMosaicAIのメソッド名"""
+        return {"model": self.model_name or self.provider or type(self).__name__,
+                "method": method or metrics.current_method()}
+
+    def _get_retry_policy(self) -> RetryPolicy:
+        """モデルに設定された再試行の方針、または既定の方針を返す"""
+        return self.retry_policy or retry.default_policy()
+
+    def _attempt_kwargs(self, kwargs: Dict[str, Any], attempt: int,
+                        deadline: Optional[float]) -> Dict[str, Any]:
+        """
+        再試行時やモデル固有の方針を使用する場合は、SDKのタイムアウトを呼び出し全体の残り時間に短縮する
+        既定の方針での初回はクライアントに設定されたタイムアウト（REQUEST_TIMEOUT）を使用する
+        """
+        if deadline is None or (attempt == 0 and self.retry_policy is None):
+            return kwargs
+        remaining = max(deadline - time.monotonic(), 0.001)
+        return {**kwargs, **self._timeout_kwargs(remaining)}
+
+    def _with_retry(self, call: Callable[[Dict[str, Any]], Any], kwargs: Dict[str, Any],
+                    labels: Dict[str, str]) -> Any:
+        """
+        再試行の方針に従ってcallを実行する
+
+        :param call: キーワード引数を受け取り、1回のリクエストを実行する関数
+        :param kwargs: SDKのリクエストメソッドのキーワード引数
+        :param labels: 再試行の回数を記録するメトリクスのラベル
+        :return: callの戻り値
+        """
+        policy = self._get_retry_policy()
+        deadline = policy.deadline()
+        attempt = 0
+        while True:
+            try:
+                return call(self._attempt_kwargs(kwargs, attempt, deadline))
+            except Exception as e:
+                delay = policy.next_delay(e, attempt, deadline)
+                if delay is None:
+                    if isinstance(e.__cause__, MosaicAIError):
+                        # SDKが接続エラーとして包んだMosaicAI自身のエラー（カセットの不一致など）は元の例外を送出する
+                        raise e.__cause__ from e
+                    raise
+                logging.warning(f"一時的なエラーのため{delay:.2f}秒後に再試行します"
+                                f"（{attempt + 1}/{policy.max_retries}）: {e}")
+                metrics.RETRIES.inc(**labels)
+                time.sleep(delay)
+                attempt += 1
+
+    async def _with_retry_async(self, call: Callable[[Dict[str, Any]], Awaitable[Any]],
+                                kwargs: Dict[str, Any], labels: Dict[str, str]) -> Any:
+        """_with_retryの非同期版"""
+        policy = self._get_retry_policy()
+        deadline = policy.deadline()
+        attempt = 0
+        while True:
+            try:
+                return await call(self._attempt_kwargs(kwargs, attempt, deadline))
+            except Exception as e:
+                delay = policy.next_delay(e, attempt, deadline)
+                if delay is None:
+                    if isinstance(e.__cause__, MosaicAIError):
+                        # SDKが接続エラーとして包んだMosaicAI自身のエラー（カセットの不一致など）は元の例外を送出する
+                        raise e.__cause__ from e
+                    raise
+                logging.warning(f"一時的なエラーのため{delay:.2f}秒後に再試行します"
+                                f"（{attempt + 1}/{policy.max_retries}）: {e}")
+                metrics.RETRIES.inc(**labels)
+                await asyncio.sleep(delay)
+                attempt += 1
+
+    def _send(self, create: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+        """
+        SDKのリクエストを送信する。ストリーミング以外のAPI呼び出しはすべてこのメソッドを経由する
+        レート制限の枠を予約し、一時的なエラーは再試行の方針に従って再試行する
+        ペイロードのサイズ、トークン使用量、再試行の回数をメトリクスに記録する
+
+        :param create: SDKのリクエストメソッド（client.chat.completions.createなど）
+        :return: SDKの応答
+        """
+        def attempt(attempt_kwargs):
+            reservation = self._reserve(args, attempt_kwargs)
+            metrics.REQUEST_BYTES.observe(metrics.payload_bytes(*args, **attempt_kwargs), **labels)
+            try:
+                response = create(*args, **attempt_kwargs)
+            except BaseException:
+                if reservation is not None:
+                    reservation.cancel()
+                raise
+            usage = self._extract_usage(response)
+            metrics.record_usage(labels["model"], labels["method"], usage)
+            if reservation is not None:
+                reservation.settle(usage)
+            return response
+        labels = self._metric_labels()
+        with profiling.stage("request", **labels):
+            response = self._with_retry(attempt, kwargs, labels)
+        self._capture_response(response)
+        return response
+
+    async def _send_async(self, create: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+        """
+        _sendの非同期版
+
+        :param create: 非同期SDKのリクエストメソッド
+        :return: SDKの応答
+        """
+        async def attempt(attempt_kwargs):
+            reservation = await self._reserve_async(args, attempt_kwargs)
+            metrics.REQUEST_BYTES.observe(metrics.payload_bytes(*args, **attempt_kwargs), **labels)
+            try:
+                response = await create(*args, **attempt_kwargs)
+            except BaseException:
+                if reservation is not None:
+                    reservation.cancel()
+                raise
+            usage = self._extract_usage(response)
+            metrics.record_usage(labels["model"], labels["method"], usage)
+            if reservation is not None:
+                reservation.settle(usage)
+            return response
+        labels = self._metric_labels()
+        with profiling.stage("request", **labels):
+            response = await self._with_retry_async(attempt, kwargs, labels)
+        self._capture_response(response)
+        return response
+
+    def _stream(self, create: Callable[..., Any], to_events: Callable[[Any], Iterator[StreamEvent]],
+                *args: Any, **kwargs: Any) -> Iterator[StreamEvent]:
+        """
+        ストリーミングのリクエストを送信し、応答をイベントに変換して返す
+        ストリーミングのAPI呼び出しはすべてこのメソッドを経由する
+        再試行はストリームを開始するまでのエラーに対してのみ行う
+        最初のテキストを受信するまでの時間とストリーム全体の時間をメトリクスに記録する
+
+        :param create: SDKのリクエストメソッド
+        :param to_events: SDKのストリームをStreamDeltaとUsageに変換する関数
+        :return: StreamDeltaまたはUsageのイテレータ
+        """
+        def attempt(attempt_kwargs):
+            reservation = self._reserve(args, attempt_kwargs)
+            metrics.REQUEST_BYTES.observe(metrics.payload_bytes(*args, **attempt_kwargs), **labels)
+            try:
+                return create(*args, **attempt_kwargs), reservation
+            except BaseException:
+                if reservation is not None:
+                    reservation.cancel()
+                raise
+        labels = self._metric_labels("generate_text_stream")
+        start = time.monotonic()
+        try:
+            with profiling.stage("request", **labels):
+                stream, reservation = self._with_retry(attempt, kwargs, labels)
+        except Exception as e:
+            metrics.record_call(labels["model"], labels["method"], time.monotonic() - start, e)
+            raise
+        usage = None
+        first_token = True
+        error = None
+        try:
+            for event in to_events(stream):
+                if isinstance(event, Usage):
+                    usage = event
+                elif first_token and event.text:
+                    first_token = False
+                    metrics.TIME_TO_FIRST_TOKEN.observe(time.monotonic() - start, **labels)
+                yield event
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            metrics.record_call(labels["model"], labels["method"], time.monotonic() - start, error)
+            metrics.record_usage(labels["model"], labels["method"], usage)
+            if reservation is not None:
+                reservation.settle(usage)
+            close = getattr(stream, "close", None)
+            if close is not None:
+                close()
+
+    async def _stream_async(self, create: Callable[..., Any],
+                            to_events: Callable[[Any], AsyncIterator[StreamEvent]], *args: Any,
+                            **kwargs: Any) -> AsyncIterator[StreamEvent]:
+        """
+        _streamの非同期版
+
+        :param create: 非同期SDKのリクエストメソッド
+        :param to_events: SDKのストリームをStreamDeltaとUsageに変換する非同期ジェネレーター関数
+        :return: StreamDeltaまたはUsageの非同期イテレータ
+        """
+        async def attempt(attempt_kwargs):
+            reservation = await self._reserve_async(args, attempt_kwargs)
+            metrics.REQUEST_BYTES.observe(metrics.payload_bytes(*args, **attempt_kwargs), **labels)
+            try:
+                return await create(*args, **attempt_kwargs), reservation
+            except BaseException:
+                if reservation is not None:
+                    reservation.cancel()
+                raise
+        labels = self._metric_labels("generate_text_stream")
+        start = time.monotonic()
+        try:
+            with profiling.stage("request", **labels):
+                stream, reservation = await self._with_retry_async(attempt, kwargs, labels)
+        except Exception as e:
+            metrics.record_call(labels["model"], labels["method"], time.monotonic() - start, e)
+            raise
+        usage = None
+        first_token = True
+        error = None
+        try:
+            async for event in to_events(stream):
+                if isinstance(event, Usage):
+                    usage = event
+                elif first_token and event.text:
+                    first_token = False
+                    metrics.TIME_TO_FIRST_TOKEN.observe(time.monotonic() - start, **labels)
+                yield event
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            metrics.record_call(labels["model"], labels["method"], time.monotonic() - start, error)
+            metrics.record_usage(labels["model"], labels["method"], usage)
+            if reservation is not None:
+                reservation.settle(usage)
+            close = getattr(stream, "close", None)
+            if close is not None:
+                result = close()
+                if inspect.isawaitable(result):
+                    await result
+
     @abstractmethod
     def generate(self, message: str) -> str:
         """
@@ -15,6 +517,39 @@ class AIModelBase(ABC):
         """
         pass
 
+    @abstractmethod
+    async def generate_async(self, message: str) -> str:
+        """
+        generateの非同期版。各モデルの非同期SDKを使用して応答を生成する抽象メソッド
+
+        :param message: ユーザーからの入力メッセージ
+        :return: AIモデルが生成した応答テキスト
+        """
+        pass
+
+    def generate_text_stream(self, message: str) -> TextStream:
+        """
+        メッセージを受け取り、AIモデルからの応答をストリーミングで生成するメソッド
+        ストリーミングに対応していないモデルでは、generateの結果を1つの差分として返す
+
+        :param message: ユーザーからの入力メッセージ
+        :return: StreamDeltaを返すTextStream（終了後にusageを参照可能）
+        """
+        def events():
+            yield StreamDelta(self.generate(message), "stop")
+        return TextStream(events())
+
+    def generate_text_stream_async(self, message: str) -> AsyncTextStream:
+        """
+        generate_text_streamの非同期版
+
+        :param message: ユーザーからの入力メッセージ
+        :return: StreamDeltaを返すAsyncTextStream（終了後にusageを参照可能）
+        """
+        async def events():
+            yield StreamDelta(await self.generate_async(message), "stop")
+        return AsyncTextStream(events())
+
     # @abstractmethod
     # def generate_with_image(self, message: str, image_path: str) -> str:
     #     """
@@ -36,6 +571,19 @@ class AIModelBase(ABC):
         """
         pass
 
+    async def generate_json_async(
+            self, message: str,
+            output_schema: Union[Dict[str, Union[str, Dict]], Type[BaseModel]]) -> Dict[str, Any]:
+        """
+        generate_jsonの非同期版
+
+        :param message: ユーザーからの入力メッセージ
+        :param output_schema: 期待される出力のスキーマ（キーと型の指定）
+        :return: AIモデルが生成したJSON応答（辞書形式）
+        """
+        pass
+
+    @profiled("parse_json")
     def _parse_json_response(self, response: str) -> dict:
         """
         文字列形式のJSON応答をパースする内部メソッド
@@ -49,6 +597,7 @@ class AIModelBase(ABC):
             error_message = f"生成された応答が有効なJSONではありません。エラー: {str(e)}\n応答内容: {response}"
             raise ValueError(error_message)
 
+    @profiled("schema")
     def _generate_schema_description(self, schema: Union[Dict[str, Union[str, Dict]], Type[BaseModel]]) -> str:
         """
         出力スキーマの説明を生成する内部メソッド
@@ -111,6 +660,7 @@ class AIModelBase(ABC):
         description += f'{" " * indent}}}'
         return description
 
+    @profiled("convert_types")
     def _convert_types(self, data: Dict[str, Any], schema: Union[Dict[str, Union[str, Dict]], Type[BaseModel]]) -> Dict[str, Any]:
         """
         データの型をスキーマに従って変換する内部メソッド
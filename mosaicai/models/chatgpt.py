@@ -1,14 +1,23 @@
-import base64
-from typing import Dict, Any, Union, Type
+from typing import Dict, Any, Union, Type, List, Optional, Tuple
 import json
 import openai
-from openai import OpenAI
 from .base import AIModelBase
+from ..images import ImageInput, ImageSource, LabeledImages
+from ..profiling import profiled
+from ..streaming import (TextStream, AsyncTextStream, openai_stream_events,
+                         openai_stream_events_async, openai_response_usage, openai_response_info)
+from ..types import Usage
 from ..utils.api_key_manager import APIKeyManager
+from ..utils import client_registry
 from pydantic import BaseModel
 
 
 class ChatGPT(AIModelBase):
+    provider = "openai"
+    # Chat Completions APIの1回のリクエストに含められる画像の数と、リクエストの最大サイズ
+    max_images_per_request = 500
+    max_request_bytes = 50 * 1024 * 1024
+
     def __init__(self, api_key_manager: APIKeyManager, model: str = "gpt-4o"):
         """
         ChatGPTモデルの初期化
@@ -19,9 +28,21 @@ class ChatGPT(AIModelBase):
         api_key = self.api_key_manager.get_api_key("openai")
         if not api_key:
             raise ValueError("OpenAI APIキーが設定されていません。")
-        self.client = OpenAI(api_key=api_key)
+        self._api_key = api_key
+        # SDKクライアントと接続プールはプロセス内で共有する
+        self._base_url = client_registry.get_base_url("openai")
+        self.client = client_registry.get_openai_client(api_key, self._base_url)
         self.model = model
 
+    def _extract_usage(self, response) -> Optional[Usage]:
+        return openai_response_usage(response)
+
+    def _response_info(self, response) -> Dict[str, Optional[str]]:
+        return openai_response_info(response)
+
+    def _get_async_client(self):
+        return client_registry.get_async_openai_client(self._api_key, self._base_url)
+
     def get_model(self) -> str:
         """
         self.modelの値を返す
@@ -35,33 +56,68 @@ class ChatGPT(AIModelBase):
         :param message: ユーザーからの入力メッセージ
         :return: ChatGPTが生成した応答テキスト
         """
-        response = self.client.chat.completions.create(
+        response = self._send(
+            self.client.chat.completions.create,
+            model=self.model,
+            messages=[{"role": "user", "content": message}]
+        )
+        return response.choices[0].message.content
+
+    async def generate_async(self, message: str) -> str:
+        """
+        generateの非同期版
+        :param message: ユーザーからの入力メッセージ
+        :return: ChatGPTが生成した応答テキスト
+        """
+        response = await self._send_async(
+            self.async_client.chat.completions.create,
             model=self.model,
             messages=[{"role": "user", "content": message}]
         )
         return response.choices[0].message.content
 
-    def generate_with_image(self, message: str, image_path: str) -> str:
+    def generate_text_stream(self, message: str) -> TextStream:
+        """
+        指定されたメッセージに対するChatGPTの応答をストリーミングで生成する
+        :param message: ユーザーからの入力メッセージ
+        :return: StreamDeltaを返すTextStream（終了後にusageを参照可能）
+        """
+        return TextStream(self._stream_events(message))
+
+    def generate_text_stream_async(self, message: str) -> AsyncTextStream:
+        """
+        generate_text_streamの非同期版
+        :param message: ユーザーからの入力メッセージ
+        :return: StreamDeltaを返すAsyncTextStream（終了後にusageを参照可能）
+        """
+        return AsyncTextStream(self._stream_events_async(message))
+
+    def generate_with_image(self, message: str, image_path: ImageSource) -> str:
         """
         画像を含むメッセージに対してChatGPTの応答を生成する
         :param message: ユーザーからの入力メッセージ
-        :param image_path: 画像ファイルのパス
+        :param image_path: 画像（ファイルのパス、バイト列、memoryview、PILの画像、またはImageInput）
+        :return: ChatGPTが生成した応答テキスト
+        """
+        response = self._send(
+            self.client.chat.completions.create,
+            model=self.model,
+            messages=[{"role": "user", "content": self._image_content(message, image_path)}]
+        )
+        return response.choices[0].message.content
+
+    async def generate_with_image_async(self, message: str, image_path: ImageSource) -> str:
+        """
+        generate_with_imageの非同期版
+        :param message: ユーザーからの入力メッセージ
+        :param image_path: 画像（ファイルのパス、バイト列、memoryview、PILの画像、またはImageInput）
         :return: ChatGPTが生成した応答テキスト
         """
-        with open(image_path, "rb") as image_file:
-            response = self.client.chat.completions.create(
-                model=self.model,
-                messages=[
-                    {
-                        "role": "user",
-                        "content": [
-                            {"type": "text", "text": message},
-                            {"type": "image_url", "image_url": {
-                                "url": f"data:image/jpeg;base64,{base64.b64encode(image_file.read()).decode()}"}}
-                        ],
-                    }
-                ]
-            )
+        response = await self._send_async(
+            self.async_client.chat.completions.create,
+            model=self.model,
+            messages=[{"role": "user", "content": self._image_content(message, image_path)}]
+        )
         return response.choices[0].message.content
 
     def generate_json(self, message: str, output_schema: Union[Dict[str, Union[str, Dict]], Type[BaseModel]]) -> Dict[str, Any]:
@@ -74,60 +130,233 @@ class ChatGPT(AIModelBase):
 
         # Structured Output（JSON形式での応答）: 正式リリースしたら統合する
         if self.model == 'gpt-4o-2024-08-06':
-            system_message = f"応答はJSON形式で生成してください。日本語で回答してください。"
-            response = self.client.beta.chat.completions.parse(
-                model=self.model,
-                messages=[
-                    {"role": "system", "content": system_message},
-                    {"role": "user", "content": message}
-                ],
-                tools=[
-                    openai.pydantic_function_tool(output_schema),
-                ]
-            )
+            response = self._send(
+                self.client.beta.chat.completions.parse,
+                **self._structured_output_request(message, output_schema))
             return response.choices[0].message.tool_calls[0].function.parsed_arguments.dict()
 
-        else:
-            schema_description = self._generate_schema_description(output_schema)
-            system_message = f"応答は以下のJSON形式で生成してください: \n{schema_description}"
+        response = self._send(
+            self.client.chat.completions.create,
+            **self._json_request(message, output_schema))
+        json_response = self._parse_json_response(response.choices[0].message.content)
+        return self._convert_types(json_response, output_schema)
 
-            response = self.client.chat.completions.create(
-                model=self.model,
-                messages=[
-                    {"role": "system", "content": system_message},
-                    {"role": "user", "content": message}
-                ],
-                response_format={"type": "json_object"}
-            )
+    async def generate_json_async(
+            self, message: str,
+            output_schema: Union[Dict[str, Union[str, Dict]], Type[BaseModel]]) -> Dict[str, Any]:
+        """
+        generate_jsonの非同期版
+        :param message: ユーザーからの入力メッセージ
+        :param output_schema: 期待される出力のスキーマ（キーと型の指定）
+        :return: ChatGPTが生成したJSON応答（辞書形式）
+        """
+        if self.model == 'gpt-4o-2024-08-06':
+            response = await self._send_async(
+                self.async_client.beta.chat.completions.parse,
+                **self._structured_output_request(message, output_schema))
+            return response.choices[0].message.tool_calls[0].function.parsed_arguments.dict()
 
-            json_response = self._parse_json_response(response.choices[0].message.content)
-            return self._convert_types(json_response, output_schema)
+        response = await self._send_async(
+            self.async_client.chat.completions.create,
+            **self._json_request(message, output_schema))
+        json_response = self._parse_json_response(response.choices[0].message.content)
+        return self._convert_types(json_response, output_schema)
 
-    def generate_with_image_json(self, message: str, image_path: str, output_schema: Union[Dict[str, Union[str, Dict]], Type[BaseModel]]) -> Dict[str, Any]:
+    def generate_with_image_json(
+            self, message: str, image_path: ImageSource,
+            output_schema: Union[Dict[str, Union[str, Dict]], Type[BaseModel]]) -> Dict[str, Any]:
         """
         画像を含むメッセージに対してChatGPTのJSON応答を生成する
         :param message: ユーザーからの入力メッセージ
-        :param image_path: 画像ファイルのパス
+        :param image_path: 画像（ファイルのパス、バイト列、memoryview、PILの画像、またはImageInput）
         :param output_schema: 期待される出力のスキーマ（キーと型の指定）
         :return: ChatGPTが生成したJSON応答（辞書形式）
         """
-        schema_description = self._generate_schema_description(output_schema)
-        system_message = f"応答は以下のJSON形式で生成してください: \n{schema_description}"
-
-        with open(image_path, "rb") as image_file:
-            response = self.client.chat.completions.create(
-                model=self.model,
-                messages=[
-                    {"role": "system", "content": system_message},
-                    {"role": "user", "content": [
-                        {"type": "text", "text": message},
-                        {"type": "image_url", "image_url": {
-                            "url": f"data:image/jpeg;base64,{base64.b64encode(image_file.read()).decode()}"
-                        }}
-                    ]}
-                ],
-                response_format={"type": "json_object"}
-            )
+        response = self._send(
+            self.client.chat.completions.create,
+            **self._json_request(self._image_content(message, image_path), output_schema))
+        json_response = self._parse_json_response(response.choices[0].message.content)
+        return self._convert_types(json_response, output_schema)
 
+    async def generate_with_image_json_async(
+            self, message: str, image_path: ImageSource,
+            output_schema: Union[Dict[str, Union[str, Dict]], Type[BaseModel]]) -> Dict[str, Any]:
+        """
+        generate_with_image_jsonの非同期版
+        :param message: ユーザーからの入力メッセージ
+        :param image_path: 画像（ファイルのパス、バイト列、memoryview、PILの画像、またはImageInput）
+        :param output_schema: 期待される出力のスキーマ（キーと型の指定）
+        :return: ChatGPTが生成したJSON応答（辞書形式）
+        """
+        response = await self._send_async(
+            self.async_client.chat.completions.create,
+            **self._json_request(self._image_content(message, image_path), output_schema))
         json_response = self._parse_json_response(response.choices[0].message.content)
         return self._convert_types(json_response, output_schema)
+
+    def generate_with_images(self, message: str, images: LabeledImages) -> str:
+        """
+        ラベルを付けた複数の画像を含むメッセージに対してChatGPTの応答を生成する
+        画像の数や大きさが1回のリクエストの上限を超える場合は、できるだけ少ない回数に分けて送信し、回答を1つにまとめる
+        :param message: ユーザーからの入力メッセージ
+        :param images: ラベルと画像の辞書、または画像か(ラベル, 画像)のリスト
+        :return: ChatGPTが生成した応答テキスト
+        """
+        return self._run_image_batches(message, images, self._generate_with_image_batch,
+                                       self.generate)
+
+    async def generate_with_images_async(self, message: str, images: LabeledImages) -> str:
+        """
+        generate_with_imagesの非同期版
+        :param message: ユーザーからの入力メッセージ
+        :param images: ラベルと画像の辞書、または画像か(ラベル, 画像)のリスト
+        :return: ChatGPTが生成した応答テキスト
+        """
+        return await self._run_image_batches_async(
+            message, images, self._generate_with_image_batch_async, self.generate_async)
+
+    def generate_with_images_json(
+            self, message: str, images: LabeledImages,
+            output_schema: Union[Dict[str, Union[str, Dict]], Type[BaseModel]]) -> Dict[str, Any]:
+        """
+        ラベルを付けた複数の画像を含むメッセージに対してChatGPTのJSON応答を生成する
+        :param message: ユーザーからの入力メッセージ
+        :param images: ラベルと画像の辞書、または画像か(ラベル, 画像)のリスト
+        :param output_schema: 期待される出力のスキーマ（キーと型の指定）
+        :return: ChatGPTが生成したJSON応答（辞書形式）
+        """
+        return self._run_image_batches(
+            message, images,
+            lambda text, parts: self._generate_with_image_batch(text, parts, output_schema),
+            lambda prompt: self.generate_json(prompt, output_schema))
+
+    async def generate_with_images_json_async(
+            self, message: str, images: LabeledImages,
+            output_schema: Union[Dict[str, Union[str, Dict]], Type[BaseModel]]) -> Dict[str, Any]:
+        """
+        generate_with_images_jsonの非同期版
+        :param message: ユーザーからの入力メッセージ
+        :param images: ラベルと画像の辞書、または画像か(ラベル, 画像)のリスト
+        :param output_schema: 期待される出力のスキーマ（キーと型の指定）
+        :return: ChatGPTが生成したJSON応答（辞書形式）
+        """
+        return await self._run_image_batches_async(
+            message, images,
+            lambda text, parts: self._generate_with_image_batch_async(text, parts, output_schema),
+            lambda prompt: self.generate_json_async(prompt, output_schema))
+
+    def _images_request(
+            self, message: str, image_parts: List[Tuple[str, Dict[str, Any]]],
+            output_schema: Optional[Union[Dict[str, Union[str, Dict]], Type[BaseModel]]]
+    ) -> Dict[str, Any]:
+        """複数の画像を含むchat.completions.createの引数を作成する"""
+        content = self._labeled_image_content(message, image_parts)
+        if output_schema is not None:
+            return self._json_request(content, output_schema)
+        return {"model": self.model, "messages": [{"role": "user", "content": content}]}
+
+    def _generate_with_image_batch(
+            self, message: str, image_parts: List[Tuple[str, Dict[str, Any]]],
+            output_schema: Optional[Union[Dict[str, Union[str, Dict]], Type[BaseModel]]] = None
+    ) -> Any:
+        """複数の画像を含む1回のリクエストを送信し、応答テキスト（output_schemaを指定した場合はJSON）を返す"""
+        response = self._send(self.client.chat.completions.create,
+                              **self._images_request(message, image_parts, output_schema))
+        if output_schema is None:
+            return response.choices[0].message.content
+        return self._convert_types(self._parse_json_response(response.choices[0].message.content),
+                                   output_schema)
+
+    async def _generate_with_image_batch_async(
+            self, message: str, image_parts: List[Tuple[str, Dict[str, Any]]],
+            output_schema: Optional[Union[Dict[str, Union[str, Dict]], Type[BaseModel]]] = None
+    ) -> Any:
+        """_generate_with_image_batchの非同期版"""
+        request = self._images_request(message, image_parts, output_schema)
+        response = await self._send_async(self.async_client.chat.completions.create, **request)
+        if output_schema is None:
+            return response.choices[0].message.content
+        return self._convert_types(self._parse_json_response(response.choices[0].message.content),
+                                   output_schema)
+
+    def _stream_events(self, message: str):
+        """ストリーミング応答のチャンクをStreamDeltaとUsageに変換して返す"""
+        yield from self._stream(self.client.chat.completions.create, openai_stream_events,
+                                **self._stream_request(message))
+
+    async def _stream_events_async(self, message: str):
+        """_stream_eventsの非同期版"""
+        async for event in self._stream_async(self.async_client.chat.completions.create,
+                                              openai_stream_events_async,
+                                              **self._stream_request(message)):
+            yield event
+
+    def _stream_request(self, message: str) -> Dict[str, Any]:
+        """ストリーミング応答を要求するchat.completions.createの引数を作成する"""
+        return {
+            "model": self.model,
+            "messages": [{"role": "user", "content": message}],
+            "stream": True,
+            # 最終チャンクでトークン使用量を受け取る
+            "stream_options": {"include_usage": True}
+        }
+
+    @profiled("encode_image")
+    def _image_content(self, message: str, image_path: ImageSource) -> List[Dict[str, Any]]:
+        """画像をbase64エンコードし、テキストと画像からなるcontentを作成する"""
+        return [
+            {"type": "text", "text": message},
+            self._image_part(image_path)
+        ]
+
+    def _image_part(self, image_path: ImageSource) -> Dict[str, Any]:
+        """画像をbase64エンコードしたデータURLを持つcontentの要素を作成する"""
+        image = ImageInput.of(image_path)
+        url = self._cached_image(image, "data_url", lambda: self._image_url(image))
+        return {"type": "image_url", "image_url": {"url": url}}
+
+    def _labeled_image_content(
+            self, message: str,
+            image_parts: List[Tuple[str, Dict[str, Any]]]) -> List[Dict[str, Any]]:
+        """各画像の前にラベルを置き、最後にメッセージを置いたcontentを作成する"""
+        content = []
+        for label, part in image_parts:
+            content.append({"type": "text", "text": f"{label}:"})
+            content.append(part)
+        content.append({"type": "text", "text": message})
+        return content
+
+    def _image_url(self, image: ImageInput) -> str:
+        """画像を（前処理の方針が設定されている場合は前処理してから）base64エンコードしたデータURLを返す"""
+        processed = self._preprocess_image(image)
+        return self._encode_image_payload(processed or image, data_url=True)[1]
+
+    def _json_request(
+            self, content: Union[str, List[Dict[str, Any]]],
+            output_schema: Union[Dict[str, Union[str, Dict]], Type[BaseModel]]) -> Dict[str, Any]:
+        """JSON形式の応答を要求するchat.completions.createの引数を作成する"""
+        schema_description = self._generate_schema_description(output_schema)
+        system_message = f"応答は以下のJSON形式で生成してください: \n{schema_description}"
+        return {
+            "model": self.model,
+            "messages": [
+                {"role": "system", "content": system_message},
+                {"role": "user", "content": content}
+            ],
+            "response_format": {"type": "json_object"}
+        }
+
+    def _structured_output_request(self, message: str,
+                                   output_schema: Type[BaseModel]) -> Dict[str, Any]:
+        """Structured Outputを使用するbeta.chat.completions.parseの引数を作成する"""
+        system_message = f"応答はJSON形式で生成してください。日本語で回答してください。"
+        return {
+            "model": self.model,
+            "messages": [
+                {"role": "system", "content": system_message},
+                {"role": "user", "content": message}
+            ],
+            "tools": [
+                openai.pydantic_function_tool(output_schema),
+            ]
+        }
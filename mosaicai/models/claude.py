@@ -1,30 +1,59 @@
-import base64
-import mimetypes
 import json
 import os
 import logging
-from typing import Dict, Any, Union, Type
+from typing import Dict, Any, Union, Type, Optional, Iterator, AsyncIterator, List, Tuple
 from pydantic import BaseModel
-from anthropic import Anthropic
 from .base import AIModelBase
+from ..images import ImageInput, ImageSource, LabeledImages
+from ..profiling import profiled
+from ..streaming import TextStream, AsyncTextStream, StreamEvent, text_or_none
+from ..types import StreamDelta, Usage
 from ..utils.api_key_manager import APIKeyManager
+from ..utils import client_registry
 
 
 class Claude(AIModelBase):
-    def __init__(self, api_key_manager: APIKeyManager, model: str = "claude-3-5-sonnet-20240620"):
+    provider = "claude"
+    # Messages APIの1回のリクエストに含められる画像の数と、リクエストの最大サイズ
+    max_images_per_request = 100
+    max_request_bytes = 32 * 1024 * 1024
+
+    def __init__(self, api_key_manager: APIKeyManager, model: str = "claude-3-5-sonnet-20240620",
+                 max_tokens: int = 1000):
         """
         Claudeモデルの初期化
         :param api_key_manager: API鍵を管理するAPIKeyManagerインスタンス
         :param model: 使用するモデルの名前（デフォルトは"claude-3-5-sonnet-20240620"）
+        :param max_tokens: 1回の応答で生成する最大トークン数（デフォルトは1000）
         """
         self.api_key_manager = api_key_manager
         api_key = self.api_key_manager.get_api_key("claude")
         if not api_key:
             raise ValueError("Claude APIキーが設定されていません。")
-        self.client = Anthropic(api_key=api_key)
+        self._api_key = api_key
+        # SDKクライアントと接続プールはプロセス内で共有する
+        self._base_url = client_registry.get_base_url("claude")
+        self.client = client_registry.get_anthropic_client(api_key, self._base_url)
         self.model = model
+        self.max_tokens = max_tokens
         self.max_image_size = 20 * 1024 * 1024  # 20MB
 
+    def _extract_usage(self, response) -> Optional[Usage]:
+        usage = getattr(response, "usage", None)
+        return Usage.from_counts(getattr(usage, "input_tokens", None),
+                                 getattr(usage, "output_tokens", None))
+
+    def _response_info(self, response) -> Dict[str, Optional[str]]:
+        return {
+            "finish_reason": text_or_none(getattr(response, "stop_reason", None)),
+            "model": text_or_none(getattr(response, "model", None)),
+            "request_id": (text_or_none(getattr(response, "_request_id", None))
+                           or text_or_none(getattr(response, "id", None))),
+        }
+
+    def _get_async_client(self):
+        return client_registry.get_async_anthropic_client(self._api_key, self._base_url)
+
     def get_model(self) -> str:
         """
         self.modelの値を返す
@@ -39,54 +68,67 @@ class Claude(AIModelBase):
         :return: Claudeが生成した応答テキスト
         """
         try:
-            response = self.client.messages.create(
-                model=self.model,
-                messages=[
-                    {"role": "user", "content": message}
-                ],
-                max_tokens=1000
-            )
+            response = self._send(self.client.messages.create, **self._request(message))
+            return response.content[0].text
+        except Exception as e:
+            logging.error(f"テキスト生成中にエラーが発生しました: {str(e)}")
+            raise
+
+    async def generate_async(self, message: str) -> str:
+        """
+        generateの非同期版
+        :param message: ユーザーからの入力メッセージ
+        :return: Claudeが生成した応答テキスト
+        """
+        try:
+            response = await self._send_async(self.async_client.messages.create,
+                                              **self._request(message))
             return response.content[0].text
         except Exception as e:
             logging.error(f"テキスト生成中にエラーが発生しました: {str(e)}")
             raise
 
-    def generate_with_image(self, message: str, image_path: str) -> str:
+    def generate_text_stream(self, message: str) -> TextStream:
+        """
+        指定されたメッセージに対するClaudeの応答をストリーミングで生成する
+        :param message: ユーザーからの入力メッセージ
+        :return: StreamDeltaを返すTextStream（終了後にusageを参照可能）
+        """
+        return TextStream(self._stream_events(message))
+
+    def generate_text_stream_async(self, message: str) -> AsyncTextStream:
+        """
+        generate_text_streamの非同期版
+        :param message: ユーザーからの入力メッセージ
+        :return: StreamDeltaを返すAsyncTextStream（終了後にusageを参照可能）
+        """
+        return AsyncTextStream(self._stream_events_async(message))
+
+    def generate_with_image(self, message: str, image_path: ImageSource) -> str:
         """
         画像を含むメッセージに対してClaudeの応答を生成する
         :param message: ユーザーからの入力メッセージ
-        :param image_path: 画像ファイルのパス
+        :param image_path: 画像（ファイルのパス、バイト列、memoryview、PILの画像、またはImageInput）
         :return: Claudeが生成した応答テキスト
         """
         try:
-            self._validate_image_file(image_path)
-            mime_type = self._get_mime_type(image_path)
-            base64_image = self._encode_image(image_path)
-
-            logging.info(f"画像ファイルのパス: {image_path}")
-            logging.info(f"MIMEタイプ: {mime_type}")
-            logging.info(f"ファイルサイズ: {os.path.getsize(image_path)} bytes")
-
-            response = self.client.messages.create(
-                model=self.model,
-                messages=[
-                    {
-                        "role": "user",
-                        "content": [
-                            {"type": "text", "text": message},
-                            {
-                                "type": "image",
-                                "source": {
-                                    "type": "base64",
-                                    "media_type": mime_type,
-                                    "data": base64_image
-                                }
-                            }
-                        ]
-                    }
-                ],
-                max_tokens=1000
-            )
+            response = self._send(self.client.messages.create,
+                                  **self._request(message, image_path=image_path))
+            return response.content[0].text
+        except Exception as e:
+            logging.error(f"画像を含むメッセージの生成中にエラーが発生しました: {str(e)}")
+            raise
+
+    async def generate_with_image_async(self, message: str, image_path: ImageSource) -> str:
+        """
+        generate_with_imageの非同期版
+        :param message: ユーザーからの入力メッセージ
+        :param image_path: 画像（ファイルのパス、バイト列、memoryview、PILの画像、またはImageInput）
+        :return: Claudeが生成した応答テキスト
+        """
+        try:
+            response = await self._send_async(self.async_client.messages.create,
+                                              **self._request(message, image_path=image_path))
             return response.content[0].text
         except Exception as e:
             logging.error(f"画像を含むメッセージの生成中にエラーが発生しました: {str(e)}")
@@ -99,81 +141,267 @@ class Claude(AIModelBase):
         :param output_schema: 期待される出力のスキーマ（キーと型の指定）
         :return: Claudeが生成したJSON応答（辞書形式）
         """
-        schema_description = self._generate_schema_description(output_schema)
-        system_message = f"応答は以下のJSON形式で生成してください: \n{schema_description}"
+        request = self._request(message, output_schema=output_schema)
         try:
-            response = self.client.messages.create(
-                model=self.model,
-                system=system_message,
-                messages=[
-                    {"role": "user", "content": message}
-                ],
-                max_tokens=1000
-            )
+            response = self._send(self.client.messages.create, **request)
             json_response = self._parse_json_response(response.content[0].text)
             return self._convert_types(json_response, output_schema)
         except Exception as e:
             logging.error(f"JSON生成中にエラーが発生しました: {str(e)}")
             raise
 
-    def generate_with_image_json(self, message: str, image_path: str, output_schema: Union[Dict[str, Union[str, Dict]], Type[BaseModel]]) -> Dict[str, Any]:
+    async def generate_json_async(
+            self, message: str,
+            output_schema: Union[Dict[str, Union[str, Dict]], Type[BaseModel]]) -> Dict[str, Any]:
+        """
+        generate_jsonの非同期版
+        :param message: ユーザーからの入力メッセージ
+        :param output_schema: 期待される出力のスキーマ（キーと型の指定）
+        :return: Claudeが生成したJSON応答（辞書形式）
+        """
+        request = self._request(message, output_schema=output_schema)
+        try:
+            response = await self._send_async(self.async_client.messages.create, **request)
+            json_response = self._parse_json_response(response.content[0].text)
+            return self._convert_types(json_response, output_schema)
+        except Exception as e:
+            logging.error(f"JSON生成中にエラーが発生しました: {str(e)}")
+            raise
+
+    def generate_with_image_json(
+            self, message: str, image_path: ImageSource,
+            output_schema: Union[Dict[str, Union[str, Dict]], Type[BaseModel]]) -> Dict[str, Any]:
         """
         画像を含むメッセージに対してClaudeのJSON応答を生成する
         :param message: ユーザーからの入力メッセージ
-        :param image_path: 画像ファイルのパス
+        :param image_path: 画像（ファイルのパス、バイト列、memoryview、PILの画像、またはImageInput）
         :param output_schema: 期待される出力のスキーマ（キーと型の指定）
         :return: Claudeが生成したJSON応答（辞書形式）
         """
         try:
-            self._validate_image_file(image_path)
-            schema_description = self._generate_schema_description(output_schema)
-            system_message = f"応答は以下のJSON形式で生成してください: \n{schema_description}"
-            mime_type = self._get_mime_type(image_path)
-            base64_image = self._encode_image(image_path)
-
-            response = self.client.messages.create(
-                model=self.model,
-                system=system_message,
-                messages=[
-                    {
-                        "role": "user",
-                        "content": [
-                            {"type": "text", "text": message},
-                            {
-                                "type": "image",
-                                "source": {
-                                    "type": "base64",
-                                    "media_type": mime_type,
-                                    "data": base64_image
-                                }
-                            }
-                        ]
-                    }
-                ],
-                max_tokens=1000
-            )
+            response = self._send(
+                self.client.messages.create,
+                **self._request(message, image_path=image_path, output_schema=output_schema))
             json_response = self._parse_json_response(response.content[0].text)
             return self._convert_types(json_response, output_schema)
         except Exception as e:
             logging.error(f"画像を含むJSONメッセージの生成中にエラーが発生しました: {str(e)}")
             raise
 
-    def _validate_image_file(self, image_path: str):
-        """画像ファイルの妥当性を検証する"""
-        if not os.path.exists(image_path):
-            raise FileNotFoundError(f"画像ファイルが見つかりません: {image_path}")
-        if not os.access(image_path, os.R_OK):
-            raise PermissionError(f"画像ファイルを読み込む権限がありません: {image_path}")
-        if os.path.getsize(image_path) > self.max_image_size:
-            raise ValueError(f"画像ファイルが大きすぎます。{self.max_image_size/1024/1024}MB以下にしてください。")
+    async def generate_with_image_json_async(
+            self, message: str, image_path: ImageSource,
+            output_schema: Union[Dict[str, Union[str, Dict]], Type[BaseModel]]) -> Dict[str, Any]:
+        """
+        generate_with_image_jsonの非同期版
+        :param message: ユーザーからの入力メッセージ
+        :param image_path: 画像（ファイルのパス、バイト列、memoryview、PILの画像、またはImageInput）
+        :param output_schema: 期待される出力のスキーマ（キーと型の指定）
+        :return: Claudeが生成したJSON応答（辞書形式）
+        """
+        try:
+            response = await self._send_async(
+                self.async_client.messages.create,
+                **self._request(message, image_path=image_path, output_schema=output_schema))
+            json_response = self._parse_json_response(response.content[0].text)
+            return self._convert_types(json_response, output_schema)
+        except Exception as e:
+            logging.error(f"画像を含むJSONメッセージの生成中にエラーが発生しました: {str(e)}")
+            raise
+
+    def generate_with_images(self, message: str, images: LabeledImages) -> str:
+        """
+        ラベルを付けた複数の画像を含むメッセージに対してClaudeの応答を生成する
+        画像の数や大きさが1回のリクエストの上限を超える場合は、できるだけ少ない回数に分けて送信し、回答を1つにまとめる
+        :param message: ユーザーからの入力メッセージ
+        :param images: ラベルと画像の辞書、または画像か(ラベル, 画像)のリスト
+        :return: Claudeが生成した応答テキスト
+        """
+        return self._run_image_batches(message, images, self._generate_with_image_batch,
+                                       self.generate)
+
+    async def generate_with_images_async(self, message: str, images: LabeledImages) -> str:
+        """
+        generate_with_imagesの非同期版
+        :param message: ユーザーからの入力メッセージ
+        :param images: ラベルと画像の辞書、または画像か(ラベル, 画像)のリスト
+        :return: Claudeが生成した応答テキスト
+        """
+        return await self._run_image_batches_async(
+            message, images, self._generate_with_image_batch_async, self.generate_async)
 
-    def _get_mime_type(self, image_path: str) -> str:
-        """画像ファイルのMIMEタイプを取得する"""
-        mime_type = "image/jpeg" if image_path.lower().endswith(('.jpg', '.jpeg')
-                                                                ) else mimetypes.guess_type(image_path)[0]
-        return mime_type if mime_type else 'application/octet-stream'
+    def generate_with_images_json(
+            self, message: str, images: LabeledImages,
+            output_schema: Union[Dict[str, Union[str, Dict]], Type[BaseModel]]) -> Dict[str, Any]:
+        """
+        ラベルを付けた複数の画像を含むメッセージに対してClaudeのJSON応答を生成する
+        :param message: ユーザーからの入力メッセージ
+        :param images: ラベルと画像の辞書、または画像か(ラベル, 画像)のリスト
+        :param output_schema: 期待される出力のスキーマ（キーと型の指定）
+        :return: Claudeが生成したJSON応答（辞書形式）
+        """
+        return self._run_image_batches(
+            message, images,
+            lambda text, parts: self._generate_with_image_batch(text, parts, output_schema),
+            lambda prompt: self.generate_json(prompt, output_schema))
+
+    async def generate_with_images_json_async(
+            self, message: str, images: LabeledImages,
+            output_schema: Union[Dict[str, Union[str, Dict]], Type[BaseModel]]) -> Dict[str, Any]:
+        """
+        generate_with_images_jsonの非同期版
+        :param message: ユーザーからの入力メッセージ
+        :param images: ラベルと画像の辞書、または画像か(ラベル, 画像)のリスト
+        :param output_schema: 期待される出力のスキーマ（キーと型の指定）
+        :return: Claudeが生成したJSON応答（辞書形式）
+        """
+        return await self._run_image_batches_async(
+            message, images,
+            lambda text, parts: self._generate_with_image_batch_async(text, parts, output_schema),
+            lambda prompt: self.generate_json_async(prompt, output_schema))
+
+    def _generate_with_image_batch(
+            self, message: str, image_parts: List[Tuple[str, Dict[str, Any]]],
+            output_schema: Optional[Union[Dict[str, Union[str, Dict]], Type[BaseModel]]] = None
+    ) -> Any:
+        """複数の画像を含む1回のリクエストを送信し、応答テキスト（output_schemaを指定した場合はJSON）を返す"""
+        request = self._request(message, output_schema=output_schema, image_parts=image_parts)
+        response = self._send(self.client.messages.create, **request)
+        if output_schema is None:
+            return response.content[0].text
+        return self._convert_types(self._parse_json_response(response.content[0].text),
+                                   output_schema)
+
+    async def _generate_with_image_batch_async(
+            self, message: str, image_parts: List[Tuple[str, Dict[str, Any]]],
+            output_schema: Optional[Union[Dict[str, Union[str, Dict]], Type[BaseModel]]] = None
+    ) -> Any:
+        """_generate_with_image_batchの非同期版"""
+        request = self._request(message, output_schema=output_schema, image_parts=image_parts)
+        response = await self._send_async(self.async_client.messages.create, **request)
+        if output_schema is None:
+            return response.content[0].text
+        return self._convert_types(self._parse_json_response(response.content[0].text),
+                                   output_schema)
+
+    def _stream_events(self, message: str):
+        """ストリーミング応答のイベントをStreamDeltaとUsageに変換して返す"""
+        yield from self._stream(self.client.messages.create, self._message_events,
+                                **self._request(message), stream=True)
+
+    async def _stream_events_async(self, message: str):
+        """_stream_eventsの非同期版"""
+        async for event in self._stream_async(self.async_client.messages.create,
+                                              self._message_events_async,
+                                              **self._request(message), stream=True):
+            yield event
+
+    def _message_events(self, stream) -> Iterator[StreamEvent]:
+        """Messages APIのストリームをイベントに変換する"""
+        usage = Usage()
+        for event in stream:
+            yield from self._stream_event(event, usage)
+
+    async def _message_events_async(self, stream) -> AsyncIterator[StreamEvent]:
+        """_message_eventsの非同期版"""
+        usage = Usage()
+        async for event in stream:
+            for stream_event in self._stream_event(event, usage):
+                yield stream_event
+
+    @staticmethod
+    def _stream_event(event, usage: Usage) -> Iterator[StreamEvent]:
+        """
+        Messages APIのストリーミングイベントを変換する
+        入力トークン数はmessage_start、出力トークン数はmessage_deltaで通知される
+        """
+        if event.type == "message_start":
+            usage.prompt_tokens = event.message.usage.input_tokens
+        elif event.type == "content_block_delta" and event.delta.type == "text_delta":
+            yield StreamDelta(event.delta.text)
+        elif event.type == "message_delta":
+            usage.completion_tokens = event.usage.output_tokens
+            yield StreamDelta("", event.delta.stop_reason)
+            yield Usage(usage.prompt_tokens, usage.completion_tokens)
+
+    def _request(
+            self, message: str, image_path: Optional[ImageSource] = None,
+            output_schema: Optional[Union[Dict[str, Union[str, Dict]], Type[BaseModel]]] = None,
+            image_parts: Optional[List[Tuple[str, Dict[str, Any]]]] = None) -> Dict[str, Any]:
+        """
+        messages.createに渡す引数を作成する
+        :param message: ユーザーからの入力メッセージ
+        :param image_path: 画像（オプション）
+        :param output_schema: JSON応答のスキーマ（オプション）
+        :param image_parts: ラベルと画像のブロックのリスト（オプション。複数の画像を送信する場合）
+        :return: messages.createのキーワード引数
+        """
+        content: Union[str, list] = message
+        if image_path is not None:
+            content = [{"type": "text", "text": message}, self._image_part(image_path)]
+        elif image_parts is not None:
+            # 各画像の前にラベルを置き、メッセージは最後に置く
+            content = []
+            for label, block in image_parts:
+                content.append({"type": "text", "text": f"{label}:"})
+                content.append(block)
+            content.append({"type": "text", "text": message})
+
+        request = {
+            "model": self.model,
+            "messages": [{"role": "user", "content": content}],
+            "max_tokens": self.max_tokens
+        }
+        if output_schema is not None:
+            schema_description = self._generate_schema_description(output_schema)
+            request["system"] = f"応答は以下のJSON形式で生成してください: \n{schema_description}"
+        return request
+
+    def _image_part(self, image_path: ImageSource) -> Dict[str, Any]:
+        """画像を検証してbase64エンコードし、messages.createに渡す画像のブロックを作成する"""
+        image = ImageInput.of(image_path)
+        # 前処理する場合は、元の画像ではなく送信する画像の大きさを検証する
+        self._validate_image(image, check_size=self.image_policy is None)
+        mime_type, base64_image = self._cached_image(image, "base64",
+                                                     lambda: self._image_source(image))
+
+        logging.info(f"画像: {image.name}")
+        logging.info(f"MIMEタイプ: {mime_type}")
+        logging.info(f"ファイルサイズ: {image.size} bytes")
+
+        return {
+            "type": "image",
+            "source": {
+                "type": "base64",
+                "media_type": mime_type,
+                "data": base64_image
+            }
+        }
+
+    def _image_source(self, image: ImageInput) -> Tuple[str, str]:
+        """画像を（前処理の方針が設定されている場合は前処理してから）base64エンコードし、MIMEタイプとともに返す"""
+        processed = self._preprocess_image(image)
+        if processed is not None:
+            self._validate_image_size(processed.size)
+            return self._encode_image_payload(processed)
+        return self._encode_image(image)
+
+    @profiled("validate_image")
+    def _validate_image(self, image: ImageInput, check_size: bool = True):
+        """画像の妥当性を検証する"""
+        if image.is_file:
+            if not os.path.exists(image.path):
+                raise FileNotFoundError(f"画像ファイルが見つかりません: {image.path}")
+            if not os.access(image.path, os.R_OK):
+                raise PermissionError(f"画像ファイルを読み込む権限がありません: {image.path}")
+        if check_size:
+            self._validate_image_size(image.size)
+
+    def _validate_image_size(self, size: int):
+        """送信する画像の大きさがmax_image_size以下であることを検証する"""
+        if size > self.max_image_size:
+            raise ValueError(f"画像ファイルが大きすぎます。{self.max_image_size/1024/1024}MB以下にしてください。")
 
-    def _encode_image(self, image_path: str) -> str:
-        """画像ファイルをbase64エンコードする"""
-        with open(image_path, "rb") as image_file:
-            return base64.b64encode(image_file.read()).decode()
+    @profiled("encode_image")
+    def _encode_image(self, image: ImageInput) -> Tuple[str, str]:
+        """画像をbase64エンコードし、MIMEタイプとともに返す"""
+        return self._encode_image_payload(image)
@@ -1,13 +1,29 @@
 import google.generativeai as genai
-from typing import Dict, Any, Union, Type
+from typing import Dict, Any, Union, Type, Iterator, AsyncIterator, List, Optional, Tuple
 from PIL import Image
+import io
 import json
 from .base import AIModelBase
+from ..cache import payload_size
+from ..images import ImageInput, ImageSource, LabeledImages
+from ..profiling import profiled
+from ..streaming import TextStream, AsyncTextStream, StreamEvent, text_or_none
+from ..types import StreamDelta, Usage
 from ..utils.api_key_manager import APIKeyManager
+from ..utils import client_registry
 from pydantic import BaseModel
 
 
+# Geminiがバイト列のまま受け付ける画像のMIMEタイプ
+GEMINI_MIME_TYPES = ("image/png", "image/jpeg", "image/webp", "image/heic", "image/heif")
+
+
 class Gemini(AIModelBase):
+    provider = "gemini"
+    # 1回のリクエストに含められる画像の数と、画像をインラインで送信するリクエストの最大サイズ
+    max_images_per_request = 3600
+    max_request_bytes = 20 * 1024 * 1024
+
     def __init__(self, api_key_manager: APIKeyManager, model: str = 'gemini-1.5-pro'):
         """
         Geminiモデルの初期化
@@ -18,11 +34,26 @@ class Gemini(AIModelBase):
         api_key = self.api_key_manager.get_api_key("gemini")
         if not api_key:
             raise ValueError("Gemini APIキーが設定されていません。")
-        # Google Generative AI APIの設定
-        genai.configure(api_key=api_key)
+        self._api_key = api_key
+        # Google Generative AI APIの設定（APIキーが変わった場合のみ再設定し、接続を再利用する）
+        client_registry.configure_gemini(api_key)
         # Generative AIモデルのインスタンスを作成
         self.model = genai.GenerativeModel(model)
 
+    def _extract_usage(self, response) -> Optional[Usage]:
+        usage_metadata = getattr(response, "usage_metadata", None)
+        return Usage.from_counts(getattr(usage_metadata, "prompt_token_count", None),
+                                 getattr(usage_metadata, "candidates_token_count", None))
+
+    def _response_info(self, response) -> Dict[str, Optional[str]]:
+        # Geminiの応答にはモデルIDとリクエストIDが含まれない
+        candidates = getattr(response, "candidates", None)
+        finish_reason = getattr(candidates[0], "finish_reason", None) if candidates else None
+        return {"finish_reason": text_or_none(getattr(finish_reason, "name", None))}
+
+    def _timeout_kwargs(self, timeout: float) -> Dict[str, Any]:
+        return {"request_options": {"timeout": timeout}}
+
     def get_model(self) -> str:
         """
         self.modelの値を返す
@@ -37,24 +68,60 @@ class Gemini(AIModelBase):
         :return: Geminiが生成した応答テキスト
         """
         # Gemini APIを使用してコンテンツを生成
-        response = self.model.generate_content(message)
+        response = self._send(self.model.generate_content, message)
         # 生成された応答テキストを返す
         return response.text
 
-    def generate_with_image(self, message: str, image_path: str) -> str:
+    async def generate_async(self, message: str) -> str:
+        """
+        generateの非同期版
+        :param message: ユーザーからの入力メッセージ
+        :return: Geminiが生成した応答テキスト
+        """
+        response = await self._send_async(self.model.generate_content_async, message)
+        return response.text
+
+    def generate_text_stream(self, message: str) -> TextStream:
+        """
+        指定されたメッセージに対するGeminiの応答をストリーミングで生成する
+        :param message: ユーザーからの入力メッセージ
+        :return: StreamDeltaを返すTextStream（終了後にusageを参照可能）
+        """
+        return TextStream(self._stream_events(message))
+
+    def generate_text_stream_async(self, message: str) -> AsyncTextStream:
+        """
+        generate_text_streamの非同期版
+        :param message: ユーザーからの入力メッセージ
+        :return: StreamDeltaを返すAsyncTextStream（終了後にusageを参照可能）
+        """
+        return AsyncTextStream(self._stream_events_async(message))
+
+    def generate_with_image(self, message: str, image_path: ImageSource) -> str:
         """
         指定されたメッセージと画像に対してGeminiの応答を生成する
         :param message: ユーザーからの入力メッセージ
-        :param image_path: 入力画像のファイルパス
+        :param image_path: 画像（ファイルのパス、バイト列、memoryview、PILの画像、またはImageInput）
         :return: Geminiが生成した応答テキスト
         """
         # 画像ファイルを開く
-        image = Image.open(image_path)
+        image = self._load_image(image_path)
         # メッセージと画像を使用してコンテンツを生成
-        response = self.model.generate_content([message, image])
+        response = self._send(self.model.generate_content, [message, image])
         # 生成された応答テキストを返す
         return response.text
 
+    async def generate_with_image_async(self, message: str, image_path: ImageSource) -> str:
+        """
+        generate_with_imageの非同期版
+        :param message: ユーザーからの入力メッセージ
+        :param image_path: 画像（ファイルのパス、バイト列、memoryview、PILの画像、またはImageInput）
+        :return: Geminiが生成した応答テキスト
+        """
+        image = self._load_image(image_path)
+        response = await self._send_async(self.model.generate_content_async, [message, image])
+        return response.text
+
     def generate_json(self, message: str, output_schema: Union[Dict[str, Union[str, Dict]], Type[BaseModel]]) -> Dict[str, Any]:
         """
         指定されたメッセージに対してGeminiのJSON応答を生成する
@@ -62,34 +129,236 @@ class Gemini(AIModelBase):
         :param output_schema: 期待される出力のスキーマ（キーと型の指定）
         :return: Geminiが生成したJSON応答（辞書形式）
         """
-        # スキーマの説明を生成
-        schema_description = self._generate_schema_description(output_schema)
-        # プロンプトを作成
-        prompt = f"応答は以下のJSON形式で生成してください。```json```をつける必要はありません。: \n{schema_description}\n\n{message}"
-
         # Gemini APIを使用してコンテンツを生成
-        response = self.model.generate_content(prompt)
+        prompt = self._json_prompt(message, output_schema)
+        response = self._send(self.model.generate_content, prompt)
         # 生成されたJSON応答をパースして返す
         json_response = self._parse_json_response(response.text)
         return self._convert_types(json_response, output_schema)
 
-    def generate_with_image_json(self, message: str, image_path: str, output_schema: Union[Dict[str, Union[str, Dict]], Type[BaseModel]]) -> Dict[str, Any]:
+    async def generate_json_async(
+            self, message: str,
+            output_schema: Union[Dict[str, Union[str, Dict]], Type[BaseModel]]) -> Dict[str, Any]:
+        """
+        generate_jsonの非同期版
+        :param message: ユーザーからの入力メッセージ
+        :param output_schema: 期待される出力のスキーマ（キーと型の指定）
+        :return: Geminiが生成したJSON応答（辞書形式）
+        """
+        prompt = self._json_prompt(message, output_schema)
+        response = await self._send_async(self.model.generate_content_async, prompt)
+        json_response = self._parse_json_response(response.text)
+        return self._convert_types(json_response, output_schema)
+
+    def generate_with_image_json(
+            self, message: str, image_path: ImageSource,
+            output_schema: Union[Dict[str, Union[str, Dict]], Type[BaseModel]]) -> Dict[str, Any]:
         """
         画像を含むメッセージに対してGeminiのJSON応答を生成する
         :param message: ユーザーからの入力メッセージ
-        :param image_path: 画像ファイルのパス
+        :param image_path: 画像（ファイルのパス、バイト列、memoryview、PILの画像、またはImageInput）
         :param output_schema: 期待される出力のスキーマ（キーと型の指定）
         :return: Geminiが生成したJSON応答（辞書形式）
         """
         # 画像ファイルを開く
-        image = Image.open(image_path)
-        # スキーマの説明を生成
-        schema_description = self._generate_schema_description(output_schema)
-        # プロンプトを作成
-        prompt = f"応答は以下のJSON形式で生成してください。JSONのみを出力し、バッククォートや説明テキストは含めないでください: \n<JSONSchema>{schema_description}</JSONSchema>\n\n{message}"
-
+        image = self._load_image(image_path)
         # メッセージと画像を使用してコンテンツを生成
-        response = self.model.generate_content([prompt, image])
+        prompt = self._image_json_prompt(message, output_schema)
+        response = self._send(self.model.generate_content, [prompt, image])
         # 生成されたJSON応答をパースして返す
         json_response = self._parse_json_response(response.text)
         return self._convert_types(json_response, output_schema)
+
+    async def generate_with_image_json_async(
+            self, message: str, image_path: ImageSource,
+            output_schema: Union[Dict[str, Union[str, Dict]], Type[BaseModel]]) -> Dict[str, Any]:
+        """
+        generate_with_image_jsonの非同期版
+        :param message: ユーザーからの入力メッセージ
+        :param image_path: 画像（ファイルのパス、バイト列、memoryview、PILの画像、またはImageInput）
+        :param output_schema: 期待される出力のスキーマ（キーと型の指定）
+        :return: Geminiが生成したJSON応答（辞書形式）
+        """
+        image = self._load_image(image_path)
+        prompt = self._image_json_prompt(message, output_schema)
+        response = await self._send_async(self.model.generate_content_async, [prompt, image])
+        json_response = self._parse_json_response(response.text)
+        return self._convert_types(json_response, output_schema)
+
+    def generate_with_images(self, message: str, images: LabeledImages) -> str:
+        """
+        ラベルを付けた複数の画像を含むメッセージに対してGeminiの応答を生成する
+        画像の数や大きさが1回のリクエストの上限を超える場合は、できるだけ少ない回数に分けて送信し、回答を1つにまとめる
+        :param message: ユーザーからの入力メッセージ
+        :param images: ラベルと画像の辞書、または画像か(ラベル, 画像)のリスト
+        :return: Geminiが生成した応答テキスト
+        """
+        return self._run_image_batches(message, images, self._generate_with_image_batch,
+                                       self.generate)
+
+    async def generate_with_images_async(self, message: str, images: LabeledImages) -> str:
+        """
+        generate_with_imagesの非同期版
+        :param message: ユーザーからの入力メッセージ
+        :param images: ラベルと画像の辞書、または画像か(ラベル, 画像)のリスト
+        :return: Geminiが生成した応答テキスト
+        """
+        return await self._run_image_batches_async(
+            message, images, self._generate_with_image_batch_async, self.generate_async)
+
+    def generate_with_images_json(
+            self, message: str, images: LabeledImages,
+            output_schema: Union[Dict[str, Union[str, Dict]], Type[BaseModel]]) -> Dict[str, Any]:
+        """
+        ラベルを付けた複数の画像を含むメッセージに対してGeminiのJSON応答を生成する
+        :param message: ユーザーからの入力メッセージ
+        :param images: ラベルと画像の辞書、または画像か(ラベル, 画像)のリスト
+        :param output_schema: 期待される出力のスキーマ（キーと型の指定）
+        :return: Geminiが生成したJSON応答（辞書形式）
+        """
+        return self._run_image_batches(
+            message, images,
+            lambda text, parts: self._generate_with_image_batch(text, parts, output_schema),
+            lambda prompt: self.generate_json(prompt, output_schema))
+
+    async def generate_with_images_json_async(
+            self, message: str, images: LabeledImages,
+            output_schema: Union[Dict[str, Union[str, Dict]], Type[BaseModel]]) -> Dict[str, Any]:
+        """
+        generate_with_images_jsonの非同期版
+        :param message: ユーザーからの入力メッセージ
+        :param images: ラベルと画像の辞書、または画像か(ラベル, 画像)のリスト
+        :param output_schema: 期待される出力のスキーマ（キーと型の指定）
+        :return: Geminiが生成したJSON応答（辞書形式）
+        """
+        return await self._run_image_batches_async(
+            message, images,
+            lambda text, parts: self._generate_with_image_batch_async(text, parts, output_schema),
+            lambda prompt: self.generate_json_async(prompt, output_schema))
+
+    def _generate_with_image_batch(
+            self, message: str, image_parts: List[Tuple[str, Any]],
+            output_schema: Optional[Union[Dict[str, Union[str, Dict]], Type[BaseModel]]] = None
+    ) -> Any:
+        """複数の画像を含む1回のリクエストを送信し、応答テキスト（output_schemaを指定した場合はJSON）を返す"""
+        if output_schema is not None:
+            message = self._image_json_prompt(message, output_schema)
+        contents = self._images_contents(message, image_parts)
+        response = self._send(self.model.generate_content, contents)
+        if output_schema is None:
+            return response.text
+        return self._convert_types(self._parse_json_response(response.text), output_schema)
+
+    async def _generate_with_image_batch_async(
+            self, message: str, image_parts: List[Tuple[str, Any]],
+            output_schema: Optional[Union[Dict[str, Union[str, Dict]], Type[BaseModel]]] = None
+    ) -> Any:
+        """_generate_with_image_batchの非同期版"""
+        if output_schema is not None:
+            message = self._image_json_prompt(message, output_schema)
+        contents = self._images_contents(message, image_parts)
+        response = await self._send_async(self.model.generate_content_async, contents)
+        if output_schema is None:
+            return response.text
+        return self._convert_types(self._parse_json_response(response.text), output_schema)
+
+    def _stream_events(self, message: str):
+        """ストリーミング応答のチャンクをStreamDeltaとUsageに変換して返す"""
+        yield from self._stream(self.model.generate_content, self._response_events, message,
+                                stream=True)
+
+    async def _stream_events_async(self, message: str):
+        """_stream_eventsの非同期版"""
+        async for event in self._stream_async(self.model.generate_content_async,
+                                              self._response_events_async, message, stream=True):
+            yield event
+
+    def _response_events(self, response) -> Iterator[StreamEvent]:
+        """generate_content(stream=True)の応答をイベントに変換する"""
+        for chunk in response:
+            yield from self._chunk_events(chunk)
+
+    async def _response_events_async(self, response) -> AsyncIterator[StreamEvent]:
+        """_response_eventsの非同期版"""
+        async for chunk in response:
+            for event in self._chunk_events(chunk):
+                yield event
+
+    @staticmethod
+    def _chunk_events(chunk) -> Iterator[StreamEvent]:
+        """
+        generate_contentのストリーミングチャンクを変換する
+        usage_metadataは各チャンクに累積値で含まれる
+        """
+        try:
+            text = chunk.text
+        except ValueError:
+            # テキストを含まないチャンク（終了通知など）
+            text = ""
+        finish_reason = None
+        if chunk.candidates and chunk.candidates[0].finish_reason:
+            finish_reason = chunk.candidates[0].finish_reason.name
+        if text or finish_reason:
+            yield StreamDelta(text, finish_reason)
+        usage_metadata = chunk.usage_metadata
+        if usage_metadata and usage_metadata.total_token_count:
+            yield Usage(usage_metadata.prompt_token_count, usage_metadata.candidates_token_count)
+
+    @profiled("load_image")
+    def _load_image(self, image_path: ImageSource) -> Union["Image.Image", Dict[str, Any]]:
+        """
+        画像をGeminiに送信するパートに変換する
+        対応する形式の画像は、PILで展開せずにバイト列とMIMEタイプを持つ辞書として送信する
+        """
+        image = ImageInput.of(image_path)
+        if self.image_cache is not None:
+            return self._cached_image(image, "part", lambda: self._open_image(image))
+        return self._open_image(image)
+
+    def _image_part(self, image: ImageInput) -> Union["Image.Image", Dict[str, Any]]:
+        return self._load_image(image)
+
+    def _image_part_bytes(self, part: Union["Image.Image", Dict[str, Any]]) -> int:
+        # バイト列はbase64エンコードして送信される。PILの画像はSDKが変換するため、展開したピクセルのサイズで見積もる
+        if isinstance(part, dict):
+            return (len(part["data"]) + 2) // 3 * 4 + len(part["mime_type"])
+        return payload_size(part)
+
+    def _images_contents(self, message: str, image_parts: List[Tuple[str, Any]]) -> List[Any]:
+        """各画像の前にラベルを置き、最後にメッセージを置いたgenerate_contentの入力を作成する"""
+        contents: List[Any] = []
+        for label, part in image_parts:
+            contents.extend([f"{label}:", part])
+        contents.append(message)
+        return contents
+
+    def _open_image(self, image: ImageInput) -> Union["Image.Image", Dict[str, Any]]:
+        """_load_imageの実装"""
+        processed = self._preprocess_image(image)
+        if processed is not None:
+            return {"mime_type": processed.mime_type, "data": processed.read()}
+        if image.image is not None:
+            # PILの画像はSDKが変換する
+            return image.image
+        data = image.read()
+        if image.mime_type in GEMINI_MIME_TYPES:
+            return {"mime_type": image.mime_type, "data": data}
+        # Geminiが対応していない形式（GIF、BMPなど）はPILで開き、SDKに変換させる
+        opened = Image.open(io.BytesIO(data))
+        opened.load()
+        return opened
+
+    def _json_prompt(self, message: str,
+                     output_schema: Union[Dict[str, Union[str, Dict]], Type[BaseModel]]) -> str:
+        """JSON応答を要求するプロンプトを作成する"""
+        schema_description = self._generate_schema_description(output_schema)
+        return f"応答は以下のJSON形式で生成してください。```json```をつける必要はありません。: \n{schema_description}\n\n{message}"
+
+    def _image_json_prompt(
+            self, message: str,
+            output_schema: Union[Dict[str, Union[str, Dict]], Type[BaseModel]]) -> str:
+        """画像付きでJSON応答を要求するプロンプトを作成する"""
+        schema_description = self._generate_schema_description(output_schema)
+        return (f"応答は以下のJSON形式で生成してください。"
+                f"JSONのみを出力し、バッククォートや説明テキストは含めないでください: \n"
+                f"<JSONSchema>{schema_description}</JSONSchema>\n\n{message}")
@@ -1,11 +1,18 @@
-from openai import OpenAI
-from typing import Dict, Any, Union, Type
+from typing import Dict, Any, Union, Type, Optional
 from pydantic import BaseModel
 from .base import AIModelBase
+from ..images import ImageSource
+from ..streaming import (TextStream, AsyncTextStream, openai_stream_events,
+                         openai_stream_events_async, openai_response_usage, openai_response_info)
+from ..types import Usage
 from ..utils.api_key_manager import APIKeyManager
+from ..utils import client_registry
 
 
 class Perplexity(AIModelBase):
+    provider = "perplexity"
+    base_url = "https://api.perplexity.ai"
+
     def __init__(self, api_key_manager: APIKeyManager, model: str = "llama-3.1-sonar-large-128k-online"):
         """
         Perplexityモデルの初期化
@@ -13,10 +20,22 @@ class Perplexity(AIModelBase):
         :param model: 使用するモデルの名前（デフォルトは"llama-3.1-sonar-large-128k-online"）
         """
         self.api_key_manager = api_key_manager
-        self.client = OpenAI(api_key=self.api_key_manager.get_api_key("perplexity"),
-                             base_url="https://api.perplexity.ai")
+        api_key = self.api_key_manager.get_api_key("perplexity")
+        self._api_key = api_key
+        # ChatGPTと同じOpenAI SDKを使用するため、HTTP接続プールを共有する
+        self._base_url = client_registry.get_base_url("perplexity", self.base_url)
+        self.client = client_registry.get_openai_client(api_key, self._base_url)
         self.model = model
 
+    def _extract_usage(self, response) -> Optional[Usage]:
+        return openai_response_usage(response)
+
+    def _response_info(self, response) -> Dict[str, Optional[str]]:
+        return openai_response_info(response)
+
+    def _get_async_client(self):
+        return client_registry.get_async_openai_client(self._api_key, self._base_url)
+
     def get_model(self) -> str:
         """
         self.modelの値を返す
@@ -30,16 +49,49 @@ class Perplexity(AIModelBase):
         :param message: ユーザーからの入力メッセージ
         :return: Perplexityが生成した応答テキスト
         """
-        response = self.client.chat.completions.create(
+        response = self._send(
+            self.client.chat.completions.create,
+            model=self.model,
+            messages=[{"role": "user", "content": message}]
+        )
+        return response.choices[0].message.content
+
+    async def generate_async(self, message: str) -> str:
+        """
+        generateの非同期版
+        :param message: ユーザーからの入力メッセージ
+        :return: Perplexityが生成した応答テキスト
+        """
+        response = await self._send_async(
+            self.async_client.chat.completions.create,
             model=self.model,
             messages=[{"role": "user", "content": message}]
         )
         return response.choices[0].message.content
 
-    def generate_with_image(self, image_path: str, prompt: str) -> str:
+    def generate_text_stream(self, message: str) -> TextStream:
+        """
+        指定されたメッセージに対するPerplexityの応答をストリーミングで生成する
+        :param message: ユーザーからの入力メッセージ
+        :return: StreamDeltaを返すTextStream（終了後にusageを参照可能）
+        """
+        return TextStream(self._stream_events(message))
+
+    def generate_text_stream_async(self, message: str) -> AsyncTextStream:
+        """
+        generate_text_streamの非同期版
+        :param message: ユーザーからの入力メッセージ
+        :return: StreamDeltaを返すAsyncTextStream（終了後にusageを参照可能）
+        """
+        return AsyncTextStream(self._stream_events_async(message))
+
+    def generate_with_image(self, message: str, image_path: ImageSource) -> str:
         # Perplexityは現在画像入力をサポートしていないため、エラーを返す
         raise NotImplementedError("Perplexity does not support image input.")
 
+    async def generate_with_image_async(self, message: str, image_path: ImageSource) -> str:
+        raise NotImplementedError("Perplexity does not support image input.")
+
     def generate_json(self, message: str, output_schema: Union[Dict[str, Union[str, Dict]], Type[BaseModel]]) -> Dict[str, Any]:
         """
         指定されたメッセージに対してPerplexityのJSON応答を生成する
@@ -47,18 +99,61 @@ class Perplexity(AIModelBase):
         :param output_schema: 期待される出力のスキーマ（キーと型の指定）
         :return: Perplexityが生成したJSON応答（辞書形式）
         """
-        schema_description = self._generate_schema_description(output_schema)
-        system_message = f"応答は以下のJSON形式で生成してください: \n{schema_description}"
+        request = self._json_request(message, output_schema)
+        response = self._send(self.client.chat.completions.create, **request)
 
-        response = self.client.chat.completions.create(
-            model=self.model,
-            messages=[
-                {"role": "system", "content": system_message},
-                {"role": "user", "content": message}
-            ],
-            response_format={"type": "json_object"}
-        )
+        json_response = self._parse_json_response(
+            response.choices[0].message.content)
+        return self._convert_types(json_response, output_schema)
+
+    async def generate_json_async(
+            self, message: str,
+            output_schema: Union[Dict[str, Union[str, Dict]], Type[BaseModel]]) -> Dict[str, Any]:
+        """
+        generate_jsonの非同期版
+        :param message: ユーザーからの入力メッセージ
+        :param output_schema: 期待される出力のスキーマ（キーと型の指定）
+        :return: Perplexityが生成したJSON応答（辞書形式）
+        """
+        request = self._json_request(message, output_schema)
+        response = await self._send_async(self.async_client.chat.completions.create, **request)
 
         json_response = self._parse_json_response(
             response.choices[0].message.content)
         return self._convert_types(json_response, output_schema)
+
+    def _stream_events(self, message: str):
+        """ストリーミング応答のチャンクをStreamDeltaとUsageに変換して返す"""
+        # Perplexityは各チャンクに累積のusageを含めて返す
+        yield from self._stream(self.client.chat.completions.create, openai_stream_events,
+                                **self._stream_request(message))
+
+    async def _stream_events_async(self, message: str):
+        """_stream_eventsの非同期版"""
+        request = self._stream_request(message)
+        async for event in self._stream_async(self.async_client.chat.completions.create,
+                                              openai_stream_events_async, **request):
+            yield event
+
+    def _stream_request(self, message: str) -> Dict[str, Any]:
+        """ストリーミング応答を要求するchat.completions.createの引数を作成する"""
+        return {
+            "model": self.model,
+            "messages": [{"role": "user", "content": message}],
+            "stream": True
+        }
+
+    def _json_request(
+            self, message: str,
+            output_schema: Union[Dict[str, Union[str, Dict]], Type[BaseModel]]) -> Dict[str, Any]:
+        """JSON形式の応答を要求するchat.completions.createの引数を作成する"""
+        schema_description = self._generate_schema_description(output_schema)
+        system_message = f"応答は以下のJSON形式で生成してください: \n{schema_description}"
+        return {
+            "model": self.model,
+            "messages": [
+                {"role": "system", "content": system_message},
+                {"role": "user", "content": message}
+            ],
+            "response_format": {"type": "json_object"}
+        }
@@ -0,0 +1,139 @@
+import contextlib
+import contextvars
+import functools
+import logging
+import time
+from dataclasses import dataclass, replace
+from typing import Any, Callable, ContextManager, Optional, Tuple
+
+# 登録されたフック（読み取りをロックなしで行うため、変更時はタプルを置き換える）
+_hooks: Tuple["ProfilingHook", ...] = ()
+# 実行中のステージ名（再帰的に呼び出されるメソッドで、同じステージを重複して通知しないために使用する）
+_current_stage = contextvars.ContextVar("mosaicai_stage", default=None)
+_NULL_STAGE = contextlib.nullcontext()
+
+
+@dataclass(frozen=True)
+class StageEvent:
+    """
+    生成処理の1つのステージの開始または終了を表すイベントです。
+    開始と終了はそれぞれ別の変更できないイベントとして通知されるため、
+    フックはイベントを保持しても構いません。
+
+    :param stage: ステージ名（validate_image、encode_image、load_image、schema、request、
+                  parse_json、convert_types）
+    :param model: モデル名
+    :param method: 呼び出し中のMosaicAIのメソッド名（MosaicAIを経由しない場合は"unknown"）
+    :param start: ステージの開始時刻（time.perf_counterの値）
+    :param duration: ステージの所要時間（秒）。開始イベントではNone
+    :param error: ステージで発生した例外（終了イベントのみ）
+    """
+    stage: str
+    model: str
+    method: str
+    start: float = 0.0
+    duration: Optional[float] = None
+    error: Optional[BaseException] = None
+
+
+class ProfilingHook:
+    """
+    ステージの開始と終了の通知を受け取るフックの基底クラスです。必要なメソッドだけをオーバーライドしてください。
+
+    フックは生成処理を実行しているスレッド（またはイベントループ）で同期的に呼び出されるため、短時間で処理を終えてください。
+    フックで発生した例外は記録され、生成処理には影響しません。
+    """
+
+    def on_stage_start(self, event: StageEvent):
+        """ステージの開始時に呼び出されます。"""
+
+    def on_stage_end(self, event: StageEvent):
+        """ステージの終了時に呼び出されます。event.durationに所要時間が格納されています。"""
+
+
+def add_hook(hook: ProfilingHook):
+    """
+    フックを登録します。登録したフックはプロセス内のすべての生成処理に適用されます。
+
+    :param hook: 登録するフック
+    """
+    global _hooks
+    _hooks = _hooks + (hook,)
+
+
+def remove_hook(hook: ProfilingHook):
+    """
+    登録したフックを削除します。
+
+    :param hook: 削除するフック
+    """
+    global _hooks
+    _hooks = tuple(registered for registered in _hooks if registered is not hook)
+
+
+def clear_hooks():
+    """すべてのフックを削除します。"""
+    global _hooks
+    _hooks = ()
+
+
+def _notify(name: str, event: StageEvent):
+    for hook in _hooks:
+        try:
+            getattr(hook, name)(event)
+        except Exception as e:
+            logging.warning(f"プロファイリングのフックでエラーが発生しました: {e}")
+
+
+class _Stage:
+    """ステージの開始と終了をフックに通知するコンテキストマネージャー"""
+    __slots__ = ("event", "token")
+
+    def __init__(self, event: StageEvent):
+        self.event = event
+        self.token = None
+
+    def __enter__(self) -> StageEvent:
+        self.token = _current_stage.set(self.event.stage)
+        self.event = replace(self.event, start=time.perf_counter())
+        _notify("on_stage_start", self.event)
+        return self.event
+
+    def __exit__(self, exc_type, exc, tb):
+        end = replace(self.event, duration=time.perf_counter() - self.event.start, error=exc)
+        _current_stage.reset(self.token)
+        _notify("on_stage_end", end)
+        return False
+
+
+def stage(name: str, model: str, method: str) -> ContextManager:
+    """
+    ステージを計測するコンテキストマネージャーを返します。フックが登録されていない場合は何もしません。
+
+    :param name: ステージ名
+    :param model: モデル名
+    :param method: メソッド名
+    :return: コンテキストマネージャー
+    """
+    if not _hooks or _current_stage.get() == name:
+        return _NULL_STAGE
+    return _Stage(StageEvent(name, model, method))
+
+
+def profiled(name: str) -> Callable[[Callable[..., Any]], Callable[..., Any]]:
+    """
+    モデルクラスのメソッドをステージとして計測するデコレーターです。
+    ラベルはメソッドの所有者の_metric_labels()から取得します。同じステージの中での再帰呼び出しは通知しません。
+
+    :param name: ステージ名
+    :return: デコレーター
+    """
+    def decorator(func: Callable[..., Any]) -> Callable[..., Any]:
+        @functools.wraps(func)
+        def wrapper(self, *args, **kwargs):
+            if not _hooks or _current_stage.get() == name:
+                return func(self, *args, **kwargs)
+            with _Stage(StageEvent(name, **self._metric_labels())):
+                return func(self, *args, **kwargs)
+        return wrapper
+    return decorator
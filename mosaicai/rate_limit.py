@@ -0,0 +1,245 @@
+import asyncio
+import hashlib
+import threading
+import time
+from typing import Any, Dict, Optional, Tuple
+from .types import Usage
+
+# 画像1枚あたりの見積もりトークン数
+IMAGE_TOKEN_ESTIMATE = 1000
+# 1トークンあたりのおおよその文字数
+CHARS_PER_TOKEN = 4
+
+
+class TokenBucket:
+    """
+    スレッドセーフなトークンバケットです。
+
+    reserveは残量が足りない場合でも即座に予約し、残量を負にして待ち時間を返します。
+    これにより、待機中のリクエストは予約した順に実行されます。
+    """
+
+    def __init__(self, capacity: float, refill_per_second: float):
+        """
+        :param capacity: バケットの容量
+        :param refill_per_second: 1秒あたりの補充量
+        """
+        self.capacity = capacity
+        self.refill_per_second = refill_per_second
+        self._tokens = capacity
+        self._updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float):
+        elapsed = now - self._updated_at
+        self._tokens = min(self.capacity, self._tokens + elapsed * self.refill_per_second)
+        self._updated_at = now
+
+    def reserve(self, amount: float) -> float:
+        """
+        指定量を予約し、使用可能になるまでの待ち時間（秒）を返します。
+
+        :param amount: 予約する量
+        :return: 待ち時間（秒）
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            self._tokens -= amount
+            if self._tokens >= 0:
+                return 0.0
+            return -self._tokens / self.refill_per_second
+
+    def adjust(self, amount: float):
+        """
+        残量を調整します。見積もりと実際の使用量の差を反映するために使用します。
+
+        :param amount: 加算する量（負の値で減算）
+        """
+        with self._lock:
+            self._refill(time.monotonic())
+            self._tokens = min(self.capacity, self._tokens + amount)
+
+    @property
+    def available(self) -> float:
+        """現在の残量を返します。"""
+        with self._lock:
+            self._refill(time.monotonic())
+            return self._tokens
+
+
+class RateLimitReservation:
+    """
+    RateLimiterで予約した1リクエスト分の枠です。
+    応答を受け取った後にsettleを呼び出すと、見積もりトークン数と実際の使用量の差が反映されます。
+    """
+
+    def __init__(self, limiter: "RateLimiter", estimated_tokens: int):
+        self.limiter = limiter
+        self.estimated_tokens = estimated_tokens
+        self._settled = False
+
+    def settle(self, usage: Optional[Usage]):
+        """
+        実際の使用量でトークンの予約を確定します。usageがNoneの場合は見積もりのまま確定します。
+
+        :param usage: 実際のトークン使用量
+        """
+        if self._settled:
+            return
+        self._settled = True
+        if usage is not None and self.limiter.tokens is not None:
+            self.limiter.tokens.adjust(self.estimated_tokens - usage.total_tokens)
+
+    def cancel(self):
+        """
+        リクエストが失敗した場合に、予約したトークンを返却します。
+        リクエスト数の予約は返却しません。
+        """
+        self.settle(Usage())
+
+
+class RateLimiter:
+    """
+    1分あたりのリクエスト数（RPM）とトークン数（TPM）を制限するレートリミッターです。
+    スレッドとasyncioの両方から安全に使用できます。
+    """
+
+    def __init__(self, rpm: Optional[int] = None, tpm: Optional[int] = None):
+        """
+        :param rpm: 1分あたりのリクエスト数の上限（Noneの場合は制限なし）
+        :param tpm: 1分あたりのトークン数の上限（Noneの場合は制限なし）
+        """
+        self.rpm = rpm
+        self.tpm = tpm
+        self.requests = TokenBucket(rpm, rpm / 60) if rpm else None
+        self.tokens = TokenBucket(tpm, tpm / 60) if tpm else None
+
+    def _reserve(self, estimated_tokens: int) -> Tuple[RateLimitReservation, float]:
+        wait = 0.0
+        if self.requests is not None:
+            wait = max(wait, self.requests.reserve(1))
+        if self.tokens is not None:
+            wait = max(wait, self.tokens.reserve(estimated_tokens))
+        return RateLimitReservation(self, estimated_tokens), wait
+
+    def acquire(self, estimated_tokens: int = 0) -> RateLimitReservation:
+        """
+        リクエストの枠を予約し、使用可能になるまで待機します。
+
+        :param estimated_tokens: リクエストの見積もりトークン数
+        :return: 予約した枠
+        """
+        reservation, wait = self._reserve(estimated_tokens)
+        if wait > 0:
+            time.sleep(wait)
+        return reservation
+
+    async def acquire_async(self, estimated_tokens: int = 0) -> RateLimitReservation:
+        """
+        acquireの非同期版です。イベントループをブロックせずに待機します。
+
+        :param estimated_tokens: リクエストの見積もりトークン数
+        :return: 予約した枠
+        """
+        reservation, wait = self._reserve(estimated_tokens)
+        if wait > 0:
+            await asyncio.sleep(wait)
+        return reservation
+
+
+_lock = threading.Lock()
+_configs: Dict[Tuple[str, Optional[str]], Tuple[Optional[int], Optional[int]]] = {}
+_limiters: Dict[Tuple[str, Optional[str]], RateLimiter] = {}
+
+
+def _key_id(api_key: Optional[str]) -> Optional[str]:
+    if api_key is None:
+        return None
+    return hashlib.sha256(api_key.encode()).hexdigest()
+
+
+def configure_rate_limit(provider: str, rpm: Optional[int] = None, tpm: Optional[int] = None,
+                         api_key: Optional[str] = None):
+    """
+    プロバイダーのレート制限を設定します。設定はプロセス内のすべてのMosaicAIインスタンスで共有されます。
+
+    api_keyを省略した場合は、そのプロバイダーのすべてのAPIキーに適用されます（制限はAPIキーごとに計算されます）。
+    rpmとtpmの両方にNoneを指定すると、設定を解除します。
+
+    :param provider: プロバイダー名（"openai"、"claude"、"gemini"、"perplexity"）
+    :param rpm: 1分あたりのリクエスト数の上限
+    :param tpm: 1分あたりのトークン数の上限
+    :param api_key: 特定のAPIキーにのみ適用する場合のAPIキー
+    """
+    key = (provider, _key_id(api_key))
+    with _lock:
+        if rpm is None and tpm is None:
+            _configs.pop(key, None)
+        else:
+            _configs[key] = (rpm, tpm)
+        # 設定が変わったプロバイダーのリミッターは作り直す
+        for limiter_key in [k for k in _limiters if k[0] == provider]:
+            del _limiters[limiter_key]
+
+
+def clear_rate_limits():
+    """すべてのレート制限の設定を解除します。"""
+    with _lock:
+        _configs.clear()
+        _limiters.clear()
+
+
+def get_rate_limiter(provider: str, api_key: Optional[str]) -> Optional[RateLimiter]:
+    """
+    プロバイダーとAPIキーに対応するレートリミッターを返します。
+
+    :param provider: プロバイダー名
+    :param api_key: APIキー
+    :return: レートリミッター（制限が設定されていない場合はNone）
+    """
+    if not _configs:
+        return None
+    key_id = _key_id(api_key)
+    with _lock:
+        limiter = _limiters.get((provider, key_id))
+        if limiter is None:
+            config = _configs.get((provider, key_id)) or _configs.get((provider, None))
+            if config is None:
+                return None
+            limiter = _limiters[(provider, key_id)] = RateLimiter(*config)
+        return limiter
+
+
+def estimate_tokens(*args: Any, **kwargs: Any) -> int:
+    """
+    リクエストの引数からトークン数を見積もります。
+
+    テキストは約4文字を1トークンとし、画像は1枚あたり固定のトークン数として数えます。
+    max_tokensが指定されている場合は出力分としてそのまま加算します。
+
+    :return: 見積もりトークン数
+    """
+    total = _estimate(args) + _estimate({k: v for k, v in kwargs.items() if k != "max_tokens"})
+    max_tokens = kwargs.get("max_tokens")
+    if isinstance(max_tokens, int):
+        total += max_tokens
+    return total
+
+
+def _estimate(value: Any) -> int:
+    if isinstance(value, str):
+        if value.startswith("data:"):
+            return IMAGE_TOKEN_ESTIMATE
+        return len(value) // CHARS_PER_TOKEN + 1
+    if isinstance(value, dict):
+        if value.get("type") in ("image", "image_url"):
+            return IMAGE_TOKEN_ESTIMATE
+        return sum(_estimate(v) for k, v in value.items()
+                   if k not in ("model", "stream", "response_format"))
+    if isinstance(value, (list, tuple)):
+        return sum(_estimate(v) for v in value)
+    if isinstance(value, (bytes, bytearray, memoryview)) or hasattr(value, "size"):
+        # 画像のバイト列やPILの画像
+        return IMAGE_TOKEN_ESTIMATE
+    return 0
@@ -0,0 +1,186 @@
+import email.utils
+import os
+import random
+import time
+from dataclasses import dataclass
+from typing import Optional
+from .exceptions import MosaicAIError
+
+# 再試行するHTTPステータスコード（529はAnthropicの過負荷エラー）
+RETRYABLE_STATUS_CODES = frozenset({408, 409, 429, 500, 502, 503, 504, 529})
+
+# 再試行する例外のクラス名（SDKを読み込まずに判定するため、クラス名で比較する）
+RETRYABLE_ERROR_NAMES = frozenset({
+    "APIConnectionError",   # openai, anthropic
+    "APITimeoutError",      # openai, anthropic
+    "TimeoutException",     # httpx
+    "NetworkError",         # httpx
+    "RemoteProtocolError",  # httpx
+    "ServiceUnavailable",   # google.api_core
+    "DeadlineExceeded",     # google.api_core
+    "TooManyRequests",      # google.api_core
+    "ResourceExhausted",    # google.api_core
+    "InternalServerError",  # google.api_core, openai, anthropic
+})
+
+
+@dataclass
+class RetryPolicy:
+    """
+    一時的なエラーに対する再試行の方針です。
+
+    再試行できるエラー（429、5xx、タイムアウト、接続エラー）の場合、サーバーのRetry-Afterヘッダーがあればその時間、
+    なければ上限付きの指数バックオフにジッターを加えた時間だけ待機して再試行します。
+    timeoutは再試行を含む1回の呼び出し全体の期限で、期限内に再試行できない場合は最後のエラーを送出します。
+
+    :param max_retries: 最大再試行回数
+    :param timeout: 呼び出し全体の期限（秒）。Noneの場合は期限なし
+    :param base_delay: バックオフの初期待機時間（秒）
+    :param max_delay: バックオフの待機時間の上限（秒）
+    :param jitter: 待機時間を0から計算値までの乱数にする（Full Jitter）かどうか
+    """
+    max_retries: int = 3
+    timeout: Optional[float] = 30.0
+    base_delay: float = 0.5
+    max_delay: float = 20.0
+    jitter: bool = True
+
+    @classmethod
+    def from_env(cls) -> "RetryPolicy":
+        """
+        環境変数MAX_RETRIESとREQUEST_TIMEOUTから再試行の方針を作成します。
+
+        :return: 再試行の方針
+        """
+        policy = cls()
+        max_retries = os.getenv("MAX_RETRIES")
+        if max_retries:
+            policy.max_retries = int(max_retries)
+        timeout = os.getenv("REQUEST_TIMEOUT")
+        if timeout:
+            policy.timeout = float(timeout)
+        return policy
+
+    def deadline(self) -> Optional[float]:
+        """呼び出しを開始した時点の期限（time.monotonicの値）を返します。"""
+        if self.timeout is None:
+            return None
+        return time.monotonic() + self.timeout
+
+    def backoff(self, attempt: int) -> float:
+        """
+        attempt回目の再試行前に待機する時間を返します。
+
+        :param attempt: 0から始まる再試行の回数
+        :return: 待機時間（秒）
+        """
+        delay = min(self.max_delay, self.base_delay * (2 ** attempt))
+        if self.jitter:
+            delay = random.uniform(0, delay)
+        return delay
+
+    def next_delay(self, error: BaseException, attempt: int,
+                   deadline: Optional[float]) -> Optional[float]:
+        """
+        エラーの後に再試行する場合の待機時間を返します。
+
+        :param error: 発生したエラー
+        :param attempt: 0から始まる再試行の回数
+        :param deadline: 呼び出しの期限（time.monotonicの値）
+        :return: 待機時間（秒）。再試行しない場合はNone
+        """
+        if attempt >= self.max_retries or not is_retryable(error):
+            return None
+        delay = retry_after(error)
+        if delay is None:
+            delay = self.backoff(attempt)
+        if deadline is not None and time.monotonic() + delay >= deadline:
+            # 待機すると期限を過ぎる場合は、すぐに失敗させる
+            return None
+        return delay
+
+
+_default_policy: Optional[RetryPolicy] = None
+
+
+def default_policy() -> RetryPolicy:
+    """
+    モデルに再試行の方針が設定されていない場合に使用する既定の方針を返します。
+    初回の呼び出し時に環境変数から作成されます。
+
+    :return: 再試行の方針
+    """
+    global _default_policy
+    if _default_policy is None:
+        _default_policy = RetryPolicy.from_env()
+    return _default_policy
+
+
+def set_default_policy(policy: Optional[RetryPolicy]):
+    """
+    既定の再試行の方針を設定します。Noneを指定すると、次回の使用時に環境変数から作り直します。
+
+    :param policy: 再試行の方針
+    """
+    global _default_policy
+    _default_policy = policy
+
+
+def status_code(error: BaseException) -> Optional[int]:
+    """
+    エラーに対応するHTTPステータスコードを返します。
+
+    :param error: SDKが送出したエラー
+    :return: ステータスコード（取得できない場合はNone）
+    """
+    # openai、anthropicはstatus_code、google.api_coreはcodeにHTTPステータスを持つ
+    for name in ("status_code", "code"):
+        code = getattr(error, name, None)
+        if isinstance(code, int):
+            return code
+    return None
+
+
+def is_retryable(error: BaseException) -> bool:
+    """
+    エラーが再試行で解消する可能性のある一時的なエラーかどうかを判定します。
+
+    :param error: SDKが送出したエラー
+    :return: 再試行できる場合はTrue
+    """
+    # SDKが接続エラーとして包んだMosaicAI自身のエラー（カセットの不一致など）は再試行しない
+    if isinstance(error.__cause__, MosaicAIError):
+        return False
+    code = status_code(error)
+    if code is not None:
+        return code in RETRYABLE_STATUS_CODES
+    if isinstance(error, (TimeoutError, ConnectionError)):
+        return True
+    return any(cls.__name__ in RETRYABLE_ERROR_NAMES for cls in type(error).__mro__)
+
+
+def retry_after(error: BaseException) -> Optional[float]:
+    """
+    エラー応答のRetry-After（またはretry-after-ms）ヘッダーが指定する待機時間を返します。
+
+    :param error: SDKが送出したエラー
+    :return: 待機時間（秒）。ヘッダーがない場合はNone
+    """
+    headers = getattr(getattr(error, "response", None), "headers", None)
+    if not headers:
+        return None
+    try:
+        value = headers.get("retry-after-ms")
+        if value is not None:
+            return max(0.0, float(value) / 1000)
+        value = headers.get("retry-after")
+        if value is None:
+            return None
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            # HTTP日付形式
+            retry_at = email.utils.parsedate_to_datetime(value)
+            return max(0.0, retry_at.timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
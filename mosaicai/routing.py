@@ -0,0 +1,85 @@
+import random
+import statistics
+from dataclasses import dataclass
+from typing import List, Optional, Sequence
+from . import stats
+
+
+@dataclass
+class LatencyRouter:
+    """
+    モデルのプールから、呼び出しごとに現在最も速いと見込まれるモデルを選択するルーターです。
+
+    各モデルのスコアは、観測したレイテンシ（サンプルがmin_samples以上ある場合はpercentileパーセンタイル、
+    それ以外はEWMA）に、失敗した場合にフェイルオーバー先を待つ時間として (エラー率 × 基準のレイテンシ) を加え、
+    (1 + 実行中のリクエスト数) を掛けて (1 - エラー率) で割った値です。
+    基準のレイテンシは、プールのモデルのレイテンシの中央値（どのモデルも観測していない場合はdefault_latency）です。
+    失敗のみでレイテンシを観測していないモデルのレイテンシには、基準のレイテンシを使用します。
+    スコアが小さい順に試行し、失敗した場合は次のモデルにフェイルオーバーします。
+    まだ呼び出されていないモデルは優先して選択され、explorationの確率でランダムな順序を使用して統計情報を更新し続けます。
+
+    :param models: 選択の対象とするモデルの名前
+    :param percentile: スコアに使用するレイテンシのパーセンタイル
+    :param min_samples: パーセンタイルを使用するために必要なサンプル数
+    :param exploration: ランダムな順序で試行する確率
+    :param default_latency: どのモデルのレイテンシも観測していない場合の基準のレイテンシ（秒）
+    """
+    models: Sequence[str]
+    percentile: float = 90.0
+    min_samples: int = 10
+    exploration: float = 0.05
+    default_latency: float = 1.0
+
+    def score(self, model: str, baseline: Optional[float] = None) -> float:
+        """
+        モデルのスコアを返します。小さいほど優先されます。
+
+        :param model: モデル名
+        :param baseline: 基準のレイテンシ（秒）。Noneの場合はプールのモデルから計算します
+        :return: スコア
+        """
+        model_stats = stats.model_stats(model)
+        if model_stats.successes + model_stats.failures == 0:
+            # まだ呼び出されていないモデルは優先する
+            return 0.0
+        if baseline is None:
+            baseline = self.baseline_latency()
+        latency = self._latency(model_stats)
+        if latency is None:
+            latency = baseline
+        error_rate = model_stats.error_rate
+        penalty = latency + error_rate * baseline
+        return penalty * (1 + model_stats.inflight) / max(1 - error_rate, 0.01)
+
+    def baseline_latency(self) -> float:
+        """
+        プールのモデルのレイテンシの中央値を返します。
+
+        :return: 基準のレイテンシ（秒）。どのモデルも観測していない場合はdefault_latency
+        """
+        latencies = [self._latency(stats.model_stats(model)) for model in self.models]
+        latencies = [latency for latency in latencies if latency is not None]
+        return statistics.median(latencies) if latencies else self.default_latency
+
+    def _latency(self, model_stats: stats.ModelStats) -> Optional[float]:
+        """観測したレイテンシ（観測していない場合はNone）を返す"""
+        if model_stats.ewma_latency is None:
+            return None
+        if len(model_stats.latency) >= self.min_samples:
+            return model_stats.latency.percentile(self.percentile)
+        return model_stats.ewma_latency
+
+    def rank(self) -> List[str]:
+        """
+        モデルを試行する順に並べて返します。
+
+        :return: モデル名のリスト
+        """
+        models = list(self.models)
+        if random.random() < self.exploration:
+            random.shuffle(models)
+            return models
+        baseline = self.baseline_latency()
+        # まだ呼び出されていないモデル同士は、実行中のリクエストが少ない方を優先する
+        return sorted(models, key=lambda model: (self.score(model, baseline),
+                                                 stats.model_stats(model).inflight))
@@ -0,0 +1,129 @@
+import math
+import threading
+from collections import deque
+from typing import Dict, Optional
+
+
+class LatencyWindow:
+    """
+    直近のレイテンシを保持し、パーセンタイルを計算するスレッドセーフなウィンドウです。
+    """
+
+    def __init__(self, max_samples: int = 1000):
+        """
+        :param max_samples: 保持するサンプル数の上限
+        """
+        self._samples = deque(maxlen=max_samples)
+        self._lock = threading.Lock()
+
+    def add(self, seconds: float):
+        """レイテンシ（秒）を追加します。"""
+        with self._lock:
+            self._samples.append(seconds)
+
+    def percentile(self, percentile: float) -> Optional[float]:
+        """
+        指定したパーセンタイルのレイテンシを返します（最近接順位法）。
+
+        :param percentile: 0から100までのパーセンタイル
+        :return: レイテンシ（秒）。サンプルがない場合はNone
+        """
+        with self._lock:
+            samples = sorted(self._samples)
+        if not samples:
+            return None
+        rank = max(1, math.ceil(percentile / 100 * len(samples)))
+        return samples[min(rank, len(samples)) - 1]
+
+    def __len__(self) -> int:
+        return len(self._samples)
+
+
+class ModelStats:
+    """
+    モデルごとの呼び出しの統計情報です。
+
+    レイテンシのパーセンタイルに加えて、レイテンシとエラー率の指数加重移動平均（EWMA）、
+    実行中のリクエスト数を継続的に記録します。
+    """
+
+    def __init__(self, max_samples: int = 1000, alpha: float = 0.2):
+        """
+        :param max_samples: 保持するレイテンシのサンプル数の上限
+        :param alpha: 指数加重移動平均の平滑化係数（0から1。大きいほど直近の値を重視）
+        """
+        self.latency = LatencyWindow(max_samples)
+        self.alpha = alpha
+        self.ewma_latency: Optional[float] = None
+        self.error_rate = 0.0
+        self.successes = 0
+        self.failures = 0
+        self.inflight = 0
+        self._lock = threading.Lock()
+
+    def start(self):
+        """リクエストの開始を記録します。"""
+        with self._lock:
+            self.inflight += 1
+
+    def finish(self):
+        """リクエストの終了（成功または失敗）を記録します。"""
+        with self._lock:
+            self.inflight -= 1
+
+    def record_success(self, seconds: float):
+        """
+        成功した呼び出しを記録します。
+
+        :param seconds: 呼び出しのレイテンシ（秒）
+        """
+        self.latency.add(seconds)
+        with self._lock:
+            self.successes += 1
+            self._update_latency(seconds)
+            self.error_rate *= 1 - self.alpha
+
+    def record_failure(self, seconds: Optional[float] = None):
+        """
+        失敗した呼び出しを記録します。失敗までの時間もレイテンシとして記録するため、
+        タイムアウトするモデルのレイテンシは大きくなります。
+
+        :param seconds: 失敗するまでの時間（秒）。Noneの場合はレイテンシを記録しない
+        """
+        if seconds is not None:
+            self.latency.add(seconds)
+        with self._lock:
+            self.failures += 1
+            if seconds is not None:
+                self._update_latency(seconds)
+            self.error_rate += self.alpha * (1 - self.error_rate)
+
+    def _update_latency(self, seconds: float):
+        if self.ewma_latency is None:
+            self.ewma_latency = seconds
+        else:
+            self.ewma_latency += self.alpha * (seconds - self.ewma_latency)
+
+
+_lock = threading.Lock()
+_stats: Dict[str, ModelStats] = {}
+
+
+def model_stats(model: str) -> ModelStats:
+    """
+    モデルの統計情報を返します。統計情報はプロセス内のすべてのMosaicAIインスタンスで共有されます。
+
+    :param model: モデル名
+    :return: 統計情報
+    """
+    with _lock:
+        stats = _stats.get(model)
+        if stats is None:
+            stats = _stats[model] = ModelStats()
+        return stats
+
+
+def clear_stats():
+    """すべてのモデルの統計情報を破棄します。"""
+    with _lock:
+        _stats.clear()
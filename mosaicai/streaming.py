@@ -0,0 +1,163 @@
+from typing import Any, AsyncIterator, Dict, Iterator, Optional, Union
+from .types import StreamDelta, Usage
+
+StreamEvent = Union[StreamDelta, Usage]
+
+
+class TextStream:
+    """
+    ストリーミング応答を共通の差分型（StreamDelta）で返すイテレータです。
+
+    各モデルのSDKが返すチャンクはStreamDeltaとUsageのイベント列に正規化されます。
+    反復処理が終了すると、usageに最終的なトークン使用量、textに生成されたテキスト全体が格納されます。
+    """
+
+    def __init__(self, events: Iterator[StreamEvent]):
+        """
+        :param events: StreamDeltaまたはUsageを返すイテレータ
+        """
+        self._events = events
+        self.usage: Optional[Usage] = None
+        self.finish_reason: Optional[str] = None
+        self._chunks = []
+
+    @property
+    def text(self) -> str:
+        """これまでに受信したテキストを連結して返します。"""
+        return "".join(self._chunks)
+
+    def __iter__(self) -> Iterator[StreamDelta]:
+        for event in self._events:
+            if isinstance(event, Usage):
+                self.usage = event
+                continue
+            if event.finish_reason:
+                self.finish_reason = event.finish_reason
+            self._chunks.append(event.text)
+            yield event
+
+    def close(self):
+        """ストリームを途中で終了し、接続を解放します。"""
+        close = getattr(self._events, "close", None)
+        if close is not None:
+            close()
+
+    def __enter__(self) -> "TextStream":
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class AsyncTextStream:
+    """
+    TextStreamの非同期版です。async forで差分を受信します。
+    """
+
+    def __init__(self, events: AsyncIterator[StreamEvent]):
+        """
+        :param events: StreamDeltaまたはUsageを返す非同期イテレータ
+        """
+        self._events = events
+        self.usage: Optional[Usage] = None
+        self.finish_reason: Optional[str] = None
+        self._chunks = []
+
+    @property
+    def text(self) -> str:
+        """これまでに受信したテキストを連結して返します。"""
+        return "".join(self._chunks)
+
+    async def __aiter__(self) -> AsyncIterator[StreamDelta]:
+        async for event in self._events:
+            if isinstance(event, Usage):
+                self.usage = event
+                continue
+            if event.finish_reason:
+                self.finish_reason = event.finish_reason
+            self._chunks.append(event.text)
+            yield event
+
+    async def aclose(self):
+        """ストリームを途中で終了し、接続を解放します。"""
+        aclose = getattr(self._events, "aclose", None)
+        if aclose is not None:
+            await aclose()
+
+    async def __aenter__(self) -> "AsyncTextStream":
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.aclose()
+
+
+def openai_chunk_events(chunk) -> Iterator[StreamEvent]:
+    """
+    OpenAI互換API（ChatGPT、Perplexity）のストリーミングチャンクをイベントに変換します。
+
+    :param chunk: ChatCompletionChunk
+    :return: StreamDeltaまたはUsageのイテレータ
+    """
+    if chunk.choices:
+        choice = chunk.choices[0]
+        text = choice.delta.content or ""
+        if text or choice.finish_reason:
+            yield StreamDelta(text, choice.finish_reason)
+    if getattr(chunk, "usage", None):
+        yield Usage(chunk.usage.prompt_tokens, chunk.usage.completion_tokens)
+
+
+def openai_stream_events(stream) -> Iterator[StreamEvent]:
+    """
+    OpenAI互換APIのストリーミング応答をイベントに変換します。
+
+    :param stream: chat.completions.create(stream=True)の戻り値
+    :return: StreamDeltaまたはUsageのイテレータ
+    """
+    for chunk in stream:
+        yield from openai_chunk_events(chunk)
+
+
+async def openai_stream_events_async(stream) -> AsyncIterator[StreamEvent]:
+    """
+    openai_stream_eventsの非同期版です。
+
+    :param stream: 非同期クライアントのchat.completions.create(stream=True)の戻り値
+    :return: StreamDeltaまたはUsageの非同期イテレータ
+    """
+    async for chunk in stream:
+        for event in openai_chunk_events(chunk):
+            yield event
+
+
+def openai_response_usage(response) -> Optional[Usage]:
+    """
+    OpenAI互換APIの応答からトークン使用量を取り出します。
+
+    :param response: ChatCompletion
+    :return: Usage（取得できない場合はNone）
+    """
+    usage = getattr(response, "usage", None)
+    return Usage.from_counts(getattr(usage, "prompt_tokens", None),
+                             getattr(usage, "completion_tokens", None))
+
+
+def openai_response_info(response) -> Dict[str, Optional[str]]:
+    """
+    OpenAI互換APIの応答から終了理由、モデルID、リクエストIDを取り出します。
+
+    :param response: ChatCompletion
+    :return: finish_reason、model、request_idを持つ辞書
+    """
+    choices = getattr(response, "choices", None) or [None]
+    return {
+        "finish_reason": text_or_none(getattr(choices[0], "finish_reason", None)),
+        "model": text_or_none(getattr(response, "model", None)),
+        "request_id": (text_or_none(getattr(response, "_request_id", None))
+                       or text_or_none(getattr(response, "id", None))),
+    }
+
+
+def text_or_none(value: Any) -> Optional[str]:
+    """値が文字列の場合はそのまま、それ以外の場合はNoneを返します。"""
+    return value if isinstance(value, str) else None
@@ -0,0 +1,7 @@
+from .mock_server import MockBehavior, MockProviderServer, mock_base_urls
+
+__all__ = [
+    'MockBehavior',
+    'MockProviderServer',
+    'mock_base_urls'
+]
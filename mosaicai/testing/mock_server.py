@@ -0,0 +1,383 @@
+"""
+OpenAI（chat.completions）、Anthropic（messages）、Perplexityの各APIを模倣するローカルのHTTPサーバーです。
+
+実際のAPIの利用枠を消費せずに、MosaicAIを組み込んだアプリケーションの負荷試験や結合テストを行うために使用します。
+応答の遅延（対数正規分布）、500エラーと429エラーの注入、ストリーミング応答に対応しています。
+
+使用例:
+    $ python -m mosaicai.testing --port 8080 --latency 0.3 --latency-sigma 0.5 \
+          --rate-limit-rate 0.01
+"""
+import argparse
+import json
+import math
+import random
+import threading
+import time
+import uuid
+from dataclasses import dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+from ..utils import client_registry
+
+# APIのパスと、それを模倣するプロバイダー
+# OpenAI SDKはbase_urlに/chat/completionsを、Anthropic SDKは/v1/messagesを付加する
+ROUTES = {
+    "/v1/chat/completions": "openai",
+    "/perplexity/chat/completions": "perplexity",
+    "/v1/messages": "claude",
+}
+
+
+def mock_base_urls(url: str) -> Dict[str, str]:
+    """
+    モックサーバーのURLから、プロバイダーごとに設定するベースURLを作成します。
+
+    :param url: モックサーバーのURL（例: "http://127.0.0.1:8080"）
+    :return: プロバイダー名をキー、ベースURLを値とする辞書
+    """
+    url = url.rstrip("/")
+    return {"openai": f"{url}/v1", "claude": url, "perplexity": f"{url}/perplexity"}
+
+
+@dataclass
+class MockBehavior:
+    """
+    モックサーバーの応答の振る舞いを表すクラスです。
+
+    :param latency: 応答を返すまでの遅延の中央値（秒）。ストリーミングでは最初のチャンクまでの遅延
+    :param latency_sigma: 遅延の対数正規分布のσ（0の場合は常にlatencyだけ遅延する）
+    :param error_rate: 500エラーを返す確率
+    :param rate_limit_rate: 429エラーを返す確率
+    :param retry_after: 429エラーのretry-after-msヘッダーに指定する待機時間（秒、Noneの場合はヘッダーを返さない）
+    :param chunk_delay: ストリーミングのチャンクの間隔（秒）
+    :param chunk_count: ストリーミングで応答を分割するチャンクの数
+    :param text: テキストの応答
+    :param json_text: JSON形式の応答を要求された場合に返す応答
+    """
+    latency: float = 0.0
+    latency_sigma: float = 0.0
+    error_rate: float = 0.0
+    rate_limit_rate: float = 0.0
+    retry_after: Optional[float] = 0.05
+    chunk_delay: float = 0.0
+    chunk_count: int = 8
+    text: str = "これはモックサーバーの応答です。"
+    json_text: str = '{"answer": "mock"}'
+
+
+class MockProviderServer:
+    """
+    プロバイダーのAPIを模倣するHTTPサーバーです。バックグラウンドのスレッドで実行されます。
+
+    ```python
+    with MockProviderServer(MockBehavior(latency=0.2)) as server:
+        server.configure_clients()
+        client = MosaicAI("gpt-4o")
+    ```
+    """
+
+    def __init__(self, behavior: Optional[MockBehavior] = None,
+                 provider_behaviors: Optional[Dict[str, MockBehavior]] = None,
+                 host: str = "127.0.0.1", port: int = 0, seed: Optional[int] = None):
+        """
+        :param behavior: すべてのプロバイダーに共通する振る舞い
+        :param provider_behaviors: プロバイダー名（"openai"、"claude"、"perplexity"）ごとの振る舞い
+        :param host: 待ち受けるホスト
+        :param port: 待ち受けるポート（0の場合は空いているポートを使用する）
+        :param seed: 遅延とエラーの注入に使用する乱数のシード
+        """
+        self.behavior = behavior or MockBehavior()
+        self.provider_behaviors = dict(provider_behaviors or {})
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._stats: Dict[str, Dict[str, int]] = {}
+        self._httpd = _Server((host, port), _Handler)
+        self._httpd.mock = self
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        """サーバーのURLを返します。"""
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def base_urls(self) -> Dict[str, str]:
+        """プロバイダーごとに設定するベースURLを返します。"""
+        return mock_base_urls(self.url)
+
+    def start(self) -> "MockProviderServer":
+        """バックグラウンドのスレッドでサーバーを起動します。"""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._httpd.serve_forever,
+                                            name="mosaicai-mock-server", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        """サーバーを停止します。"""
+        if self._thread is not None:
+            self._httpd.shutdown()
+            self._thread.join()
+            self._thread = None
+        self._httpd.server_close()
+
+    def configure_clients(self):
+        """
+        以降に作成されるモデルインスタンスのリクエストがこのサーバーに送られるよう、ベースURLを設定します。
+        元に戻す場合はconfigure_base_url(provider, None)を呼び出してください。
+        """
+        for provider, base_url in self.base_urls.items():
+            client_registry.configure_base_url(provider, base_url)
+
+    def behavior_for(self, provider: str) -> MockBehavior:
+        """
+        プロバイダーの振る舞いを返します。
+
+        :param provider: プロバイダー名
+        :return: 振る舞い
+        """
+        return self.provider_behaviors.get(provider, self.behavior)
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        """
+        プロバイダーごとに、受け付けたリクエスト（requests）、ストリーミング（streams）、
+        500エラー（errors）、429エラー（rate_limited）の数を返します。
+        """
+        with self._lock:
+            return {provider: dict(counts) for provider, counts in self._stats.items()}
+
+    def _count(self, provider: str, name: str):
+        with self._lock:
+            counts = self._stats.setdefault(
+                provider, {"requests": 0, "streams": 0, "errors": 0, "rate_limited": 0})
+            counts[name] += 1
+
+    def _sample(self, behavior: MockBehavior) -> Tuple[float, float]:
+        """遅延（秒）と、エラーを決めるための一様乱数を返す"""
+        with self._lock:
+            noise = self._random.gauss(0.0, 1.0) if behavior.latency_sigma > 0 else 0.0
+            delay = behavior.latency * math.exp(behavior.latency_sigma * noise)
+            return delay, self._random.random()
+
+    def __enter__(self) -> "MockProviderServer":
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+    # 既定値（5）では多数の同時接続で接続待ちのキューがあふれ、SYNの再送による約1秒の遅延が発生する
+    request_queue_size = 1024
+
+
+class _Handler(BaseHTTPRequestHandler):
+    """モックサーバーのリクエストハンドラー"""
+    # キープアライブを有効にして、実際のAPIと同じく接続プールを再利用させる
+    protocol_version = "HTTP/1.1"
+    # ストリーミングの小さなチャンクがNagleアルゴリズムと遅延ACKによって待たされないようにする
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    @property
+    def mock(self) -> MockProviderServer:
+        return self.server.mock
+
+    def do_POST(self):
+        provider = ROUTES.get(self.path.split("?", 1)[0])
+        body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        if provider is None:
+            self._send_json(404, _error_body(provider, "not_found_error",
+                                             f"Unknown path: {self.path}"))
+            return
+        try:
+            request = json.loads(body or b"{}")
+        except ValueError:
+            self._send_json(400, _error_body(provider, "invalid_request_error",
+                                             "Invalid JSON body"))
+            return
+
+        behavior = self.mock.behavior_for(provider)
+        stream = bool(request.get("stream"))
+        self.mock._count(provider, "requests")
+        if stream:
+            self.mock._count(provider, "streams")
+        delay, roll = self.mock._sample(behavior)
+        time.sleep(delay)
+
+        if roll < behavior.rate_limit_rate:
+            self.mock._count(provider, "rate_limited")
+            headers = {}
+            if behavior.retry_after is not None:
+                headers["retry-after-ms"] = str(int(behavior.retry_after * 1000))
+            self._send_json(429, _error_body(provider, "rate_limit_error", "Rate limit exceeded"),
+                            headers)
+            return
+        if roll < behavior.rate_limit_rate + behavior.error_rate:
+            self.mock._count(provider, "errors")
+            self._send_json(500, _error_body(provider, "api_error", "Internal server error"))
+            return
+
+        text = behavior.json_text if _wants_json(provider, request) else behavior.text
+        prompt_tokens = _count_tokens(json.dumps(request.get("messages", []), ensure_ascii=False))
+        model = request.get("model", "mock")
+        if provider == "claude":
+            if stream:
+                events = _anthropic_events(model, text, prompt_tokens, behavior.chunk_count)
+                self._send_stream(events, behavior.chunk_delay, named=True)
+            else:
+                self._send_json(200, _anthropic_message(model, text, prompt_tokens))
+        elif stream:
+            include_usage = bool((request.get("stream_options") or {}).get("include_usage"))
+            events = _openai_chunks(model, text, prompt_tokens, behavior.chunk_count, include_usage)
+            self._send_stream(events, behavior.chunk_delay, named=False)
+        else:
+            self._send_json(200, _openai_completion(model, text, prompt_tokens))
+
+    def _send_json(self, status: int, body: Dict[str, Any],
+                   headers: Optional[Dict[str, str]] = None):
+        data = json.dumps(body, ensure_ascii=False).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.send_header("x-request-id", f"req_{uuid.uuid4().hex}")
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _send_stream(self, events: Iterator[Tuple[Optional[str], Any]], chunk_delay: float,
+                     named: bool):
+        """Server-Sent Eventsをchunked転送で送信する"""
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.send_header("x-request-id", f"req_{uuid.uuid4().hex}")
+        self.end_headers()
+        for index, (event, data) in enumerate(events):
+            if index and chunk_delay:
+                time.sleep(chunk_delay)
+            payload = data if isinstance(data, str) else json.dumps(data, ensure_ascii=False)
+            message = (f"event: {event}\n" if named else "") + f"data: {payload}\n\n"
+            self._write_chunk(message.encode())
+        self._write_chunk(b"")
+
+    def _write_chunk(self, data: bytes):
+        self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+        self.wfile.flush()
+
+
+def _wants_json(provider: str, request: Dict[str, Any]) -> bool:
+    """MosaicAIのgenerate_jsonによるリクエストかどうかを判定する"""
+    if provider == "claude":
+        return "JSON" in str(request.get("system", ""))
+    return (request.get("response_format") or {}).get("type") == "json_object"
+
+
+def _count_tokens(text: str) -> int:
+    """トークン数のおおよその値（4文字を1トークンとする）"""
+    return max(1, len(text) // 4)
+
+
+def _split(text: str, count: int) -> List[str]:
+    size = max(1, math.ceil(len(text) / max(1, count)))
+    return [text[i:i + size] for i in range(0, len(text), size)]
+
+
+def _error_body(provider: Optional[str], error_type: str, message: str) -> Dict[str, Any]:
+    if provider == "claude":
+        return {"type": "error", "error": {"type": error_type, "message": message}}
+    return {"error": {"type": error_type, "message": message, "code": None, "param": None}}
+
+
+def _openai_completion(model: str, text: str, prompt_tokens: int) -> Dict[str, Any]:
+    completion_tokens = _count_tokens(text)
+    return {
+        "id": f"chatcmpl-{uuid.uuid4().hex}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [{"index": 0, "message": {"role": "assistant", "content": text},
+                     "finish_reason": "stop"}],
+        "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                  "total_tokens": prompt_tokens + completion_tokens},
+    }
+
+
+def _openai_chunks(model: str, text: str, prompt_tokens: int, chunk_count: int,
+                   include_usage: bool) -> Iterator[Tuple[Optional[str], Any]]:
+    base = {"id": f"chatcmpl-{uuid.uuid4().hex}", "object": "chat.completion.chunk",
+            "created": int(time.time()), "model": model}
+    for piece in _split(text, chunk_count):
+        yield None, dict(base, choices=[{"index": 0, "delta": {"content": piece},
+                                         "finish_reason": None}])
+    yield None, dict(base, choices=[{"index": 0, "delta": {}, "finish_reason": "stop"}])
+    if include_usage:
+        completion_tokens = _count_tokens(text)
+        usage = {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                 "total_tokens": prompt_tokens + completion_tokens}
+        yield None, dict(base, choices=[], usage=usage)
+    yield None, "[DONE]"
+
+
+def _anthropic_message(model: str, text: str, prompt_tokens: int) -> Dict[str, Any]:
+    return {
+        "id": f"msg_{uuid.uuid4().hex}",
+        "type": "message",
+        "role": "assistant",
+        "model": model,
+        "content": [{"type": "text", "text": text}],
+        "stop_reason": "end_turn",
+        "stop_sequence": None,
+        "usage": {"input_tokens": prompt_tokens, "output_tokens": _count_tokens(text)},
+    }
+
+
+def _anthropic_events(model: str, text: str, prompt_tokens: int,
+                      chunk_count: int) -> Iterator[Tuple[Optional[str], Any]]:
+    message = dict(_anthropic_message(model, "", prompt_tokens), content=[], stop_reason=None,
+                   usage={"input_tokens": prompt_tokens, "output_tokens": 1})
+    yield "message_start", {"type": "message_start", "message": message}
+    yield "content_block_start", {"type": "content_block_start", "index": 0,
+                                  "content_block": {"type": "text", "text": ""}}
+    for piece in _split(text, chunk_count):
+        yield "content_block_delta", {"type": "content_block_delta", "index": 0,
+                                      "delta": {"type": "text_delta", "text": piece}}
+    yield "content_block_stop", {"type": "content_block_stop", "index": 0}
+    yield "message_delta", {"type": "message_delta",
+                            "delta": {"stop_reason": "end_turn", "stop_sequence": None},
+                            "usage": {"output_tokens": _count_tokens(text)}}
+    yield "message_stop", {"type": "message_stop"}
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Run a local mock of the OpenAI, Anthropic and Perplexity APIs.")
+    parser.add_argument("--host", default="127.0.0.1", help="待ち受けるホスト")
+    parser.add_argument("--port", type=int, default=8080, help="待ち受けるポート")
+    parser.add_argument("--latency", type=float, default=0.0, help="遅延の中央値（秒）")
+    parser.add_argument("--latency-sigma", type=float, default=0.0, help="遅延の対数正規分布のσ")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="500エラーを返す確率")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="429エラーを返す確率")
+    parser.add_argument("--chunk-delay", type=float, default=0.0, help="ストリーミングのチャンクの間隔（秒）")
+    parser.add_argument("--seed", type=int, default=None, help="乱数のシード")
+    args = parser.parse_args()
+
+    behavior = MockBehavior(latency=args.latency, latency_sigma=args.latency_sigma,
+                            error_rate=args.error_rate, rate_limit_rate=args.rate_limit_rate,
+                            chunk_delay=args.chunk_delay)
+    server = MockProviderServer(behavior, host=args.host, port=args.port, seed=args.seed)
+    print(f"Mock provider server listening on {server.url}")
+    for provider, base_url in server.base_urls.items():
+        print(f"  {provider}: {base_url}")
+    try:
+        server._httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server._httpd.server_close()
@@ -0,0 +1,90 @@
+from dataclasses import asdict, dataclass
+from typing import Any, Dict, Optional
+
+
+@dataclass
+class Usage:
+    """
+    プロバイダーごとに異なるトークン使用量を正規化したクラスです。
+
+    :param prompt_tokens: 入力（プロンプト）のトークン数
+    :param completion_tokens: 出力（生成結果）のトークン数
+    """
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+
+    @property
+    def total_tokens(self) -> int:
+        """入力と出力の合計トークン数を返します。"""
+        return self.prompt_tokens + self.completion_tokens
+
+    @classmethod
+    def from_counts(cls, prompt_tokens: Any, completion_tokens: Any) -> Optional["Usage"]:
+        """
+        SDKの応答から取り出したトークン数をUsageに変換します。
+
+        :param prompt_tokens: 入力のトークン数
+        :param completion_tokens: 出力のトークン数
+        :return: Usage（どちらかが整数でない場合はNone）
+        """
+        if not isinstance(prompt_tokens, int) or not isinstance(completion_tokens, int):
+            return None
+        return cls(prompt_tokens, completion_tokens)
+
+
+@dataclass
+class StreamDelta:
+    """
+    ストリーミング応答の1チャンク分の差分を表すクラスです。
+
+    :param text: 追加で生成されたテキスト
+    :param finish_reason: 生成が終了した場合の終了理由（それ以外はNone）
+    """
+    text: str
+    finish_reason: Optional[str] = None
+
+
+# 出力が上限のトークン数で打ち切られたことを表す終了理由（OpenAI互換、Claude、Gemini）
+TRUNCATED_FINISH_REASONS = frozenset({"length", "max_tokens", "MAX_TOKENS"})
+
+
+@dataclass
+class GenerationResult:
+    """
+    生成結果と、トークン使用量や終了理由などの応答の情報をまとめたクラスです。
+
+    :param content: 生成されたテキスト、またはJSON（辞書）
+    :param usage: トークン使用量（プロバイダーが報告しない場合はNone）
+    :param finish_reason: プロバイダーが返した終了理由（"stop"、"end_turn"、"length"、"max_tokens"、"STOP"など）
+    :param model: プロバイダーが返したモデルID（返さない場合は指定したモデル名）
+    :param request_id: プロバイダーが返したリクエストまたは応答のID
+    :param latency: 生成にかかった時間（秒）。JSONの解析と型の変換を含みます
+    :param cached: キャッシュから返された結果の場合はTrue
+    """
+    content: Any
+    usage: Optional[Usage] = None
+    finish_reason: Optional[str] = None
+    model: Optional[str] = None
+    request_id: Optional[str] = None
+    latency: float = 0.0
+    cached: bool = False
+
+    @property
+    def truncated(self) -> bool:
+        """出力が上限のトークン数で打ち切られた場合にTrueを返します。"""
+        return self.finish_reason in TRUNCATED_FINISH_REASONS
+
+    def to_dict(self) -> Dict[str, Any]:
+        """JSONに変換できる辞書を返します。"""
+        return asdict(self)
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "GenerationResult":
+        """
+        to_dictで作成した辞書からGenerationResultを作成します。
+
+        :param data: to_dictで作成した辞書
+        :return: GenerationResult
+        """
+        usage = data.get("usage")
+        return cls(**{**data, "usage": Usage(**usage) if usage is not None else None})
@@ -4,14 +4,28 @@ from dotenv import load_dotenv
 
 
 class APIKeyManager:
+    # プロセス内で共有する暗号化キーと、.envファイルの読み込み状態
+    # （インスタンスを作成するたびに鍵の生成と.envの読み込みを行わないようにする）
+    _process_encryption_key = None
+    _dotenv_loaded = False
+
     def __init__(self):
-        # 環境変数から暗号化キーを取得、または新しいキーを生成
-        self.encryption_key = os.environ.get("MOSAICAI_ENCRYPTION_KEY") or Fernet.generate_key()
+        # 環境変数から暗号化キーを取得、またはプロセス内で共有するキーを使用
+        self.encryption_key = (os.environ.get("MOSAICAI_ENCRYPTION_KEY")
+                               or self._get_process_encryption_key())
         self.fernet = Fernet(self.encryption_key)
         # APIキーを保存する辞書
         self.api_keys = {}
-        # .envファイルを読み込む
-        load_dotenv()
+        # .envファイルを読み込む（プロセス内で1回のみ）
+        if not APIKeyManager._dotenv_loaded:
+            load_dotenv()
+            APIKeyManager._dotenv_loaded = True
+
+    @classmethod
+    def _get_process_encryption_key(cls) -> bytes:
+        if cls._process_encryption_key is None:
+            cls._process_encryption_key = Fernet.generate_key()
+        return cls._process_encryption_key
 
     def set_api_key(self, model: str, api_key: str):
         # APIキーを暗号化して辞書に保存
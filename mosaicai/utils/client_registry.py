@@ -0,0 +1,249 @@
+import asyncio
+import hashlib
+import threading
+import weakref
+from typing import Any, Callable, Dict, Optional
+from .. import retry
+
+# HTTP接続プールの設定（OpenAI SDKの既定値に合わせる）
+_pool_config = {
+    "max_connections": 1000,
+    "max_keepalive_connections": 100,
+    "keepalive_expiry": 5.0,
+}
+
+_lock = threading.Lock()
+# 同期クライアントはプロセス全体で共有する
+_sync_scope: Dict[Any, Any] = {}
+# 非同期クライアントはイベントループごとに共有する（httpx.AsyncClientはループをまたいで使用できないため）
+_async_scopes: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[Any, Any]]" = \
+    weakref.WeakKeyDictionary()
+_unbound_async_scope: Dict[Any, Any] = {}
+_gemini_api_key: Optional[str] = None
+# プロバイダーごとのAPIのベースURL（モックサーバーやプロキシを使用する場合に設定する）
+_base_urls: Dict[str, str] = {}
+# HTTPトランスポートを置き換えるオブジェクト（mosaicai.cassette.Cassetteなど）
+_transport_hook: Optional[Any] = None
+
+
+def configure_http_pool(max_connections: Optional[int] = None,
+                        max_keepalive_connections: Optional[int] = None,
+                        keepalive_expiry: Optional[float] = None):
+    """
+    共有するHTTP接続プールの上限とキープアライブ時間を設定します。
+
+    設定は以降に作成されるクライアントに適用されます。既存のモデルインスタンスは
+    作成時の接続プールを引き続き使用します。
+
+    :param max_connections: 同時接続数の上限
+    :param max_keepalive_connections: キープアライブで保持する接続数の上限
+    :param keepalive_expiry: アイドル状態の接続を保持する秒数
+    """
+    with _lock:
+        if max_connections is not None:
+            _pool_config["max_connections"] = max_connections
+        if max_keepalive_connections is not None:
+            _pool_config["max_keepalive_connections"] = max_keepalive_connections
+        if keepalive_expiry is not None:
+            _pool_config["keepalive_expiry"] = keepalive_expiry
+        _clear_locked()
+
+
+def install_transport(hook: Optional[Any]):
+    """
+    以降に作成されるクライアントのHTTPトランスポートを置き換えます。
+    hookのtransport(inner)とasync_transport(inner)が、実際に通信を行うトランスポートを受け取って使用するトランスポートを返します。
+    既存のクライアントへの参照は破棄されます。
+
+    :param hook: トランスポートを作成するオブジェクト（Noneの場合は既定のトランスポートに戻す）
+    """
+    global _transport_hook
+    with _lock:
+        _transport_hook = hook
+        _clear_locked()
+
+
+def configure_base_url(provider: str, base_url: Optional[str]):
+    """
+    プロバイダーのAPIのベースURLを設定します。ローカルのモックサーバーやプロキシにリクエストを送る場合に使用します。
+
+    設定は以降に作成されるモデルインスタンスに適用されます。
+
+    :param provider: プロバイダー名（"openai"、"claude"、"perplexity"）
+    :param base_url: APIのベースURL（Noneの場合は既定値に戻す）
+    """
+    with _lock:
+        if base_url is None:
+            _base_urls.pop(provider, None)
+        else:
+            _base_urls[provider] = base_url
+
+
+def get_base_url(provider: str, default: Optional[str] = None) -> Optional[str]:
+    """
+    configure_base_urlで設定したプロバイダーのベースURLを返します。
+
+    :param provider: プロバイダー名
+    :param default: 設定されていない場合に返す値
+    :return: APIのベースURL
+    """
+    return _base_urls.get(provider, default)
+
+
+def clear_clients():
+    """
+    共有しているクライアントへの参照をすべて破棄します。
+    以降のget_*_client呼び出しでは新しいクライアントが作成されます。
+    """
+    with _lock:
+        _clear_locked()
+
+
+def _clear_locked():
+    global _gemini_api_key
+    _sync_scope.clear()
+    _async_scopes.clear()
+    _unbound_async_scope.clear()
+    _gemini_api_key = None
+
+
+def _key_id(api_key: Optional[str]) -> Optional[str]:
+    """APIキーをそのまま保持しないよう、識別用のハッシュに変換する"""
+    if api_key is None:
+        return None
+    return hashlib.sha256(api_key.encode()).hexdigest()
+
+
+def _limits():
+    import httpx
+    return httpx.Limits(**_pool_config)
+
+
+def _request_options() -> Dict[str, Any]:
+    """
+    SDKクライアントに共通するリクエストの設定
+    再試行はmosaicai.retryで行うため、SDK自身の再試行は無効にする
+    """
+    return {"timeout": retry.default_policy().timeout, "max_retries": 0}
+
+
+def _async_scope() -> Dict[Any, Any]:
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        return _unbound_async_scope
+    scope = _async_scopes.get(loop)
+    if scope is None:
+        scope = _async_scopes[loop] = {}
+    return scope
+
+
+def _get_or_create(scope: Dict[Any, Any], key: tuple, factory: Callable[[], Any]) -> Any:
+    with _lock:
+        client = scope.get(key)
+        if client is None:
+            client = scope[key] = factory()
+        return client
+
+
+def _new_http_client():
+    import httpx
+    from .image_upload import ImageUploadClient
+    # 送信するときに、リクエストに含まれるImagePlaceholderを画像に置き換える
+    if _transport_hook is None:
+        return ImageUploadClient(limits=_limits())
+    transport = _transport_hook.transport(httpx.HTTPTransport(limits=_limits()))
+    return ImageUploadClient(transport=transport)
+
+
+def _new_async_http_client():
+    import httpx
+    from .image_upload import AsyncImageUploadClient
+    if _transport_hook is None:
+        return AsyncImageUploadClient(limits=_limits())
+    transport = _transport_hook.async_transport(httpx.AsyncHTTPTransport(limits=_limits()))
+    return AsyncImageUploadClient(transport=transport)
+
+
+def _http_client():
+    return _get_or_create(_sync_scope, ("http",), _new_http_client)
+
+
+def _async_http_client():
+    return _get_or_create(_async_scope(), ("http",), _new_async_http_client)
+
+
+def get_openai_client(api_key: Optional[str], base_url: Optional[str] = None):
+    """
+    (APIキー, base_url) ごとに共有されるOpenAIクライアントを返します。
+    OpenAI SDKを使用するChatGPTとPerplexityは同じHTTP接続プールを共有します。
+
+    :param api_key: APIキー
+    :param base_url: APIのベースURL（Noneの場合はSDKの既定値）
+    :return: OpenAIクライアント
+    """
+    from openai import OpenAI
+    http_client = _http_client()
+    return _get_or_create(_sync_scope, ("openai", _key_id(api_key), base_url),
+                          lambda: OpenAI(api_key=api_key, base_url=base_url,
+                                         http_client=http_client, **_request_options()))
+
+
+def get_async_openai_client(api_key: Optional[str], base_url: Optional[str] = None):
+    """
+    get_openai_clientの非同期版です。実行中のイベントループごとに共有されます。
+
+    :param api_key: APIキー
+    :param base_url: APIのベースURL（Noneの場合はSDKの既定値）
+    :return: AsyncOpenAIクライアント
+    """
+    from openai import AsyncOpenAI
+    http_client = _async_http_client()
+    return _get_or_create(_async_scope(), ("openai", _key_id(api_key), base_url),
+                          lambda: AsyncOpenAI(api_key=api_key, base_url=base_url,
+                                              http_client=http_client, **_request_options()))
+
+
+def get_anthropic_client(api_key: Optional[str], base_url: Optional[str] = None):
+    """
+    (APIキー, base_url) ごとに共有されるAnthropicクライアントを返します。
+
+    :param api_key: APIキー
+    :param base_url: APIのベースURL（Noneの場合はSDKの既定値）
+    :return: Anthropicクライアント
+    """
+    from anthropic import Anthropic
+    http_client = _http_client()
+    return _get_or_create(_sync_scope, ("anthropic", _key_id(api_key), base_url),
+                          lambda: Anthropic(api_key=api_key, base_url=base_url,
+                                            http_client=http_client, **_request_options()))
+
+
+def get_async_anthropic_client(api_key: Optional[str], base_url: Optional[str] = None):
+    """
+    get_anthropic_clientの非同期版です。実行中のイベントループごとに共有されます。
+
+    :param api_key: APIキー
+    :param base_url: APIのベースURL（Noneの場合はSDKの既定値）
+    :return: AsyncAnthropicクライアント
+    """
+    from anthropic import AsyncAnthropic
+    http_client = _async_http_client()
+    return _get_or_create(_async_scope(), ("anthropic", _key_id(api_key), base_url),
+                          lambda: AsyncAnthropic(api_key=api_key, base_url=base_url,
+                                                 http_client=http_client, **_request_options()))
+
+
+def configure_gemini(api_key: str):
+    """
+    Google Generative AI SDKを設定します。
+    genai.configureは呼び出しのたびに接続を作り直すため、APIキーが変わった場合のみ呼び出します。
+
+    :param api_key: APIキー
+    """
+    global _gemini_api_key
+    import google.generativeai as genai
+    with _lock:
+        if _gemini_api_key != api_key:
+            genai.configure(api_key=api_key)
+            _gemini_api_key = api_key
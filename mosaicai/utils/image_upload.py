@@ -0,0 +1,74 @@
+import re
+from typing import Iterator, AsyncIterator, List, Union
+import httpx
+from ..images import PLACEHOLDER_PREFIX, ImagePlaceholder, find_placeholder, has_placeholders
+
+# リクエストの本文に含まれるImagePlaceholderの文字列
+_PLACEHOLDER_PATTERN = re.compile(re.escape(PLACEHOLDER_PREFIX.encode("ascii")) + rb"[0-9a-f]{32}")
+
+
+class _ImageStream(httpx.SyncByteStream, httpx.AsyncByteStream):
+    """ImagePlaceholderを、画像を少しずつbase64エンコードしたものに置き換えて送信するリクエストの本文"""
+
+    def __init__(self, parts: List[Union[bytes, ImagePlaceholder]]):
+        self._parts = parts
+
+    def __iter__(self) -> Iterator[bytes]:
+        for part in self._parts:
+            if isinstance(part, bytes):
+                yield part
+            else:
+                yield from part.iter_encoded()
+
+    async def __aiter__(self) -> AsyncIterator[bytes]:
+        for chunk in self:
+            yield chunk
+
+
+def expand_placeholders(request: httpx.Request) -> httpx.Request:
+    """
+    リクエストの本文に送信前のImagePlaceholderが含まれる場合、画像をエンコードしながら送信するストリームを
+    本文とする新しいリクエストを返します。含まれない場合は、requestをそのまま返します。
+
+    :param request: 送信するリクエスト
+    :return: 送信するリクエスト
+    """
+    if not has_placeholders() or not isinstance(request.stream, httpx.ByteStream):
+        return request
+    content = request.read()
+    if PLACEHOLDER_PREFIX.encode("ascii") not in content:
+        return request
+    parts: List[Union[bytes, ImagePlaceholder]] = []
+    position = 0
+    for match in _PLACEHOLDER_PATTERN.finditer(content):
+        placeholder = find_placeholder(match.group().decode("ascii"))
+        if placeholder is None:
+            continue
+        parts.append(content[position:match.start()])
+        parts.append(placeholder)
+        position = match.end()
+    if not parts:
+        return request
+    parts.append(content[position:])
+    headers = request.headers.copy()
+    headers["Content-Length"] = str(sum(len(part) if isinstance(part, bytes) else part.encoded_size
+                                        for part in parts))
+    return httpx.Request(request.method, request.url, headers=headers, stream=_ImageStream(parts),
+                         extensions=request.extensions)
+
+
+class ImageUploadClient(httpx.Client):
+    """
+    送信するときに、リクエストに含まれるImagePlaceholderを画像に置き換えるHTTPクライアントです。
+    client_registryがSDKに渡すHTTPクライアントとして作成します。
+    """
+
+    def send(self, request: httpx.Request, **kwargs) -> httpx.Response:
+        return super().send(expand_placeholders(request), **kwargs)
+
+
+class AsyncImageUploadClient(httpx.AsyncClient):
+    """ImageUploadClientの非同期版"""
+
+    async def send(self, request: httpx.Request, **kwargs) -> httpx.Response:
+        return await super().send(expand_placeholders(request), **kwargs)
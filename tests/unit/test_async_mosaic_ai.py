@@ -0,0 +1,89 @@
+import asyncio
+import pytest
+from unittest.mock import AsyncMock, Mock
+from mosaicai import AsyncMosaicAI
+from pydantic import BaseModel
+
+
+class OutputSchema(BaseModel):
+    name: str
+    age: int
+
+
+@pytest.fixture
+def async_mosaicai(monkeypatch):
+    monkeypatch.setenv("OPENAI_API_KEY", "test-openai-key")
+    return AsyncMosaicAI("gpt-4o")
+
+
+def _completion(content):
+    return Mock(choices=[Mock(message=Mock(content=content))])
+
+
+def test_generate_text(async_mosaicai):
+    """generate_textが非同期SDKを使用して結果を返すことを確認"""
+    model = async_mosaicai.models["gpt-4o"]
+    model.async_client = Mock()
+    model.async_client.chat.completions.create = AsyncMock(
+        return_value=_completion("Async response"))
+
+    result = asyncio.run(async_mosaicai.generate_text("Test prompt"))
+    assert result == "Async response"
+    model.async_client.chat.completions.create.assert_awaited_once()
+
+
+def test_generate_json(async_mosaicai):
+    """generate_jsonがスキーマに従って型変換された結果を返すことを確認"""
+    model = async_mosaicai.models["gpt-4o"]
+    model.async_client = Mock()
+    model.async_client.chat.completions.create = AsyncMock(
+        return_value=_completion('{"name": "John", "age": "30"}'))
+
+    result = asyncio.run(async_mosaicai.generate_json("Create a person", OutputSchema))
+    assert result == {"name": "John", "age": 30}
+
+
+def test_generate_with_image_json(async_mosaicai):
+    """generate_with_image_jsonが画像をエンコードしてリクエストに含めることを確認"""
+    model = async_mosaicai.models["gpt-4o"]
+    model.async_client = Mock()
+    model.async_client.chat.completions.create = AsyncMock(
+        return_value=_completion('{"name": "Cat", "age": 2}'))
+
+    result = asyncio.run(async_mosaicai.generate_with_image_json(
+        "Analyze this image", "./tests/test_image.jpg", OutputSchema))
+    assert result == {"name": "Cat", "age": 2}
+    messages = model.async_client.chat.completions.create.call_args[1]["messages"]
+    assert messages[1]["content"][1]["type"] == "image_url"
+
+
+def test_concurrent_requests(async_mosaicai):
+    """1つのイベントループで複数のリクエストが並行して処理されることを確認"""
+    in_flight = 0
+    max_in_flight = 0
+
+    async def create(**kwargs):
+        nonlocal in_flight, max_in_flight
+        in_flight += 1
+        max_in_flight = max(max_in_flight, in_flight)
+        await asyncio.sleep(0.01)
+        in_flight -= 1
+        return _completion(kwargs["messages"][0]["content"])
+
+    model = async_mosaicai.models["gpt-4o"]
+    model.async_client = Mock()
+    model.async_client.chat.completions.create = create
+
+    async def run():
+        return await asyncio.gather(
+            *(async_mosaicai.generate_text(f"prompt {i}") for i in range(50)))
+
+    results = asyncio.run(run())
+    assert results == [f"prompt {i}" for i in range(50)]
+    assert max_in_flight == 50
+
+
+def test_empty_prompt(async_mosaicai):
+    """空のプロンプトでValueErrorが発生することを確認"""
+    with pytest.raises(ValueError):
+        asyncio.run(async_mosaicai.generate_text("  "))
@@ -0,0 +1,134 @@
+import asyncio
+import threading
+import time
+import pytest
+from unittest.mock import patch
+from mosaicai import MosaicAI, AsyncMosaicAI
+from mosaicai.batch import BatchResult, build_batch_items, run_batch, run_batch_async
+
+
+def test_build_batch_items():
+    """プロンプトと項目ごとの引数が正しく組み合わされることを確認"""
+    items = list(build_batch_items(["a", "b"], None, ["x.jpg", None]))
+    assert items == [("a", (None, "x.jpg")), ("b", (None, None))]
+
+
+def test_run_batch_preserves_order():
+    """ordered=Trueの場合、完了順に関係なく入力順で結果が返されることを確認"""
+    def func(prompt):
+        time.sleep(0.05 if prompt == "0" else 0)
+        return prompt.upper()
+
+    results = list(run_batch(func, build_batch_items(["0", "1", "2"]), max_concurrency=3))
+    assert [r.index for r in results] == [0, 1, 2]
+    assert [r.result for r in results] == ["0", "1", "2"]
+
+
+def test_run_batch_as_completed():
+    """ordered=Falseの場合、完了順で結果が返されることを確認"""
+    def func(prompt):
+        time.sleep(0.1 if prompt == "slow" else 0)
+        return prompt
+
+    items = build_batch_items(["slow", "fast"])
+    results = list(run_batch(func, items, max_concurrency=2, ordered=False))
+    assert [r.prompt for r in results] == ["fast", "slow"]
+
+
+@pytest.mark.parametrize("ordered, expected", [(True, ["slow", "fast"]), (False, ["fast", "slow"])])
+def test_run_batch_async_order(ordered, expected):
+    """run_batch_asyncがorderedに応じて入力順または完了順で結果を返すことを確認"""
+    async def func(prompt):
+        await asyncio.sleep(0.05 if prompt == "slow" else 0)
+        return prompt
+
+    async def collect():
+        items = build_batch_items(["slow", "fast"])
+        return [r async for r in run_batch_async(func, items, max_concurrency=2, ordered=ordered)]
+
+    results = asyncio.run(collect())
+    assert [r.prompt for r in results] == expected
+    assert [r.result for r in results] == expected
+
+
+def test_run_batch_limits_concurrency():
+    """同時実行数がmax_concurrencyを超えないことを確認"""
+    lock = threading.Lock()
+    state = {"current": 0, "max": 0}
+
+    def func(prompt):
+        with lock:
+            state["current"] += 1
+            state["max"] = max(state["max"], state["current"])
+        time.sleep(0.01)
+        with lock:
+            state["current"] -= 1
+        return prompt
+
+    results = list(run_batch(func, build_batch_items(str(i) for i in range(20)), max_concurrency=3))
+    assert len(results) == 20
+    assert state["max"] <= 3
+
+
+def test_run_batch_collects_errors():
+    """一部の項目で例外が発生してもバッチ全体が中断されないことを確認"""
+    def func(prompt):
+        if prompt == "bad":
+            raise RuntimeError("failure")
+        return prompt
+
+    results = list(run_batch(func, build_batch_items(["ok", "bad", "ok2"])))
+    assert [r.ok for r in results] == [True, False, True]
+    assert isinstance(results[1].error, RuntimeError)
+
+
+def test_run_batch_invalid_concurrency():
+    """max_concurrencyが0以下の場合にValueErrorが発生することを確認"""
+    with pytest.raises(ValueError):
+        list(run_batch(lambda p: p, build_batch_items(["a"]), max_concurrency=0))
+
+
+def test_generate_json_batch(monkeypatch):
+    """generate_json_batchが項目ごとのスキーマと画像を振り分けることを確認"""
+    monkeypatch.setenv("OPENAI_API_KEY", "test-openai-key")
+    client = MosaicAI("gpt-4o")
+    schema = {"name": "str"}
+    with patch.object(MosaicAI, 'generate_json', return_value={"name": "text"}) as mock_json, \
+            patch.object(MosaicAI, 'generate_with_image_json',
+                         return_value={"name": "image"}) as mock_image:
+        results = list(client.generate_json_batch(["a", "b"], schema,
+                                                  image_paths=[None, "img.jpg"]))
+
+    assert [r.result for r in results] == [{"name": "text"}, {"name": "image"}]
+    mock_json.assert_called_once_with("a", schema)
+    mock_image.assert_called_once_with("b", "img.jpg", schema)
+
+
+def test_generate_text_batch_empty_prompt(monkeypatch):
+    """空のプロンプトはその項目のエラーとして返されることを確認"""
+    monkeypatch.setenv("OPENAI_API_KEY", "test-openai-key")
+    client = MosaicAI("gpt-4o")
+    with patch.object(client.models["gpt-4o"], 'generate', return_value="ok"):
+        results = list(client.generate_text_batch(["hello", " "]))
+
+    assert results[0].result == "ok"
+    assert isinstance(results[1].error, ValueError)
+
+
+def test_async_generate_text_batch(monkeypatch):
+    """AsyncMosaicAIのgenerate_text_batchが入力順で結果を返すことを確認"""
+    monkeypatch.setenv("OPENAI_API_KEY", "test-openai-key")
+    client = AsyncMosaicAI("gpt-4o")
+
+    async def generate_async(prompt):
+        await asyncio.sleep(0.01 * (3 - int(prompt)))
+        return f"result {prompt}"
+
+    client.models["gpt-4o"].generate_async = generate_async
+
+    async def run():
+        return [r async for r in client.generate_text_batch(["0", "1", "2"], max_concurrency=2)]
+
+    results = asyncio.run(run())
+    assert [r.result for r in results] == ["result 0", "result 1", "result 2"]
+    assert all(isinstance(r, BatchResult) for r in results)
@@ -0,0 +1,169 @@
+import time
+from unittest.mock import Mock, patch
+from PIL import Image
+from mosaicai import ImageCache, ImagePolicy, MosaicAI, ResponseCache
+from mosaicai.cache import MemoryCache, SQLiteCache, make_cache_key
+from pydantic import BaseModel
+
+
+class OutputSchema(BaseModel):
+    name: str
+    age: int
+
+
+def test_make_cache_key_is_stable(tmp_path):
+    """同じリクエストには同じキー、異なるリクエストには異なるキーが生成されることを確認"""
+    image_a = tmp_path / "a.jpg"
+    image_b = tmp_path / "b.jpg"
+    image_a.write_bytes(b"same")
+    image_b.write_bytes(b"same")
+
+    key = make_cache_key("gpt-4o", "generate_json", "prompt", OutputSchema)
+    assert key == make_cache_key("gpt-4o", "generate_json", "prompt", OutputSchema)
+    assert key != make_cache_key("claude-3-5-sonnet-20240620", "generate_json", "prompt",
+                                 OutputSchema)
+    assert key != make_cache_key("gpt-4o", "generate_json", "prompt", {"name": "str"})
+    # 画像はパスではなく内容で識別される
+    assert make_cache_key("gpt-4o", "generate_with_image", "p", image_path=str(image_a)) == \
+        make_cache_key("gpt-4o", "generate_with_image", "p", image_path=str(image_b))
+
+
+def test_memory_cache_lru_eviction():
+    """上限を超えた場合、最も古く使用されたエントリが削除されることを確認"""
+    cache = MemoryCache(max_entries=2)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")
+    cache.set("c", 3)
+    assert cache.get("a") == 1
+    assert cache.get("b") is None
+    assert len(cache) == 2
+
+
+def test_memory_cache_ttl():
+    """TTLを過ぎたエントリが返されないことを確認"""
+    cache = MemoryCache(ttl=0.01)
+    cache.set("a", "value")
+    time.sleep(0.02)
+    assert cache.get("a") is None
+
+
+def test_sqlite_cache_persists_and_evicts_by_size(tmp_path):
+    """SQLiteキャッシュが値を永続化し、サイズの上限で古いエントリを削除することを確認"""
+    path = str(tmp_path / "cache.db")
+    cache = SQLiteCache(path, max_bytes=30)
+    cache.set("a", {"text": "aaaaaaaaaa"})
+    cache.close()
+
+    cache = SQLiteCache(path, max_bytes=30)
+    assert cache.get("a") == {"text": "aaaaaaaaaa"}
+    cache.set("b", {"text": "bbbbbbbbbb"})
+    assert cache.get("a") is None
+    assert cache.get("b") == {"text": "bbbbbbbbbb"}
+    assert cache._conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+
+
+def test_response_cache_tiers_and_stats(tmp_path):
+    """ディスクでヒットした値がメモリに昇格され、統計情報が記録されることを確認"""
+    path = str(tmp_path / "cache.db")
+    ResponseCache(path=path).set("key", "value")
+
+    cache = ResponseCache(path=path)
+    assert cache.get("missing") is None
+    assert cache.get("key") == "value"
+    assert cache.get("key") == "value"
+    assert cache.stats() == {"hits": 2, "memory_hits": 1, "disk_hits": 1, "misses": 1}
+
+
+def test_response_cache_returns_copies():
+    """返された値を変更してもキャッシュが影響を受けないことを確認"""
+    cache = ResponseCache()
+    cache.set("key", {"items": [1]})
+    cache.get("key")["items"].append(2)
+    assert cache.get("key") == {"items": [1]}
+
+
+def test_mosaicai_uses_cache(monkeypatch):
+    """MosaicAIが同一のリクエストでモデルを再度呼び出さないことを確認"""
+    monkeypatch.setenv("OPENAI_API_KEY", "test-openai-key")
+    cache = ResponseCache()
+    client = MosaicAI("gpt-4o", cache=cache)
+    model = client.models["gpt-4o"]
+    with patch.object(model, 'generate_json',
+                      return_value={"name": "John", "age": 30}) as mock_generate:
+        first = client.generate_json("Create a person", OutputSchema)
+        second = client.generate_json("Create a person", OutputSchema)
+        client.generate_json("Create another person", OutputSchema)
+
+    assert first == second == {"name": "John", "age": 30}
+    assert mock_generate.call_count == 2
+    assert cache.stats()["hits"] == 1
+
+
+def test_image_cache_lru_by_bytes(tmp_path):
+    """ペイロードの合計サイズが上限を超えた場合、最も古く使用されたエントリが削除されることを確認"""
+    paths = []
+    for name in ("a", "b", "c"):
+        paths.append(str(tmp_path / f"{name}.jpg"))
+        with open(paths[-1], "wb") as f:
+            f.write(name.encode())
+    cache = ImageCache(max_bytes=250)
+    create = Mock(side_effect=lambda: "x" * 100)
+
+    cache.get_or_create(paths[0], "base64", create)
+    cache.get_or_create(paths[1], "base64", create)
+    cache.get_or_create(paths[0], "base64", create)
+    cache.get_or_create(paths[2], "base64", create)
+    assert create.call_count == 3
+    assert cache.stats() == {"hits": 1, "misses": 3, "evictions": 1, "entries": 2, "bytes": 200}
+    # 最も古く使用されたbが削除されている
+    cache.get_or_create(paths[0], "base64", create)
+    assert create.call_count == 3
+    # 上限より大きいペイロードは保存しない
+    assert cache.get_or_create(paths[1], "data_url", lambda: "y" * 300) == "y" * 300
+    assert len(cache) == 2
+
+
+def test_image_cache_invalidated_by_file_change(tmp_path):
+    """画像ファイルが更新された場合はキャッシュしたペイロードを使用せず、by_digestの場合は内容で識別されることを確認"""
+    path = str(tmp_path / "image.jpg")
+    with open(path, "wb") as f:
+        f.write(b"first")
+    cache = ImageCache()
+    assert cache.get_or_create(path, "base64", lambda: "first") == "first"
+    with open(path, "wb") as f:
+        f.write(b"second!")
+    assert cache.get_or_create(path, "base64", lambda: "second") == "second"
+
+    digest_cache = ImageCache(by_digest=True)
+    copy_path = str(tmp_path / "copy.jpg")
+    with open(copy_path, "wb") as f:
+        f.write(b"second!")
+    digest_cache.get_or_create(path, "base64", lambda: "second")
+    assert digest_cache.get_or_create(copy_path, "base64", lambda: "other") == "second"
+
+
+def test_models_share_image_cache(monkeypatch, tmp_path):
+    """MosaicAIのモデルが、同じ画像のエンコードをプロバイダーと前処理の方針ごとに1回だけ行うことを確認"""
+    monkeypatch.setenv("OPENAI_API_KEY", "test-openai-key")
+    monkeypatch.setenv("ANTHROPIC_API_KEY", "test-anthropic-key")
+    path = str(tmp_path / "photo.png")
+    Image.new("RGB", (64, 48), (200, 100, 50)).save(path)
+    cache = ImageCache()
+    client = MosaicAI("gpt-4o", image_cache=cache)
+    claude = client.initialize_model("claude-3-5-sonnet-20240620")
+    chatgpt = client.models["gpt-4o"]
+
+    with patch.object(claude, "_encode_image", wraps=claude._encode_image) as encode:
+        first = claude._request("1つ目の質問", image_path=path)
+        second = claude._request("2つ目の質問", image_path=path)
+    assert encode.call_count == 1
+    assert first["messages"][0]["content"][1] == second["messages"][0]["content"][1]
+    assert chatgpt._image_content("質問", path) == chatgpt._image_content("質問", path)
+    assert cache.stats()["hits"] == 2 and cache.stats()["entries"] == 2
+
+    # 前処理の方針が異なる場合は別のペイロードとして扱う
+    claude.image_policy = ImagePolicy(format="WEBP")
+    source = claude._request("質問", image_path=path)["messages"][0]["content"][1]["source"]
+    assert source["media_type"] == "image/webp"
+    assert cache.stats()["entries"] == 3
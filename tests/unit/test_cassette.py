@@ -0,0 +1,106 @@
+import asyncio
+import json
+import time
+import pytest
+from mosaicai import AsyncMosaicAI, MosaicAI, RetryPolicy
+from mosaicai.cassette import Cassette
+from mosaicai.exceptions import CassetteMismatchError
+from mosaicai.testing import MockBehavior, MockProviderServer
+from mosaicai.utils import client_registry
+
+GPT = "gpt-4o"
+CLAUDE = "claude-3-5-sonnet-20240620"
+
+
+@pytest.fixture(autouse=True)
+def api_keys(monkeypatch):
+    monkeypatch.setenv("OPENAI_API_KEY", "sk-secret-openai-key")
+    monkeypatch.setenv("ANTHROPIC_API_KEY", "sk-ant-secret-key")
+    yield
+    client_registry.install_transport(None)
+    for provider in ("openai", "claude", "perplexity"):
+        client_registry.configure_base_url(provider, None)
+
+
+@pytest.fixture
+def recorded(tmp_path):
+    """モックサーバーへのリクエストを記録したカセットのパスを返す"""
+    path = str(tmp_path / "cassettes" / "session.json")
+    with MockProviderServer(MockBehavior(text="記録した応答", latency=0.2, chunk_delay=0.02)) as server:
+        server.configure_clients()
+        with Cassette(path, mode="record"):
+            assert MosaicAI(GPT).generate_text("こんにちは") == "記録した応答"
+            stream = MosaicAI(CLAUDE).generate_text_stream("こんにちは")
+            assert "".join(delta.text for delta in stream) == "記録した応答"
+    # サーバーを停止した後も、記録したときと同じベースURLにリクエストを送る
+    return path
+
+
+def test_recorded_file_has_no_secrets(recorded):
+    """記録したファイルに、認証情報を含まない正規化されたリクエストと応答が保存されることを確認"""
+    with open(recorded, encoding="utf-8") as f:
+        text = f.read()
+    data = json.loads(text)
+
+    assert "sk-secret-openai-key" not in text and "sk-ant-secret-key" not in text
+    assert len(data["interactions"]) == 2
+    request = data["interactions"][0]["request"]
+    assert request["body"] == {"messages": [{"role": "user", "content": "こんにちは"}], "model": GPT}
+    assert set(request["headers"]) == {"content-type"}
+    response = data["interactions"][0]["response"]
+    assert response["status"] == 200 and response["elapsed"] >= 0.2
+    assert len(data["interactions"][1]["response"]["chunks"]) > 1
+
+
+def test_replay_without_network(recorded):
+    """サーバーを停止した後も、記録した応答が再生されることを確認"""
+    with Cassette(recorded, speed=None):
+        client = MosaicAI(GPT)
+        assert client.generate_text("こんにちは") == "記録した応答"
+        # 記録した回数より多いリクエストには、記録した応答を繰り返し返す
+        assert client.generate_text("こんにちは") == "記録した応答"
+        stream = MosaicAI(CLAUDE).generate_text_stream("こんにちは")
+        assert "".join(delta.text for delta in stream) == "記録した応答"
+        assert stream.usage is not None
+
+
+def test_replay_speed(recorded):
+    """記録した応答時間どおり、またはspeed倍の速さで再生されることを確認"""
+    with Cassette(recorded, speed=1.0):
+        start = time.perf_counter()
+        MosaicAI(GPT).generate_text("こんにちは")
+        original = time.perf_counter() - start
+    with Cassette(recorded, speed=10.0):
+        start = time.perf_counter()
+        MosaicAI(GPT).generate_text("こんにちは")
+        accelerated = time.perf_counter() - start
+
+    assert original >= 0.2
+    assert accelerated < original / 2
+
+
+def test_async_replay(recorded):
+    """AsyncMosaicAIでも記録した応答が再生されることを確認"""
+    with Cassette(recorded, speed=None):
+        assert asyncio.run(AsyncMosaicAI(GPT).generate_text("こんにちは")) == "記録した応答"
+
+
+def test_mismatch_is_not_retried(recorded):
+    """記録にないリクエストはCassetteMismatchErrorとなり、再試行されないことを確認"""
+    with Cassette(recorded, speed=None, repeat=False) as cassette:
+        client = MosaicAI(GPT, retry_policy=RetryPolicy(max_retries=3, base_delay=1.0))
+        start = time.perf_counter()
+        with pytest.raises(CassetteMismatchError):
+            client.generate_text("記録していないプロンプト")
+        assert time.perf_counter() - start < 1.0
+
+        client.generate_text("こんにちは")
+        with pytest.raises(CassetteMismatchError):
+            client.generate_text("こんにちは")
+    assert cassette.mode == "replay"
+
+
+def test_invalid_mode(tmp_path):
+    """不正なmodeを指定した場合にValueErrorが発生することを確認"""
+    with pytest.raises(ValueError):
+        Cassette(str(tmp_path / "cassette.json"), mode="rewind")
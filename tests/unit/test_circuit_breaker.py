@@ -0,0 +1,188 @@
+import asyncio
+import time
+import pytest
+from unittest.mock import patch
+from mosaicai import AsyncMosaicAI, CircuitBreakerPolicy, CircuitOpenError, HedgePolicy, MosaicAI
+from mosaicai import circuit_breaker
+from mosaicai.circuit_breaker import CircuitBreaker
+from mosaicai.models.chatgpt import ChatGPT
+from mosaicai.models.claude import Claude
+
+
+@pytest.fixture(autouse=True)
+def api_keys(monkeypatch):
+    monkeypatch.setenv("OPENAI_API_KEY", "fake_openai_key")
+    monkeypatch.setenv("ANTHROPIC_API_KEY", "fake_anthropic_key")
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(circuit_breaker.time, "monotonic", lambda: now[0])
+    return now
+
+
+def test_breaker_opens_on_failure_rate(clock):
+    """失敗の割合がしきい値を超えるとオープン状態になることを確認"""
+    breaker = CircuitBreaker(failure_rate_threshold=0.5, window_size=4, minimum_calls=4)
+    breaker.record_success(0.1)
+    breaker.record_success(0.1)
+    breaker.record_failure()
+    assert breaker.state == circuit_breaker.CLOSED
+    breaker.record_failure()
+    assert breaker.state == circuit_breaker.OPEN
+    assert not breaker.allow_request()
+
+
+def test_breaker_counts_slow_calls_as_failures(clock):
+    """slow_call_thresholdより遅い呼び出しが失敗として扱われることを確認"""
+    breaker = CircuitBreaker(slow_call_threshold=1.0, window_size=2, minimum_calls=2)
+    breaker.record_success(5.0)
+    breaker.record_success(5.0)
+    assert breaker.state == circuit_breaker.OPEN
+
+
+def test_breaker_half_open_probe(clock):
+    """reset_timeoutの経過後に試行リクエストが許可され、その結果で状態が変わることを確認"""
+    breaker = CircuitBreaker(window_size=1, minimum_calls=1, reset_timeout=30,
+                             half_open_max_calls=1)
+    breaker.record_failure()
+    assert not breaker.allow_request()
+
+    clock[0] += 30
+    assert breaker.state == circuit_breaker.HALF_OPEN
+    assert breaker.allow_request()
+    assert not breaker.allow_request()
+    breaker.record_failure()
+    assert breaker.state == circuit_breaker.OPEN
+
+    clock[0] += 30
+    assert breaker.allow_request()
+    breaker.record_success(0.1)
+    assert breaker.state == circuit_breaker.CLOSED
+    assert breaker.allow_request()
+
+
+def test_breaker_release_returns_probe(clock):
+    """成否を記録せずに返却された試行リクエストの後、次の試行リクエストが許可されることを確認"""
+    breaker = CircuitBreaker(window_size=1, minimum_calls=1, reset_timeout=30,
+                             half_open_max_calls=1)
+    breaker.record_failure()
+    clock[0] += 30
+    assert breaker.available()
+    assert breaker.allow_request()
+    assert not breaker.available()
+    breaker.release()
+    assert breaker.state == circuit_breaker.HALF_OPEN
+    assert breaker.allow_request()
+
+
+def test_failover_to_next_model():
+    """使用中のモデルが失敗した場合、fallback_modelsのモデルに切り替わることを確認"""
+    policy = CircuitBreakerPolicy(window_size=2, minimum_calls=2)
+    client = MosaicAI("claude-3-5-sonnet-20240620", fallback_models=["gpt-4o"],
+                      circuit_breaker=policy)
+
+    with patch.object(Claude, "generate", side_effect=ConnectionError("503")) as claude_generate, \
+            patch.object(ChatGPT, "generate", return_value="gpt-4oの応答") as chatgpt_generate:
+        assert client.generate_text("こんにちは") == "gpt-4oの応答"
+        assert client.generate_text("こんにちは") == "gpt-4oの応答"
+        # ブレーカーがオープンになった後は、Claudeにリクエストを送信しない
+        assert client.generate_text("こんにちは") == "gpt-4oの応答"
+
+    assert claude_generate.call_count == 2
+    assert chatgpt_generate.call_count == 3
+    assert policy.breaker("claude-3-5-sonnet-20240620").state == circuit_breaker.OPEN
+
+
+def test_raises_circuit_open_error_when_no_model_is_available():
+    """すべてのモデルのブレーカーがオープン状態の場合、すぐにCircuitOpenErrorが送出されることを確認"""
+    policy = CircuitBreakerPolicy(window_size=1, minimum_calls=1)
+    client = MosaicAI("gpt-4o", circuit_breaker=policy)
+
+    with patch.object(ChatGPT, "generate", side_effect=TimeoutError("timeout")) as generate:
+        with pytest.raises(TimeoutError):
+            client.generate_text("こんにちは")
+        with pytest.raises(CircuitOpenError):
+            client.generate_text("こんにちは")
+    assert generate.call_count == 1
+
+
+def test_last_error_is_raised_when_all_models_fail():
+    """すべてのモデルが失敗した場合、最後のエラーが送出されることを確認"""
+    client = MosaicAI("claude-3-5-sonnet-20240620", fallback_models=["gpt-4o"],
+                      circuit_breaker=CircuitBreakerPolicy())
+
+    with patch.object(Claude, "generate_json", side_effect=ConnectionError("claude")), \
+            patch.object(ChatGPT, "generate_json", side_effect=TimeoutError("gpt")):
+        with pytest.raises(TimeoutError, match="gpt"):
+            client.generate_json("こんにちは", {"answer": "str"})
+
+
+def test_fallback_models_use_shared_default_policy():
+    """circuit_breakerを省略した場合、共有の既定の方針が使用されることを確認"""
+    client = MosaicAI("gpt-4o", fallback_models=["claude-3-5-sonnet-20240620"])
+    assert client.circuit_breaker is circuit_breaker.default_policy
+    assert MosaicAI("gpt-4o").circuit_breaker is None
+
+
+def test_async_failover():
+    """AsyncMosaicAIでもfallback_modelsのモデルに切り替わることを確認"""
+    client = AsyncMosaicAI("gpt-4o", fallback_models=["claude-3-5-sonnet-20240620"],
+                           circuit_breaker=CircuitBreakerPolicy())
+
+    with patch.object(ChatGPT, "generate_with_image_async", side_effect=ConnectionError("503")), \
+            patch.object(Claude, "generate_with_image_async", return_value="Claudeの応答"):
+        result = asyncio.run(client.generate_with_image("説明してください", "image.jpg"))
+    assert result == "Claudeの応答"
+
+
+def test_caller_error_is_not_failed_over():
+    """入力の誤りによるエラーはフォールバックせずに送出され、サーキットブレーカーに記録されないことを確認"""
+    policy = CircuitBreakerPolicy(window_size=1, minimum_calls=1)
+    client = MosaicAI("gpt-4o-mini", fallback_models=["claude-3-5-sonnet-20240620"],
+                      circuit_breaker=policy)
+
+    with patch.object(Claude, "generate_with_image", return_value="Claudeの応答") as claude_generate:
+        for _ in range(2):
+            with pytest.raises(FileNotFoundError):
+                client.generate_with_image("説明してください", "/nonexistent.png")
+    claude_generate.assert_not_called()
+    assert policy.breaker("gpt-4o-mini").state == circuit_breaker.CLOSED
+
+
+def test_hedge_skips_open_model():
+    """ヘッジリクエストの送信先のサーキットブレーカーがオープン状態の場合、ヘッジリクエストを送信しないことを確認"""
+    policy = CircuitBreakerPolicy(window_size=1, minimum_calls=1)
+    policy.breaker("claude-3-5-sonnet-20240620").record_failure()
+    hedge = HedgePolicy(delay=0.0, max_hedge_rate=1.0, model="claude-3-5-sonnet-20240620")
+    client = MosaicAI("gpt-4o", circuit_breaker=policy, hedge=hedge)
+
+    def slow(self, prompt):
+        time.sleep(0.1)
+        return "gpt-4oの応答"
+
+    with patch.object(ChatGPT, "generate", slow), \
+            patch.object(Claude, "generate") as claude_generate:
+        assert client.generate_text("こんにちは") == "gpt-4oの応答"
+    claude_generate.assert_not_called()
+
+
+def test_async_race_releases_cancelled_probe():
+    """ハーフオープン状態のモデルがrace_jsonで負けてキャンセルされても、試行リクエストが返却されることを確認"""
+    policy = CircuitBreakerPolicy(window_size=1, minimum_calls=1, reset_timeout=0)
+    breaker = policy.breaker("gpt-4o-mini")
+    breaker.record_failure()
+    client = AsyncMosaicAI("gpt-4o-mini", circuit_breaker=policy)
+
+    async def slow(self, prompt, schema):
+        await asyncio.sleep(5)
+        return {"answer": "gpt"}
+
+    with patch.object(ChatGPT, "generate_json_async", slow), \
+            patch.object(Claude, "generate_json_async", return_value={"answer": "claude"}):
+        result = asyncio.run(client.race_json("こんにちは", {"answer": "str"},
+                                              ["gpt-4o-mini", "claude-3-5-sonnet-20240620"]))
+    assert result == {"answer": "claude"}
+    assert breaker.state == circuit_breaker.HALF_OPEN
+    assert breaker.allow_request()
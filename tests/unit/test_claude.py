@@ -1,5 +1,6 @@
+import asyncio
 import pytest
-from unittest.mock import Mock, patch, mock_open
+from unittest.mock import AsyncMock, Mock, patch, mock_open
 from mosaicai.models.claude import Claude
 from mosaicai.utils.api_key_manager import APIKeyManager
 from anthropic import Anthropic
@@ -114,3 +115,15 @@ def test_generate_with_image_json(mock_guess_type, mock_b64encode, mock_file, cl
                       "key_float": 1.23, "key_bool": True, "key_list": ["a", "b", "c"]}
     claude_instance.client.messages.create.assert_called_once()
     mock_file.assert_called_once_with("./tests/test_image.jpg", "rb")
+
+
+def test_generate_async(claude_instance):
+    """generate_asyncメソッドのテスト"""
+    mock_response = Mock()
+    mock_response.content = [Mock(text="Generated async response")]
+    claude_instance.async_client = Mock()
+    claude_instance.async_client.messages.create = AsyncMock(return_value=mock_response)
+
+    result = asyncio.run(claude_instance.generate_async("Test message"))
+    assert result == "Generated async response"
+    claude_instance.async_client.messages.create.assert_awaited_once()
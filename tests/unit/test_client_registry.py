@@ -0,0 +1,85 @@
+import asyncio
+import pytest
+from unittest.mock import patch
+from mosaicai import MosaicAI
+from mosaicai.utils import client_registry
+from mosaicai.utils.api_key_manager import APIKeyManager
+
+
+@pytest.fixture(autouse=True)
+def clear_registry():
+    client_registry.clear_clients()
+    yield
+    client_registry.clear_clients()
+
+
+def test_sync_clients_are_shared_per_key_and_base_url():
+    """同じ (APIキー, base_url) には同じクライアントが返されることを確認"""
+    client = client_registry.get_openai_client("key-a")
+    assert client_registry.get_openai_client("key-a") is client
+    assert client_registry.get_openai_client("key-b") is not client
+    assert client_registry.get_openai_client("key-a", "https://api.perplexity.ai") is not client
+
+
+def test_openai_and_perplexity_share_connection_pool():
+    """ChatGPTとPerplexityのクライアントが同じHTTP接続プールを使用することを確認"""
+    openai_client = client_registry.get_openai_client("key-a")
+    perplexity_client = client_registry.get_openai_client("key-b", "https://api.perplexity.ai")
+    anthropic_client = client_registry.get_anthropic_client("key-c")
+    assert openai_client._client is perplexity_client._client is anthropic_client._client
+
+
+def test_configure_http_pool():
+    """接続プールの設定が以降に作成されるクライアントに適用されることを確認"""
+    before = client_registry.get_openai_client("key-a")
+    client_registry.configure_http_pool(max_connections=10, max_keepalive_connections=5,
+                                        keepalive_expiry=30)
+    try:
+        after = client_registry.get_openai_client("key-a")
+        assert after is not before
+        pool = after._client._transport._pool
+        assert pool._max_connections == 10
+        assert pool._max_keepalive_connections == 5
+        assert pool._keepalive_expiry == 30
+    finally:
+        client_registry.configure_http_pool(max_connections=1000, max_keepalive_connections=100,
+                                            keepalive_expiry=5.0)
+
+
+def test_async_clients_are_shared_per_event_loop():
+    """非同期クライアントがイベントループ内では共有され、ループごとに分かれることを確認"""
+    async def get_clients():
+        return (client_registry.get_async_openai_client("key-a"),
+                client_registry.get_async_openai_client("key-a"))
+
+    first, second = asyncio.run(get_clients())
+    other, _ = asyncio.run(get_clients())
+    assert first is second
+    assert other is not first
+
+
+def test_mosaicai_instances_share_clients(monkeypatch):
+    """複数のMosaicAIインスタンスが同じSDKクライアントを使用することを確認"""
+    monkeypatch.setenv("OPENAI_API_KEY", "shared-key")
+    first = MosaicAI("gpt-4o")
+    second = MosaicAI("gpt-4o-mini")
+    assert first.models["gpt-4o"].client is second.models["gpt-4o-mini"].client
+
+
+def test_api_key_manager_reuses_process_state(monkeypatch):
+    """APIKeyManagerが暗号化キーを共有し、.envを1回だけ読み込むことを確認"""
+    monkeypatch.delenv("MOSAICAI_ENCRYPTION_KEY", raising=False)
+    with patch("mosaicai.utils.api_key_manager.load_dotenv") as mock_load_dotenv:
+        first = APIKeyManager()
+        second = APIKeyManager()
+    assert first.encryption_key == second.encryption_key
+    assert mock_load_dotenv.call_count <= 1
+
+
+def test_configure_gemini_only_when_key_changes():
+    """genai.configureがAPIキーの変更時のみ呼び出されることを確認"""
+    with patch("google.generativeai.configure") as mock_configure:
+        client_registry.configure_gemini("key-a")
+        client_registry.configure_gemini("key-a")
+        client_registry.configure_gemini("key-b")
+    assert mock_configure.call_count == 2
@@ -0,0 +1,134 @@
+import asyncio
+import threading
+import time
+import pytest
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import patch
+from mosaicai import AsyncMosaicAI, MosaicAI, RequestCoalescer, ResponseCache
+from mosaicai.models.chatgpt import ChatGPT
+
+
+@pytest.fixture(autouse=True)
+def api_keys(monkeypatch):
+    monkeypatch.setenv("OPENAI_API_KEY", "fake_openai_key")
+
+
+def test_concurrent_identical_calls_are_coalesced():
+    """同時に実行された同じキーの呼び出しが1回にまとめられ、全員が結果を受け取ることを確認"""
+    coalescer = RequestCoalescer()
+    release = threading.Event()
+    calls = []
+
+    def call():
+        calls.append(1)
+        release.wait(5)
+        return {"answer": "結果"}
+
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        futures = [executor.submit(coalescer.do, "key", call) for _ in range(4)]
+        while coalescer.stats()["coalesced"] < 3:
+            time.sleep(0.001)
+        release.set()
+        results = [future.result() for future in futures]
+
+    assert calls == [1]
+    assert results == [{"answer": "結果"}] * 4
+    # 待機していたリクエストには結果のコピーが返される
+    assert len({id(result) for result in results}) == 4
+    assert coalescer.stats() == {"calls": 1, "coalesced": 3}
+
+
+def test_errors_are_shared_and_not_retained():
+    """例外が待機中のリクエストにも送出され、完了後は新しく呼び出されることを確認"""
+    coalescer = RequestCoalescer()
+    release = threading.Event()
+
+    def fail():
+        release.wait(5)
+        raise RuntimeError("503")
+
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        futures = [executor.submit(coalescer.do, "key", fail) for _ in range(2)]
+        while coalescer.stats()["coalesced"] < 1:
+            time.sleep(0.001)
+        release.set()
+        for future in futures:
+            with pytest.raises(RuntimeError):
+                future.result()
+
+    assert coalescer.do("key", lambda: "次の結果") == "次の結果"
+    assert coalescer.stats()["calls"] == 2
+
+
+def test_async_calls_are_coalesced_and_cancelled_with_last_waiter():
+    """asyncioの呼び出しがまとめられ、待機しているリクエストがすべてキャンセルされると呼び出しもキャンセルされることを確認"""
+    coalescer = RequestCoalescer()
+    calls = []
+    cancelled = []
+
+    async def call():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return "結果"
+
+    async def slow():
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            cancelled.append(True)
+            raise
+
+    async def run():
+        results = await asyncio.gather(*(coalescer.do_async("key", call) for _ in range(3)))
+        waiters = [asyncio.ensure_future(coalescer.do_async("slow", slow)) for _ in range(2)]
+        await asyncio.sleep(0)
+        for waiter in waiters:
+            waiter.cancel()
+        await asyncio.gather(*waiters, return_exceptions=True)
+        await asyncio.sleep(0)
+        return results
+
+    assert asyncio.run(run()) == ["結果"] * 3
+    assert calls == [1]
+    assert cancelled == [True]
+
+
+def test_mosaicai_coalesces_identical_requests():
+    """MosaicAIの同時に実行された同一のリクエストが、1回のAPI呼び出しにまとめられることを確認"""
+    client = MosaicAI("gpt-4o", coalescer=RequestCoalescer())
+    release = threading.Event()
+
+    def generate(self, prompt):
+        release.wait(5)
+        return f"{prompt}への回答"
+
+    with patch.object(ChatGPT, "generate", autospec=True, side_effect=generate) as mock_generate:
+        with ThreadPoolExecutor(max_workers=3) as executor:
+            futures = [executor.submit(client.generate_text, "こんにちは") for _ in range(3)]
+            while client.coalescer.stats()["coalesced"] < 2:
+                time.sleep(0.001)
+            release.set()
+            assert [future.result() for future in futures] == ["こんにちはへの回答"] * 3
+        assert mock_generate.call_count == 1
+        assert client.generate_text("さようなら") == "さようならへの回答"
+        assert mock_generate.call_count == 2
+
+
+def test_async_mosaicai_coalesces_with_cache():
+    """AsyncMosaicAIでキャッシュと併用した場合、まとめられた呼び出しの結果が1回だけキャッシュされることを確認"""
+    cache = ResponseCache()
+    client = AsyncMosaicAI("gpt-4o", cache=cache, coalescer=RequestCoalescer())
+
+    async def generate_async(self, prompt):
+        await asyncio.sleep(0.01)
+        return "回答"
+
+    async def run():
+        return await asyncio.gather(*(client.generate_text("こんにちは") for _ in range(3)))
+
+    with patch.object(ChatGPT, "generate_async", autospec=True,
+                      side_effect=generate_async) as mock_generate:
+        assert asyncio.run(run()) == ["回答"] * 3
+        assert asyncio.run(client.generate_text("こんにちは")) == "回答"
+    assert mock_generate.call_count == 1
+    assert cache.stats()["hits"] == 1
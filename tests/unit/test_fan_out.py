@@ -0,0 +1,112 @@
+import asyncio
+import pytest
+from unittest.mock import patch
+from mosaicai import AsyncMosaicAI, CircuitBreakerPolicy, CircuitOpenError, MosaicAI, stats
+from mosaicai.fan_out import ModelResult, build_aggregation_prompt
+from mosaicai.models.chatgpt import ChatGPT
+from mosaicai.models.claude import Claude
+
+GPT = "gpt-4o"
+CLAUDE = "claude-3-5-sonnet-20240620"
+
+
+@pytest.fixture(autouse=True)
+def setup(monkeypatch):
+    monkeypatch.setenv("OPENAI_API_KEY", "fake_openai_key")
+    monkeypatch.setenv("ANTHROPIC_API_KEY", "fake_anthropic_key")
+    stats.clear_stats()
+    yield
+    stats.clear_stats()
+
+
+def test_fan_out_collects_results_and_errors():
+    """すべてのモデルの結果と例外が、modelsの順に返されることを確認"""
+    client = MosaicAI(GPT)
+
+    with patch.object(ChatGPT, "generate", return_value="gptの回答"), \
+            patch.object(Claude, "generate", side_effect=RuntimeError("503")):
+        result = client.fan_out("こんにちは", models=[CLAUDE, GPT])
+
+    assert [r.model for r in result.results] == [CLAUDE, GPT]
+    assert isinstance(result[CLAUDE].error, RuntimeError)
+    assert result[GPT].result == "gptの回答"
+    assert result[GPT].latency >= 0
+    assert result.successes == [result[GPT]]
+    assert result.aggregate is None
+
+
+def test_fan_out_shares_model_instances():
+    """fan_outが使用中のモデルのインスタンスを共有することを確認"""
+    client = MosaicAI(GPT)
+    instance = client.models[GPT]
+
+    with patch.object(ChatGPT, "generate", return_value="gptの回答"), \
+            patch.object(Claude, "generate", return_value="claudeの回答"):
+        client.fan_out("こんにちは", models=[GPT, CLAUDE])
+        client.fan_out("こんにちは", models=[GPT, CLAUDE])
+    assert client.models[GPT] is instance
+    assert set(client.models) == {GPT, CLAUDE}
+
+
+def test_fan_out_aggregates_successful_responses():
+    """aggregatorを指定した場合、成功した回答がまとめて集約モデルに送信されることを確認"""
+    client = MosaicAI(GPT)
+
+    with patch.object(Claude, "generate", side_effect=["claudeの回答", "結論"]) as claude_generate, \
+            patch.object(ChatGPT, "generate", side_effect=RuntimeError("503")):
+        result = client.fan_out("質問", models=[GPT, CLAUDE], aggregator=CLAUDE,
+                                aggregation_prompt="{prompt}\n{responses}")
+
+    assert result.aggregate.model == CLAUDE
+    assert result.aggregate.result == "結論"
+    assert claude_generate.call_args.args[-1] == "質問\n### claude-3-5-sonnet-20240620\nclaudeの回答"
+
+
+def test_fan_out_skips_aggregation_when_all_fail():
+    """すべてのモデルが失敗した場合は集約しないことを確認"""
+    client = MosaicAI(GPT)
+
+    with patch.object(ChatGPT, "generate", side_effect=RuntimeError("503")) as generate:
+        result = client.fan_out("質問", models=[GPT], aggregator=GPT)
+    assert result.aggregate is None
+    assert generate.call_count == 1
+
+
+def test_fan_out_reports_open_circuit():
+    """サーキットブレーカーがオープン状態のモデルはCircuitOpenErrorとして報告されることを確認"""
+    policy = CircuitBreakerPolicy(window_size=1, minimum_calls=1)
+    policy.breaker(CLAUDE).record_failure()
+    client = MosaicAI(GPT, circuit_breaker=policy)
+
+    with patch.object(ChatGPT, "generate_json", return_value={"answer": "gpt"}), \
+            patch.object(Claude, "generate_json") as claude_generate:
+        result = client.fan_out("質問", models=[GPT, CLAUDE], schema={"answer": "str"})
+    assert result[GPT].result == {"answer": "gpt"}
+    assert isinstance(result[CLAUDE].error, CircuitOpenError)
+    claude_generate.assert_not_called()
+
+
+def test_build_aggregation_prompt_uses_only_successes():
+    """集約プロンプトに失敗したモデルの回答が含まれないことを確認"""
+    results = [ModelResult("a", "回答A"), ModelResult("b", error=RuntimeError("失敗"))]
+    assert build_aggregation_prompt("質問", results, "{prompt}|{responses}") == "質問|### a\n回答A"
+
+
+def test_async_fan_out_runs_concurrently():
+    """AsyncMosaicAIのfan_outがすべてのモデルを同時に呼び出すことを確認"""
+    client = AsyncMosaicAI(GPT)
+    running = []
+
+    async def generate_async(self, prompt):
+        running.append(prompt)
+        await asyncio.sleep(0.01)
+        # 両方のモデルが呼び出された後に完了する
+        assert len(running) >= 2
+        return type(self).__name__
+
+    with patch.object(ChatGPT, "generate_async", generate_async), \
+            patch.object(Claude, "generate_async", generate_async):
+        result = asyncio.run(client.fan_out("質問", models=[GPT, CLAUDE], aggregator=GPT))
+
+    assert [r.result for r in result.results] == ["ChatGPT", "Claude"]
+    assert result.aggregate.ok
@@ -1,5 +1,6 @@
+import asyncio
 import pytest
-from unittest.mock import MagicMock, patch
+from unittest.mock import AsyncMock, MagicMock, patch
 from PIL import Image
 import json
 import google.generativeai as genai
@@ -62,21 +63,23 @@ def test_generate(mock_generative_model, mock_api_key_manager):
 # generate_with_imageメソッドのテスト
 @patch('google.generativeai.GenerativeModel')
 @patch('PIL.Image.open')
-def test_generate_with_image(mock_image_open, mock_generative_model, mock_api_key_manager):
+def test_generate_with_image(mock_image_open, mock_generative_model, mock_api_key_manager,
+                             tmp_path):
     # モックの設定
     mock_response = MagicMock()
     mock_response.text = "Generated response with image"
     mock_generative_model.return_value.generate_content.return_value = mock_response
-    mock_image = MagicMock(spec=Image.Image)
-    mock_image_open.return_value = mock_image
+    image_path = tmp_path / "image.png"
+    image_path.write_bytes(b"\x89PNG\r\n\x1a\nimage_data")
 
     gemini = Gemini(mock_api_key_manager)
-    result = gemini.generate_with_image("Test message with image", "fake_image_path")
+    result = gemini.generate_with_image("Test message with image", str(image_path))
 
-    # メソッドが正しく呼び出されたか確認
-    mock_image_open.assert_called_once_with("fake_image_path")
+    # PNGはPILで展開せず、バイト列のまま送信される
+    mock_image_open.assert_not_called()
     mock_generative_model.return_value.generate_content.assert_called_once_with(
-        ["Test message with image", mock_image])
+        ["Test message with image",
+         {"mime_type": "image/png", "data": b"\x89PNG\r\n\x1a\nimage_data"}])
     assert result == "Generated response with image"
 # generate_jsonメソッドのテスト
 @patch('google.generativeai.GenerativeModel')
@@ -104,16 +107,16 @@ def test_generate_with_image_json(mock_image_open, mock_generative_model, mock_a
     mock_response = MagicMock()
     mock_response.text = '{"key_str": "value with image", "key_int": 123, "key_float": 1.23, "key_bool": true, "key_list": ["a", "b", "c"]}'
     mock_generative_model.return_value.generate_content.return_value = mock_response
-    mock_image = MagicMock(spec=Image.Image)
-    mock_image_open.return_value = mock_image
 
     gemini = Gemini(mock_api_key_manager)
     output_schema = OutputSchema
     result = gemini.generate_with_image_json(
-        "Test JSON message with image", "fake_image_path", output_schema)
+        "Test JSON message with image", b"\xff\xd8\xffimage_data", output_schema)
 
     # メソッドが正しく呼び出されたか確認
-    mock_image_open.assert_called_once_with("fake_image_path")
+    mock_image_open.assert_not_called()
+    assert mock_generative_model.return_value.generate_content.call_args.args[0][1] == \
+        {"mime_type": "image/jpeg", "data": b"\xff\xd8\xffimage_data"}
     mock_generative_model.return_value.generate_content.assert_called_once()
     assert isinstance(result, dict)
     assert result == {"key_str": "value with image", "key_int": 123, "key_float": 1.23, "key_bool": True, "key_list": ["a", "b", "c"]}
@@ -145,4 +148,38 @@ def test_type_conversion(mock_api_key_manager):
     # 文字列からブール値への変換をテスト
     with patch.object(gemini.model, 'generate_content', return_value=MagicMock(text='{"flag": "true"}')):
         result = gemini.generate_json("Test message", {"flag": "bool"})
-        assert result == {"flag": True}
\ No newline at end of file
+        assert result == {"flag": True}
+
+
+# generate_json_asyncメソッドのテスト
+@patch('google.generativeai.GenerativeModel')
+def test_generate_json_async(mock_generative_model, mock_api_key_manager):
+    # モックの設定
+    mock_response = MagicMock()
+    mock_response.text = ('{"key_str": "value", "key_int": "123", "key_float": 1.23, '
+                          '"key_bool": true, "key_list": ["a"]}')
+    mock_generative_model.return_value.generate_content_async = AsyncMock(
+        return_value=mock_response)
+
+    gemini = Gemini(mock_api_key_manager)
+    result = asyncio.run(gemini.generate_json_async("Test JSON message", OutputSchema))
+
+    # メソッドが正しく呼び出されたか確認
+    mock_generative_model.return_value.generate_content_async.assert_awaited_once()
+    assert result == {"key_str": "value", "key_int": 123, "key_float": 1.23, "key_bool": True,
+                      "key_list": ["a"]}
+
+
+# 画像のペイロードのキャッシュのテスト
+def test_load_image_with_cache(mock_api_key_manager, tmp_path):
+    from mosaicai import ImageCache
+    path = str(tmp_path / "image.png")
+    Image.new("RGB", (10, 20)).save(path)
+    gemini = Gemini(mock_api_key_manager)
+    gemini.image_cache = ImageCache()
+
+    first = gemini._load_image(path)
+    # キャッシュしたパートと同じオブジェクトが返される
+    assert first["mime_type"] == "image/png"
+    assert gemini._load_image(path) is first
+    assert gemini.image_cache.stats()["bytes"] == len(first["data"]) + len("image/png")
@@ -0,0 +1,113 @@
+import asyncio
+import pytest
+from types import SimpleNamespace as NS
+from unittest.mock import AsyncMock, MagicMock, Mock
+from mosaicai import AsyncMosaicAI, MosaicAI, ResponseCache
+from mosaicai.models.gemini import Gemini
+from mosaicai.types import GenerationResult, Usage
+from mosaicai.utils.api_key_manager import APIKeyManager
+
+GPT = "gpt-4o"
+CLAUDE = "claude-3-5-sonnet-20240620"
+
+
+@pytest.fixture(autouse=True)
+def api_keys(monkeypatch):
+    monkeypatch.setenv("OPENAI_API_KEY", "fake_openai_key")
+    monkeypatch.setenv("ANTHROPIC_API_KEY", "fake_anthropic_key")
+
+
+def _openai_response(content, finish_reason="stop"):
+    return NS(id="chatcmpl-123", model="gpt-4o-2024-05-13",
+              choices=[NS(message=NS(content=content), finish_reason=finish_reason)],
+              usage=NS(prompt_tokens=10, completion_tokens=4))
+
+
+def test_generate_text_returns_result():
+    """return_result=Trueの場合、テキストと応答の情報を含むGenerationResultが返されることを確認"""
+    client = MosaicAI(GPT, return_result=True)
+    client.models[GPT].client = Mock()
+    client.models[GPT].client.chat.completions.create.return_value = _openai_response("こんにちは")
+
+    result = client.generate_text("hello")
+
+    assert isinstance(result, GenerationResult)
+    assert result.content == "こんにちは"
+    assert result.usage == Usage(10, 4)
+    assert result.finish_reason == "stop"
+    assert result.model == "gpt-4o-2024-05-13"
+    assert result.request_id == "chatcmpl-123"
+    assert result.latency >= 0
+    assert not result.truncated
+
+
+def test_claude_json_result_detects_truncation():
+    """Claudeのstop_reasonがmax_tokensの場合にtruncatedがTrueになり、contentに解析済みのJSONが格納されることを確認"""
+    client = MosaicAI(CLAUDE, return_result=True)
+    client.models[CLAUDE].client = Mock()
+    client.models[CLAUDE].client.messages.create.return_value = NS(
+        id="msg_1", model=CLAUDE, stop_reason="max_tokens",
+        content=[NS(text='{"answer": "a"}')], usage=NS(input_tokens=7, output_tokens=1000))
+
+    result = client.generate_json("hello", {"answer": "str"})
+
+    assert result.content == {"answer": "a"}
+    assert result.usage == Usage(7, 1000)
+    assert result.truncated
+    assert result.request_id == "msg_1"
+
+
+def test_default_client_returns_plain_values():
+    """return_resultを指定しない場合、これまでどおり文字列が返されることを確認"""
+    client = MosaicAI(GPT)
+    client.models[GPT].client = Mock()
+    client.models[GPT].client.chat.completions.create.return_value = _openai_response("こんにちは")
+    assert client.generate_text("hello") == "こんにちは"
+
+
+def test_gemini_call_with_result():
+    """モデルクラスのcall_with_resultで、Geminiの終了理由とトークン使用量が取得できることを確認"""
+    manager = MagicMock(spec=APIKeyManager)
+    manager.get_api_key.return_value = "fake_api_key"
+    gemini = Gemini(manager, "gemini-1.5-pro")
+    gemini.model = Mock()
+    gemini.model.generate_content.return_value = NS(
+        text="応答", candidates=[NS(finish_reason=NS(name="STOP"))],
+        usage_metadata=NS(prompt_token_count=3, candidates_token_count=2))
+
+    result = gemini.call_with_result("generate", "hello")
+
+    assert result == GenerationResult("応答", Usage(3, 2), "STOP", latency=result.latency)
+
+
+def test_result_is_cached_and_restored(tmp_path):
+    """GenerationResultがキャッシュに保存され、キャッシュから返された場合はcachedがTrueになることを確認"""
+    cache = ResponseCache(path=str(tmp_path / "cache.db"))
+    client = MosaicAI(GPT, cache=cache, return_result=True)
+    client.models[GPT].client = Mock()
+    client.models[GPT].client.chat.completions.create.return_value = _openai_response("こんにちは")
+
+    first = client.generate_text("hello")
+    cache.memory.clear()
+    second = client.generate_text("hello")
+
+    assert not first.cached and second.cached
+    assert second.content == "こんにちは" and second.usage == Usage(10, 4)
+    assert client.models[GPT].client.chat.completions.create.call_count == 1
+    # 生成結果を返すクライアントとはキャッシュキーが異なる
+    plain = MosaicAI(GPT, cache=cache)
+    assert plain._cache_key("generate", "hello") != client._cache_key("generate", "hello")
+
+
+def test_async_client_returns_result():
+    """AsyncMosaicAIでもGenerationResultが返されることを確認"""
+    client = AsyncMosaicAI(GPT, return_result=True)
+    model = client.models[GPT]
+    model.async_client = Mock()
+    model.async_client.chat.completions.create = AsyncMock(
+        return_value=_openai_response("こんにちは", "length"))
+
+    result = asyncio.run(client.generate_text("hello"))
+
+    assert result.content == "こんにちは"
+    assert result.truncated
@@ -0,0 +1,152 @@
+import asyncio
+import threading
+import time
+import pytest
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import patch
+from mosaicai import AsyncMosaicAI, HedgePolicy, MosaicAI, stats
+from mosaicai.hedging import hedged_call, hedged_call_async
+from mosaicai.models.chatgpt import ChatGPT
+from mosaicai.stats import ModelStats
+
+
+@pytest.fixture(autouse=True)
+def clear_stats(monkeypatch):
+    monkeypatch.setenv("OPENAI_API_KEY", "fake_api_key")
+    stats.clear_stats()
+    yield
+    stats.clear_stats()
+
+
+@pytest.fixture
+def executor():
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        yield executor
+
+
+def test_hedge_delay_uses_percentile_after_min_samples():
+    """サンプルが揃うまではfallback_delay、揃った後はパーセンタイルが使用されることを確認"""
+    policy = HedgePolicy(percentile=90, min_samples=10, fallback_delay=3.0)
+    model_stats = ModelStats()
+    for i in range(9):
+        model_stats.record_success(i + 1)
+    assert policy.hedge_delay(model_stats) == 3.0
+    model_stats.record_success(10)
+    assert policy.hedge_delay(model_stats) == 9
+    assert HedgePolicy(delay=0.5).hedge_delay(model_stats) == 0.5
+
+
+def test_hedge_rate_is_capped():
+    """ヘッジリクエストの割合がmax_hedge_rateを超えないことを確認"""
+    policy = HedgePolicy(max_hedge_rate=0.1)
+    acquired = 0
+    for _ in range(100):
+        policy.record_request()
+        acquired += policy.try_acquire_hedge()
+    assert acquired == 10
+
+
+def test_hedged_call_returns_faster_response(executor):
+    """最初のリクエストが遅い場合、ヘッジリクエストの結果が返されることを確認"""
+    release = threading.Event()
+
+    def slow():
+        release.wait(5)
+        return "slow"
+
+    policy = HedgePolicy(max_hedge_rate=1.0)
+    try:
+        assert hedged_call(slow, lambda: "hedge", 0.01, policy, executor) == "hedge"
+    finally:
+        release.set()
+    assert policy.hedges == 1
+
+
+def test_hedged_call_skips_hedge_when_primary_is_fast(executor):
+    """待機時間内に完了した場合はヘッジリクエストが送信されないことを確認"""
+    policy = HedgePolicy(max_hedge_rate=1.0)
+    hedge_calls = []
+    result = hedged_call(lambda: "primary", lambda: hedge_calls.append(1), 1.0, policy, executor)
+    assert result == "primary"
+    assert hedge_calls == []
+    assert policy.hedges == 0
+
+
+def test_hedged_call_falls_back_when_one_fails(executor):
+    """一方が失敗した場合は、もう一方の結果が返されることを確認"""
+    def slow_failure():
+        time.sleep(0.05)
+        raise RuntimeError("失敗")
+
+    def slower_success():
+        time.sleep(0.1)
+        return "hedge"
+
+    policy = HedgePolicy(max_hedge_rate=1.0)
+    assert hedged_call(slow_failure, slower_success, 0.01, policy, executor) == "hedge"
+
+
+def test_hedged_call_async_cancels_loser():
+    """非同期版では、負けたリクエストがキャンセルされることを確認"""
+    cancelled = []
+
+    async def slow():
+        try:
+            await asyncio.sleep(5)
+        except asyncio.CancelledError:
+            cancelled.append(True)
+            raise
+
+    async def fast():
+        return "hedge"
+
+    async def run():
+        result = await hedged_call_async(slow, fast, 0.01, HedgePolicy(max_hedge_rate=1.0))
+        await asyncio.sleep(0)
+        return result
+
+    assert asyncio.run(run()) == "hedge"
+    assert cancelled == [True]
+
+
+def test_mosaicai_generate_text_hedges_to_alternate_model():
+    """generate_textが別のモデルにヘッジリクエストを送信することを確認"""
+    release = threading.Event()
+
+    def generate(self, prompt):
+        if self.model == "gpt-4o":
+            release.wait(5)
+        return f"{self.model}: {prompt}"
+
+    hedge = HedgePolicy(delay=0.01, max_hedge_rate=1.0, model="gpt-4o-mini")
+    client = MosaicAI("gpt-4o", hedge=hedge)
+    with patch.object(ChatGPT, "generate", generate):
+        try:
+            assert client.generate_text("こんにちは") == "gpt-4o-mini: こんにちは"
+        finally:
+            release.set()
+    assert len(stats.model_stats("gpt-4o-mini").latency) == 1
+
+
+def test_mosaicai_instances_share_executor():
+    """ヘッジリクエストのスレッドプールがすべてのインスタンスで共有されることを確認"""
+    executor = MosaicAI("gpt-4o")._get_executor()
+    assert MosaicAI("gpt-4o-mini")._get_executor() is executor
+    assert MosaicAI._executor is executor
+
+
+def test_async_mosaicai_generate_json_hedges():
+    """AsyncMosaicAI.generate_jsonが同じモデルにヘッジリクエストを送信することを確認"""
+    calls = []
+
+    async def generate_json_async(self, prompt, schema):
+        calls.append(prompt)
+        if len(calls) == 1:
+            await asyncio.sleep(5)
+        return {"answer": len(calls)}
+
+    client = AsyncMosaicAI("gpt-4o", hedge=HedgePolicy(delay=0.01, max_hedge_rate=1.0))
+    with patch.object(ChatGPT, "generate_json_async", generate_json_async):
+        result = asyncio.run(client.generate_json("質問", {"answer": "int"}))
+    assert result == {"answer": 2}
+    assert calls == ["質問", "質問"]
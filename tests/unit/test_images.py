@@ -0,0 +1,364 @@
+import asyncio
+import base64
+import io
+import json
+import os
+import httpx
+import pytest
+from unittest.mock import Mock, patch
+from PIL import Image
+from mosaicai import AsyncMosaicAI, ImagePolicy, MosaicAI, metrics
+from mosaicai.cache import make_cache_key
+from mosaicai.images import (ImageInput, ImagePlaceholder, detect_mime_type, encode_base64,
+                             has_placeholders, label_images, pack_images, preprocess_image)
+from mosaicai.utils import client_registry
+from mosaicai.utils.image_upload import expand_placeholders
+from mosaicai.models.chatgpt import ChatGPT
+from mosaicai.models.claude import Claude
+from mosaicai.models.gemini import Gemini
+from mosaicai.utils.api_key_manager import APIKeyManager
+
+
+@pytest.fixture
+def mock_api_key_manager():
+    manager = Mock(spec=APIKeyManager)
+    manager.get_api_key.return_value = "mock_api_key"
+    return manager
+
+
+def write_image(path, size, image_format="JPEG", mode="RGB", exif=None):
+    """ノイズを拡大した画像ファイルを作成する"""
+    image = Image.effect_noise((size[0] // 4, size[1] // 4), 64).resize(size).convert(mode)
+    options = {"exif": exif} if exif is not None else {}
+    image.save(path, format=image_format, **options)
+    return str(path)
+
+
+def test_resize_to_provider_limit(tmp_path):
+    """プロバイダーごとの実効的な最大解像度に縮小され、削減したバイト数が報告されることを確認"""
+    path = write_image(tmp_path / "large.jpg", (4000, 2000))
+
+    claude = preprocess_image(path, "claude", ImagePolicy())
+    assert (claude.width, claude.height) == (1568, 784)
+    assert claude.mime_type == "image/jpeg" and claude.resized
+    assert claude.bytes_saved == claude.original_bytes - len(claude.data) > 0
+
+    # OpenAIは短辺も768ピクセルに縮小される
+    openai = preprocess_image(path, "openai", ImagePolicy())
+    assert (openai.width, openai.height) == (1536, 768)
+
+    policy = ImagePolicy(max_dimension=1000, format="webp", quality=70)
+    custom = preprocess_image(path, "gemini", policy)
+    assert (custom.width, custom.height) == (1000, 500)
+    assert custom.mime_type == "image/webp"
+    assert Image.open(io.BytesIO(custom.data)).format == "WEBP"
+
+
+def test_small_image_is_sent_as_is(tmp_path):
+    """縮小も再圧縮も不要な画像は、元のバイト列がそのまま使用されることを確認"""
+    path = write_image(tmp_path / "small.png", (200, 100), "PNG")
+    with open(path, "rb") as f:
+        original = f.read()
+
+    image = preprocess_image(path, "claude", ImagePolicy())
+    assert image.data == original
+    assert image.bytes_saved == 0 and not image.resized
+
+
+def test_strip_metadata_and_orientation(tmp_path):
+    """EXIFが除去され、向きの情報に従って回転されることを確認"""
+    exif = Image.Exif()
+    exif[0x0112] = 6  # 時計回りに90度回転して表示する
+    exif[0x010F] = "camera maker"
+    path = write_image(tmp_path / "photo.jpg", (300, 200), "JPEG", exif=exif.tobytes())
+
+    image = preprocess_image(path, "claude", ImagePolicy())
+    processed = Image.open(io.BytesIO(image.data))
+    assert processed.size == (200, 300)
+    assert not processed.getexif()
+
+    kept = preprocess_image(path, "claude", ImagePolicy(strip_metadata=False))
+    assert Image.open(io.BytesIO(kept.data)).getexif().get(0x010F) == "camera maker"
+
+
+def test_transparent_image_to_jpeg(tmp_path):
+    """透過のある画像をJPEGに変換できることを確認"""
+    path = write_image(tmp_path / "alpha.png", (100, 100), "PNG", mode="RGBA")
+    image = preprocess_image(path, "openai", ImagePolicy(format="JPEG"))
+    assert Image.open(io.BytesIO(image.data)).mode == "RGB"
+
+
+def test_invalid_policy():
+    """不正な形式や品質を指定した場合にValueErrorが発生することを確認"""
+    with pytest.raises(ValueError):
+        ImagePolicy(format="BMP")
+    with pytest.raises(ValueError):
+        ImagePolicy(quality=0)
+
+
+def test_adapters_send_preprocessed_image(tmp_path, mock_api_key_manager):
+    """画像の前処理の方針を設定した各アダプターが、前処理した画像を送信することを確認"""
+    path = write_image(tmp_path / "large.jpg", (4000, 3000))
+    metrics.clear_metrics()
+    policy = ImagePolicy()
+
+    claude = Claude(mock_api_key_manager)
+    claude.image_policy = policy
+    request = claude._request("説明してください", image_path=path)
+    source = request["messages"][0]["content"][1]["source"]
+    assert source["media_type"] == "image/jpeg"
+    assert Image.open(io.BytesIO(base64.b64decode(source["data"]))).size == (1568, 1176)
+
+    chatgpt = ChatGPT(mock_api_key_manager)
+    chatgpt.image_policy = policy
+    url = chatgpt._image_content("説明してください", path)[1]["image_url"]["url"]
+    assert url.startswith("data:image/jpeg;base64,")
+
+    with patch("google.generativeai.GenerativeModel"):
+        gemini = Gemini(mock_api_key_manager)
+    gemini.image_policy = policy
+    part = gemini._load_image(path)
+    assert part["mime_type"] == "image/jpeg"
+    assert Image.open(io.BytesIO(part["data"])).size == (3072, 2304)
+
+    saved = {sample["labels"]["model"]: sample["value"]
+             for sample in metrics.IMAGE_BYTES_SAVED.samples()}
+    assert set(saved) == {"claude", "openai", "gemini"}
+    assert all(value > 0 for value in saved.values())
+
+
+def test_large_file_allowed_when_preprocessed(tmp_path, mock_api_key_manager):
+    """前処理する場合は、max_image_sizeより大きい画像ファイルも縮小して送信できることを確認"""
+    path = write_image(tmp_path / "large.jpg", (2000, 1000))
+    claude = Claude(mock_api_key_manager)
+    claude.max_image_size = 100 * 1024
+    with pytest.raises(ValueError):
+        claude._request("説明してください", image_path=path)
+
+    claude.image_policy = ImagePolicy(max_dimension=500)
+    request = claude._request("説明してください", image_path=path)
+    assert request["messages"][0]["content"][1]["source"]["data"]
+
+
+def test_without_policy_sends_original(tmp_path, mock_api_key_manager):
+    """方針を設定しない場合は、これまでどおり画像ファイルがそのまま送信されることを確認"""
+    path = write_image(tmp_path / "large.jpg", (2000, 1000))
+    with open(path, "rb") as f:
+        encoded = base64.b64encode(f.read()).decode()
+
+    request = Claude(mock_api_key_manager)._request("説明してください", image_path=path)
+    assert request["messages"][0]["content"][1]["source"]["data"] == encoded
+
+
+@pytest.mark.parametrize("size", [0, 1, 2, 3, 786431, 786432, 786433, 2 * 786432 + 5])
+def test_encode_base64(tmp_path, size):
+    """ファイルとバイト列を分割してエンコードした結果が、base64.b64encodeと一致することを確認"""
+    data = os.urandom(size)
+    path = tmp_path / "image.bin"
+    path.write_bytes(data)
+    expected = base64.b64encode(data).decode()
+
+    assert encode_base64(str(path)) == expected
+    encoded = encode_base64(memoryview(data), prefix="data:image/png;base64,")
+    assert encoded == "data:image/png;base64," + expected
+    placeholder = ImagePlaceholder(str(path), prefix="data:image/png;base64,")
+    encoded = b"".join(placeholder.iter_encoded())
+    assert encoded.decode() == "data:image/png;base64," + expected
+    assert placeholder.encoded_size == len(encoded)
+
+
+class CapturingTransport:
+    """送信されたリクエストの本文を記録し、固定の応答を返すトランスポート"""
+
+    def __init__(self):
+        self.requests = []
+
+    def handle(self, request):
+        self.requests.append((request.headers["Content-Length"], request.read()))
+        if request.url.path.endswith("/messages"):
+            return httpx.Response(200, json={
+                "id": "msg", "type": "message", "role": "assistant", "model": "claude",
+                "content": [{"type": "text", "text": "ok"}], "stop_reason": "end_turn",
+                "usage": {"input_tokens": 1, "output_tokens": 1}})
+        return httpx.Response(200, json={
+            "id": "chatcmpl", "object": "chat.completion", "created": 0, "model": "gpt",
+            "choices": [{"index": 0, "finish_reason": "stop",
+                         "message": {"role": "assistant", "content": "ok"}}]})
+
+    async def handle_async(self, request):
+        return self.handle(request)
+
+    def transport(self, inner):
+        return httpx.MockTransport(self.handle)
+
+    def async_transport(self, inner):
+        return httpx.MockTransport(self.handle_async)
+
+
+@pytest.mark.parametrize("model", ["claude-3-5-sonnet-20240620", "gpt-4o"])
+def test_stream_images(tmp_path, monkeypatch, model):
+    """stream_imagesを有効にした場合、送信するときに画像がエンコードされ、本文とContent-Lengthが正しいことを確認"""
+    monkeypatch.setenv("OPENAI_API_KEY", "test-openai-key")
+    monkeypatch.setenv("ANTHROPIC_API_KEY", "test-anthropic-key")
+    data = os.urandom(1024 * 1024 + 1)
+    path = tmp_path / "image.png"
+    path.write_bytes(data)
+    transport = CapturingTransport()
+    client_registry.install_transport(transport)
+    try:
+        client = MosaicAI(model, stream_images=True)
+        assert client.generate_with_image("説明してください", str(path)) == "ok"
+        async_client = AsyncMosaicAI(model, stream_images=True)
+        assert asyncio.run(async_client.generate_with_image("説明してください", str(path))) == "ok"
+    finally:
+        client_registry.install_transport(None)
+
+    assert len(transport.requests) == 2
+    for content_length, body in transport.requests:
+        assert int(content_length) == len(body)
+        assert base64.b64encode(data) in body and b"mosaicai-image-" not in body
+        json.loads(body)
+    # 送信が完了したImagePlaceholderは保持されない
+    assert not has_placeholders()
+
+
+def test_expand_placeholders_builds_new_request(tmp_path):
+    """ImagePlaceholderを含むリクエストは、元のリクエストを変更せずに新しいリクエストに置き換えられることを確認"""
+    data = os.urandom(1000)
+    path = tmp_path / "image.png"
+    path.write_bytes(data)
+    placeholder = ImagePlaceholder(str(path))
+    request = httpx.Request("POST", "https://api.example.com/v1", json={"image": placeholder})
+    body = request.read()
+
+    expanded = expand_placeholders(request)
+    assert expanded is not request
+    assert request.read() == body
+    content = b"".join(expanded.stream)
+    assert content == body.replace(placeholder.encode("ascii"), base64.b64encode(data))
+    assert int(expanded.headers["Content-Length"]) == len(content)
+
+    plain = httpx.Request("POST", "https://api.example.com/v1", json={"text": "画像なし"})
+    assert expand_placeholders(plain) is plain
+
+
+def test_detect_mime_type():
+    """内容の先頭のバイト列からMIMEタイプが判定され、判定できない場合は拡張子から推測されることを確認"""
+    assert detect_mime_type(b"\x89PNG\r\n\x1a\n\x00\x00", "photo.jpg") == "image/png"
+    assert detect_mime_type(b"RIFF\x00\x00\x00\x00WEBPVP8 ") == "image/webp"
+    assert detect_mime_type(b"\x00\x00\x00\x18ftypheic") == "image/heic"
+    assert detect_mime_type(b"unknown", "photo.JPEG") == "image/jpeg"
+    assert detect_mime_type(b"unknown") == "application/octet-stream"
+
+
+@pytest.mark.parametrize("kind", ["path", "pathlike", "bytes", "bytearray", "memoryview", "file",
+                                  "input"])
+def test_image_input_sources(tmp_path, mock_api_key_manager, kind):
+    """パス、バイト列、memoryview、ファイルオブジェクトのいずれを渡しても、同じ画像が送信されることを確認"""
+    path = write_image(tmp_path / "image.bin", (64, 48), "PNG")
+    data = (tmp_path / "image.bin").read_bytes()
+    source = {
+        "path": path, "pathlike": tmp_path / "image.bin", "bytes": data,
+        "bytearray": bytearray(data), "memoryview": memoryview(data), "file": io.BytesIO(data),
+        "input": ImageInput(data, name="upload"),
+    }[kind]
+    expected = base64.b64encode(data).decode()
+
+    # 拡張子から判定できない場合も、ChatGPTに正しいMIMEタイプが送信される
+    url = ChatGPT(mock_api_key_manager)._image_content("説明してください", source)[1]["image_url"]["url"]
+    assert url == "data:image/png;base64," + expected
+    if kind == "file":
+        source = io.BytesIO(data)
+    request = Claude(mock_api_key_manager)._request("説明してください", image_path=source)
+    claude_source = request["messages"][0]["content"][1]["source"]
+    assert claude_source == {"type": "base64", "media_type": "image/png", "data": expected}
+
+
+def test_image_input_pil_and_gemini(tmp_path, mock_api_key_manager):
+    """PILの画像はPNGとして送信され、Geminiが対応していない形式はPILで開いて送信されることを確認"""
+    image = Image.effect_noise((32, 16), 64).convert("RGB")
+    request = Claude(mock_api_key_manager)._request("説明してください", image_path=image)
+    source = request["messages"][0]["content"][1]["source"]
+    assert source["media_type"] == "image/png"
+    assert Image.open(io.BytesIO(base64.b64decode(source["data"]))).size == (32, 16)
+
+    with patch("google.generativeai.GenerativeModel"):
+        gemini = Gemini(mock_api_key_manager)
+    assert gemini._load_image(image) is image
+    bmp = write_image(tmp_path / "image.bmp", (20, 10), "BMP")
+    part = gemini._load_image(bmp)
+    assert isinstance(part, Image.Image) and part.size == (20, 10)
+
+    with pytest.raises(TypeError):
+        ImageInput(123)
+
+
+def test_image_input_cache_keys(tmp_path):
+    """ファイルとバイト列は内容で識別され、応答のキャッシュのキーが一致することを確認"""
+    path = write_image(tmp_path / "image.png", (40, 30), "PNG")
+    data = (tmp_path / "image.png").read_bytes()
+    assert make_cache_key("gpt-4o", "generate_with_image", "説明", image_path=path) == \
+        make_cache_key("gpt-4o", "generate_with_image", "説明", image_path=memoryview(data))
+    assert make_cache_key("gpt-4o", "generate_with_image", "説明", image_path=data + b"\x00") != \
+        make_cache_key("gpt-4o", "generate_with_image", "説明", image_path=data)
+
+
+def test_label_images_and_pack_images():
+    """ラベルのない画像に連番のラベルが付き、画像ができるだけ少ないグループに分けられることを確認"""
+    labeled = label_images([b"\x89PNG\r\n\x1a\n", ("後", b"GIF89a")])
+    assert [label for label, _ in labeled] == ["画像1", "後"]
+    assert [label for label, _ in label_images({"A": b"a", "B": b"b"})] == ["A", "B"]
+    with pytest.raises(ValueError):
+        label_images([])
+
+    assert pack_images([1] * 5, max_count=2) == [[0, 1], [2, 3], [4]]
+    # 元の順序で区切ると3回になるが、大きい順に詰めると2回で済む
+    assert pack_images([6, 5, 5, 4], max_bytes=10) == [[0, 3], [1, 2]]
+    assert pack_images([3, 4], max_count=None, max_bytes=None) == [[0, 1]]
+    with pytest.raises(ValueError):
+        pack_images([11], max_bytes=10)
+
+
+def test_labeled_image_request(tmp_path, mock_api_key_manager):
+    """複数の画像がラベルとともに1つのメッセージに含まれることを確認"""
+    first = write_image(tmp_path / "a.png", (16, 16), "PNG")
+    second = write_image(tmp_path / "b.png", (16, 16), "PNG")
+    claude = Claude(mock_api_key_manager)
+    parts = [(label, claude._image_part(image))
+             for label, image in label_images({"前": first, "後": second})]
+    content = claude._request("違いを説明してください", image_parts=parts)["messages"][0]["content"]
+    assert [block["type"] for block in content] == ["text", "image", "text", "image", "text"]
+    assert content[0]["text"] == "前:" and content[2]["text"] == "後:"
+    assert content[4]["text"] == "違いを説明してください"
+
+    chatgpt = ChatGPT(mock_api_key_manager)
+    parts = [(label, chatgpt._image_part(image)) for label, image in label_images([first, second])]
+    content = chatgpt._labeled_image_content("違いを説明してください", parts)
+    assert [block.get("text") for block in content] == ["画像1:", None, "画像2:", None, "違いを説明してください"]
+
+
+def test_generate_with_images_split(tmp_path, monkeypatch):
+    """上限を超える画像が少ない回数に分けて送信され、回答がまとめられ、使用量が合算されることを確認"""
+    monkeypatch.setenv("ANTHROPIC_API_KEY", "test-anthropic-key")
+    monkeypatch.setattr(Claude, "max_images_per_request", 2)
+    images = [write_image(tmp_path / f"{number}.png", (16, 16), "PNG") for number in range(5)]
+    transport = CapturingTransport()
+    client_registry.install_transport(transport)
+    try:
+        client = MosaicAI("claude-3-5-sonnet-20240620", return_result=True)
+        result = client.generate_with_images("それぞれ説明してください", images)
+        assert asyncio.run(AsyncMosaicAI("claude-3-5-sonnet-20240620")
+                           .generate_with_images("それぞれ説明してください", images)) == "ok"
+    finally:
+        client_registry.install_transport(None)
+
+    # 画像を3回に分けて送信し、4回目で回答をまとめる
+    assert result.content == "ok"
+    assert result.usage.prompt_tokens == 4 and result.usage.completion_tokens == 4
+    bodies = [json.loads(body) for _, body in transport.requests[:4]]
+    contents = [body["messages"][0]["content"] for body in bodies]
+    image_counts = [sum(block["type"] == "image" for block in content) for content in contents[:3]]
+    assert image_counts == [2, 2, 1]
+    assert "3回に分けて" in contents[0][-1]["text"]
+    assert "画像5" in contents[3] and "それぞれ説明してください" in contents[3]
+    assert len(transport.requests) == 8
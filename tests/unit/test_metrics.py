@@ -0,0 +1,125 @@
+import httpx
+import openai
+import pytest
+from types import SimpleNamespace as NS
+from unittest.mock import Mock, patch
+from mosaicai import MosaicAI, RetryPolicy, metrics
+from mosaicai.metrics import MetricsRegistry
+from mosaicai.models import base
+
+
+@pytest.fixture(autouse=True)
+def setup(monkeypatch):
+    monkeypatch.setenv("OPENAI_API_KEY", "fake_openai_key")
+    metrics.clear_metrics()
+    yield
+    metrics.clear_metrics()
+
+
+def _completion(content, prompt_tokens=12, completion_tokens=3):
+    return NS(choices=[NS(message=NS(content=content))],
+              usage=NS(prompt_tokens=prompt_tokens, completion_tokens=completion_tokens))
+
+
+def _samples(name):
+    return metrics.snapshot()[name]["samples"]
+
+
+def test_prometheus_text_format():
+    """カウンターとヒストグラムがPrometheusのテキスト形式で出力されることを確認"""
+    registry = MetricsRegistry()
+    counter = registry.counter("requests_total", "Requests.", ("model",))
+    histogram = registry.histogram("latency_seconds", "Latency.", ("model",), buckets=(0.5, 1.0))
+    counter.inc(model='gpt-"4o"')
+    histogram.observe(0.2, model="gpt-4o")
+    histogram.observe(2.0, model="gpt-4o")
+
+    assert registry.to_prometheus() == (
+        "# HELP requests_total Requests.\n"
+        "# TYPE requests_total counter\n"
+        'requests_total{model="gpt-\\"4o\\""} 1\n'
+        "# HELP latency_seconds Latency.\n"
+        "# TYPE latency_seconds histogram\n"
+        'latency_seconds_bucket{model="gpt-4o",le="0.5"} 1\n'
+        'latency_seconds_bucket{model="gpt-4o",le="1.0"} 1\n'
+        'latency_seconds_bucket{model="gpt-4o",le="+Inf"} 2\n'
+        'latency_seconds_sum{model="gpt-4o"} 2.2\n'
+        'latency_seconds_count{model="gpt-4o"} 2\n'
+    )
+    assert registry.counter("requests_total", "Requests.", ("model",)) is counter
+    with pytest.raises(ValueError):
+        registry.histogram("requests_total", "Requests.", ("model",))
+
+
+def test_mosaicai_records_latency_tokens_and_bytes():
+    """MosaicAIの呼び出しでレイテンシ、トークン使用量、ペイロードのサイズが記録されることを確認"""
+    client = MosaicAI("gpt-4o")
+    client.models["gpt-4o"].client = Mock()
+    client.models["gpt-4o"].client.chat.completions.create.return_value = _completion("こんにちは")
+
+    assert client.generate_text("hello") == "こんにちは"
+
+    labels = {"model": "gpt-4o", "method": "generate"}
+    assert metrics.REQUESTS.value(**labels) == 1
+    assert metrics.PROMPT_TOKENS.value(**labels) == 12
+    assert metrics.COMPLETION_TOKENS.value(**labels) == 3
+    [duration] = _samples("mosaicai_request_duration_seconds")
+    assert duration["labels"] == labels and duration["count"] == 1
+    [payload] = _samples("mosaicai_request_payload_bytes")
+    # model、role、contentなどの文字列の合計
+    assert payload["sum"] >= len("hello")
+
+
+def test_mosaicai_records_errors_and_retries(monkeypatch):
+    """失敗した呼び出しと再試行の回数が記録されることを確認"""
+    monkeypatch.setattr(base.time, "sleep", lambda seconds: None)
+    client = MosaicAI("gpt-4o", retry_policy=RetryPolicy(max_retries=1, jitter=False))
+    request = httpx.Request("POST", "https://api.openai.com/v1/chat/completions")
+    response = httpx.Response(503, request=request)
+    error = openai.InternalServerError("エラー", response=response, body=None)
+    client.models["gpt-4o"].client = Mock()
+    client.models["gpt-4o"].client.chat.completions.create.side_effect = error
+
+    with pytest.raises(openai.InternalServerError):
+        client.generate_json("hello", {"answer": "str"})
+
+    labels = {"model": "gpt-4o", "method": "generate_json"}
+    assert metrics.RETRIES.value(**labels) == 1
+    assert metrics.ERRORS.value(error="InternalServerError", **labels) == 1
+    expected = "mosaicai_retries_total{model=\"gpt-4o\",method=\"generate_json\"} 1"
+    assert expected in metrics.export_prometheus()
+
+
+def test_stream_records_time_to_first_token(monkeypatch):
+    """ストリーミングで最初のテキストまでの時間とトークン使用量が記録されることを確認"""
+    client = MosaicAI("gpt-4o")
+    client.models["gpt-4o"].client = Mock()
+    client.models["gpt-4o"].client.chat.completions.create.return_value = iter([
+        NS(choices=[NS(delta=NS(content="Hello"), finish_reason=None)], usage=None),
+        NS(choices=[], usage=NS(prompt_tokens=5, completion_tokens=1)),
+    ])
+
+    assert "".join(delta.text for delta in client.generate_text_stream("hello")) == "Hello"
+
+    labels = {"model": "gpt-4o", "method": "generate_text_stream"}
+    [ttft] = _samples("mosaicai_time_to_first_token_seconds")
+    assert ttft["labels"] == labels and ttft["count"] == 1
+    assert metrics.REQUESTS.value(**labels) == 1
+    assert metrics.PROMPT_TOKENS.value(**labels) == 5
+
+
+def test_direct_model_calls_use_unknown_method():
+    """MosaicAIを経由しない呼び出しはmethodラベルが"unknown"になることを確認"""
+    client = MosaicAI("gpt-4o")
+    model = client.models["gpt-4o"]
+    model.client = Mock()
+    model.client.chat.completions.create.return_value = _completion("応答")
+    with patch.object(metrics, "record_call") as record_call:
+        model.generate("hello")
+    record_call.assert_not_called()
+    assert metrics.PROMPT_TOKENS.value(model="gpt-4o", method="unknown") == 12
+
+
+def test_payload_bytes():
+    """文字列（UTF-8）とバイト列のサイズが再帰的に合計されることを確認"""
+    assert metrics.payload_bytes("abc", messages=[{"content": "あ"}], data=b"1234") == 3 + 3 + 4
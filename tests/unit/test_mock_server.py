@@ -0,0 +1,83 @@
+import asyncio
+import openai
+import pytest
+from mosaicai import AsyncMosaicAI, MosaicAI, RetryPolicy
+from mosaicai.testing import MockBehavior, MockProviderServer
+from mosaicai.types import Usage
+from mosaicai.utils import client_registry
+
+MODELS = ["gpt-4o", "claude-3-5-sonnet-20240620", "llama-3.1-sonar-large-128k-online"]
+
+
+@pytest.fixture(autouse=True)
+def api_keys(monkeypatch):
+    monkeypatch.setenv("OPENAI_API_KEY", "fake_openai_key")
+    monkeypatch.setenv("ANTHROPIC_API_KEY", "fake_anthropic_key")
+    monkeypatch.setenv("PERPLEXITY_API_KEY", "fake_perplexity_key")
+    yield
+    for provider in ("openai", "claude", "perplexity"):
+        client_registry.configure_base_url(provider, None)
+
+
+@pytest.fixture
+def server():
+    with MockProviderServer(MockBehavior(text="モックの応答"), seed=0) as server:
+        server.configure_clients()
+        yield server
+
+
+@pytest.mark.parametrize("model", MODELS)
+def test_generate_text_and_json(server, model):
+    """各プロバイダーのSDKがモックサーバーに接続し、テキストとJSONの応答を受け取れることを確認"""
+    client = MosaicAI(model)
+    assert client.generate_text("こんにちは") == "モックの応答"
+    assert client.generate_json("こんにちは", {"answer": "str"}) == {"answer": "mock"}
+
+
+@pytest.mark.parametrize("model", ["gpt-4o", "claude-3-5-sonnet-20240620"])
+def test_streaming(server, model):
+    """ストリーミング応答が複数のチャンクに分割され、最後にトークン使用量が通知されることを確認"""
+    stream = MosaicAI(model).generate_text_stream("こんにちは")
+    deltas = [delta.text for delta in stream]
+
+    assert len([text for text in deltas if text]) > 1
+    assert stream.text == "モックの応答"
+    assert isinstance(stream.usage, Usage) and stream.usage.completion_tokens > 0
+
+
+def test_async_client(server):
+    """AsyncMosaicAIからもモックサーバーに接続できることを確認"""
+    async def main():
+        client = AsyncMosaicAI("claude-3-5-sonnet-20240620")
+        return await asyncio.gather(*(client.generate_text("こんにちは") for _ in range(5)))
+
+    assert asyncio.run(main()) == ["モックの応答"] * 5
+    assert server.stats()["claude"]["requests"] == 5
+
+
+def test_error_injection():
+    """429エラーと500エラーが注入され、サーバー側で数えられることを確認"""
+    behaviors = {"openai": MockBehavior(rate_limit_rate=1.0),
+                 "claude": MockBehavior(error_rate=1.0)}
+    with MockProviderServer(provider_behaviors=behaviors) as server:
+        server.configure_clients()
+        no_retry = RetryPolicy(max_retries=0)
+        with pytest.raises(openai.RateLimitError):
+            MosaicAI("gpt-4o", retry_policy=no_retry).generate_text("こんにちは")
+        with pytest.raises(Exception, match="500"):
+            MosaicAI("claude-3-5-sonnet-20240620", retry_policy=no_retry).generate_text("こんにちは")
+        # 再試行しても失敗し続ける場合は、再試行の回数だけリクエストが送られる
+        with pytest.raises(openai.RateLimitError):
+            retrying = RetryPolicy(max_retries=2, base_delay=0.01)
+            MosaicAI("gpt-4o", retry_policy=retrying).generate_text("こんにちは")
+
+        assert server.stats()["openai"] == {"requests": 4, "streams": 0, "errors": 0,
+                                            "rate_limited": 4}
+        assert server.stats()["claude"]["errors"] == 1
+
+
+def test_base_url_from_config(server):
+    """configのbase_urlsで指定したベースURLが使用されることを確認"""
+    client_registry.configure_base_url("openai", None)
+    client = MosaicAI("gpt-4o", config={"base_urls": {"openai": server.base_urls["openai"]}})
+    assert client.generate_text("こんにちは") == "モックの応答"
@@ -1,3 +1,6 @@
+import os
+import subprocess
+import sys
 import pytest
 from unittest.mock import patch, MagicMock
 from dotenv import load_dotenv
@@ -102,3 +105,25 @@ def test_generate_with_image_json(mock_generate_with_image_json, mosaicai):
                       "is_available": True}
     mock_generate_with_image_json.assert_called_once_with(
         "Analyze this image", "image.jpg", schema)
+
+
+def test_import_does_not_load_provider_sdks():
+    # import mosaicaiの時点ではプロバイダーのSDKが読み込まれないことを確認
+    code = ("import sys, mosaicai; "
+            "print([m for m in ('openai', 'anthropic', 'google.generativeai', 'PIL') "
+            "if m in sys.modules])")
+    result = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True,
+                            check=True)
+    assert result.stdout.strip() == "[]"
+
+
+def test_initialize_model_loads_only_required_sdk():
+    # 使用するモデルのSDKのみが読み込まれることを確認
+    code = ("import sys, mosaicai; mosaicai.MosaicAI('gpt-4o'); "
+            "print([m for m in ('openai', 'anthropic', 'google.generativeai') "
+            "if m in sys.modules])")
+    # 開発者の環境変数に依存しないように、APIキーを設定して実行する
+    env = {**os.environ, "OPENAI_API_KEY": "fake_openai_key"}
+    result = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True,
+                            check=True, env=env)
+    assert result.stdout.strip() == "['openai']"
@@ -1,3 +1,4 @@
+import asyncio
 import pytest
 from unittest.mock import Mock, patch
 from openai import OpenAI
@@ -65,6 +66,12 @@ def test_generate_with_image(perplexity_instance):
     """generate_with_imageメソッドのテスト"""
     with pytest.raises(NotImplementedError):
         perplexity_instance.generate_with_image("image.jpg", "Test prompt")
+    # 他のモデルと同じキーワード引数で呼び出してもNotImplementedErrorとなる
+    with pytest.raises(NotImplementedError):
+        perplexity_instance.generate_with_image(message="Test prompt", image_path="image.jpg")
+    with pytest.raises(NotImplementedError):
+        asyncio.run(perplexity_instance.generate_with_image_async(message="Test prompt",
+                                                                  image_path="image.jpg"))
 
 
 @patch('openai.OpenAI')
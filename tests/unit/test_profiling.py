@@ -0,0 +1,137 @@
+import asyncio
+import pytest
+from types import SimpleNamespace as NS
+from unittest.mock import AsyncMock, Mock, patch
+from mosaicai import AsyncMosaicAI, MosaicAI, profiling
+from mosaicai.models.claude import Claude
+from mosaicai.profiling import ProfilingHook
+
+
+class RecordingHook(ProfilingHook):
+    def __init__(self):
+        self.events = []
+
+    def on_stage_start(self, event):
+        self.events.append(("start", event.stage))
+
+    def on_stage_end(self, event):
+        self.events.append(("end", event.stage, event.model, event.method, event.duration,
+                            event.error))
+
+
+@pytest.fixture(autouse=True)
+def setup(monkeypatch):
+    monkeypatch.setenv("OPENAI_API_KEY", "fake_openai_key")
+    monkeypatch.setenv("ANTHROPIC_API_KEY", "fake_anthropic_key")
+    yield
+    profiling.clear_hooks()
+
+
+@pytest.fixture
+def hook():
+    hook = RecordingHook()
+    profiling.add_hook(hook)
+    return hook
+
+
+def _claude_response(text):
+    return NS(content=[NS(text=text)], usage=NS(input_tokens=10, output_tokens=5))
+
+
+def test_stages_of_generate_with_image_json(hook, tmp_path):
+    """generate_with_image_jsonの各ステージの開始と終了が順に通知されることを確認"""
+    image_path = tmp_path / "image.png"
+    image_path.write_bytes(b"\x89PNG")
+    client = MosaicAI("claude-3-5-sonnet-20240620")
+    client.models["claude-3-5-sonnet-20240620"].client = Mock()
+    client.models["claude-3-5-sonnet-20240620"].client.messages.create.return_value = \
+        _claude_response('{"answer": {"value": "1"}}')
+
+    schema = {"answer": {"value": "int"}}
+    result = client.generate_with_image_json("説明してください", str(image_path), schema)
+
+    assert result == {"answer": {"value": 1}}
+    assert [event[:2] for event in hook.events] == [
+        ("start", "validate_image"), ("end", "validate_image"),
+        ("start", "encode_image"), ("end", "encode_image"),
+        ("start", "schema"), ("end", "schema"),
+        ("start", "request"), ("end", "request"),
+        ("start", "parse_json"), ("end", "parse_json"),
+        # _convert_typesの再帰呼び出しは通知されない
+        ("start", "convert_types"), ("end", "convert_types"),
+    ]
+    for event in hook.events:
+        if event[0] == "end":
+            assert event[2:4] == ("claude-3-5-sonnet-20240620", "generate_with_image_json")
+            assert event[4] >= 0 and event[5] is None
+
+
+def test_start_and_end_events_are_separate():
+    """開始イベントに開始時刻が設定され、終了の通知で開始イベントが変更されないことを確認"""
+    events = []
+    recorder = Mock(spec=ProfilingHook)
+    recorder.on_stage_start.side_effect = events.append
+    recorder.on_stage_end.side_effect = events.append
+    profiling.add_hook(recorder)
+
+    with profiling.stage("request", "gpt-4o", "generate_text"):
+        pass
+
+    start, end = events
+    assert start.start > 0 and start.duration is None
+    assert end is not start and end.start == start.start and end.duration >= 0
+    with pytest.raises(AttributeError):
+        start.duration = 1.0
+
+
+def test_stage_end_reports_error(hook):
+    """ステージで例外が発生した場合、終了イベントに例外が格納されることを確認"""
+    client = MosaicAI("claude-3-5-sonnet-20240620")
+    client.models["claude-3-5-sonnet-20240620"].client = Mock()
+    client.models["claude-3-5-sonnet-20240620"].client.messages.create.return_value = \
+        _claude_response("JSONではない")
+
+    with pytest.raises(ValueError):
+        client.generate_json("こんにちは", {"answer": "str"})
+    assert isinstance(hook.events[-1][5], ValueError)
+    assert hook.events[-1][1] == "parse_json"
+
+
+def test_hook_errors_do_not_break_generation(hook):
+    """フックで発生した例外が生成処理に影響しないことを確認"""
+    broken = Mock(spec=ProfilingHook)
+    broken.on_stage_start.side_effect = RuntimeError("フックのエラー")
+    profiling.add_hook(broken)
+    client = MosaicAI("gpt-4o")
+    client.models["gpt-4o"].client = Mock()
+    client.models["gpt-4o"].client.chat.completions.create.return_value = NS(
+        choices=[NS(message=NS(content="応答"))], usage=None)
+
+    assert client.generate_text("こんにちは") == "応答"
+    assert broken.on_stage_end.call_count == 1
+    assert hook.events[-1][:2] == ("end", "request")
+
+
+def test_no_overhead_without_hooks():
+    """フックが登録されていない場合、イベントが作成されないことを確認"""
+    with patch.object(profiling, "StageEvent") as stage_event:
+        client = MosaicAI("claude-3-5-sonnet-20240620")
+        with patch.object(Claude, "_send", return_value=_claude_response('{"answer": "a"}')):
+            assert client.generate_json("こんにちは", {"answer": "str"}) == {"answer": "a"}
+    stage_event.assert_not_called()
+    request_stage = profiling.stage("request", "gpt-4o", "generate")
+    assert request_stage is profiling.stage("schema", "gpt-4o", "generate")
+
+
+def test_async_request_stage(hook):
+    """非同期の呼び出しでもrequestステージが通知されることを確認"""
+    client = AsyncMosaicAI("claude-3-5-sonnet-20240620")
+    model = client.models["claude-3-5-sonnet-20240620"]
+    model.async_client = Mock()
+    model.async_client.messages.create = AsyncMock(return_value=_claude_response("応答"))
+
+    assert asyncio.run(client.generate_text("こんにちは")) == "応答"
+    duration = hook.events[-1][4]
+    assert hook.events == [
+        ("start", "request"),
+        ("end", "request", "claude-3-5-sonnet-20240620", "generate", duration, None)]
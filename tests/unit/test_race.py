@@ -0,0 +1,109 @@
+import asyncio
+import threading
+import pytest
+from unittest.mock import patch
+from mosaicai import AsyncMosaicAI, CircuitBreakerPolicy, CircuitOpenError, MosaicAI, stats
+from mosaicai.models.chatgpt import ChatGPT
+from mosaicai.models.claude import Claude
+
+GPT = "gpt-4o"
+CLAUDE = "claude-3-5-sonnet-20240620"
+SCHEMA = {"answer": "str"}
+
+
+@pytest.fixture(autouse=True)
+def setup(monkeypatch):
+    monkeypatch.setenv("OPENAI_API_KEY", "fake_openai_key")
+    monkeypatch.setenv("ANTHROPIC_API_KEY", "fake_anthropic_key")
+    stats.clear_stats()
+    yield
+    stats.clear_stats()
+
+
+def test_race_skips_invalid_response():
+    """スキーマの検証に失敗したモデルの応答は使用されず、有効な応答が返されることを確認"""
+    client = MosaicAI(GPT)
+
+    invalid = ValueError("キー 'answer' が応答に含まれていません。")
+    with patch.object(ChatGPT, "generate_json", side_effect=invalid), \
+            patch.object(Claude, "generate_json", return_value={"answer": "claude"}):
+        assert client.race_json("こんにちは", SCHEMA, [GPT, CLAUDE]) == {"answer": "claude"}
+    # 応答の検証の失敗はプロバイダーの障害ではないため、失敗として記録しない
+    assert stats.model_stats(GPT).failures == 0
+
+
+def test_race_returns_fastest_valid_response():
+    """先に完了したモデルの応答が返されることを確認"""
+    client = MosaicAI(GPT)
+    release = threading.Event()
+
+    def slow(self, prompt, schema):
+        release.wait(5)
+        return {"answer": "gpt"}
+
+    try:
+        with patch.object(ChatGPT, "generate_json", slow), \
+                patch.object(Claude, "generate_json", return_value={"answer": "claude"}):
+            assert client.race_json("こんにちは", SCHEMA, [GPT, CLAUDE]) == {"answer": "claude"}
+    finally:
+        release.set()
+
+
+def test_race_with_image_uses_image_method():
+    """image_pathを指定した場合、画像付きのJSON生成が呼び出されることを確認"""
+    client = MosaicAI(GPT)
+
+    with patch.object(ChatGPT, "generate_with_image_json",
+                      return_value={"answer": "gpt"}) as generate:
+        result = client.race_json("説明してください", SCHEMA, [GPT], image_path="image.jpg")
+        assert result == {"answer": "gpt"}
+    generate.assert_called_once_with("説明してください", "image.jpg", SCHEMA)
+
+
+def test_race_raises_first_error_when_all_fail():
+    """すべてのモデルが失敗した場合、例外が送出されることを確認"""
+    client = MosaicAI(GPT)
+
+    with patch.object(ChatGPT, "generate_json", side_effect=ValueError("gpt")), \
+            patch.object(Claude, "generate_json", side_effect=ValueError("claude")):
+        with pytest.raises(ValueError):
+            client.race_json("こんにちは", SCHEMA, [GPT, CLAUDE])
+
+
+def test_race_skips_models_with_open_circuit():
+    """サーキットブレーカーがオープン状態のモデルにはリクエストを送信しないことを確認"""
+    policy = CircuitBreakerPolicy(window_size=1, minimum_calls=1)
+    policy.breaker(GPT).record_failure()
+    client = MosaicAI(GPT, circuit_breaker=policy)
+
+    with patch.object(ChatGPT, "generate_json") as chatgpt_generate, \
+            patch.object(Claude, "generate_json", return_value={"answer": "claude"}):
+        assert client.race_json("こんにちは", SCHEMA, [GPT, CLAUDE]) == {"answer": "claude"}
+        chatgpt_generate.assert_not_called()
+        with pytest.raises(CircuitOpenError):
+            client.race_json("こんにちは", SCHEMA, [GPT])
+
+
+def test_async_race_cancels_losers():
+    """AsyncMosaicAIでは、最初の有効な応答が返された後に残りのリクエストがキャンセルされることを確認"""
+    client = AsyncMosaicAI(GPT)
+    cancelled = []
+
+    async def slow(self, prompt, schema):
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            cancelled.append(True)
+            raise
+        return {"answer": "gpt"}
+
+    async def run():
+        result = await client.race_json("こんにちは", SCHEMA, [GPT, CLAUDE])
+        await asyncio.sleep(0)
+        return result
+
+    with patch.object(ChatGPT, "generate_json_async", slow), \
+            patch.object(Claude, "generate_json_async", return_value={"answer": "claude"}):
+        assert asyncio.run(run()) == {"answer": "claude"}
+    assert cancelled == [True]
+    assert stats.model_stats(GPT).inflight == 0
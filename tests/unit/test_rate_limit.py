@@ -0,0 +1,152 @@
+import asyncio
+import pytest
+from types import SimpleNamespace
+from unittest.mock import AsyncMock, MagicMock, Mock
+from mosaicai import MosaicAI, rate_limit
+from mosaicai.models.chatgpt import ChatGPT
+from mosaicai.rate_limit import RateLimiter, TokenBucket, estimate_tokens
+from mosaicai.types import Usage
+from mosaicai.utils.api_key_manager import APIKeyManager
+
+
+@pytest.fixture(autouse=True)
+def clear_rate_limits():
+    rate_limit.clear_rate_limits()
+    yield
+    rate_limit.clear_rate_limits()
+
+
+@pytest.fixture
+def chatgpt():
+    manager = MagicMock(spec=APIKeyManager)
+    manager.get_api_key.return_value = "fake_api_key"
+    instance = ChatGPT(manager)
+    instance.client = Mock()
+    return instance
+
+
+def _response(prompt_tokens, completion_tokens):
+    return SimpleNamespace(
+        choices=[SimpleNamespace(message=SimpleNamespace(content="応答"))],
+        usage=SimpleNamespace(prompt_tokens=prompt_tokens, completion_tokens=completion_tokens))
+
+
+def test_token_bucket_reserve_returns_wait_time():
+    """残量を超えた予約では、不足分が補充されるまでの待ち時間が返されることを確認"""
+    bucket = TokenBucket(capacity=10, refill_per_second=5)
+    assert bucket.reserve(10) == 0.0
+    assert bucket.reserve(5) == pytest.approx(1.0, abs=0.01)
+    # 待機中の予約は順番に積み重なる
+    assert bucket.reserve(5) == pytest.approx(2.0, abs=0.01)
+
+
+def test_rate_limiter_waits_for_rpm(monkeypatch):
+    """RPMの上限を超えたリクエストが待機することを確認"""
+    sleeps = []
+    monkeypatch.setattr(rate_limit.time, "sleep", sleeps.append)
+    limiter = RateLimiter(rpm=60)
+    for _ in range(60):
+        limiter.acquire()
+    assert sleeps == []
+    limiter.acquire()
+    assert sleeps[0] == pytest.approx(1.0, abs=0.01)
+
+
+def test_rate_limiter_acquire_async(monkeypatch):
+    """非同期の待機がasyncio.sleepで行われることを確認"""
+    sleep = AsyncMock()
+    monkeypatch.setattr(rate_limit.asyncio, "sleep", sleep)
+    limiter = RateLimiter(tpm=600)
+
+    async def run():
+        await limiter.acquire_async(600)
+        await limiter.acquire_async(10)
+
+    asyncio.run(run())
+    sleep.assert_awaited_once()
+    assert sleep.await_args.args[0] == pytest.approx(1.0, abs=0.01)
+
+
+def test_reservation_settle_reconciles_tokens():
+    """見積もりと実際の使用量の差がバケットに反映されることを確認"""
+    limiter = RateLimiter(tpm=1000)
+    reservation = limiter.acquire(500)
+    reservation.settle(Usage(100, 100))
+    assert limiter.tokens.available == pytest.approx(800, abs=1)
+    # 2回目以降のsettleは無視される
+    reservation.settle(Usage(0, 0))
+    assert limiter.tokens.available == pytest.approx(800, abs=1)
+
+
+def test_estimate_tokens():
+    """テキスト、画像、max_tokensからトークン数が見積もられることを確認"""
+    text_only = estimate_tokens(model="gpt-4o", messages=[{"role": "user", "content": "a" * 400}])
+    assert text_only == pytest.approx(100, abs=5)
+    with_image = estimate_tokens(messages=[{"role": "user", "content": [
+        {"type": "text", "text": "a" * 400},
+        {"type": "image_url", "image_url": {"url": "data:image/jpeg;base64," + "A" * 100000}}]}],
+        max_tokens=1000)
+    assert with_image == pytest.approx(100 + rate_limit.IMAGE_TOKEN_ESTIMATE + 1000, abs=10)
+
+
+def test_limiters_are_per_api_key():
+    """プロバイダー全体の設定でも、制限はAPIキーごとに計算されることを確認"""
+    rate_limit.configure_rate_limit("openai", rpm=10)
+    rate_limit.configure_rate_limit("claude", rpm=5, api_key="key-c")
+    first = rate_limit.get_rate_limiter("openai", "key-a")
+    assert first is rate_limit.get_rate_limiter("openai", "key-a")
+    assert first is not rate_limit.get_rate_limiter("openai", "key-b")
+    assert rate_limit.get_rate_limiter("claude", "key-c").rpm == 5
+    assert rate_limit.get_rate_limiter("claude", "key-d") is None
+    assert rate_limit.get_rate_limiter("gemini", "key-a") is None
+
+
+def test_send_reconciles_with_response_usage(chatgpt):
+    """モデルのリクエストが予約され、応答のusageで補正されることを確認"""
+    rate_limit.configure_rate_limit("openai", rpm=100, tpm=10000, api_key="fake_api_key")
+    chatgpt.client.chat.completions.create.return_value = _response(30, 20)
+
+    assert chatgpt.generate("こんにちは") == "応答"
+
+    limiter = rate_limit.get_rate_limiter("openai", "fake_api_key")
+    assert limiter.tokens.available == pytest.approx(10000 - 50, abs=1)
+    assert limiter.requests.available == pytest.approx(99, abs=0.1)
+
+
+def test_send_refunds_tokens_on_error(chatgpt):
+    """リクエストが失敗した場合、予約したトークンが返却されることを確認"""
+    rate_limit.configure_rate_limit("openai", tpm=10000)
+    chatgpt.client.chat.completions.create.side_effect = RuntimeError("接続エラー")
+
+    with pytest.raises(RuntimeError):
+        chatgpt.generate("a" * 4000)
+
+    limiter = rate_limit.get_rate_limiter("openai", "fake_api_key")
+    assert limiter.tokens.available == pytest.approx(10000, abs=1)
+
+
+def test_stream_reconciles_with_final_usage(chatgpt):
+    """ストリーミングでは最終チャンクのusageで補正されることを確認"""
+    rate_limit.configure_rate_limit("openai", tpm=10000)
+    chunks = [
+        SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content="応答"),
+                                                 finish_reason="stop")],
+                        usage=None),
+        SimpleNamespace(choices=[], usage=SimpleNamespace(prompt_tokens=10, completion_tokens=5)),
+    ]
+    chatgpt.client.chat.completions.create.return_value = MagicMock(
+        __iter__=lambda self: iter(chunks))
+
+    stream = chatgpt.generate_text_stream("a" * 4000)
+    assert "".join(delta.text for delta in stream) == "応答"
+
+    limiter = rate_limit.get_rate_limiter("openai", "fake_api_key")
+    assert limiter.tokens.available == pytest.approx(10000 - 15, abs=1)
+
+
+def test_rate_limits_from_config(monkeypatch):
+    """configのrate_limitsからレート制限が設定されることを確認"""
+    monkeypatch.setenv("OPENAI_API_KEY", "config-key")
+    MosaicAI("gpt-4o", config={"rate_limits": {"openai": {"rpm": 500, "tpm": 30000}}})
+    limiter = rate_limit.get_rate_limiter("openai", "config-key")
+    assert (limiter.rpm, limiter.tpm) == (500, 30000)
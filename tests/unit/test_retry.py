@@ -0,0 +1,145 @@
+import asyncio
+import httpx
+import openai
+import pytest
+from unittest.mock import AsyncMock, MagicMock, Mock
+from mosaicai import MosaicAI, RetryPolicy, retry
+from mosaicai.models import base
+from mosaicai.models.chatgpt import ChatGPT
+from mosaicai.utils.api_key_manager import APIKeyManager
+
+
+def _status_error(error_class, status, headers=None):
+    request = httpx.Request("POST", "https://api.openai.com/v1/chat/completions")
+    response = httpx.Response(status, headers=headers or {}, request=request)
+    return error_class("エラー", response=response, body=None)
+
+
+@pytest.fixture
+def chatgpt():
+    manager = MagicMock(spec=APIKeyManager)
+    manager.get_api_key.return_value = "fake_api_key"
+    instance = ChatGPT(manager)
+    instance.client = Mock()
+    instance.retry_policy = RetryPolicy(max_retries=3, timeout=60, jitter=False)
+    return instance
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    calls = []
+    monkeypatch.setattr(base.time, "sleep", calls.append)
+    return calls
+
+
+def _completion(content):
+    return Mock(choices=[Mock(message=Mock(content=content))])
+
+
+def test_is_retryable():
+    """429、5xx、タイムアウト、接続エラーのみが再試行の対象になることを確認"""
+    assert retry.is_retryable(_status_error(openai.RateLimitError, 429))
+    assert retry.is_retryable(_status_error(openai.InternalServerError, 503))
+    request = httpx.Request("POST", "https://example.com")
+    assert retry.is_retryable(openai.APITimeoutError(request=request))
+    assert retry.is_retryable(ConnectionError())
+    assert not retry.is_retryable(_status_error(openai.BadRequestError, 400))
+    assert not retry.is_retryable(_status_error(openai.AuthenticationError, 401))
+    assert not retry.is_retryable(ValueError("不正な値"))
+
+
+def test_retry_after_headers():
+    """Retry-Afterとretry-after-msヘッダーが待機時間として解釈されることを確認"""
+    assert retry.retry_after(_status_error(openai.RateLimitError, 429, {"retry-after": "2"})) == 2.0
+    error = _status_error(openai.RateLimitError, 429, {"retry-after-ms": "1500"})
+    assert retry.retry_after(error) == 1.5
+    assert retry.retry_after(_status_error(openai.RateLimitError, 429)) is None
+    assert retry.retry_after(ValueError()) is None
+
+
+def test_backoff_is_capped():
+    """バックオフが指数的に増加し、上限で打ち切られることを確認"""
+    policy = RetryPolicy(base_delay=1, max_delay=5, jitter=False)
+    assert [policy.backoff(attempt) for attempt in range(5)] == [1, 2, 4, 5, 5]
+    jittered = RetryPolicy(base_delay=1, max_delay=5)
+    assert all(0 <= jittered.backoff(3) <= 5 for _ in range(20))
+
+
+def test_next_delay_respects_deadline_and_max_retries():
+    """期限を過ぎる待機や、最大回数を超える再試行が行われないことを確認"""
+    policy = RetryPolicy(max_retries=2, timeout=1, jitter=False)
+    error = _status_error(openai.RateLimitError, 429, {"retry-after": "5"})
+    assert policy.next_delay(error, 0, policy.deadline()) is None
+    error = _status_error(openai.RateLimitError, 429)
+    assert policy.next_delay(error, 0, policy.deadline()) == 0.5
+    assert policy.next_delay(error, 2, policy.deadline()) is None
+
+
+def test_from_env(monkeypatch):
+    """環境変数MAX_RETRIESとREQUEST_TIMEOUTが読み込まれることを確認"""
+    monkeypatch.setenv("MAX_RETRIES", "5")
+    monkeypatch.setenv("REQUEST_TIMEOUT", "12.5")
+    policy = RetryPolicy.from_env()
+    assert (policy.max_retries, policy.timeout) == (5, 12.5)
+
+
+def test_send_retries_transient_errors(chatgpt, sleeps):
+    """一時的なエラーが再試行され、再試行時はタイムアウトが残り時間に短縮されることを確認"""
+    create = chatgpt.client.chat.completions.create
+    create.side_effect = [
+        _status_error(openai.RateLimitError, 429, {"retry-after": "3"}),
+        _status_error(openai.InternalServerError, 500),
+        _completion("成功"),
+    ]
+
+    assert chatgpt.generate("こんにちは") == "成功"
+
+    assert create.call_count == 3
+    assert sleeps == [3.0, 1.0]
+    assert 0 < create.call_args.kwargs["timeout"] <= 60
+
+
+def test_send_does_not_retry_client_errors(chatgpt, sleeps):
+    """再試行できないエラーはすぐに送出されることを確認"""
+    create = chatgpt.client.chat.completions.create
+    create.side_effect = _status_error(openai.BadRequestError, 400)
+
+    with pytest.raises(openai.BadRequestError):
+        chatgpt.generate("こんにちは")
+
+    assert create.call_count == 1
+    assert sleeps == []
+
+
+def test_send_raises_after_max_retries(chatgpt, sleeps):
+    """最大回数まで再試行した後は最後のエラーが送出されることを確認"""
+    create = chatgpt.client.chat.completions.create
+    create.side_effect = _status_error(openai.RateLimitError, 429)
+
+    with pytest.raises(openai.RateLimitError):
+        chatgpt.generate("こんにちは")
+
+    assert create.call_count == 4
+    assert sleeps == [0.5, 1.0, 2.0]
+
+
+def test_send_async_retries(chatgpt, monkeypatch):
+    """非同期のリクエストでもasyncio.sleepで待機して再試行されることを確認"""
+    sleep = AsyncMock()
+    monkeypatch.setattr(base.asyncio, "sleep", sleep)
+    chatgpt.async_client = Mock()
+    chatgpt.async_client.chat.completions.create = AsyncMock(side_effect=[
+        openai.APIConnectionError(request=httpx.Request("POST", "https://example.com")),
+        _completion("成功"),
+    ])
+
+    assert asyncio.run(chatgpt.generate_async("こんにちは")) == "成功"
+    sleep.assert_awaited_once_with(0.5)
+
+
+def test_retry_policy_is_passed_to_models(monkeypatch):
+    """MosaicAIに指定した再試行の方針がモデルに設定されることを確認"""
+    monkeypatch.setenv("OPENAI_API_KEY", "fake_api_key")
+    policy = RetryPolicy(max_retries=1)
+    client = MosaicAI("gpt-4o", retry_policy=policy)
+    assert client.models["gpt-4o"].retry_policy is policy
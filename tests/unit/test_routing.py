@@ -0,0 +1,122 @@
+import asyncio
+import pytest
+from unittest.mock import patch
+from mosaicai import AsyncMosaicAI, LatencyRouter, MosaicAI, stats
+from mosaicai.models.chatgpt import ChatGPT
+from mosaicai.models.claude import Claude
+from mosaicai.stats import ModelStats
+
+GPT = "gpt-4o"
+CLAUDE = "claude-3-5-sonnet-20240620"
+
+
+@pytest.fixture(autouse=True)
+def setup(monkeypatch):
+    monkeypatch.setenv("OPENAI_API_KEY", "fake_openai_key")
+    monkeypatch.setenv("ANTHROPIC_API_KEY", "fake_anthropic_key")
+    stats.clear_stats()
+    yield
+    stats.clear_stats()
+
+
+def _record(model, latencies, failures=0):
+    model_stats = stats.model_stats(model)
+    for latency in latencies:
+        model_stats.record_success(latency)
+    for _ in range(failures):
+        model_stats.record_failure()
+
+
+def test_model_stats_ewma_and_error_rate():
+    """EWMAのレイテンシとエラー率が更新されることを確認"""
+    model_stats = ModelStats(alpha=0.5)
+    model_stats.record_success(1.0)
+    model_stats.record_success(3.0)
+    assert model_stats.ewma_latency == 2.0
+    model_stats.record_failure()
+    assert model_stats.error_rate == 0.5
+    model_stats.record_success(2.0)
+    assert model_stats.error_rate == 0.25
+    assert (model_stats.successes, model_stats.failures) == (3, 1)
+
+
+def test_router_prefers_faster_model():
+    """レイテンシが小さいモデルが優先されることを確認"""
+    router = LatencyRouter([GPT, CLAUDE], min_samples=3, exploration=0)
+    _record(GPT, [2.0, 2.0, 2.0])
+    _record(CLAUDE, [0.5, 0.5, 0.5])
+    assert router.rank() == [CLAUDE, GPT]
+
+
+def test_router_penalizes_errors_and_inflight():
+    """エラー率と実行中のリクエスト数がスコアに反映されることを確認"""
+    router = LatencyRouter([GPT, CLAUDE], exploration=0)
+    _record(GPT, [1.0])
+    _record(CLAUDE, [0.8], failures=3)
+    assert router.rank() == [GPT, CLAUDE]
+
+    stats.clear_stats()
+    _record(GPT, [1.0])
+    _record(CLAUDE, [0.8])
+    stats.model_stats(CLAUDE).start()
+    assert router.rank() == [GPT, CLAUDE]
+
+
+@pytest.mark.parametrize("failure_latency", [None, 0.01, 5.0])
+def test_router_ranks_failing_model_last(failure_latency):
+    """失敗し続けるモデルは、失敗までの時間に関係なく最後に試行されることを確認"""
+    router = LatencyRouter(["bad", "good"], exploration=0)
+    _record("good", [1.0])
+    for _ in range(5):
+        stats.model_stats("bad").record_failure(failure_latency)
+    assert router.rank() == ["good", "bad"]
+    assert router.score("bad") > router.score("good")
+
+
+def test_model_stats_records_failure_latency():
+    """失敗までの時間がEWMAとパーセンタイルのウィンドウに記録されることを確認"""
+    model_stats = ModelStats(alpha=0.5)
+    model_stats.record_success(1.0)
+    model_stats.record_failure(3.0)
+    assert model_stats.ewma_latency == 2.0
+    assert len(model_stats.latency) == 2 and model_stats.latency.percentile(100) == 3.0
+
+
+def test_router_tries_unsampled_models_first():
+    """まだ呼び出されていないモデルが優先されることを確認"""
+    router = LatencyRouter([GPT, CLAUDE], exploration=0)
+    _record(GPT, [0.1])
+    assert router.rank() == [CLAUDE, GPT]
+
+
+def test_mosaicai_routes_to_fastest_model_and_fails_over():
+    """MosaicAIがルーターの選択したモデルを呼び出し、失敗した場合は次のモデルを試すことを確認"""
+    client = MosaicAI(GPT, router=LatencyRouter([GPT, CLAUDE], exploration=0))
+    _record(GPT, [3.0])
+    _record(CLAUDE, [1.0])
+
+    with patch.object(ChatGPT, "generate", return_value="gpt") as chatgpt_generate, \
+            patch.object(Claude, "generate", return_value="claude"):
+        assert client.generate_text("こんにちは") == "claude"
+        chatgpt_generate.assert_not_called()
+
+    with patch.object(ChatGPT, "generate", return_value="gpt"), \
+            patch.object(Claude, "generate", side_effect=ConnectionError("503")):
+        assert client.generate_text("こんにちは") == "gpt"
+    assert stats.model_stats(CLAUDE).failures == 1
+    assert stats.model_stats(CLAUDE).inflight == 0
+
+
+def test_async_mosaicai_tracks_inflight():
+    """AsyncMosaicAIの呼び出し中は実行中のリクエスト数が増えることを確認"""
+    client = AsyncMosaicAI(GPT, router=LatencyRouter([GPT], exploration=0))
+    observed = []
+
+    async def generate_async(self, prompt):
+        observed.append(stats.model_stats(GPT).inflight)
+        return "gpt"
+
+    with patch.object(ChatGPT, "generate_async", generate_async):
+        assert asyncio.run(client.generate_text("こんにちは")) == "gpt"
+    assert observed == [1]
+    assert stats.model_stats(GPT).inflight == 0
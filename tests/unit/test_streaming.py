@@ -0,0 +1,163 @@
+import asyncio
+from types import SimpleNamespace as NS
+from unittest.mock import MagicMock, Mock
+from mosaicai import MosaicAI, AsyncMosaicAI
+from mosaicai.models.claude import Claude
+from mosaicai.models.gemini import Gemini
+from mosaicai.streaming import TextStream, openai_chunk_events
+from mosaicai.types import StreamDelta, Usage
+
+
+class FakeStream(list):
+    """close()を持つSDKのストリームの代替"""
+    closed = False
+
+    def close(self):
+        self.closed = True
+
+
+class FakeAsyncStream:
+    """async forとclose()を持つ非同期SDKのストリームの代替"""
+
+    def __init__(self, items):
+        self.items = items
+        self.closed = False
+
+    async def __aiter__(self):
+        for item in self.items:
+            yield item
+
+    async def close(self):
+        self.closed = True
+
+
+def _openai_chunk(content=None, finish_reason=None, usage=None):
+    choices = [] if content is None and finish_reason is None else [
+        NS(delta=NS(content=content), finish_reason=finish_reason)]
+    return NS(choices=choices, usage=usage)
+
+
+OPENAI_CHUNKS = [
+    _openai_chunk("Hello"),
+    _openai_chunk(", world"),
+    _openai_chunk("", "stop"),
+    _openai_chunk(usage=NS(prompt_tokens=5, completion_tokens=3)),
+]
+
+
+def test_text_stream_collects_text_and_usage():
+    """TextStreamが差分を返し、終了後にテキストとusageを保持することを確認"""
+    stream = TextStream(iter([StreamDelta("a"), StreamDelta("b", "stop"), Usage(1, 2)]))
+    assert [delta.text for delta in stream] == ["a", "b"]
+    assert stream.text == "ab"
+    assert stream.finish_reason == "stop"
+    assert stream.usage.total_tokens == 3
+
+
+def test_openai_chunk_events():
+    """OpenAI形式のチャンクが共通のイベントに変換されることを確認"""
+    events = [event for chunk in OPENAI_CHUNKS for event in openai_chunk_events(chunk)]
+    assert events == [StreamDelta("Hello"), StreamDelta(", world"), StreamDelta("", "stop"),
+                      Usage(5, 3)]
+
+
+def test_mosaicai_generate_text_stream(monkeypatch):
+    """MosaicAI.generate_text_streamがChatGPTのストリームを正規化することを確認"""
+    monkeypatch.setenv("OPENAI_API_KEY", "test-openai-key")
+    client = MosaicAI("gpt-4o")
+    model = client.models["gpt-4o"]
+    sdk_stream = FakeStream(OPENAI_CHUNKS)
+    model.client = Mock()
+    model.client.chat.completions.create = Mock(return_value=sdk_stream)
+
+    stream = client.generate_text_stream("Say hello")
+    assert "".join(delta.text for delta in stream) == "Hello, world"
+    assert stream.usage == Usage(5, 3)
+    assert sdk_stream.closed
+    kwargs = model.client.chat.completions.create.call_args[1]
+    assert kwargs["stream"] is True
+    assert kwargs["stream_options"] == {"include_usage": True}
+
+
+def test_async_mosaicai_generate_text_stream(monkeypatch):
+    """AsyncMosaicAI.generate_text_streamが非同期イテレータとして動作することを確認"""
+    monkeypatch.setenv("OPENAI_API_KEY", "test-openai-key")
+    client = AsyncMosaicAI("gpt-4o")
+    model = client.models["gpt-4o"]
+    sdk_stream = FakeAsyncStream(OPENAI_CHUNKS)
+
+    async def create(**kwargs):
+        return sdk_stream
+
+    model.async_client = Mock()
+    model.async_client.chat.completions.create = create
+
+    async def run():
+        stream = client.generate_text_stream("Say hello")
+        texts = [delta.text async for delta in stream]
+        return stream, texts
+
+    stream, texts = asyncio.run(run())
+    assert "".join(texts) == "Hello, world"
+    assert stream.usage == Usage(5, 3)
+    assert sdk_stream.closed
+
+
+def test_claude_stream_events():
+    """ClaudeのストリーミングイベントからテキストとUsageが得られることを確認"""
+    manager = Mock()
+    manager.get_api_key.return_value = "mock_api_key"
+    claude = Claude(manager, max_tokens=4096)
+    events = FakeStream([
+        NS(type="message_start", message=NS(usage=NS(input_tokens=10, output_tokens=1))),
+        NS(type="content_block_start"),
+        NS(type="content_block_delta", delta=NS(type="text_delta", text="Hi")),
+        NS(type="content_block_delta", delta=NS(type="text_delta", text=" there")),
+        NS(type="message_delta", delta=NS(stop_reason="end_turn"), usage=NS(output_tokens=4)),
+        NS(type="message_stop"),
+    ])
+    claude.client = Mock()
+    claude.client.messages.create = Mock(return_value=events)
+
+    stream = claude.generate_text_stream("Hello")
+    assert [delta.text for delta in stream if delta.text] == ["Hi", " there"]
+    assert stream.finish_reason == "end_turn"
+    assert stream.usage == Usage(10, 4)
+    assert claude.client.messages.create.call_args[1]["max_tokens"] == 4096
+
+
+def test_gemini_chunk_events():
+    """Geminiのチャンクからテキストと累積Usageが得られることを確認"""
+    manager = MagicMock()
+    manager.get_api_key.return_value = "fake_api_key"
+    gemini = Gemini(manager)
+    chunks = [
+        NS(text="Hel", candidates=[NS(finish_reason=0)],
+           usage_metadata=NS(prompt_token_count=7, candidates_token_count=1, total_token_count=8)),
+        NS(text="lo", candidates=[NS(finish_reason=NS(name="STOP"))],
+           usage_metadata=NS(prompt_token_count=7, candidates_token_count=2, total_token_count=9)),
+    ]
+    gemini.model = Mock()
+    gemini.model.generate_content = Mock(return_value=iter(chunks))
+
+    stream = gemini.generate_text_stream("Hello")
+    assert stream.text == "" and [delta.text for delta in stream] == ["Hel", "lo"]
+    assert stream.finish_reason == "STOP"
+    assert stream.usage == Usage(7, 2)
+    gemini.model.generate_content.assert_called_once_with("Hello", stream=True)
+
+
+def test_default_stream_falls_back_to_generate(monkeypatch):
+    """ストリーミング非対応のモデルではgenerateの結果が1つの差分として返されることを確認"""
+    from mosaicai.models.base import AIModelBase
+
+    class EchoModel(AIModelBase):
+        def generate(self, message):
+            return message
+
+        async def generate_async(self, message):
+            return message
+
+    stream = EchoModel().generate_text_stream("echo")
+    assert [delta.text for delta in stream] == ["echo"]
+    assert stream.usage is None